@@ -14,6 +14,7 @@ from flask import Blueprint, jsonify, request, session
 
 from config import (ADMIN_LOGIN_LOCKOUT_SECONDS, ADMIN_LOGIN_MAX_FAILURES,
                     ADMIN_PASSWORD, AGGREGATED_M3U_PATH, MAX_PAGE_SIZE)
+from core import epg_feeds
 from core.aggregator import AggregatorUtils
 from core.sources import SourceUtils
 
@@ -37,7 +38,7 @@ def _admin_disabled():
 
 # ---------------------------------------------------------------- 登录防爆破
 
-# 进程内失败计数（GUNICORN_WORKERS=1 保证单 worker 内存态有效）。
+# 进程内失败计数（每个 worker 各计各的：多 worker 时锁定前可尝试次数 × worker 数）。
 # 注：nginx 反代后 remote_addr 为 127.0.0.1，等价「全局锁定」——
 # 单管理员场景反而更严格（任何来源连错 N 次全锁）。nginx 层另配 limit_req 双保险。
 _login_lock = threading.Lock()
@@ -551,6 +552,9 @@ _SETTING_KEYS = {
     'startup_delay': 'int',
     'stream_check_concurrency': 'int',
     'stream_probe_timeout': 'int',
+    'probe_result_max_age': 'int',
+    'failover_mode': 'str',
+    'epg_xmltv_urls': 'str',
 }
 
 
@@ -561,9 +565,9 @@ def _settings_effective():
                         CHECK_WINDOW_END_HOUR, CHECK_WINDOW_START_HOUR,
                         GROUP_HEALTH_RATIOS, LOG_KEEP_DAYS, MIN_CHANNEL_COUNT,
                         MONITOR_HISTORY_KEEP, OFFICIAL_REFRESH_INTERVAL,
-                        PUBLIC_BASE_URL, STARTUP_DELAY, STREAM_CHECK_CONCURRENCY,
-                        STREAM_CHECK_INTERVAL, STREAM_FAIL_LIMIT,
-                        STREAM_HISTORY_KEEP, STREAM_PROBE_TIMEOUT)
+                        PROBE_RESULT_MAX_AGE, PUBLIC_BASE_URL, STARTUP_DELAY,
+                        STREAM_CHECK_CONCURRENCY, STREAM_CHECK_INTERVAL,
+                        STREAM_FAIL_LIMIT, STREAM_HISTORY_KEEP, STREAM_PROBE_TIMEOUT)
     return {
         'min_channel_count': db.get_effective_int('min_channel_count', MIN_CHANNEL_COUNT),
         'stream_fail_limit': db.get_effective_int('stream_fail_limit', STREAM_FAIL_LIMIT),
@@ -593,6 +597,10 @@ def _settings_effective():
             'stream_check_concurrency', STREAM_CHECK_CONCURRENCY),
         'stream_probe_timeout': db.get_effective_int(
             'stream_probe_timeout', STREAM_PROBE_TIMEOUT),
+        'probe_result_max_age': db.get_effective_int(
+            'probe_result_max_age', PROBE_RESULT_MAX_AGE),
+        'failover_mode': AggregatorUtils._failover_mode(),
+        'epg_xmltv_urls': ', '.join(epg_feeds.feed_urls()),
     }
 
 
@@ -625,6 +633,9 @@ def settings():
             elif key == 'monitor_window_end':
                 if not (1 <= value <= 24):
                     return jsonify({'error': f'{key} 必须在 1-24 之间（GMT+8 小时）'}), 400
+            elif key == 'probe_result_max_age':
+                if value < 0:
+                    return jsonify({'error': f'{key} 必须为不小于 0 的整数（0=不复用）'}), 400
             elif value < 1:
                 return jsonify({'error': f'{key} 必须为不小于 1 的整数'}), 400
         elif kind == 'str':
@@ -640,6 +651,17 @@ def settings():
                 if any('@' not in v for v in items):
                     return jsonify({'error': f'{key} 必须是逗号分隔的有效邮箱'}), 400
                 updates[key] = ', '.join(items)
+            elif key == 'failover_mode':
+                from config import FAILOVER_MODES
+                if value.strip().lower() not in FAILOVER_MODES:
+                    return jsonify({'error': f"{key} 必须为 {' / '.join(FAILOVER_MODES)} 之一"}), 400
+                updates[key] = value.strip().lower()
+            elif key == 'epg_xmltv_urls':
+                # 逗号分隔的 XMLTV 地址，可留空（留空 = 不合并外部节目单）
+                items = [v.strip() for v in value.split(',') if v.strip()]
+                if any(not v.startswith(('http://', 'https://')) for v in items):
+                    return jsonify({'error': f'{key} 必须是逗号分隔的 http(s) 地址'}), 400
+                updates[key] = ', '.join(items)
         elif kind == 'json':
             if not isinstance(value, dict) or not all(
                     isinstance(k, str) and isinstance(v, (int, float))
@@ -12,7 +12,7 @@ import sqlite3
 import threading
 
 from config import (ADMIN_DB_PATH, GMT8, LOG_KEEP_DAYS, MONITOR_HISTORY_KEEP,
-                    STREAM_HISTORY_KEEP)
+                    PROBE_RESULT_KEEP_DAYS, STREAM_HISTORY_KEEP)
 
 # 模块级写锁：SQLite 并发写串行化（监控线程 + API 线程）。
 # 用 RLock：数据层写失败打日志 → SqliteHandler 回写 save_log 会重入本锁（同线程）
@@ -61,6 +61,14 @@ CREATE TABLE IF NOT EXISTS settings (
   key TEXT PRIMARY KEY,
   value TEXT
 );
+CREATE TABLE IF NOT EXISTS probe_results (
+  url TEXT PRIMARY KEY,
+  strict_ok INTEGER, strict_at REAL,
+  loose_ok INTEGER, loose_at REAL,
+  status INTEGER, latency REAL,
+  checked_at REAL NOT NULL DEFAULT 0,
+  fail_count INTEGER DEFAULT 0
+);
 CREATE INDEX IF NOT EXISTS idx_monitor_ts ON monitor_history(ts);
 CREATE INDEX IF NOT EXISTS idx_stream_ts ON stream_check_history(ts);
 CREATE INDEX IF NOT EXISTS idx_logs_ts ON logs(ts);
@@ -95,6 +103,21 @@ def _execute_locked(sql, params=()):
         return None
 
 
+def _executemany_locked(sql, seq):
+    """持锁状态下批量执行同一条写语句（单连接单事务）；异常返回 None（不抛出）"""
+    try:
+        conn = _connect()
+        try:
+            cur = conn.executemany(sql, seq)
+            conn.commit()
+            return cur.rowcount
+        finally:
+            conn.close()
+    except Exception as e:
+        _get_db_logger().warning(f"管理数据写入失败: {str(e)}")
+        return None
+
+
 def _execute(sql, params=()):
     """执行写操作（加锁串行化），返回受影响行数（失败返回 0）"""
     with _db_lock:
@@ -137,6 +160,7 @@ def init_db():
             conn = _connect()
             try:
                 conn.executescript(_SCHEMA)
+                _rekey_channel_overrides(conn)
                 conn.commit()
             finally:
                 conn.close()
@@ -146,6 +170,40 @@ def init_db():
         return False
 
 
+def _rekey_channel_overrides(conn):
+    """
+    频道覆盖 key 迁移：channel_key 即 SourceUtils.normalize_name 的结果，归一化规则扩展后
+    （去 HD/高清后缀、央视别名 "CCTV1" -> "CCTV-1 综合"、卫视去英文台标前缀）旧 key 不再命中。
+    按新规则重算全部 key（已是新 key 的不变，可重复执行）；多行归到同一 key 时保留 id 最小的一行，
+    丢弃的行逐条记 WARNING（旧 key、新 key 与覆盖内容，便于管理员在后台补回）
+    """
+    from core.sources import SourceUtils
+    rows = conn.execute("SELECT id, channel_key, display_name, group_title, enabled "
+                        "FROM channel_overrides ORDER BY id").fetchall()
+    winners = {}
+    for row_id, key, *_values in rows:
+        winners.setdefault(SourceUtils.normalize_name(key), (row_id, key))
+    moved = {row_id: new_key for new_key, (row_id, key) in winners.items() if new_key != key}
+    if not moved and len(winners) == len(rows):
+        return
+    keep = {row_id for row_id, _key in winners.values()}
+    dropped = [row for row in rows if row[0] not in keep]
+    # 先记日志再写库：WARNING 会经 SqliteHandler 另开连接写 logs 表，本连接写事务未提交时会锁等
+    for _row_id, key, display_name, group_title, enabled in dropped:
+        new_key = SourceUtils.normalize_name(key)
+        _get_db_logger().warning(
+            f"频道覆盖 key 迁移：{key!r} 与 {winners[new_key][1]!r} 同归为 {new_key!r}，丢弃该行"
+            f"（display_name={display_name!r}, group_title={group_title!r}, enabled={enabled}）")
+    conn.executemany("DELETE FROM channel_overrides WHERE id=?",
+                     [(row[0],) for row in dropped])
+    # 两步改名：先挪到临时 key，避免新旧 key 互相占用触发 UNIQUE 冲突
+    conn.executemany("UPDATE channel_overrides SET channel_key=? WHERE id=?",
+                     [(f"__rekey__{row_id}", row_id) for row_id in moved])
+    conn.executemany("UPDATE channel_overrides SET channel_key=? WHERE id=?",
+                     [(new_key, row_id) for row_id, new_key in moved.items()])
+    _get_db_logger().info(f"频道覆盖 key 迁移：改名 {len(moved)} 条，合并丢弃 {len(rows) - len(keep)} 条")
+
+
 def db_ready():
     """管理库是否已初始化（文件存在且已建 sources 表）。
 
@@ -506,6 +564,65 @@ def count_logs(level=None, keyword=None):
     return rows[0]['n'] if rows else 0
 
 
+# ---------------------------------------------------------------- 探测结果
+
+# 探测口径 → (结果列, 时间列)；严格=监控（仅 200/206），宽松=聚合过滤（403 也算可达）
+_PROBE_MODE_COLS = {'strict': ('strict_ok', 'strict_at'), 'loose': ('loose_ok', 'loose_at')}
+# IN (...) 查询分批大小（低于 SQLite 变量数上限）
+_IN_CHUNK = 500
+
+
+def save_probe_results(mode, rows):
+    """批量写入一轮探测结果（按 URL UPSERT，不动 fail_count），并清理久未探测的记录。
+
+    mode: 'strict' / 'loose'
+    rows: [(url, checked_at epoch 秒, ok, status, latency), ...]
+    """
+    if not rows:
+        return 0
+    ok_col, at_col = _PROBE_MODE_COLS[mode]
+    sql = (f"INSERT INTO probe_results (url, {ok_col}, {at_col}, status, latency, checked_at) "
+           f"VALUES (?,?,?,?,?,?) ON CONFLICT(url) DO UPDATE SET "
+           f"{ok_col}=excluded.{ok_col}, {at_col}=excluded.{at_col}, status=excluded.status, "
+           f"latency=excluded.latency, checked_at=excluded.checked_at")
+    with _db_lock:
+        _executemany_locked(sql, [(url, 1 if ok else 0, ts, status, latency, ts)
+                                  for url, ts, ok, status, latency in rows])
+        cutoff = max(r[1] for r in rows) - PROBE_RESULT_KEEP_DAYS * 86400
+        _execute_locked("DELETE FROM probe_results WHERE checked_at < ? AND fail_count = 0",
+                        (cutoff,))
+    return len(rows)
+
+
+def get_probe_results(urls):
+    """按 URL 批量查探测结果 {url: 行 dict}（无记录的 URL 不出现）"""
+    urls = list(urls)
+    results = {}
+    for i in range(0, len(urls), _IN_CHUNK):
+        chunk = urls[i:i + _IN_CHUNK]
+        marks = ','.join('?' * len(chunk))
+        for row in _query(f"SELECT * FROM probe_results WHERE url IN ({marks})", tuple(chunk)):
+            results[row['url']] = row
+    return results
+
+
+def get_probe_fail_counts():
+    """聚合过滤的连续失败计数 {url: 次数}（只含计数 > 0 的 URL）"""
+    rows = _query("SELECT url, fail_count FROM probe_results WHERE fail_count > 0")
+    return {r['url']: r['fail_count'] for r in rows}
+
+
+def save_probe_fail_counts(counts):
+    """整体替换连续失败计数：counts 之外的 URL 清零（对应旧 stream_failures.json 整体覆盖）"""
+    with _db_lock:
+        _execute_locked("UPDATE probe_results SET fail_count = 0 WHERE fail_count > 0")
+        _executemany_locked(
+            "INSERT INTO probe_results (url, fail_count) VALUES (?,?) "
+            "ON CONFLICT(url) DO UPDATE SET fail_count=excluded.fail_count",
+            list(counts.items()))
+    return len(counts)
+
+
 # ---------------------------------------------------------------- 设置
 
 def get_setting(key, default=None):
@@ -1,18 +1,22 @@
 """Flask 应用工厂与全部路由（薄层，业务逻辑在 core/ 与 monitoring/）"""
 import datetime
 import os
+import threading
 import time
 from concurrent.futures import ThreadPoolExecutor
 
-from flask import Flask, Response, abort, jsonify, request as flask_request, send_file
+from flask import (Flask, Response, abort, jsonify, redirect, request as flask_request,
+                   send_file)
 from flask_caching import Cache
 
-from config import (ADMIN_SESSION_HOURS, GZ_FILE_PATH, SECRET_KEY,
-                    SESSION_COOKIE_SECURE)
+from config import (ADMIN_SESSION_HOURS, GZ_FILE_PATH, SECRET_KEY, SENDFILE_ACCEL_PREFIX,
+                    SESSION_COOKIE_SECURE, XML_FILE_PATH)
+from core import failover, live_tracker, segment_cache
 from core.aggregator import AggregatorUtils, register_refresh_callback
 from core.bilibili import BilibiliUtils
 from core.epg import XmlUtils
 from core.hntv_client import CryptoUtils, TokenUtils
+from core.snapshot import SNAPSHOT_ENCODINGS, PlaylistSnapshot
 
 
 def create_app():
@@ -50,9 +54,22 @@ def create_app():
 
     @cache.cached(timeout=600, key_prefix='transList2M3U')
     def trans_list_to_m3u_cached():
-        """直播列表（带 10 分钟缓存；底层已读磁盘聚合缓存，开销极小）"""
+        """直播列表降级路径（聚合快照未就绪时用，带 10 分钟缓存）"""
         return AggregatorUtils.trans_list_to_m3u()
 
+    # 降级列表快照：同一份降级文本只编码一次（冷启动窗口内每个请求都重编码 gzip/deflate
+    # 正是快照要消除的负载）；锁内取文本，缓存失效时并发请求也只生成一次降级列表
+    fallback = {'snapshot': None}
+    fallback_lock = threading.Lock()
+
+    def fallback_snapshot():
+        with fallback_lock:
+            text = trans_list_to_m3u_cached()
+            snapshot = fallback['snapshot']
+            if snapshot is None or snapshot.text != text:
+                snapshot = fallback['snapshot'] = PlaylistSnapshot.build(text)
+            return snapshot
+
     @app.route('/api/proxy', methods=['GET'])
     def proxy_api():
         """API 代理端点（需 Bearer token），封装 HNTV 官方直播列表"""
@@ -87,31 +104,59 @@ def create_app():
 
     @app.route('/api/live.m3u8', methods=['GET'])
     def generate_m3u():
-        """生成 M3U 格式的直播列表（多源聚合结果）"""
+        """
+        生成 M3U 格式的直播列表（多源聚合结果）：
+        优先用聚合落盘时发布的预编码快照（ETag/Last-Modified 条件请求 → 304，
+        Accept-Encoding 协商 gzip/deflate）；快照未就绪时走降级列表
+        """
         try:
-            m3u_content = trans_list_to_m3u_cached()
-            return m3u_content, 200, {'Content-Type': 'application/x-mpegURL'}
+            snapshot = AggregatorUtils.get_playlist_snapshot()
+            if snapshot is None:
+                # 启动窗口/聚合失败：降级列表不发布为快照（聚合完成后自动切换）
+                snapshot = fallback_snapshot()
+            return _snapshot_response(snapshot)
         except Exception as e:
             return f"#EXTM3U\n# Error: {str(e)}", 500, {'Content-Type': 'application/x-mpegURL'}
 
+    @app.route('/api/ch/<path:key>', methods=['GET'])
+    def channel_redirect(key):
+        """
+        公开频道故障切换跳转（FAILOVER_MODE=redirect 时列表里的频道地址）：
+        302 到该频道当前最健康的候选地址（后台健康表维护，主地址失效即切备用）
+        """
+        url = failover.resolve(key)
+        if url is None:
+            return 'Error: 频道不存在或未启用故障切换', 404
+        return redirect(url, code=302)
+
     @app.route('/api/live.xml', methods=['GET'])
     def generate_xml():
-        """生成 EPG XML 节目单（读磁盘缓存，每天 02:30 刷新）"""
+        """
+        EPG XML 节目单（生成时已落盘明文与 gzip 两份，每天 02:30 刷新）：
+        客户端接受 gzip 时直接发 .gz 文件（Content-Encoding: gzip），否则发明文文件；
+        条件请求 / Range 由 send_file 处理，请求路径不解压、不读进内存
+        """
         try:
-            xml_content = XmlUtils.trans_list_to_xml()
-            return xml_content, 200, {'Content-Type': 'application/xml'}
+            if not os.path.exists(XML_FILE_PATH) and not os.path.exists(GZ_FILE_PATH):
+                XmlUtils.get_and_save_xml_data(unless_exists=(XML_FILE_PATH, GZ_FILE_PATH))
+            if flask_request.accept_encodings.quality('gzip') > 0 and os.path.exists(GZ_FILE_PATH):
+                return _send_epg_file(GZ_FILE_PATH, 'application/xml', encoding='gzip')
+            if os.path.exists(XML_FILE_PATH):
+                return _send_epg_file(XML_FILE_PATH, 'application/xml')
+            # 只有 gz（明文文件缺失）且客户端不收 gzip：解压应答；生成失败两份都没有：空节目单
+            content = XmlUtils.trans_list_to_xml() if os.path.exists(GZ_FILE_PATH) else XmlUtils.EMPTY_XML
+            return content, 200, {'Content-Type': 'application/xml'}
         except Exception as e:
             return f'<?xml version="1.0" encoding="UTF-8"?>\n<error>{str(e)}</error>', 500, {
                 'Content-Type': 'application/xml'}
 
     @app.route('/api/live.xml.gz', methods=['GET'])
     def generate_compressed_xml():
-        """生成压缩的 EPG XML（文件不存在才现场生成）"""
+        """压缩的 EPG XML 下载（文件不存在才现场生成）"""
         try:
             if not os.path.exists(GZ_FILE_PATH):
-                XmlUtils.get_and_save_xml_data()
-            return send_file(GZ_FILE_PATH, as_attachment=True, download_name='live.xml.gz',
-                             mimetype='application/gzip')
+                XmlUtils.get_and_save_xml_data(unless_exists=(GZ_FILE_PATH,))
+            return _send_epg_file(GZ_FILE_PATH, 'application/gzip', download_name='live.xml.gz')
         except Exception as e:
             return f'<?xml version="1.0" encoding="UTF-8"?>\n<error>{str(e)}</error>', 500, {
                 'Content-Type': 'application/xml'}
@@ -137,25 +182,38 @@ def create_app():
 
     @app.route('/api/bilibili/<int:room_id>/seg/<path:seg_path>', methods=['GET'])
     def bilibili_segment(room_id, seg_path):
-        """B 站直播分片反代：带 Referer/UA 向 B 站 CDN 即时转拉（HLS 滑动窗口）"""
-        status, headers, stream = BilibiliUtils.proxy_segment(room_id, seg_path)
+        """
+        B 站直播分片反代：带 Referer/UA 向 B 站 CDN 即时转拉（HLS 滑动窗口）；
+        本进程转发名额用尽时 503（播放器重试），线程留给播放列表/EPG 等短请求
+        """
+        if not segment_cache.acquire_stream():
+            return 'Error: 分片转发繁忙，请稍后重试', 503, {'Retry-After': '1'}
+        try:
+            status, headers, stream = BilibiliUtils.proxy_segment(room_id, seg_path)
+        except Exception:
+            segment_cache.release_stream()
+            raise
         if headers is None:
+            segment_cache.release_stream()
             return f'Error: 分片拉取失败（HTTP {status}）', 404 if status == 404 else 500
-        return Response(stream, status=status, headers=headers)
+        return Response(segment_cache.StreamSlot(stream), status=status, headers=headers)
 
     @app.route('/api/bilibili/<int:room_id>/status', methods=['GET'])
     def bilibili_status(room_id):
         """
         B 站直播房间状态（聚合/探测判断用，无鉴权）：
         playUrl 解析出的地址不代表在播（未开播房间也会返回），
-        以实测拉取 m3u8 主清单 200 为"在播"判定
+        以实测拉取 m3u8 主清单 200 为"在播"判定（后台追踪线程维护，此处查表）
         """
         try:
-            live = BilibiliUtils.is_live(room_id)
+            live = live_tracker.is_live(room_id)
+            state = live_tracker.get_state(room_id) or {}
             return jsonify({
                 'room_id': room_id,
                 'live': live,
                 'playable': live,
+                'checked_at': state.get('checked_at'),
+                'changed_at': state.get('changed_at'),
             })
         except Exception as e:
             return jsonify({'room_id': room_id, 'live': False, 'error': str(e)})
@@ -164,16 +222,16 @@ def create_app():
     def bilibili_rooms():
         """
         B 站直播频道管理：
-        - GET（无鉴权）：列出全部频道（静态+动态），默认附带实时开播状态（并发探测）
+        - GET（无鉴权）：列出全部频道（静态+动态），附带开播状态（查开播追踪表）
         - POST（需 token）：动态添加频道 body={"name":"XX","room_id":123}，立即异步刷新
         """
         if flask_request.method == 'GET':
             rooms = AggregatorUtils.list_bilibili_rooms()
             if rooms:
-                # 并发实测开播状态（is_live 内部有 playUrl 缓存，主清单请求很小）
+                # 已追踪房间直接查表；未追踪的（追踪线程未启动/刚添加）并发同步判定
                 with ThreadPoolExecutor(max_workers=min(5, len(rooms))) as executor:
                     lives = list(executor.map(
-                        lambda r: BilibiliUtils.is_live(r['room_id']), rooms))
+                        lambda r: live_tracker.is_live(r['room_id']), rooms))
                 for item, live in zip(rooms, lives):
                     item['live'] = live
             return jsonify({'rooms': rooms})
@@ -235,6 +293,74 @@ def create_app():
     return app
 
 
+def _negotiate_encoding():
+    """按 Accept-Encoding 选择内容编码（gzip 优先，其次 deflate；都不接受返回 None）"""
+    accept = flask_request.accept_encodings
+    best, best_q = None, 0
+    for coding in SNAPSHOT_ENCODINGS:
+        q = accept.quality(coding)
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def _snapshot_response(snapshot):
+    """
+    快照应答：If-None-Match / If-Modified-Since 命中返回 304（零字节），
+    否则按协商编码返回预编码字节
+    """
+    coding = _negotiate_encoding()
+    not_modified = False
+    if flask_request.if_none_match:
+        # If-None-Match 优先于 If-Modified-Since（RFC 7232）；命中任一编码变体即未变
+        etags = flask_request.if_none_match
+        not_modified = etags.star_tag or any(
+            etags.contains_weak(tag) for tag in snapshot.all_etags())
+    elif flask_request.if_modified_since:
+        not_modified = snapshot.last_modified <= flask_request.if_modified_since.timestamp()
+
+    if not_modified:
+        response = Response(status=304)
+    else:
+        response = Response(snapshot.variant(coding), status=200,
+                            content_type='application/x-mpegURL')
+        if coding:
+            response.headers['Content-Encoding'] = coding
+    response.set_etag(snapshot.variant_etag(coding))
+    response.last_modified = snapshot.last_modified
+    # 允许客户端缓存但每次都回源校验（内容变化后首个轮询即拿到新列表）
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+def _send_epg_file(path, mimetype, encoding=None, download_name=None):
+    """
+    发送预生成的 EPG 文件：
+    - 默认 send_file：ETag / Last-Modified 条件请求（304）与 Range（206）由 werkzeug 处理，
+      文件体经 wsgi.file_wrapper 交给 gunicorn sendfile 零拷贝发送
+    - 配置 SENDFILE_ACCEL_PREFIX 时只回 X-Accel-Redirect，由 nginx 发送（条件请求 / Range 亦由 nginx 处理）；
+      gzip 编码变体走前缀下的 gz/ 子路径（nginx 在该 location 补 Content-Encoding）
+    :param encoding: 文件本身即内容编码后的字节（'gzip'）时设置 Content-Encoding
+    :param download_name: 作为附件下载时的文件名
+    """
+    if SENDFILE_ACCEL_PREFIX:
+        prefix = SENDFILE_ACCEL_PREFIX.rstrip('/') + ('/gz/' if encoding else '/')
+        response = Response(status=200, mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = prefix + os.path.basename(path)
+        if download_name:
+            response.headers['Content-Disposition'] = f'attachment; filename={download_name}'
+    else:
+        response = send_file(path, mimetype=mimetype, conditional=True, etag=True,
+                             as_attachment=download_name is not None, download_name=download_name)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    # 同一 URL 按 Accept-Encoding 返回不同字节；每次回源校验（每日刷新后首个请求即拿到新文件）
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
 def _extract_token():
     """从请求头或查询参数中提取 Bearer token"""
     token = flask_request.headers.get('Authorization') or flask_request.args.get('token')
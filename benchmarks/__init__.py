@@ -0,0 +1 @@
+"""聚合流水线基准测试（合成上游 + 本地 HTTP 替身，不触碰真实源）"""
@@ -0,0 +1,156 @@
+"""聚合流水线基准：拉源 → 过滤中文化 → 同台择优 → 探测过滤 → 生成 m3u
+
+用法（在项目根目录执行）：
+    python -m benchmarks.bench_aggregation                              # 默认 1k/10k 条 × 3 源
+    python -m benchmarks.bench_aggregation --sizes 1000,10000,100000 \\
+        --sources 3 --latency-ms 20 --failure-rate 0.3 --output bench.json
+    python -m benchmarks.bench_aggregation --probe-candidates           # 另测全量候选地址探测
+
+输出 JSON（stdout 或 --output 文件）：每个规模一条记录，含各阶段
+wall_s（耗时）、alloc_peak_kb（tracemalloc 阶段内分配峰值）、
+alloc_net_kb（阶段结束时净增分配）、rss_peak_kb（进程峰值 RSS，单调不减），
+以及流水线总耗时。--no-alloc 关闭 tracemalloc（其开销会放大纯耗时）。
+
+全程不触碰真实源与管理库：公开源列表指向本地替身，单源缓存/失败记录写临时目录，
+管理库指向不存在的路径（设置全部走 config 兜底）。
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import ExitStack
+from unittest import mock
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from benchmarks.fixtures import UpstreamStandIn  # noqa: E402  导入顺序：先修正 sys.path
+from core import http_client, probe_store  # noqa: E402
+from core.aggregator import AggregatorUtils  # noqa: E402
+from core.probing import probe_many  # noqa: E402
+from core.sources import SourceUtils  # noqa: E402
+
+
+def _rss_peak_kb():
+    """进程峰值 RSS（KB；macOS 的 ru_maxrss 单位是字节）"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def _run_stage(name, func, trace_alloc, stages):
+    """执行单个阶段并记录耗时/分配/RSS，返回阶段结果"""
+    if trace_alloc:
+        tracemalloc.start()
+    started = time.perf_counter()
+    result = func()
+    wall = time.perf_counter() - started
+    record = {"stage": name, "wall_s": round(wall, 4)}
+    if trace_alloc:
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        record["alloc_peak_kb"] = peak // 1024
+        record["alloc_net_kb"] = current // 1024
+    record["rss_peak_kb"] = _rss_peak_kb()
+    stages.append(record)
+    return result
+
+
+def run_once(size, sources, latency, failure_rate, probe_candidates, trace_alloc):
+    """单一规模跑一遍流水线，返回结果记录"""
+    tmp_dir = tempfile.mkdtemp(prefix='bench-')
+    stages = []
+    with UpstreamStandIn(latency=latency, failure_rate=failure_rate) as upstream, ExitStack() as stack:
+        urls = upstream.source_urls(sources, size)
+        for patcher in (
+            mock.patch.object(SourceUtils, 'get_public_source_urls', return_value=urls),
+            mock.patch('core.sources.PUBLIC_SOURCE_CACHE_DIR', os.path.join(tmp_dir, 'sources')),
+            mock.patch('admin.db.ADMIN_DB_PATH', os.path.join(tmp_dir, 'missing', 'admin.db')),
+        ):
+            stack.enter_context(patcher)
+        http_client.close_all()
+        probe_store.reset()  # 每个规模从空探测结果开始，不复用上一规模的新鲜结果
+
+        total_started = time.perf_counter()
+        channels = _run_stage('fetch_all_public_channels',
+                              SourceUtils.fetch_all_public_channels, trace_alloc, stages)
+        if probe_candidates:
+            _run_stage('probe_candidates',
+                       lambda: probe_many([ch['url'] for ch in channels], accept_403=True),
+                       trace_alloc, stages)
+        translated = _run_stage('filter_and_translate',
+                                lambda: SourceUtils.filter_and_translate(channels),
+                                trace_alloc, stages)
+        best = _run_stage('pick_best_public',
+                          lambda: AggregatorUtils.pick_best_public(translated),
+                          trace_alloc, stages)
+        best_list = [ch for ch, _score, _res in best.values()]
+        kept = _run_stage('filter_unreachable',
+                          lambda: AggregatorUtils.filter_unreachable(best_list),
+                          trace_alloc, stages)
+        m3u = _run_stage('aggregate_m3u',
+                         lambda: AggregatorUtils.aggregate_m3u([], kept, []),
+                         trace_alloc, stages)
+        total = time.perf_counter() - total_started
+
+    return {
+        "size": size,
+        "sources": sources,
+        "latency_ms": round(latency * 1000),
+        "failure_rate": failure_rate,
+        "entries_parsed": len(channels),
+        "candidates": len(translated),
+        "unique_channels": len(best_list),
+        "kept_channels": len(kept),
+        "m3u_bytes": len(m3u.encode('utf-8')),
+        "total_wall_s": round(total, 4),
+        "stages": stages,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="聚合流水线基准测试")
+    parser.add_argument('--sizes', default='1000,10000',
+                        help="每源条目数，逗号分隔（如 1000,10000,100000）")
+    parser.add_argument('--sources', type=int, default=3, help="合成源个数")
+    parser.add_argument('--latency-ms', type=float, default=10, help="替身服务每请求延迟（毫秒）")
+    parser.add_argument('--failure-rate', type=float, default=0.3, help="流地址失败比例（0~1）")
+    parser.add_argument('--probe-candidates', action='store_true',
+                        help="额外测量全量候选地址（择优前）的批量探测")
+    parser.add_argument('--no-alloc', action='store_true', help="不跟踪内存分配（纯耗时）")
+    parser.add_argument('--output', help="结果 JSON 写入文件（默认打印到 stdout）")
+    args = parser.parse_args(argv)
+
+    # 流水线 INFO 日志（每源/每阶段）会淹没结果，只保留告警
+    logging.disable(logging.INFO)
+    try:
+        runs = [
+            run_once(int(size), args.sources, args.latency_ms / 1000, args.failure_rate,
+                     args.probe_candidates, not args.no_alloc)
+            for size in args.sizes.split(',') if size.strip()
+        ]
+    finally:
+        logging.disable(logging.NOTSET)
+    report = {
+        "benchmark": "aggregation_pipeline",
+        "started_at": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "runs": runs,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,203 @@
+"""分片转发负载基准：大量并发 B 站分片流进行中，/api/live.m3u8 是否仍能及时应答
+
+用法（在项目根目录执行）：
+    python -m benchmarks.bench_serving                                   # 默认 gthread，200 路分片流
+    python -m benchmarks.bench_serving --worker-class sync --streams 20  # 对比历史单线程模型
+    python -m benchmarks.bench_serving --streams 400 --threads 512 --segment-seconds 4 \\
+        --output serving.json
+
+以 gunicorn.conf.py + benchmarks.serving_app 起单个 worker（--workers 1，量的是单进程承载），
+分片上游是本地替身（每个分片按 --segment-seconds 慢速吐完）。先测空载播放列表延迟，
+再同时打开 --streams 路分片下载，等转发都开始后逐个请求播放列表，记录：
+- 分片流：成功完成数 / 503 拒绝数（超出 SEGMENT_STREAM_LIMIT 名额）/ 其他失败数 / 转发字节数
+- 播放列表：空载与负载下的 p50 / p95 / max 延迟与失败数
+gevent 需另行安装；未安装时 config 退回 gthread（报告里的 worker_class 为实际生效值）。
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from benchmarks.fixtures import SEGMENT_CHUNK_SIZE, UpstreamStandIn  # noqa: E402  导入顺序：先修正 sys.path
+
+_SEGMENT_CHUNKS = 16
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _get(port, path, timeout):
+    """GET 并读完响应体，返回 (状态码, 字节数)；连接失败返回 (None, 0)"""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    try:
+        conn.request('GET', path)
+        response = conn.getresponse()
+        size = 0
+        while True:
+            data = response.read(SEGMENT_CHUNK_SIZE)
+            if not data:
+                break
+            size += len(data)
+        return response.status, size
+    except (OSError, http.client.HTTPException):
+        return None, 0
+    finally:
+        conn.close()
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * pct))], 4)
+
+
+def _playlist_latency(port, requests, timeout):
+    """顺序请求播放列表 requests 次，返回延迟统计"""
+    latencies = []
+    failed = 0
+    for _ in range(requests):
+        started = time.perf_counter()
+        status, _size = _get(port, '/api/live.m3u8', timeout)
+        elapsed = time.perf_counter() - started
+        if status == 200:
+            latencies.append(elapsed)
+        else:
+            failed += 1
+    return {
+        "requests": requests,
+        "failed": failed,
+        "p50_s": _percentile(latencies, 0.5),
+        "p95_s": _percentile(latencies, 0.95),
+        "max_s": round(max(latencies), 4) if latencies else None,
+    }
+
+
+def _start_server(port, upstream, data_dir, worker_class, threads):
+    """起 gunicorn（单 worker），等到播放列表可用；返回进程"""
+    env = dict(os.environ, BENCH_UPSTREAM=upstream, BENCH_DATA_DIR=data_dir,
+               GUNICORN_WORKER_CLASS=worker_class, GUNICORN_THREADS=str(threads))
+    env.pop('SEGMENT_STREAM_LIMIT', None)
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(BASE_DIR, 'gunicorn.conf.py'),
+         '--workers', '1', '--bind', f'127.0.0.1:{port}', '--pid', os.path.join(data_dir, 'gunicorn.pid'),
+         '--access-logfile', os.devnull, '--log-level', 'warning', 'benchmarks.serving_app:app'],
+        cwd=BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn 启动失败（退出码 {process.returncode}）")
+        if _get(port, '/api/live.m3u8', 1)[0] == 200:
+            return process
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("gunicorn 启动超时")
+
+
+def run(worker_class, streams, threads, segment_seconds, playlist_requests):
+    """起服务跑一轮负载，返回结果记录"""
+    from config import SEGMENT_STREAM_RESERVE
+
+    data_dir = tempfile.mkdtemp(prefix='bench-serving-')
+    port = _free_port()
+    delay = segment_seconds / _SEGMENT_CHUNKS
+    with UpstreamStandIn(segment_chunks=_SEGMENT_CHUNKS, segment_delay=delay) as upstream:
+        process = _start_server(port, upstream.base_url, data_dir, worker_class, threads)
+        try:
+            idle = _playlist_latency(port, playlist_requests, segment_seconds * 4)
+
+            results = []
+            lock = threading.Lock()
+
+            def viewer(index):
+                outcome = _get(port, f'/api/bilibili/1/seg/seg-{index}.ts', segment_seconds * 4)
+                with lock:
+                    results.append(outcome)
+
+            viewers = [threading.Thread(target=viewer, args=(i,), daemon=True) for i in range(streams)]
+            started = time.perf_counter()
+            for thread in viewers:
+                thread.start()
+            time.sleep(min(1.0, segment_seconds / 4))  # 等分片转发都已开始
+            loaded = _playlist_latency(port, playlist_requests, segment_seconds * 4)
+            for thread in viewers:
+                thread.join(segment_seconds * 8)
+            streams_wall = time.perf_counter() - started
+        finally:
+            process.terminate()
+            process.wait(10)
+
+    segment_bytes = _SEGMENT_CHUNKS * SEGMENT_CHUNK_SIZE
+    return {
+        "worker_class": _effective_worker_class(worker_class),
+        "threads": threads if worker_class == 'gthread' else None,
+        "stream_limit": max(1, threads - SEGMENT_STREAM_RESERVE) if worker_class == 'gthread' else None,
+        "streams": streams,
+        "segment_seconds": segment_seconds,
+        "streams_completed": sum(1 for status, size in results if status == 200 and size == segment_bytes),
+        "streams_rejected": sum(1 for status, _size in results if status == 503),
+        "streams_failed": sum(1 for status, size in results
+                              if status != 503 and not (status == 200 and size == segment_bytes)),
+        "relayed_bytes": sum(size for status, size in results if status == 200),
+        "streams_wall_s": round(streams_wall, 4),
+        "playlist_idle": idle,
+        "playlist_under_load": loaded,
+    }
+
+
+def _effective_worker_class(requested):
+    """gevent 未安装时 config 会退回 gthread"""
+    if requested == 'gevent':
+        import importlib.util
+        return 'gevent' if importlib.util.find_spec('gevent') else 'gthread'
+    return requested
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="分片转发负载基准")
+    parser.add_argument('--worker-class', default='gthread', choices=('gthread', 'gevent', 'sync'))
+    parser.add_argument('--streams', type=int, default=200, help="并发分片流数")
+    parser.add_argument('--threads', type=int, default=256, help="gthread 每 worker 线程数")
+    parser.add_argument('--segment-seconds', type=float, default=4, help="单个分片吐完的时长（秒）")
+    parser.add_argument('--playlist-requests', type=int, default=20, help="空载/负载下各请求播放列表次数")
+    parser.add_argument('--output', help="结果 JSON 写入文件（默认打印到 stdout）")
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.INFO)
+    try:
+        result = run(args.worker_class, args.streams, args.threads,
+                     args.segment_seconds, args.playlist_requests)
+    finally:
+        logging.disable(logging.NOTSET)
+    report = {
+        "benchmark": "segment_relay_serving",
+        "started_at": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "result": result,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,162 @@
+"""基准测试夹具：合成公开 m3u 源 + 本地上游替身服务
+
+- 合成源：按条目数生成 m3u，频道名混合央视开路（带分辨率后缀）、各省卫视与
+  会被过滤掉的杂台，同台多地址，贴近真实公开源的择优/去重负载
+- 替身服务：/source/<n>.m3u 返回第 n 个合成源；/stream/<id>.m3u8 模拟流地址，
+  按固定哈希决定失败（404），所有请求统一注入延迟；/segment/<名>.ts 模拟直播分片，
+  按 segment_chunks × 64 KiB 分块、块间隔 segment_delay 秒慢速吐出（分片转发负载基准用）
+结果可复现：同参数同输出（不用随机数）。
+"""
+import hashlib
+import http.server
+import socketserver
+import sys
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from config import CCTV_NAME_MAP
+
+PROVINCE_WEISHI = [
+    "北京卫视", "天津卫视", "河北卫视", "山西卫视", "内蒙古卫视", "辽宁卫视", "吉林卫视",
+    "黑龙江卫视", "东方卫视", "江苏卫视", "浙江卫视", "安徽卫视", "东南卫视", "江西卫视",
+    "山东卫视", "河南卫视", "湖北卫视", "湖南卫视", "广东卫视", "广西卫视", "海南卫视",
+    "重庆卫视", "四川卫视", "贵州卫视", "云南卫视", "西藏卫视", "陕西卫视", "甘肃卫视",
+    "青海卫视", "宁夏卫视", "新疆卫视",
+]
+RESOLUTIONS = ["", " (720p)", " (1080p)", " (576p)", " (2160p)"]
+NOISE_NAMES = ["CNBC", "某市新闻综合", "Discovery", "某县公共", "CGTN Documentary"]
+SEGMENT_CHUNK_SIZE = 64 * 1024
+
+
+def synthetic_channel(index):
+    """第 index 个合成条目 → (显示名, group-title)"""
+    kind = index % 4
+    if kind == 0:
+        keys = list(CCTV_NAME_MAP)
+        return keys[index // 4 % len(keys)] + RESOLUTIONS[index % len(RESOLUTIONS)], "央视"
+    if kind in (1, 2):
+        name = PROVINCE_WEISHI[index // 4 % len(PROVINCE_WEISHI)]
+        return name + RESOLUTIONS[(index // 3) % len(RESOLUTIONS)], "卫视"
+    return f"{NOISE_NAMES[index % len(NOISE_NAMES)]} {index}", "其他"
+
+
+def synthetic_m3u(source_index, size, base_url):
+    """
+    生成单个合成 m3u 源文本
+    :param source_index: 源序号（参与流 id，使多源地址不重复）
+    :param size: 条目数
+    :param base_url: 替身服务地址（流 URL 指向它）
+    """
+    lines = ["#EXTM3U"]
+    for i in range(size):
+        name, group = synthetic_channel(i)
+        lines.append(f'#EXTINF:-1 tvg-name="{name}" group-title="{group}",{name}')
+        if i % 10 == 0:
+            lines.append("#EXTVLCOPT:http-user-agent=Mozilla/5.0")
+        lines.append(f"{base_url}/stream/{source_index}-{i}.m3u8")
+    return "\n".join(lines) + "\n"
+
+
+def _stable_fraction(text):
+    """字符串 → [0, 1) 的稳定伪随机数（决定流地址是否失败）"""
+    return int(hashlib.md5(text.encode('utf-8')).hexdigest()[:8], 16) / 0x100000000
+
+
+class _UpstreamHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        parts = urlsplit(self.path)
+        if parts.path.startswith('/source/'):
+            index = int(parts.path.rsplit('/', 1)[-1].split('.')[0])
+            size = int(parse_qs(parts.query).get('size', ['1000'])[0])
+            body = server.source_body(index, size)
+            self._send(200, body, 'audio/x-mpegurl; charset=utf-8')
+        elif parts.path.startswith('/segment/'):
+            self._send_segment(server.segment_chunks, server.segment_delay)
+        elif parts.path.startswith('/stream/'):
+            if _stable_fraction(parts.path) < server.failure_rate:
+                self._send(404, b'not found', 'text/plain')
+            else:
+                self._send(200, b'#EXTM3U\n#EXT-X-TARGETDURATION:4\n' + b'#' * 1024,
+                           'application/vnd.apple.mpegurl')
+        else:
+            self._send(404, b'', 'text/plain')
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_segment(self, chunks, delay):
+        chunk = b'\x47' * SEGMENT_CHUNK_SIZE
+        self.send_response(200)
+        self.send_header('Content-Type', 'video/mp2t')
+        self.send_header('Content-Length', str(chunks * len(chunk)))
+        self.end_headers()
+        for _ in range(chunks):
+            self.wfile.write(chunk)
+            self.wfile.flush()
+            time.sleep(delay)
+
+    def log_message(self, *args):
+        pass
+
+
+class _ThreadingServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 512
+
+    def handle_error(self, request, client_address):
+        # 探测方读完首块即断开 / 轮末关闭空闲保活连接：属正常行为，不打印堆栈
+        exc = sys.exc_info()[1]
+        if isinstance(exc, (ConnectionError, TimeoutError)):
+            return
+        super().handle_error(request, client_address)
+
+
+class UpstreamStandIn:
+    """
+    本地上游替身（上下文管理器）
+    :param latency: 每个请求注入的延迟（秒）
+    :param failure_rate: 流地址失败比例（0~1）
+    :param segment_chunks: 模拟分片的 64 KiB 块数
+    :param segment_delay: 模拟分片块间隔（秒；块数 × 间隔 ≈ 单个分片下载时长）
+    """
+
+    def __init__(self, latency=0.0, failure_rate=0.0, segment_chunks=16, segment_delay=0.0):
+        self.server = _ThreadingServer(('127.0.0.1', 0), _UpstreamHandler)
+        self.server.latency = latency
+        self.server.failure_rate = failure_rate
+        self.server.segment_chunks = segment_chunks
+        self.server.segment_delay = segment_delay
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._bodies = {}
+        self._lock = threading.Lock()
+        self.server.source_body = self._source_body
+
+    def _source_body(self, index, size):
+        key = (index, size)
+        with self._lock:
+            if key not in self._bodies:
+                self._bodies[key] = synthetic_m3u(index, size, self.base_url).encode('utf-8')
+            return self._bodies[key]
+
+    def source_urls(self, count, size):
+        """count 个合成源地址（每源 size 条）"""
+        return [f"{self.base_url}/source/{i}.m3u?size={size}" for i in range(count)]
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,27 @@
+"""分片转发负载基准的 WSGI 入口（bench_serving 以 gunicorn 启动，不启动后台调度）
+
+create_app() 原样创建路由；B 站线路解析指向本地替身服务（分片请求走真实的
+proxy_segment → 分片缓存 → 线路尝试 → 流式转发路径），播放列表快照用合成列表发布一次。
+环境变量：BENCH_UPSTREAM（替身服务地址）、BENCH_DATA_DIR（临时目录，管理库指向其下不存在的路径）
+"""
+import os
+import sys
+from unittest import mock
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from app import create_app  # noqa: E402  导入顺序：先修正 sys.path
+from benchmarks.fixtures import synthetic_m3u  # noqa: E402
+from core.aggregator import AggregatorUtils  # noqa: E402
+from core.bilibili import BilibiliUtils  # noqa: E402
+
+UPSTREAM = os.environ['BENCH_UPSTREAM']
+
+mock.patch('admin.db.ADMIN_DB_PATH',
+           os.path.join(os.environ['BENCH_DATA_DIR'], 'missing', 'admin.db')).start()
+mock.patch.object(BilibiliUtils, 'resolve_play_m3u8',
+                  return_value=[(f"{UPSTREAM}/segment/index.m3u8", f"{UPSTREAM}/segment/", "")]).start()
+AggregatorUtils.publish_playlist_snapshot(synthetic_m3u(0, 400, UPSTREAM))
+
+app = create_app()
@@ -4,6 +4,7 @@
 环境变量在模块加载时读取一次（load_dotenv 唯一入口）。
 """
 import datetime
+import importlib.util
 import os
 import re
 
@@ -29,13 +30,61 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 XML_DATA_DIR = os.path.join(BASE_DIR, 'xml_data')
 XML_FILE_PATH = os.path.join(XML_DATA_DIR, 'live.xml')
 GZ_FILE_PATH = os.path.join(XML_DATA_DIR, 'live.xml.gz')
+# EPG 生成锁：同一时刻只有一个进程/线程生成 live.xml（多 worker 冷启动并发请求时只跑一轮）
+EPG_LOCK_PATH = os.path.join(XML_DATA_DIR, 'epg.lock')
+# EPG 文件交给 nginx 发送（X-Accel-Redirect）：设为 nginx 指向 xml_data 的 internal location 前缀
+# （如 /_xml_data/，示例见 docker/nginx.conf.example），应用只回响应头；
+# 留空 = 应用经 send_file 发送（gunicorn 下同样走 sendfile 零拷贝）
+SENDFILE_ACCEL_PREFIX = os.environ.get('SENDFILE_ACCEL_PREFIX', '')
 AGGREGATED_M3U_PATH = os.path.join(XML_DATA_DIR, 'aggregated.m3u')
+# 旧版聚合过滤连续失败计数文件（现存 admin 库 probe_results 表；启动时一次性迁入后删除）
 STREAM_FAILURES_PATH = os.path.join(XML_DATA_DIR, 'stream_failures.json')
+# 公开源候选测速排名（每台前 N 个候选的实测结果与胜出地址，跨轮沿用）
+CHANNEL_RANKINGS_PATH = os.path.join(XML_DATA_DIR, 'channel_rankings.json')
 # 公开源过滤+探测后的频道缓存（官方源 1h 高频刷新时复用，避免频繁拉公开源与重复探测）
 PUBLIC_CHANNELS_CACHE_PATH = os.path.join(XML_DATA_DIR, 'public_channels.json')
+# 单个公开源的解析结果缓存目录（每源一个 JSON：ETag/Last-Modified + 频道列表；
+# 上游 304 时直接复用，拉取失败时作过期兜底）
+PUBLIC_SOURCE_CACHE_DIR = os.path.join(XML_DATA_DIR, 'public_sources')
 EMAIL_TEMPLATE_PATH = os.path.join(BASE_DIR, 'templates', 'email_alert.html')
 EMAIL_MODULE_PATH = os.path.join(BASE_DIR, 'email', 'send_assistant.py')
 
+# ---------------------------------------------------------------- 多 worker 调度
+# 后台任务选主：各 gunicorn worker 竞争该文件上的 fcntl 排他锁，持锁的 leader 跑
+# 聚合/EPG/监控/开播追踪/故障切换检查，其余 worker 只读共享文件应答请求；
+# leader 退出时锁随进程释放，其余 worker 每 N 秒重试接管
+LEADER_LOCK_PATH = os.path.join(XML_DATA_DIR, 'scheduler.lock')
+LEADER_RETRY_INTERVAL = 5
+# leader → follower 共享状态文件：B 站开播状态表 / 故障切换候选与健康表
+LIVE_STATE_PATH = os.path.join(XML_DATA_DIR, 'live_state.json')
+FAILOVER_STATE_PATH = os.path.join(XML_DATA_DIR, 'failover_state.json')
+# follower 收到的手动刷新请求标志（leader 每 N 秒检查一次并执行聚合刷新）
+REFRESH_REQUEST_PATH = os.path.join(XML_DATA_DIR, 'refresh.request')
+REFRESH_REQUEST_POLL = 3
+# follower 检查共享文件（聚合 m3u / 状态文件）是否更新的最短间隔（秒）
+SHARED_STATE_CHECK_INTERVAL = 2
+# leader 发布开播状态表后，follower 在 N 秒内直接信任该表（超时则回退同步判定，防 leader 卡死）
+LIVE_STATE_MAX_AGE = 300
+
+# 注意：B 站主清单缓存与分片缓存的单飞合并在进程内生效，GUNICORN_WORKERS=N 时
+# 同一清单/分片最多被拉 N 次上游；需跨 worker 合并见 docker/nginx.conf.example 的 proxy_cache_lock
+# gunicorn worker 模型（gunicorn.conf.py 读取）：
+# gthread（默认）每个 worker 一个线程池，分片流只占一个线程，播放列表/EPG 请求由其余线程应答
+# gevent  协程并发，单进程可撑数百路分片流（需另行 pip install gevent；未安装时退回 gthread）
+# sync    历史单线程模型：一条分片流就占满整个 worker，仅用于排障对比
+GUNICORN_WORKER_CLASS = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread').lower()
+if GUNICORN_WORKER_CLASS == 'gevent' and importlib.util.find_spec('gevent') is None:
+    GUNICORN_WORKER_CLASS = 'gthread'
+# gthread 每 worker 线程数 / gevent 每 worker 并发连接数
+GUNICORN_THREADS = int(os.environ.get('GUNICORN_THREADS', '64'))
+GUNICORN_WORKER_CONNECTIONS = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', '1000'))
+# 每 worker 同时转发的 B 站分片流上限：留 SEGMENT_STREAM_RESERVE 个线程（连接）给短请求，
+# 超限的分片请求直接 503（播放器重试），长连接占满线程也饿不死播放列表/EPG 接口；0 = 不限
+SEGMENT_STREAM_RESERVE = 8
+_worker_slots = {'gevent': GUNICORN_WORKER_CONNECTIONS, 'gthread': GUNICORN_THREADS}.get(GUNICORN_WORKER_CLASS)
+SEGMENT_STREAM_LIMIT = int(os.environ.get(
+    'SEGMENT_STREAM_LIMIT', max(1, _worker_slots - SEGMENT_STREAM_RESERVE) if _worker_slots else 0))
+
 # ---------------------------------------------------------------- 聚合
 # 公开 m3u 源列表（三个源互补）：
 # - iptv-org：央视全（17个），但卫视多为运营商内网IP，公网可达性差
@@ -53,9 +102,66 @@ AGGREGATE_REFRESH_INTERVAL = 6 * 60 * 60
 # HNTV 官方源刷新间隔（秒）——官方接口签名有效期约 4h，2h 刷新留 2h 余量，保持签名新鲜
 OFFICIAL_REFRESH_INTERVAL = 2 * 60 * 60
 
+# 上游 HTTP 连接池（core/http_client.py）：按 (预设, 协议, 主机) 复用 keep-alive 会话，
+# 分片代理与探测轮次不再每次重做 TCP+TLS 握手
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', '16'))   # 单主机最大保活连接数
+HTTP_MAX_SESSIONS = 256              # 会话总数上限（探测面向大量零散主机，超出淘汰最久未用）
+HTTP_DEFAULT_TIMEOUT = 15            # 调用方未指定超时时的默认值（秒）
+HTTP_RETRIES = 2                     # 连接失败/502/503/504 自动重试次数（仅 GET）
+HTTP_RETRY_BACKOFF = 0.3             # 重试退避系数（urllib3 指数退避）
+
+# EPG 生成：逐频道拉取节目单的并发数 / 单次请求超时（秒）/ 失败重试次数
+# （官方接口偶发挂起，无超时时一个 cid 会拖住整个 02:30 任务）
+EPG_FETCH_CONCURRENCY = int(os.environ.get('EPG_FETCH_CONCURRENCY', '8'))
+EPG_FETCH_TIMEOUT = 10
+EPG_FETCH_RETRIES = 2
+EPG_FETCH_RETRY_BACKOFF = 0.5        # 重试退避基数（秒），第 n 次重试等待 n × 基数
+# EPG 多日窗口（GMT+8 日期）：XML 含昨天 .. 后天的节目，零点后播放器仍有当天节目与后续预告。
+# 逐频道逐日存于 EPG_STORE_DIR（core.epg_store），每次生成只拉缺失的日期与当天及以后拉取
+# 超过 EPG_DAY_MAX_AGE 秒的日期，XML 从存储整体渲染：02:30 任务每频道拉新进入窗口的一天
+# + 刷新当天（前一天拉的明天已不到 30 小时，沿用）；单日拉取失败沿用存储中的旧数据
+EPG_STORE_DIR = os.path.join(XML_DATA_DIR, 'epg_store')
+EPG_WINDOW_PAST_DAYS = 1
+EPG_WINDOW_FUTURE_DAYS = 2
+EPG_DAY_MAX_AGE = 30 * 3600
+# 外部 XMLTV 节目单合并（公开源央视/卫视、B 站频道的 EPG；官方接口只覆盖 hntv 频道）：
+# 逗号分隔的地址（.xml 或 .xml.gz），条件 GET 落盘到 EPG_XMLTV_CACHE_DIR 后流式解析，
+# 按频道名归一化对齐到当前播放列表的 tvg-id，只保留列表内频道与多日窗口内的节目；
+# 多个源按顺序合并，同一频道取第一个有节目的源。管理后台设置 epg_xmltv_urls 优先；空 = 不合并
+EPG_XMLTV_URLS = [url.strip() for url in os.environ.get('EPG_XMLTV_URLS', '').split(',') if url.strip()]
+EPG_XMLTV_CACHE_DIR = os.path.join(XML_DATA_DIR, 'epg_feeds')
+EPG_XMLTV_FETCH_TIMEOUT = 60
+
+# 公开源并发拉取数（总耗时从各源之和降为最慢单源）与单源超时（秒）
+PUBLIC_SOURCE_FETCH_CONCURRENCY = 8
+PUBLIC_SOURCE_FETCH_TIMEOUT = 20
+
 # 聚合时探测过滤不可达源（连续两轮失败才丢弃，避免源瞬时抖动被误杀）
 FILTER_UNREACHABLE = True
 STREAM_FAIL_LIMIT = 2                # 连续失败 N 轮才丢弃
+# 探测结果共享存储（admin 库 probe_results 表，聚合过滤与流监控共用）：
+# 聚合过滤时，新鲜期内已确认可达（宽松口径，或监控的严格口径）的 URL 直接沿用结果、不再探测
+PROBE_RESULT_MAX_AGE = int(os.environ.get('PROBE_RESULT_MAX_AGE', '1800'))   # 新鲜期（秒），0=不复用
+
+# 公开源候选测速择优：同台按地址质量/分辨率取前 N 个候选并发测速
+# （首字节耗时 + 一小段下载速率），在可达候选中选分辨率最高、同分辨率内实测最快的地址；
+# N<=1 退回纯启发式择优
+RANK_TOP_N = int(os.environ.get('RANK_TOP_N', '3'))
+RANK_SAMPLE_BYTES = 64 * 1024        # 每个候选最多采样字节数
+RANK_SAMPLE_SECONDS = 2              # 每个候选采样最长时间（秒，不含首字节耗时）
+# 分辨率优先：true（默认）先比名称中的分辨率，同分辨率内按实测代价择优；false 只比实测代价
+RANK_PREFER_RESOLUTION = os.environ.get('RANK_PREFER_RESOLUTION', 'true').lower() == 'true'
+
+# 公开频道备用地址输出方式（测速可达的其余候选作为备用，DB 设置 failover_mode 优先）：
+# off      每台只输出一个地址（默认，与历史输出一致）
+# tvbox    主备地址用 # 拼成一行（TVBox 系播放器按 # 依次切换）
+# multi    主备地址各输出一条同名条目（播放器按同名多源处理）
+# redirect 输出本服务 /api/ch/<频道> 地址，请求时 302 到当前最健康的候选（不重下列表即可切源）
+FAILOVER_MODE = os.environ.get('FAILOVER_MODE', 'off').lower()
+FAILOVER_MODES = ('off', 'tvbox', 'multi', 'redirect')
+# redirect 模式健康表：后台每 N 秒探测各频道当前地址；失败地址 M 秒内不再选用
+FAILOVER_CHECK_INTERVAL = 120
+FAILOVER_RETRY_AFTER = 600
 
 # hntv 官方频道的分组名（降级路径与聚合路径共用，避免魔法字符串）
 HNTV_GROUP_NAME = "河南卫视"
@@ -86,6 +192,9 @@ CCTV_NAME_MAP = {
     "CCTV-4K": "CCTV-4K 超高清",
 }
 
+# 频道名归一化索引的 LRU 容量（同名反复归一化走缓存；每轮聚合开始时清空）
+NAME_INDEX_CACHE_SIZE = 4096
+
 # 疑似运营商 IPTV 内网 IP 段前缀（公网环境通常不可达），用于地址质量评分。
 # 注：112./120./218. 开头实测含公网可达 CDN（112.27.235.94 吉林/120.76.248.139 阿里云/218.84.12.186），
 # 已从前缀中移除，避免误伤
@@ -128,6 +237,34 @@ BILIBILI_CACHE_PATH = os.path.join(XML_DATA_DIR, 'bilibili_rooms.json')
 BILIBILI_CUSTOM_ROOMS_PATH = os.path.join(XML_DATA_DIR, 'bilibili_custom_rooms.json')
 # 流地址解析结果的内存缓存 TTL（秒）：地址带时效签名，过期必须重新解析
 BILIBILI_PLAY_CACHE_TTL = 1800
+# uid -> 房间号 内存索引有效期（秒）：房间号基本不变，过期后下轮聚合批量重新解析
+BILIBILI_ROOM_INDEX_TTL = 6 * 3600
+# uid 解析失败（接口故障/未开通直播间）后 N 秒内不再重试，避免上游故障期间每次列表请求都付一轮超时
+BILIBILI_ROOM_FAIL_TTL = 300
+# 批量接口失败/未覆盖时逐个解析 uid 的并发上限
+BILIBILI_RESOLVE_CONCURRENCY = 4
+# 线路签名预刷新：线路带 expires/deadline 签名时间时，缓存提前 MARGIN 秒过期；
+# 后台线程每 TICK 秒检查一次，为最近 VIEWER_WINDOW 秒内有观众的房间，
+# 在缓存剩余不足 AHEAD 秒时强制重新解析
+BILIBILI_SIGN_REFRESH_MARGIN = 300
+BILIBILI_SIGN_REFRESH_AHEAD = 60
+BILIBILI_SIGN_REFRESH_TICK = 15
+BILIBILI_VIEWER_WINDOW = 120
+# 拉取失败的 CDN 主机降级时长（秒）：降级期内排到线路末尾，不再优先尝试
+BILIBILI_ROUTE_DEMOTE_SECONDS = 300
+# 线路请求超时（秒）：连接超时短（黑洞主机快速失败切备用），读取超时留足分片下载
+BILIBILI_CONNECT_TIMEOUT = 3
+BILIBILI_READ_TIMEOUT = 10
+# 线路健康 EWMA 平滑系数；未测过的主机按默认耗时（秒）排序；失败率惩罚（秒，失败率 1 时加的耗时）
+BILIBILI_ROUTE_EWMA_ALPHA = 0.3
+BILIBILI_ROUTE_DEFAULT_LATENCY = 1.0
+BILIBILI_ROUTE_ERROR_PENALTY = 5.0
+# 对冲请求（默认关）：首选线路超过近期 p95 耗时仍未响应时并发请求下一条线路，取先成功者。
+# 样本不足时等待 DEFAULT_DELAY 秒，等待时长不低于 MIN_DELAY 秒
+BILIBILI_HEDGE_REQUESTS = os.environ.get('BILIBILI_HEDGE_REQUESTS', 'false').lower() == 'true'
+BILIBILI_HEDGE_DEFAULT_DELAY = 1.0
+BILIBILI_HEDGE_MIN_DELAY = 0.2
+BILIBILI_HEDGE_WORKERS = 8
 
 # B 站直播频道所在分组（输出顺序放最后，见 GROUP_ORDER）
 BILIBILI_GROUP_NAME = "B站直播"
@@ -141,6 +278,36 @@ PUBLIC_BASE_URL = os.environ.get('PUBLIC_BASE_URL', 'http://localhost:5002')
 # （省服务器带宽，实测分片无 Referer 也可访问，防盗链只卡主清单）；
 # False 时回退全代理（分片也经本服务转发，兼容性兜底，B 站收紧分片防盗链时用）
 BILIBILI_DIRECT_SEGMENTS = os.environ.get('BILIBILI_DIRECT_SEGMENTS', 'true').lower() == 'true'
+# 代理模式分片缓存：每个房间保留最近 N 个分片（略大于 HLS 滑动窗口即可，窗口前移自动淘汰），
+# 同一分片的并发观众合并为一次上游拉取
+BILIBILI_SEGMENT_CACHE_PER_ROOM = int(os.environ.get('BILIBILI_SEGMENT_CACHE_PER_ROOM', '8'))
+# 分片缓存最多保留的房间数（超出时淘汰最久未访问的房间）
+BILIBILI_SEGMENT_CACHE_ROOMS = 8
+# 读者等待上游分片响应头/数据块的超时（秒）
+BILIBILI_SEGMENT_WAIT_TIMEOUT = 20
+# 重写后主清单的缓存 TTL：取上游 #EXT-X-TARGETDURATION（播放器按此间隔轮询），
+# 限定在 [MIN, MAX] 秒；清单缺该标签时用 DEFAULT
+BILIBILI_PLAYLIST_TTL_MIN = 1
+BILIBILI_PLAYLIST_TTL_MAX = 10
+BILIBILI_PLAYLIST_TTL_DEFAULT = 2
+# 上游拉清单失败时，过期缓存最多再沿用的时长（秒），超过则返回失败
+BILIBILI_PLAYLIST_STALE_TTL = 30
+
+# B 站开播状态追踪（后台线程轮询，聚合/房间列表/状态接口查内存表）：
+# 在播房间检测间隔（秒，及时发现下播）
+BILIBILI_LIVE_CHECK_INTERVAL = 60
+# 未开播房间检测间隔（秒）
+BILIBILI_OFFLINE_CHECK_INTERVAL = 180
+# 临近该房间历史开播时刻（前后 BILIBILI_START_WINDOW 秒内）时的检测间隔（秒）
+BILIBILI_PEAK_CHECK_INTERVAL = 30
+BILIBILI_START_WINDOW = 1800
+# 连续未开播超过该时长（秒，默认 2 天）的房间降频到 BILIBILI_IDLE_CHECK_INTERVAL
+BILIBILI_IDLE_AFTER = 2 * 86400
+BILIBILI_IDLE_CHECK_INTERVAL = 1800
+# 追踪线程节拍（秒）、房间列表重载间隔（秒）、并发检测线程数
+BILIBILI_TRACKER_TICK = 5
+BILIBILI_TRACKER_ROOMS_REFRESH = 60
+BILIBILI_TRACKER_WORKERS = 5
 
 # 分组顺序：河南卫视（hntv官方）-> 央视 -> 卫视（健康率低放最后）-> B站直播，其余兜底
 GROUP_ORDER = {HNTV_GROUP_NAME: 0, "央视": 1, "卫视": 2, BILIBILI_GROUP_NAME: 3}
@@ -170,13 +337,24 @@ MONITOR_HISTORY_KEEP = int(os.environ.get('MONITOR_HISTORY_KEEP', '500'))     #
 # 流探测条数：30 分钟一轮 × 约 70 频道 ≈ 3400 条/天，20000 约保留 6 天
 STREAM_HISTORY_KEEP = int(os.environ.get('STREAM_HISTORY_KEEP', '20000'))
 LOG_KEEP_DAYS = int(os.environ.get('LOG_KEEP_DAYS', '7'))                     # 日志保留天数
+PROBE_RESULT_KEEP_DAYS = 7           # 探测结果保留天数（超期且无失败计数的 URL 清理）
 # 管理 API 列表分页：每页条数上限（超出截断）
 MAX_PAGE_SIZE = 200
 # 频道覆盖层内存缓存 TTL（秒）：聚合/频道列表查询覆盖配置的缓存时长
 CHANNEL_OVERRIDE_CACHE_TTL = 60
 
 # ---------------------------------------------------------------- 监控
-# 检测目标（monitor 跑在 api 容器内部，自检用容器内端口 5002；
+# 检测方式：
+# inprocess（默认）监控线程与服务同进程，直接读已发布的播放列表快照（频道数 + 最近聚合时间）
+#           与磁盘 EPG 文件（大小 + 修改时间），不占用 worker、不回环请求自身
+# external  黑盒检测：按下方 URL 经 HTTP 请求服务（监控部署在别处 / 需验证反代链路时用）
+MONITOR_CHECK_MODE = os.environ.get('MONITOR_CHECK_MODE', 'inprocess').lower()
+# inprocess 模式新鲜度阈值：播放列表超过两个刷新周期（官方源周期；B 站测试模式取公开源周期）
+# 未重新发布即视为异常；EPG 文件超过 N 秒未更新（每天 02:30 刷新）即视为异常
+MONITOR_EPG_MAX_AGE = 30 * 3600
+# inprocess 模式"服务存活"判据：公开源聚合调度线程在运行（scheduling 按此名启动）
+AGGREGATE_THREAD_NAME = '聚合-公开源'
+# external 模式检测目标（monitor 跑在 api 容器内部，自检用容器内端口 5002；
 # 宿主机映射端口 15002 在容器内连不上。若未来加 nginx 反代，用环境变量覆盖）
 HEALTH_URL = os.environ.get('MONITOR_HEALTH_URL', 'http://localhost:5002/health')
 M3U_URL = os.environ.get('MONITOR_M3U_URL', 'http://localhost:5002/api/live.m3u8')
@@ -199,6 +377,8 @@ STARTUP_DELAY = 90           # 首次检测延迟（秒）：等聚合任务跑
 STREAM_CHECK_INTERVAL = 1800        # 全量流探测间隔（秒），30 分钟一轮
 STREAM_CHECK_CONCURRENCY = 10       # 并发探测数
 STREAM_PROBE_TIMEOUT = 8            # 单流探测超时（秒）
+# 聚合过滤批量探测并发（asyncio 协程数，不占线程；公开源候选可达数千条）
+FILTER_PROBE_CONCURRENCY = int(os.environ.get('FILTER_PROBE_CONCURRENCY', '64'))
 STREAM_USER_AGENT = 'hntv-api-monitor'        # 监控探测 UA
 STREAM_PROBE_UA_LOOSE = 'hntv-api-aggregator'  # 聚合过滤探测 UA（与监控区分，避免源端拒答差异）
 
@@ -3,18 +3,22 @@ import json
 import os
 import threading
 import time
-from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
 
 from config import (AGGREGATED_M3U_PATH, BILIBILI_GROUP_NAME, BILIBILI_ONLY_MODE,
-                    BILIBILI_ROOMS, CHANNEL_OVERRIDE_CACHE_TTL, FILTER_UNREACHABLE,
+                    BILIBILI_ROOMS, CHANNEL_OVERRIDE_CACHE_TTL, FAILOVER_MODE,
+                    FAILOVER_MODES, FILTER_UNREACHABLE,
                     GROUP_ORDER, HNTV_GROUP_NAME, PUBLIC_BASE_URL,
-                    PUBLIC_CHANNELS_CACHE_PATH, STREAM_CHECK_CONCURRENCY,
-                    STREAM_FAILURES_PATH, STREAM_FAIL_LIMIT, STREAM_PROBE_UA_LOOSE)
+                    PROBE_RESULT_MAX_AGE, PUBLIC_CHANNELS_CACHE_PATH,
+                    SHARED_STATE_CHECK_INTERVAL, STREAM_FAIL_LIMIT, STREAM_PROBE_UA_LOOSE)
+from core import failover, leader, live_tracker, probe_store, ranking
 from core.atomic_io import atomic_write_text
 from core.bilibili import BilibiliUtils
 from core.hntv_client import ApiUtils
 from core.logger import get_logger
-from core.probing import probe_stream
+from core.m3u_writer import render_m3u
+from core.probing import probe_many
+from core.snapshot import PlaylistSnapshot
 from core.sources import SourceUtils
 
 _logger = get_logger('aggregator')
@@ -42,6 +46,14 @@ def register_refresh_callback(cb):
         _refresh_callbacks.append(cb)
 
 
+def _m3u_mtime():
+    """聚合文件 mtime（快照 Last-Modified 与 follower 按文件加载的保持一致）；读不到返回 None"""
+    try:
+        return os.path.getmtime(AGGREGATED_M3U_PATH)
+    except OSError:
+        return None
+
+
 def _fire_refresh_callbacks():
     """聚合结果已落盘后触发全部回调（尽力而为，异常吞掉）"""
     for cb in list(_refresh_callbacks):
@@ -50,6 +62,14 @@ def _fire_refresh_callbacks():
         except Exception:
             pass
 
+# 播放列表快照（聚合落盘后发布，/api/live.m3u8 直接用预编码字节应答）。
+# 请求路径只读引用（无锁）；发布/冷启动加载用锁串行，避免旧文件内容覆盖新快照。
+# follower worker 不跑聚合，按聚合文件 mtime 变化重新加载（stat 至多每 SHARED_STATE_CHECK_INTERVAL 秒一次）
+_playlist_snapshot = None
+_snapshot_lock = threading.Lock()
+_snapshot_mtime = None
+_snapshot_checked_at = 0
+
 # 频道覆盖层内存缓存（管理后台配置的禁用/改分组/改名）：
 # {channel_key: {enabled, display_name, group_title}}，TTL 见 CHANNEL_OVERRIDE_CACHE_TTL。
 # 聚合与频道列表共享；查询失败回退空 dict（不阻断聚合）
@@ -141,6 +161,13 @@ class AggregatorUtils:
         from admin import db
         return db.get_effective_str('public_base_url', PUBLIC_BASE_URL)
 
+    @staticmethod
+    def _failover_mode():
+        """公开频道备用地址输出方式（off/tvbox/multi/redirect）：DB 设置优先，config 兜底"""
+        from admin import db
+        mode = (db.get_effective_str('failover_mode', FAILOVER_MODE) or '').lower()
+        return mode if mode in FAILOVER_MODES else 'off'
+
     @staticmethod
     def _get_bilibili_static_rooms():
         """
@@ -163,16 +190,22 @@ class AggregatorUtils:
         """
         列出全部 B 站频道（静态配置 + 动态列表合并）：
         - 以 room_id 为唯一 key 去重，静态配置优先
-        - 静态条目支持 room_id 直填或 uid（uid 走 get_room_id 解析，磁盘缓存兜底）
+        - 静态条目支持 room_id 直填或 uid（uid 走 get_room_ids 批量解析，内存索引 + 磁盘缓存兜底）
         :return: [{name, room_id, source}]，source 为 static/custom
         """
         result = []
         seen = set()
 
-        for item in AggregatorUtils._get_bilibili_static_rooms():
+        static_rooms = AggregatorUtils._get_bilibili_static_rooms()
+        # uid 条目一轮批量解析（内存索引命中则不请求）
+        uids = [item["uid"] for item in static_rooms
+                if item.get("room_id") is None and item.get("uid") is not None]
+        room_ids = BilibiliUtils.get_room_ids(uids) if uids else {}
+
+        for item in static_rooms:
             room_id = item.get("room_id")
             if room_id is None and item.get("uid") is not None:
-                room_id = BilibiliUtils.get_room_id(item["uid"])
+                room_id = room_ids.get(str(item["uid"]))
             if room_id is None or room_id in seen:
                 continue
             seen.add(room_id)
@@ -194,7 +227,7 @@ class AggregatorUtils:
         """
         拉取 B 站直播频道（开播的才加入，未开播自动跳过）：
         - 数据源 = 静态配置 + 动态列表（room_id 去重，静态优先）
-        - 实测主清单判定在播（playUrl 解析结果不可信，未开播也返回地址）
+        - 在播判定查开播追踪表（后台实测主清单；playUrl 解析结果不可信，未开播也返回地址）
         - 地址为本服务代理 URL（播放器直连原始地址会 403 防盗链）
         :return: B 站直播频道 dict 列表（可能为空）
         """
@@ -202,7 +235,7 @@ class AggregatorUtils:
         for item in AggregatorUtils.list_bilibili_rooms():
             room_id = item["room_id"]
             name = item["name"]
-            if not BilibiliUtils.is_live(room_id):
+            if not live_tracker.is_live(room_id):
                 _log(f"B站直播跳过（未开播）: {name} (room={room_id})")
                 continue
             channels.append({
@@ -243,6 +276,7 @@ class AggregatorUtils:
         - 公开源只补充 hntv 没有的频道
         - 公开源内同台多个分辨率时，保留清晰度最高的一个
         - B 站直播频道独立分组，不参与同台去重（频道名不冲突）
+        - 公开频道带备用地址（backup_urls）时按 FAILOVER_MODE 输出主备地址（默认 off 只输出主地址）
         注：可达性探测过滤已在 prepare_public_channels 阶段完成（官方源永不探测）
         :param hntv_channels: hntv 官方频道列表（优先级最高）
         :param public_channels: 公开源频道列表（已过滤+中文化+探测过滤）
@@ -262,10 +296,12 @@ class AggregatorUtils:
 
         # 公开源补充 hntv 没有的频道（同台按地址质量/分辨率择优）
         public_best = AggregatorUtils.pick_best_public(public_channels)
+        public_keys = set()
         for key, (ch, _score, _res) in public_best.items():
             if key not in merged:
                 merged[key] = ch
                 order.append(key)
+                public_keys.add(key)
 
         # B 站直播频道（独立分组，直接追加；不参与去重）
         for ch in bilibili_channels:
@@ -274,65 +310,84 @@ class AggregatorUtils:
                 merged[key] = ch
                 order.append(key)
 
-        # 频道覆盖（管理后台：禁用/改分组/改名）：只在输出前应用，不改动择优/去重逻辑
+        # 频道覆盖（管理后台：禁用/改分组/改名）：只在输出前应用，不改动择优/去重逻辑。
+        # 单遍处理：禁用项记入 dropped 集合，最后一次性过滤 order（避免循环内 list.remove）
         overrides = _get_channel_overrides()
-        for key in list(order):
-            ov = overrides.get(key)
-            if not ov:
-                continue
-            if ov.get("enabled") == 0:
-                merged.pop(key, None)
-                order.remove(key)
-                continue
-            if ov.get("display_name"):
-                merged[key] = dict(merged[key], name=ov["display_name"])
-            if ov.get("group_title"):
-                merged[key] = dict(merged[key], group_title=ov["group_title"])
+        if overrides:
+            dropped = set()
+            for key in order:
+                ov = overrides.get(key)
+                if not ov:
+                    continue
+                if ov.get("enabled") == 0:
+                    dropped.add(key)
+                    merged.pop(key, None)
+                    continue
+                if ov.get("display_name"):
+                    merged[key] = dict(merged[key], name=ov["display_name"])
+                if ov.get("group_title"):
+                    merged[key] = dict(merged[key], group_title=ov["group_title"])
+            if dropped:
+                order = [key for key in order if key not in dropped]
 
         # 分组顺序：河南卫视（hntv官方）-> 央视 -> 卫视（健康率低放最后）-> B站直播，其余兜底
         order.sort(key=lambda k: GROUP_ORDER.get(merged[k]["group_title"], 3))
 
-        # 生成 m3u 文本
-        m3u_content = "#EXTM3U\n\n"
+        # 生成 m3u 文本（公开频道按故障切换方式展开主备地址）
+        mode = AggregatorUtils._failover_mode()
+        redirect_base = AggregatorUtils._public_base_url().rstrip('/') if mode == 'redirect' else ''
+        redirect_table = {}
+        entries = []
         for key in order:
             ch = merged[key]
-            # tvg-id/tvg-name 取值：hntv 官方频道用 cid（str 兜底 name），公开源频道用其 tvg_name
-            if "cid" in ch:
-                tvg_id = str(ch["cid"]) if ch["cid"] is not None else ch["name"]
+            entry = AggregatorUtils._aggregated_entry(ch)
+            urls = [ch["url"]] + ch.get("backup_urls", []) if key in public_keys else [ch["url"]]
+            if len(urls) == 1 or mode == 'off':
+                entries.append(entry)
+            elif mode == 'tvbox':
+                entries.append(entry[:4] + ('#'.join(urls),))
+            elif mode == 'multi':
+                entries.extend(entry[:4] + (url,) for url in urls)
             else:
-                tvg_id = ch["tvg_name"]
-            m3u_content += (
-                f'#EXTINF:-1 tvg-id="{tvg_id}" tvg-name="{tvg_id}" '
-                f'group-title="{ch["group_title"]}",{ch["name"]}\n'
-                f'{ch["url"]}\n\n'
-            )
+                redirect_table[key] = urls
+                entries.append(entry[:4] + (f"{redirect_base}/api/ch/{quote(key, safe='')}",))
+        failover.publish(redirect_table)
+        m3u_content = render_m3u(entries)
 
         _log(f"聚合完成：hntv {len(hntv_channels)} 个 + 公开补充 "
               f"{len(merged) - len(hntv_channels) - len(bilibili_channels)} 个 + "
               f"B站直播 {len(bilibili_channels)} 个 = 共 {len(merged)} 个频道")
         return m3u_content
 
+    @staticmethod
+    def _aggregated_entry(ch):
+        """
+        聚合列表条目元组（供 m3u_writer 渲染）：
+        tvg-id/tvg-name 取值：hntv 官方频道用 cid（str 兜底 name），公开源频道用其 tvg_name
+        """
+        if "cid" in ch:
+            tvg_id = str(ch["cid"]) if ch["cid"] is not None else ch["name"]
+        else:
+            tvg_id = ch["tvg_name"]
+        return tvg_id, tvg_id, ch["group_title"], ch["name"], ch["url"]
+
     # ------------------------------------------------------------ 探测过滤
 
     @staticmethod
     def _load_failures():
-        """读取跨轮失败记录 {url: 连续失败次数}；文件不存在或损坏返回空 dict"""
-        try:
-            if os.path.exists(STREAM_FAILURES_PATH):
-                with open(STREAM_FAILURES_PATH, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    return data if isinstance(data, dict) else {}
-        except Exception as e:
-            _log(f"读取失败记录出错: {str(e)}")
-        return {}
+        """读取跨轮失败记录 {url: 连续失败次数}（探测结果存储，读失败返回空 dict）"""
+        return probe_store.load_fail_counts()
 
     @staticmethod
     def _save_failures(failures):
-        """保存失败记录（原子写入）"""
-        try:
-            atomic_write_text(STREAM_FAILURES_PATH, json.dumps(failures, ensure_ascii=False, indent=2))
-        except Exception as e:
-            _log(f"保存失败记录出错: {str(e)}")
+        """保存失败记录（整体替换）"""
+        probe_store.save_fail_counts(failures)
+
+    @staticmethod
+    def _probe_result_max_age():
+        """探测结果新鲜期（秒）：DB 设置优先，config 兜底"""
+        from admin import db
+        return db.get_effective_int('probe_result_max_age', PROBE_RESULT_MAX_AGE)
 
     @staticmethod
     def filter_unreachable(channels):
@@ -340,6 +395,7 @@ class AggregatorUtils:
         对公开源频道列表做可达性探测过滤（仅在 prepare_public_channels 阶段调用）：
         - 宽松判定探测（200/206/403 均可达）；本轮不可达计数+1，
           连续 STREAM_FAIL_LIMIT 轮失败才丢弃，本轮可达清空计数
+        - 新鲜期内已确认可达的 URL（本过滤或流监控刚探测过）直接沿用，不再探测
         - 官方频道不经过本方法（永不因探测被过滤）
         :param channels: 已择优的公开频道 dict 列表
         :return: 过滤后的频道列表（连续两轮失败者被剔除，第一轮失败保留）
@@ -351,15 +407,18 @@ class AggregatorUtils:
         failures = AggregatorUtils._load_failures()
         probed_urls = set(urls)
 
-        # 并发探测（宽松判定：403 也算可达；用聚合专用 UA 保持历史行为）
-        results = {}
-        with ThreadPoolExecutor(max_workers=STREAM_CHECK_CONCURRENCY) as executor:
-            for url, ok in zip(urls,
-                               executor.map(
-                                   lambda u: probe_stream(u, accept_403=True,
-                                                         user_agent=STREAM_PROBE_UA_LOOSE),
-                                   urls)):
-                results[url] = ok
+        # 新鲜期内已确认可达的跳过探测
+        fresh = probe_store.fresh_ok(urls, AggregatorUtils._probe_result_max_age())
+        todo = [u for u in dict.fromkeys(urls) if u not in fresh]
+        if fresh:
+            _log(f"探测过滤：{len(fresh)} 个 URL 近期已确认可达，跳过探测")
+
+        # 批量异步探测（宽松判定：403 也算可达；用聚合专用 UA 保持历史行为）
+        probed = probe_many(todo, accept_403=True, user_agent=STREAM_PROBE_UA_LOOSE,
+                            details=True)
+        probe_store.record(todo, probed, 'loose')
+        results = {u: True for u in fresh}
+        results.update((u, r.ok) for u, r in zip(todo, probed))
 
         kept = []
         dropped = []
@@ -391,13 +450,13 @@ class AggregatorUtils:
     @staticmethod
     def prepare_public_channels():
         """
-        准备公开源频道：拉源 -> 过滤中文化 -> 同台择优 -> 探测过滤
+        准备公开源频道：拉源 -> 过滤中文化 -> 同台候选测速择优 -> 探测过滤
         :return: 过滤后的公开频道 dict 列表
         """
         public_channels = SourceUtils.fetch_all_public_channels()
         public_channels = SourceUtils.filter_and_translate(public_channels)
-        # 同台择优（每台一个），再探测过滤
-        best = AggregatorUtils.pick_best_public(public_channels)
+        # 同台择优（前 N 个候选实测，可达者中分辨率优先、同分辨率选最快，每台一个），再探测过滤
+        best = ranking.rank_public(public_channels)
         best_list = [ch for ch, _score, _res in best.values()]
         return AggregatorUtils.filter_unreachable(best_list)
 
@@ -450,8 +509,12 @@ class AggregatorUtils:
         请求异步聚合刷新（POST 添加/删除房间后调用）：
         - 合并多次请求：已有 worker 待跑时直接返回，不重复开线程
         - 与定时任务不并发：worker 阻塞获取 _aggregate_lock，定时聚合进行中则等其完成
+        - 多 worker 部署的 follower 不跑聚合：写刷新请求标志，由调度 leader 执行
         """
         global _refresh_pending
+        if not leader.is_leader():
+            leader.request_refresh()
+            return
         with _refresh_flag_lock:
             if _refresh_pending:
                 return
@@ -480,6 +543,7 @@ class AggregatorUtils:
     def _get_aggregated_m3u_locked():
         """聚合内部实现（调用方必须已持有 _aggregate_lock）"""
         try:
+            SourceUtils.reset_name_index()
             # B 站测试模式：跳过 hntv 官方源与公开源拉取，只收集 B 站直播频道
             # （频繁重启测试时避免拉公开源+探测 70 频道拖慢启动）
             if AggregatorUtils.is_bilibili_only_mode():
@@ -502,6 +566,7 @@ class AggregatorUtils:
                 hntv_channels, public_channels, bilibili_channels)
             atomic_write_text(AGGREGATED_M3U_PATH, m3u_content)
             _log(f"聚合结果已保存到 {AGGREGATED_M3U_PATH}")
+            AggregatorUtils.publish_playlist_snapshot(m3u_content, _m3u_mtime())
             _fire_refresh_callbacks()
             # 关键事件入库（管理页日志可查）
             try:
@@ -540,6 +605,7 @@ class AggregatorUtils:
     def _refresh_official_only_locked():
         """官方源刷新内部实现（调用方必须已持有 _aggregate_lock）"""
         try:
+            SourceUtils.reset_name_index()
             # B 站测试模式：跳过 hntv 官方源与公开源，仅刷新 B 站直播频道
             if AggregatorUtils.is_bilibili_only_mode():
                 _log("测试模式（bilibili_only_mode）：官方源刷新跳过 hntv/公开源")
@@ -561,6 +627,7 @@ class AggregatorUtils:
             _log(f"官方源刷新完成，已更新 {AGGREGATED_M3U_PATH}"
                   f"（hntv {len(hntv_channels)} 个 + 公开 {len(public_channels)} 个 + "
                   f"B站直播 {len(bilibili_channels)} 个）")
+            AggregatorUtils.publish_playlist_snapshot(m3u_content, _m3u_mtime())
             _fire_refresh_callbacks()
             # 关键事件入库（管理页日志可查）
             try:
@@ -604,19 +671,66 @@ class AggregatorUtils:
             _log(f"读取聚合缓存出错: {str(e)}")
             return "#EXTM3U\n# 读取聚合缓存出错\n"
 
+    # ------------------------------------------------------------ 播放列表快照
+
+    @staticmethod
+    def publish_playlist_snapshot(m3u_content, last_modified=None):
+        """
+        发布播放列表快照（聚合落盘后调用；一次性完成 UTF-8/gzip/deflate 编码与 ETag 计算）
+        :param m3u_content: 已落盘的 m3u 文本
+        :param last_modified: 修改时间（epoch 秒），默认当前时间
+        :return: 新快照
+        """
+        global _playlist_snapshot
+        snapshot = PlaylistSnapshot.build(m3u_content, last_modified)
+        with _snapshot_lock:
+            _playlist_snapshot = snapshot
+        return snapshot
+
+    @staticmethod
+    def get_playlist_snapshot():
+        """
+        当前播放列表快照（请求路径用）：
+        - 已发布 → 直接返回（O(1)，不读盘）
+        - 进程刚启动未发布 → 磁盘有聚合结果则据此发布一次（Last-Modified 取文件 mtime）
+        - follower worker → 聚合文件 mtime 变了（leader 已重新聚合）则重新加载
+        - 磁盘也没有 → None（由调用方走降级列表）
+        :return: PlaylistSnapshot 或 None
+        """
+        global _playlist_snapshot, _snapshot_mtime, _snapshot_checked_at
+        snapshot = _playlist_snapshot
+        if snapshot is not None and (
+                leader.is_leader() or time.time() - _snapshot_checked_at < SHARED_STATE_CHECK_INTERVAL):
+            return snapshot
+        with _snapshot_lock:
+            # 等锁期间别的线程已加载 / 刚检查过，直接用
+            if _playlist_snapshot is not snapshot or (
+                    snapshot is not None
+                    and time.time() - _snapshot_checked_at < SHARED_STATE_CHECK_INTERVAL):
+                return _playlist_snapshot
+            _snapshot_checked_at = time.time()
+            try:
+                if os.path.exists(AGGREGATED_M3U_PATH):
+                    mtime = os.path.getmtime(AGGREGATED_M3U_PATH)
+                    if _playlist_snapshot is not None and mtime == _snapshot_mtime:
+                        return _playlist_snapshot
+                    with open(AGGREGATED_M3U_PATH, 'r', encoding='utf-8') as f:
+                        content = f.read()
+                    if "#EXTM3U" in content:
+                        _playlist_snapshot = PlaylistSnapshot.build(content, mtime)
+                        _snapshot_mtime = mtime
+            except Exception as e:
+                _log(f"加载播放列表快照出错: {str(e)}")
+            return _playlist_snapshot
+
     # ------------------------------------------------------------ 降级路径
 
     @staticmethod
     def get_bilibili_only_m3u():
         """仅返回 B 站直播频道（测试模式的降级路径，不碰 hntv/公开源）"""
-        m3u_content = "#EXTM3U\n\n"
-        for ch in AggregatorUtils.fetch_bilibili_channels():
-            m3u_content += (
-                f'#EXTINF:-1 tvg-id="{ch["name"]}" tvg-name="{ch["name"]}" '
-                f'group-title="{ch["group_title"]}",{ch["name"]}\n'
-                f'{ch["url"]}\n\n'
-            )
-        return m3u_content
+        return render_m3u(
+            (ch["name"], ch["name"], ch["group_title"], ch["name"], ch["url"])
+            for ch in AggregatorUtils.fetch_bilibili_channels())
 
     @staticmethod
     def get_hntv_only_m3u():
@@ -625,21 +739,15 @@ class AggregatorUtils:
         if response.status_code != 200:
             return "#EXTM3U\n# Error: Failed to fetch data"
 
-        m3u_content = "#EXTM3U\n\n"
         data = response.json()
+        channels = []
         if isinstance(data, list):
-            for item in data:
-                ch = AggregatorUtils._extract_hntv_item(item)
-                if ch:
-                    # tvg-id 直拼原始 cid（f-string 对 None 输出 "None" 字符串，
-                    # 与旧版逐字节一致，tests/test_equivalence.py 已锁定）
-                    m3u_content += (
-                        f'#EXTINF:-1 tvg-id="{ch["cid"]}" tvg-name="{ch["name"]}" '
-                        f'group-title="{HNTV_GROUP_NAME}",{ch["name"]}\n'
-                        f'{ch["url"]}\n\n'
-                    )
-
-        return m3u_content
+            channels = [ch for ch in map(AggregatorUtils._extract_hntv_item, data) if ch]
+        # tvg-id 直拼原始 cid（f-string 对 None 输出 "None" 字符串，
+        # 与旧版逐字节一致，tests/test_equivalence.py 已锁定）
+        return render_m3u(
+            (ch["cid"], ch["name"], HNTV_GROUP_NAME, ch["name"], ch["url"])
+            for ch in channels)
 
     @staticmethod
     def trans_list_to_m3u():
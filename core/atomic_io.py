@@ -1,28 +1,119 @@
 """原子文件写入：先写临时文件再 os.replace 原子替换
 
 避免写一半崩溃（断电/被杀）留下半文件被后续读取。
-崩溃最多残留 .tmp 文件（下次写入自动覆盖，无害）。
+临时文件一律在目标目录内按写入者唯一命名（{文件名}.xxxx.tmp）：多 gunicorn worker / 多线程
+同时写同一目标（房间缓存、刷新标志、共享状态文件等）时各写各的，后替换者生效，
+不会互相截断或让 os.replace 找不到临时文件。写入中途异常删除临时文件并继续抛出；
+进程被杀残留的临时文件可由调用方在独占期间用 remove_stream_tmp 清理。
+大文件用 atomic_stream_writer 边生成边写（明文与 gzip 同一遍写出），不在内存里拼整份内容。
 """
+import contextlib
 import gzip
 import os
+import tempfile
+
+
+@contextlib.contextmanager
+def _replacing(path):
+    """产出目标的唯一临时文件路径；块正常结束 os.replace 到目标，出错删除临时文件并继续抛出"""
+    tmp_path = _unique_tmp(path)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
 
 
 def atomic_write_text(path, content, encoding='utf-8'):
     """文本原子写入（自动创建父目录）"""
-    _ensure_dir(path)
-    tmp_path = f"{path}.tmp"
-    with open(tmp_path, 'w', encoding=encoding) as f:
-        f.write(content)
-    os.replace(tmp_path, path)
+    with _replacing(path) as tmp_path:
+        with open(tmp_path, 'w', encoding=encoding) as f:
+            f.write(content)
 
 
 def atomic_write_gzip(path, text, encoding='utf-8'):
     """gzip 压缩文本原子写入（自动创建父目录）"""
-    _ensure_dir(path)
-    tmp_path = f"{path}.tmp"
-    with gzip.open(tmp_path, 'wt', encoding=encoding) as f:
-        f.write(text)
-    os.replace(tmp_path, path)
+    with _replacing(path) as tmp_path:
+        with gzip.open(tmp_path, 'wt', encoding=encoding) as f:
+            f.write(text)
+
+
+def atomic_write_chunks(path, chunks):
+    """字节块流式原子写入（下载落盘用，不在内存里拼整个正文）"""
+    with _replacing(path) as tmp_path:
+        with open(tmp_path, 'wb') as f:
+            for chunk in chunks:
+                if chunk:
+                    f.write(chunk)
+
+
+class _StreamWriter:
+    """atomic_stream_writer 产出的写入器：write(text) 同时写入所有临时文件"""
+
+    def __init__(self, files):
+        self._files = files
+
+    def write(self, text):
+        for f in self._files:
+            f.write(text)
+
+
+@contextlib.contextmanager
+def atomic_stream_writer(path, gz_path=None, encoding='utf-8'):
+    """
+    流式原子写入：with 块内逐段 write，明文（及可选的 gzip 压缩版）同一遍写入各自临时文件，
+    正常退出后再逐个 os.replace；块内异常则删除临时文件、保留原文件并继续抛出。
+    :param path: 明文目标文件
+    :param gz_path: gzip 目标文件（None 则只写明文）
+    """
+    targets = [(path, False)] + ([(gz_path, True)] if gz_path else [])
+    tmp_paths = []
+    files = []
+    try:
+        for target, compressed in targets:
+            tmp_path = _unique_tmp(target)
+            tmp_paths.append(tmp_path)
+            files.append(gzip.open(tmp_path, 'wt', encoding=encoding) if compressed
+                         else open(tmp_path, 'w', encoding=encoding))
+        yield _StreamWriter(files)
+        for f in files:
+            f.close()
+        for (target, _compressed), tmp_path in zip(targets, tmp_paths):
+            os.replace(tmp_path, target)
+    except BaseException:
+        for f in files:
+            f.close()
+        for tmp_path in tmp_paths:
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+        raise
+
+
+def _unique_tmp(target):
+    """在目标目录内创建唯一临时文件（{文件名}.xxxx.tmp）；mkstemp 默认 0600，改回 0644 供 nginx 等读取"""
+    _ensure_dir(target)
+    fd, tmp_path = tempfile.mkstemp(prefix=f"{os.path.basename(target)}.", suffix='.tmp',
+                                    dir=os.path.dirname(target) or '.')
+    os.close(fd)
+    os.chmod(tmp_path, 0o644)
+    return tmp_path
+
+
+def remove_stream_tmp(*targets):
+    """删除目标残留的临时文件（写入者被杀时留下；调用方须确保此时没有写入者）"""
+    for target in targets:
+        dir_name = os.path.dirname(target) or '.'
+        prefix = f"{os.path.basename(target)}."
+        try:
+            names = os.listdir(dir_name)
+        except OSError:
+            continue
+        for name in names:
+            if name.startswith(prefix) and name.endswith('.tmp'):
+                with contextlib.suppress(OSError):
+                    os.remove(os.path.join(dir_name, name))
 
 
 def _ensure_dir(path):
@@ -6,28 +6,48 @@ B 站直播流地址带时效签名（约 4h），且 CDN 校验 Referer（无 R
 2. 通过房间号解析带签名 m3u8 地址（优先新接口 getRoomPlayInfo 支持高清，
    带登录 cookie 可解锁蓝光/原画；失败自动回退旧接口 playUrl 游客 720P）
 3. 把原始 m3u8 主清单里的分片相对路径重写为本服务代理地址
-4. 分片反代：带 Referer/UA 向 B 站 CDN 即时转拉（HLS 滑动窗口，分片实时滚动）
+4. 分片反代：带 Referer/UA 向 B 站 CDN 转拉（HLS 滑动窗口，分片实时滚动；
+   同一分片的并发观众合并为一次上游拉取，见 core.segment_cache）
 5. 多线路解析与备用切换：durl/url_info 返回多条 CDN 线路，主节点故障自动切备用
+   （失败的 CDN 主机短期降级排到末尾）
+6. 签名预刷新：有观众的房间在线路签名（expires/deadline）过期前后台重新解析
 
 注意：B 站接口非官方，随时可能改版；所有请求都需容错，
 解析失败时由调用方跳过该房间（聚合降级，不影响整体列表）。
 """
 import json
 import os
+import re
 import threading
 import time
-from urllib.parse import urlsplit, urlunsplit
-
-import requests
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import parse_qs, urlsplit, urlunsplit
 
+from core import http_client, segment_cache
+from core.atomic_io import atomic_write_text
 from core.logger import get_logger
 
 from config import (BILIBILI_CACHE_PATH, BILIBILI_COOKIE,
-                    BILIBILI_CUSTOM_ROOMS_PATH, BILIBILI_DIRECT_SEGMENTS,
-                    BILIBILI_PLAY_CACHE_TTL, BILIBILI_REFERER, BILIBILI_UA)
+                    BILIBILI_CONNECT_TIMEOUT, BILIBILI_CUSTOM_ROOMS_PATH,
+                    BILIBILI_DIRECT_SEGMENTS, BILIBILI_HEDGE_DEFAULT_DELAY,
+                    BILIBILI_HEDGE_MIN_DELAY, BILIBILI_HEDGE_REQUESTS,
+                    BILIBILI_HEDGE_WORKERS,
+                    BILIBILI_PLAY_CACHE_TTL, BILIBILI_PLAYLIST_STALE_TTL,
+                    BILIBILI_READ_TIMEOUT, BILIBILI_RESOLVE_CONCURRENCY,
+                    BILIBILI_ROOM_FAIL_TTL, BILIBILI_ROOM_INDEX_TTL,
+                    BILIBILI_ROUTE_DEFAULT_LATENCY,
+                    BILIBILI_ROUTE_DEMOTE_SECONDS, BILIBILI_ROUTE_ERROR_PENALTY,
+                    BILIBILI_ROUTE_EWMA_ALPHA, BILIBILI_SIGN_REFRESH_AHEAD,
+                    BILIBILI_SIGN_REFRESH_MARGIN, BILIBILI_SIGN_REFRESH_TICK,
+                    BILIBILI_VIEWER_WINDOW,
+                    BILIBILI_PLAYLIST_TTL_DEFAULT, BILIBILI_PLAYLIST_TTL_MAX,
+                    BILIBILI_PLAYLIST_TTL_MIN)
 
 # 上游 B 站接口地址
 ROOM_INFO_API = "https://api.live.bilibili.com/room/v1/Room/getRoomInfoOld"
+# 批量按 uid 查直播间状态（一次请求解析多个 uid）
+ROOM_STATUS_BULK_API = "https://api.live.bilibili.com/room/v1/Room/get_status_info_by_uids"
 PLAY_URL_API = "https://api.live.bilibili.com/room/v1/Room/playUrl"
 PLAY_INFO_API = "https://api.live.bilibili.com/xlive/web-room/v2/index/getRoomPlayInfo"
 # 登录态校验接口（cookie 有效性探测）
@@ -41,6 +61,37 @@ _cache_lock = threading.Lock()
 # 流地址解析缓存 {room_id: (expire_ts, 线路列表)}
 # 线路 = [(m3u8_url, base_url, query), (备用m3u8_url, 备用base_url, 备用query), ...]
 _play_cache = {}
+# uid -> 房间号 内存索引 {uid字符串: (解析时间, room_id)}；首次使用时从磁盘缓存加载
+# （磁盘加载的条目解析时间记缓存文件的修改时间，仍在有效期内的重启后不重新解析）
+_room_index = {}
+_room_index_loaded = False
+# 解析失败的 uid {uid字符串: 失败时间}：BILIBILI_ROOM_FAIL_TTL 内不再重试
+_room_failures = {}
+# 后台刷新中的 uid（已有房间号、仅过期的条目先返回旧值，后台单飞刷新）与刷新线程
+_room_refreshing = set()
+_room_refresh_thread = None
+# 重写后主清单缓存 {(room_id, 直连模式, public_base): (expire_ts, m3u8 文本)}
+_playlist_cache = {}
+# 主清单单飞锁 {缓存 key: Lock}：同 key 并发请求只有一个去拉上游
+_playlist_locks = {}
+
+# 观众活跃表 {room_id: 最近一次清单/分片请求时间}（签名预刷新只处理有观众的房间）
+_room_viewers = {}
+# CDN 主机健康 {host: {latency, errors, demoted_until}}：延迟/失败率 EWMA + 失败降级截止时间
+_route_health = {}
+# 近期线路响应耗时样本（对冲等待时长取 p95）
+_latency_samples = deque(maxlen=200)
+# 对冲请求线程池（开启对冲时首次使用创建）
+_hedge_executor = None
+# 签名预刷新线程（进程内只启动一次）
+_refresher_thread = None
+
+# 流地址签名过期时间参数（epoch 秒）
+_SIGN_EXPIRY_PARAMS = ('expires', 'deadline')
+# 线路请求中与主机健康无关的状态码：403 签名过期 / 404 分片已滑出窗口（不降级线路，交回调用方）
+_ROUTE_CLIENT_ERRORS = (403, 404)
+
+_TARGET_DURATION_RE = re.compile(r'^#EXT-X-TARGETDURATION:\s*(\d+(?:\.\d+)?)', re.MULTILINE)
 
 
 class BilibiliUtils:
@@ -49,15 +100,18 @@ class BilibiliUtils:
     # ------------------------------------------------------------ 请求基础
 
     @staticmethod
-    def _request_get(url, params=None, timeout=15):
-        """带 B 站 UA/Referer 的 GET 请求（Referer 是防盗链必需项；有 cookie 则带上）"""
-        headers = {
-            'Referer': BILIBILI_REFERER,
-            'User-Agent': BILIBILI_UA,
-        }
+    def _request_get(url, params=None, timeout=15, stream=False, preset='bilibili'):
+        """
+        带 B 站 UA/Referer 的 GET 请求（Referer 是防盗链必需项；有 cookie 则带上）。
+        走 bilibili 预设连接池：Referer/UA 由预设会话头提供，
+        同一 CDN 主机的清单/分片请求复用 TLS 连接。
+        CDN 线路请求用 bilibili_route 预设（不重试，失败交给线路切换）
+        """
+        headers = {}
         if BILIBILI_COOKIE:
             headers['Cookie'] = BILIBILI_COOKIE
-        return requests.get(url, params=params, headers=headers, timeout=timeout)
+        return http_client.get(url, preset=preset, params=params, headers=headers,
+                               timeout=timeout, stream=stream)
 
     @staticmethod
     def _check_cookie_valid():
@@ -95,10 +149,7 @@ class BilibiliUtils:
     def _save_room_cache(cache):
         """保存磁盘房间缓存（原子写入）"""
         try:
-            tmp_path = BILIBILI_CACHE_PATH + '.tmp'
-            with open(tmp_path, 'w', encoding='utf-8') as f:
-                json.dump(cache, f, ensure_ascii=False, indent=2)
-            os.replace(tmp_path, BILIBILI_CACHE_PATH)
+            atomic_write_text(BILIBILI_CACHE_PATH, json.dumps(cache, ensure_ascii=False, indent=2))
         except Exception as e:
             _logger.warning(f"保存 B 站房间缓存出错: {str(e)}")
 
@@ -123,10 +174,7 @@ class BilibiliUtils:
     def save_custom_rooms(rooms):
         """保存运行时动态添加的频道列表（原子写入）"""
         try:
-            tmp_path = BILIBILI_CUSTOM_ROOMS_PATH + '.tmp'
-            with open(tmp_path, 'w', encoding='utf-8') as f:
-                json.dump(rooms, f, ensure_ascii=False, indent=2)
-            os.replace(tmp_path, BILIBILI_CUSTOM_ROOMS_PATH)
+            atomic_write_text(BILIBILI_CUSTOM_ROOMS_PATH, json.dumps(rooms, ensure_ascii=False, indent=2))
         except Exception as e:
             _logger.warning(f"保存 B 站动态频道列表出错: {str(e)}")
 
@@ -183,26 +231,158 @@ class BilibiliUtils:
             _logger.warning(f"解析 B 站房间信息出错(uid={uid}): {str(e)}")
             return None
 
+    @staticmethod
+    def _resolve_rooms_bulk(uids):
+        """
+        批量接口 get_status_info_by_uids 一次解析多个 uid
+        :param uids: uid 列表
+        :return: {uid字符串: 房间信息 dict}（未开过直播间的 uid 不在结果中）；接口失败返回 None
+        """
+        try:
+            response = BilibiliUtils._request_get(
+                ROOM_STATUS_BULK_API, params={"uids[]": [int(uid) for uid in uids]})
+            if response.status_code != 200:
+                return None
+            data = response.json()
+            if data.get('code') != 0 or not isinstance(data.get('data'), dict):
+                return None
+            result = {}
+            for uid, info in data['data'].items():
+                if isinstance(info, dict) and info.get('room_id'):
+                    result[str(uid)] = {
+                        "room_id": info['room_id'],
+                        "live_status": info.get('live_status', 0),
+                        "title": info.get('title') or '',
+                        "online": info.get('online', 0),
+                    }
+            return result
+        except Exception as e:
+            _logger.warning(f"批量解析 B 站房间信息出错: {str(e)}")
+            return None
+
+    @staticmethod
+    def resolve_rooms_by_uids(uids):
+        """
+        批量解析 uid 的直播间信息：先走批量接口，批量失败或未覆盖的 uid
+        再有限并发逐个调 getRoomInfoOld
+        :param uids: uid 列表
+        :return: {uid字符串: 房间信息 dict}（解析失败的 uid 不在结果中）
+        """
+        uids = [str(uid) for uid in uids]
+        if not uids:
+            return {}
+        result = BilibiliUtils._resolve_rooms_bulk(uids) or {}
+        missing = [uid for uid in uids if uid not in result]
+        if missing:
+            workers = min(BILIBILI_RESOLVE_CONCURRENCY, len(missing))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                infos = executor.map(BilibiliUtils.resolve_room_by_uid, missing)
+                for uid, info in zip(missing, infos):
+                    if info:
+                        result[uid] = info
+        return result
+
+    @staticmethod
+    def _ensure_room_index():
+        """首次使用时把磁盘缓存载入内存索引，解析时间记缓存文件修改时间（调用方须持有 _cache_lock）"""
+        global _room_index_loaded
+        if not _room_index_loaded:
+            try:
+                loaded_at = os.path.getmtime(BILIBILI_CACHE_PATH)
+            except OSError:
+                loaded_at = 0
+            for uid, room_id in BilibiliUtils._load_room_cache().items():
+                _room_index.setdefault(str(uid), (loaded_at, room_id))
+            _room_index_loaded = True
+
+    @staticmethod
+    def _refresh_room_index(uids):
+        """
+        解析一批 uid 并合并进内存索引：成功的更新时间戳（房间号有变才写一次磁盘缓存），
+        失败的记入 _room_failures（失败期内不再重试，已有旧房间号的继续沿用）
+        """
+        resolved = {}
+        try:
+            resolved = BilibiliUtils.resolve_rooms_by_uids(uids)
+        finally:
+            now = time.time()
+            with _cache_lock:
+                changed = False
+                for uid in uids:
+                    info = resolved.get(uid)
+                    if not info:
+                        _room_failures[uid] = now
+                        continue
+                    _room_failures.pop(uid, None)
+                    previous = _room_index.get(uid)
+                    _room_index[uid] = (now, info["room_id"])
+                    changed = changed or previous is None or previous[1] != info["room_id"]
+                _room_refreshing.difference_update(uids)
+                if changed:
+                    # 磁盘缓存只存房间号（live_status 每次实时查，不缓存）
+                    BilibiliUtils._save_room_cache(
+                        {uid: room_id for uid, (_ts, room_id) in _room_index.items()})
+
+    @staticmethod
+    def get_room_ids(uids):
+        """
+        批量获取 uid 对应的房间号：
+        - 内存索引未过期（BILIBILI_ROOM_INDEX_TTL）的直接返回，不读盘不请求
+        - 已有房间号但过期的：立即返回旧值，后台单飞批量刷新（请求路径不等上游）
+        - 从未解析到的：本次同步批量解析，成功结果合并后只写一次磁盘缓存
+        - 解析失败的 uid 在 BILIBILI_ROOM_FAIL_TTL 内不再重试（上游故障期间不反复付超时），
+          有上次成功结果的继续兜底（避免上游抖动导致整个 B 站分组消失）
+        :param uids: uid 列表
+        :return: {uid字符串: 房间号 int 或 None}
+        """
+        global _room_refresh_thread
+        uids = [str(uid) for uid in uids]
+        now = time.time()
+        with _cache_lock:
+            BilibiliUtils._ensure_room_index()
+            due = [uid for uid in dict.fromkeys(uids)
+                   if (uid not in _room_index or now - _room_index[uid][0] >= BILIBILI_ROOM_INDEX_TTL)
+                   and now - _room_failures.get(uid, float('-inf')) >= BILIBILI_ROOM_FAIL_TTL
+                   and uid not in _room_refreshing]
+            background = [uid for uid in due if uid in _room_index]
+            blocking = [uid for uid in due if uid not in _room_index]
+            if background:
+                _room_refreshing.update(background)
+                _room_refresh_thread = threading.Thread(
+                    target=BilibiliUtils._refresh_room_index, args=(background,),
+                    name='B站房间号刷新', daemon=True)
+                _room_refresh_thread.start()
+        if blocking:
+            BilibiliUtils._refresh_room_index(blocking)
+        with _cache_lock:
+            return {uid: (_room_index[uid][1] if uid in _room_index else None) for uid in uids}
+
+    @staticmethod
+    def wait_room_refresh(timeout=None):
+        """等待后台房间号刷新结束（测试用）"""
+        thread = _room_refresh_thread
+        if thread is not None:
+            thread.join(timeout)
+
     @staticmethod
     def get_room_id(uid):
         """
-        获取 uid 对应的房间号（磁盘缓存兜底：接口失败时用上次成功结果，
-        避免上游抖动导致整个 B 站分组消失）
+        获取 uid 对应的房间号（单个 uid 版 get_room_ids）
         :param uid: 用户 UID
         :return: 房间号 int 或 None
         """
-        info = BilibiliUtils.resolve_room_by_uid(uid)
-        if info:
-            # 更新磁盘缓存（仅房间号，live_status 每次实时查，不缓存）
-            with _cache_lock:
-                cache = BilibiliUtils._load_room_cache()
-                cache[str(uid)] = info["room_id"]
-                BilibiliUtils._save_room_cache(cache)
-            return info["room_id"]
-        # 接口失败 → 用缓存兜底
+        return BilibiliUtils.get_room_ids([uid]).get(str(uid))
+
+    @staticmethod
+    def reset_room_index():
+        """清空 uid -> 房间号 内存索引与失败记录（下次使用时重新从磁盘载入，测试用）"""
+        global _room_index_loaded
+        BilibiliUtils.wait_room_refresh()
         with _cache_lock:
-            cache = BilibiliUtils._load_room_cache()
-            return cache.get(str(uid))
+            _room_index.clear()
+            _room_failures.clear()
+            _room_refreshing.clear()
+            _room_index_loaded = False
 
     # ------------------------------------------------------------ 流地址解析
 
@@ -306,6 +486,35 @@ class BilibiliUtils:
             routes.append(BilibiliUtils._split_route(full_url))
         return routes or None
 
+    @staticmethod
+    def _route_expiry(route):
+        """
+        线路签名过期时间（查询串 expires= / deadline=，epoch 秒）
+        :param route: 线路三元组 (m3u8_url, base_url, query)
+        :return: epoch 秒；无签名时间参数返回 None
+        """
+        query = parse_qs(route[2])
+        for name in _SIGN_EXPIRY_PARAMS:
+            value = (query.get(name) or [''])[0]
+            if value.isdigit():
+                return int(value)
+        return None
+
+    @staticmethod
+    def _play_cache_expiry(routes, now):
+        """
+        线路缓存过期时间：默认 BILIBILI_PLAY_CACHE_TTL；线路带签名时间时
+        提前 BILIBILI_SIGN_REFRESH_MARGIN 秒过期（签名真正失效前换新）
+        """
+        expire = now + BILIBILI_PLAY_CACHE_TTL
+        expiries = [e for e in map(BilibiliUtils._route_expiry, routes) if e]
+        if expiries:
+            sign_expire = min(expiries)
+            refresh_at = sign_expire - BILIBILI_SIGN_REFRESH_MARGIN
+            # 上游给的签名本就很短时，缓存到签名失效为止
+            expire = min(expire, refresh_at if refresh_at > now else sign_expire)
+        return expire
+
     @staticmethod
     def resolve_play_m3u8(room_id, force=False):
         """
@@ -330,41 +539,261 @@ class BilibiliUtils:
                 result = BilibiliUtils._parse_play_url(room_id)
             if result:
                 with _cache_lock:
-                    _play_cache[room_id] = (now + BILIBILI_PLAY_CACHE_TTL, result)
+                    _play_cache[room_id] = (BilibiliUtils._play_cache_expiry(result, now), result)
                 return result
         except Exception as e:
             _logger.warning(f"解析 B 站流地址出错(room={room_id}): {str(e)}")
         return None
 
+    # ------------------------------------------------------------ 签名预刷新
+
+    @staticmethod
+    def refresh_expiring_routes(now=None):
+        """
+        为有观众的房间预刷新即将过期的线路（线路缓存剩余不足 BILIBILI_SIGN_REFRESH_AHEAD 秒）。
+        观众请求因此总能命中新鲜缓存，签名轮换时不再由观众承担重新解析的延迟
+        :param now: 当前 epoch 秒（测试可注入）
+        :return: 本轮刷新的房间号列表
+        """
+        now = now if now is not None else time.time()
+        with _cache_lock:
+            for room_id in [r for r, ts in _room_viewers.items() if now - ts > BILIBILI_VIEWER_WINDOW]:
+                del _room_viewers[room_id]
+            due = [room_id for room_id in _room_viewers
+                   if room_id not in _play_cache
+                   or _play_cache[room_id][0] - now <= BILIBILI_SIGN_REFRESH_AHEAD]
+        refreshed = []
+        for room_id in due:
+            # 解析失败时保留旧缓存，观众侧仍走原有的失败重解析兜底
+            if BilibiliUtils.resolve_play_m3u8(room_id, force=True):
+                refreshed.append(room_id)
+        if refreshed:
+            _logger.info(f"B站线路签名预刷新: {refreshed}")
+        return refreshed
+
+    @staticmethod
+    def start_route_refresher():
+        """启动签名预刷新后台线程（进程内只启动一次）"""
+        global _refresher_thread
+
+        def loop():
+            while True:
+                try:
+                    BilibiliUtils.refresh_expiring_routes()
+                except Exception:
+                    _logger.exception("B站线路签名预刷新出错")
+                time.sleep(BILIBILI_SIGN_REFRESH_TICK)
+
+        with _cache_lock:
+            if _refresher_thread is not None:
+                return
+            _refresher_thread = threading.Thread(target=loop, daemon=True, name='B站签名预刷新')
+        _refresher_thread.start()
+
     # ------------------------------------------------------------ 开播判定
 
     @staticmethod
-    def _try_routes(room_id, routes, url_builder):
+    def _route_host(route):
+        """线路所在 CDN 主机"""
+        return urlsplit(route[0]).netloc.lower()
+
+    @staticmethod
+    def _mark_route(route, ok, latency=None):
         """
-        依次尝试多条线路（主 → 备用），返回第一个 200 的 (response, 线路三元组)。
-        全部失败时强制重解析（拿新签名）再试一轮。
+        记录线路拉取结果，更新主机健康（EWMA）：
+        - latency：响应头到达耗时（秒）的 EWMA，同时进全局样本（对冲等待时长取 p95）
+        - errors：失败率 EWMA（成功 0 / 失败 1）
+        - 失败的主机降级 BILIBILI_ROUTE_DEMOTE_SECONDS 秒，成功即恢复
+        """
+        host = BilibiliUtils._route_host(route)
+        alpha = BILIBILI_ROUTE_EWMA_ALPHA
+        with _cache_lock:
+            health = _route_health.setdefault(
+                host, {'latency': None, 'errors': 0.0, 'demoted_until': 0})
+            health['errors'] = (1 - alpha) * health['errors'] + alpha * (0.0 if ok else 1.0)
+            if ok:
+                health['demoted_until'] = 0
+            else:
+                health['demoted_until'] = time.time() + BILIBILI_ROUTE_DEMOTE_SECONDS
+            if latency is not None:
+                previous = health['latency']
+                health['latency'] = latency if previous is None else (1 - alpha) * previous + alpha * latency
+                _latency_samples.append(latency)
+
+    @staticmethod
+    def _route_score(health, now):
+        """线路排序键：(是否降级中, 期望耗时)；期望耗时 = 延迟 EWMA + 失败率 × 惩罚秒数"""
+        if health is None:
+            return (False, BILIBILI_ROUTE_DEFAULT_LATENCY)
+        latency = health['latency'] if health['latency'] is not None else BILIBILI_ROUTE_DEFAULT_LATENCY
+        return (health['demoted_until'] > now,
+                latency + health['errors'] * BILIBILI_ROUTE_ERROR_PENALTY)
+
+    @staticmethod
+    def _order_routes(routes):
+        """线路按主机健康排序：降级中的排末尾，其余按期望耗时升序（同分保持解析顺序）"""
+        now = time.time()
+        with _cache_lock:
+            scores = {route: BilibiliUtils._route_score(
+                _route_health.get(BilibiliUtils._route_host(route)), now) for route in routes}
+        return sorted(routes, key=lambda route: scores[route])
+
+    @staticmethod
+    def _hedge_delay():
+        """对冲等待时长：近期响应耗时的 p95（样本不足用默认值），限定在 [最小值, 连接超时]"""
+        with _cache_lock:
+            samples = sorted(_latency_samples)
+        if len(samples) < 10:
+            delay = BILIBILI_HEDGE_DEFAULT_DELAY
+        else:
+            delay = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+        return min(max(delay, BILIBILI_HEDGE_MIN_DELAY), BILIBILI_CONNECT_TIMEOUT)
+
+    @staticmethod
+    def route_health():
+        """各 CDN 主机健康快照（诊断用）"""
+        with _cache_lock:
+            return {host: dict(health) for host, health in _route_health.items()}
+
+    @staticmethod
+    def reset_route_health():
+        """清空线路健康记录与延迟样本（测试用）"""
+        with _cache_lock:
+            _route_health.clear()
+            _latency_samples.clear()
+
+    @staticmethod
+    def _attempt_route(route, url_builder, stream):
+        """
+        请求单条线路：(连接, 读取) 超时分开设置，黑洞主机在连接阶段就快速失败；
+        走不重试的 bilibili_route 预设，单次尝试耗时即线路耗时（计入健康度与对冲延迟）。
+        只有异常（连接失败/超时）与 5xx 算主机故障；403（签名过期）/404（分片已滑出窗口）
+        与主机健康无关，不记健康度，原样交回调用方判断
+        :return: 200 或 403/404 的 response；其余失败返回 None（流式响应会被关闭归还连接）
+        """
+        started = time.monotonic()
+        try:
+            response = BilibiliUtils._request_get(
+                url_builder(route), timeout=(BILIBILI_CONNECT_TIMEOUT, BILIBILI_READ_TIMEOUT),
+                stream=stream, preset='bilibili_route')
+        except Exception:
+            BilibiliUtils._mark_route(route, False)
+            return None
+        latency = time.monotonic() - started
+        if response.status_code == 200:
+            BilibiliUtils._mark_route(route, True, latency)
+            return response
+        if response.status_code in _ROUTE_CLIENT_ERRORS:
+            return response
+        if response.status_code >= 500:
+            BilibiliUtils._mark_route(route, False, latency)
+        response.close()
+        return None
+
+    @staticmethod
+    def _attempt_routes(routes, url_builder, stream):
+        """
+        按健康顺序尝试一组线路，返回第一个 200 的 (response, route)；
+        没有 200 时返回最后一个 403/404 的 (response, route)（调用方据此决定是否重解析），
+        否则 (None, None)。
+        开启对冲（BILIBILI_HEDGE_REQUESTS）时：当前线路超过 p95 耗时仍未响应，
+        即并发请求下一条线路，取先成功者；落败方的响应到达后关闭
+        """
+        routes = BilibiliUtils._order_routes(routes)
+        fallback = (None, None)
+        if not BILIBILI_HEDGE_REQUESTS or len(routes) < 2:
+            for route in routes:
+                response = BilibiliUtils._attempt_route(route, url_builder, stream)
+                if response is None:
+                    continue
+                if response.status_code == 200:
+                    BilibiliUtils._close_response(fallback[0])
+                    return response, route
+                BilibiliUtils._close_response(fallback[0])
+                fallback = (response, route)
+            return fallback
+
+        executor = BilibiliUtils._get_hedge_executor()
+        delay = BilibiliUtils._hedge_delay()
+        remaining = list(routes)
+        pending = {}
+        while remaining or pending:
+            # 首轮发起首选线路；之后每轮（等待超时 = 对冲，或有线路失败 = 补位）再发下一条
+            if remaining:
+                route = remaining.pop(0)
+                pending[executor.submit(BilibiliUtils._attempt_route, route, url_builder, stream)] = route
+            done, _ = wait(list(pending), timeout=delay if remaining else None,
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                route = pending.pop(future)
+                response = future.result()
+                if response is None:
+                    continue
+                if response.status_code == 200:
+                    BilibiliUtils._close_response(fallback[0])
+                    for loser in pending:
+                        loser.add_done_callback(BilibiliUtils._close_loser)
+                    return response, route
+                BilibiliUtils._close_response(fallback[0])
+                fallback = (response, route)
+        return fallback
+
+    @staticmethod
+    def _close_response(response):
+        """关闭不再使用的响应（归还连接）；None 忽略"""
+        if response is not None:
+            try:
+                response.close()
+            except Exception:
+                pass
+
+    @staticmethod
+    def _close_loser(future):
+        """关闭对冲落败方的响应（归还连接）"""
+        try:
+            response = future.result()
+            if response is not None:
+                response.close()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _get_hedge_executor():
+        """对冲请求线程池（首次使用时创建）"""
+        global _hedge_executor
+        with _cache_lock:
+            if _hedge_executor is None:
+                _hedge_executor = ThreadPoolExecutor(
+                    max_workers=BILIBILI_HEDGE_WORKERS, thread_name_prefix='bilibili-hedge')
+            return _hedge_executor
+
+    @staticmethod
+    def _try_routes(room_id, routes, url_builder, stream=False):
+        """
+        按主机健康顺序尝试多条线路（可选对冲并发），返回第一个 200 的 (response, 线路三元组)。
+        全部失败或 403（签名过期）时强制重解析（拿新签名）再试一轮；
+        分片 404（已滑出 HLS 窗口）与签名无关，不重解析直接返回失败
+        （清单 404 仍重解析：主播重新推流后流名会变）。
         :param room_id: 直播间房间号
         :param routes: 线路列表 [(m3u8_url, base_url, query), ...]
         :param url_builder: 函数，输入线路三元组，输出要请求的 URL 字符串
+        :param stream: 流式读取响应体（分片转发用；非 200 响应会被关闭归还连接）
         :return: (response, route) 或 (None, None)
         """
-        for route in routes:
-            try:
-                response = BilibiliUtils._request_get(url_builder(route))
-                if response.status_code == 200:
-                    return response, route
-            except Exception:
-                continue  # 主线路异常 → 试备用线路
-        # 全部线路失败：签名可能过期 → 强制重解析后再试一轮（不再递归）
+        response, route = BilibiliUtils._attempt_routes(routes, url_builder, stream)
+        if response is not None and response.status_code == 200:
+            return response, route
+        status = response.status_code if response is not None else None
+        BilibiliUtils._close_response(response)
+        if status == 404 and stream:
+            return None, None
+        # 全部线路失败 / 签名过期：强制重解析后再试一轮（不再递归）
         routes2 = BilibiliUtils.resolve_play_m3u8(room_id, force=True)
         if routes2:
-            for route in routes2:
-                try:
-                    response = BilibiliUtils._request_get(url_builder(route))
-                    if response.status_code == 200:
-                        return response, route
-                except Exception:
-                    continue
+            response, route = BilibiliUtils._attempt_routes(routes2, url_builder, stream)
+            if response is not None and response.status_code == 200:
+                return response, route
+            BilibiliUtils._close_response(response)
         return None, None
 
     @staticmethod
@@ -386,8 +815,63 @@ class BilibiliUtils:
 
     # ------------------------------------------------------------ m3u8 重写
 
+    @staticmethod
+    def _playlist_ttl(content):
+        """主清单缓存 TTL：#EXT-X-TARGETDURATION 限定到 [MIN, MAX] 秒"""
+        match = _TARGET_DURATION_RE.search(content)
+        ttl = float(match.group(1)) if match else BILIBILI_PLAYLIST_TTL_DEFAULT
+        return min(max(ttl, BILIBILI_PLAYLIST_TTL_MIN), BILIBILI_PLAYLIST_TTL_MAX)
+
+    @staticmethod
+    def _prune_playlist_cache(now):
+        """清掉超过沿用期的主清单缓存与对应单飞锁（调用方须持有 _cache_lock）"""
+        for key in [k for k, (expire, _c) in _playlist_cache.items()
+                    if expire + BILIBILI_PLAYLIST_STALE_TTL <= now]:
+            del _playlist_cache[key]
+            _playlist_locks.pop(key, None)
+
     @staticmethod
     def build_proxied_m3u8(room_id, public_base_url):
+        """
+        取重写后的 m3u8 主清单（短 TTL 缓存 + 单飞）：
+        - 缓存 key=(房间, 直连/代理模式, 对外基础地址)，TTL 取上游 #EXT-X-TARGETDURATION，
+          播放器按目标时长轮询，同房间不论多少观众，上游清单每个目标时长最多拉一次
+        - 同 key 并发请求只有一个去拉上游，其余等待并复用结果（缓存与单飞按进程生效，
+          多 worker 时同一清单每个目标时长最多拉 worker 数次，见 segment_cache 模块说明）
+        - 上游失败时沿用过期缓存（最多 BILIBILI_PLAYLIST_STALE_TTL 秒）
+        :param room_id: 直播间房间号
+        :param public_base_url: 本服务对外基础地址（仅代理模式使用）
+        :return: 重写后的 m3u8 文本；解析失败返回 None
+        """
+        key = (room_id, BILIBILI_DIRECT_SEGMENTS, public_base_url)
+        with _cache_lock:
+            _room_viewers[room_id] = time.time()
+            cached = _playlist_cache.get(key)
+            if cached and cached[0] > time.time():
+                return cached[1]
+            lock = _playlist_locks.setdefault(key, threading.Lock())
+        with lock:
+            # 等锁期间可能已由其它请求刷新
+            with _cache_lock:
+                cached = _playlist_cache.get(key)
+            now = time.time()
+            if cached and cached[0] > now:
+                return cached[1]
+            content = BilibiliUtils._fetch_proxied_m3u8(room_id, public_base_url)
+            now = time.time()
+            with _cache_lock:
+                if content is None:
+                    if cached and cached[0] + BILIBILI_PLAYLIST_STALE_TTL > now:
+                        _logger.warning(f"拉取 B 站 m3u8 清单失败，沿用缓存(room={room_id})")
+                        return cached[1]
+                    return None
+                BilibiliUtils._prune_playlist_cache(now)
+                _playlist_cache[key] = (now + BilibiliUtils._playlist_ttl(content), content)
+                _playlist_locks[key] = lock
+            return content
+
+    @staticmethod
+    def _fetch_proxied_m3u8(room_id, public_base_url):
         """
         拉取原始 m3u8 主清单并把分片改写为可播放地址：
         - 直连模式（BILIBILI_DIRECT_SEGMENTS=True，默认）：分片改写为 B 站 CDN 绝对地址
@@ -437,11 +921,23 @@ class BilibiliUtils:
     @staticmethod
     def proxy_segment(room_id, seg_path):
         """
-        分片反代：带 Referer/UA 向 B 站 CDN 即时转拉。
+        分片反代：带 Referer/UA 向 B 站 CDN 转拉，经分片缓存合并并发请求
+        （同房间多个观众请求同一分片，上游只拉一次，见 core.segment_cache）。
         多线路依次尝试：主节点故障自动切备用（同一套签名）
         :param room_id: 直播间房间号
         :param seg_path: 分片相对路径（如 live_xxx-123.ts）
-        :return: (status_code, headers dict, 流式迭代器) 或 (500, None, None)
+        :return: (status_code, headers dict, 流式迭代器) 或 (错误码, None, None)
+        """
+        with _cache_lock:
+            _room_viewers[room_id] = time.time()
+        return segment_cache.fetch(
+            room_id, seg_path, lambda: BilibiliUtils._fetch_segment(room_id, seg_path))
+
+    @staticmethod
+    def _fetch_segment(room_id, seg_path):
+        """
+        向上游拉取单个分片（分片缓存的 fetcher）
+        :return: (status_code, headers dict, 数据块迭代器) 或 (500/404, None, None)
         """
         resolved = BilibiliUtils.resolve_play_m3u8(room_id)
         if not resolved:
@@ -456,7 +952,7 @@ class BilibiliUtils:
             return seg_url
 
         response, _route = BilibiliUtils._try_routes(
-            room_id, resolved, build_seg_url)
+            room_id, resolved, build_seg_url, stream=True)
         if response is None:
             return 404, None, None
 
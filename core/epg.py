@@ -1,15 +1,47 @@
-"""EPG 节目单：XML 生成/读取/时间格式化（全部按 GMT+8）"""
+"""EPG 节目单：XML 生成/读取/时间格式化（全部按 GMT+8；节目按多日窗口逐日存储，见 core.epg_store）"""
+import contextlib
 import datetime
 import gzip
 import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-from config import GMT8, GZ_FILE_PATH, XML_FILE_PATH
-from core.atomic_io import atomic_write_gzip, atomic_write_text
+from config import (EPG_FETCH_CONCURRENCY, EPG_FETCH_RETRIES, EPG_FETCH_RETRY_BACKOFF,
+                    EPG_FETCH_TIMEOUT, EPG_LOCK_PATH, GMT8, GZ_FILE_PATH, XML_FILE_PATH)
+from core import epg_feeds, epg_store, xmltv
+from core.atomic_io import atomic_stream_writer, remove_stream_tmp
 from core.hntv_client import ApiUtils
 from core.logger import get_logger
 
+try:
+    import fcntl
+except ImportError:  # 非 POSIX 平台：只做进程内互斥
+    fcntl = None
+
 _logger = get_logger('epg')
 
+# 进程内生成互斥（fcntl.flock 按打开的文件描述符生效，同进程多线程也需要这把锁）
+_generate_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def _generation_lock():
+    """EPG 生成互斥：进程内线程锁 + EPG_LOCK_PATH 上的 fcntl 排他锁（跨 gunicorn worker），阻塞等待"""
+    with _generate_lock:
+        fd = None
+        if fcntl is not None:
+            os.makedirs(os.path.dirname(EPG_LOCK_PATH), exist_ok=True)
+            fd = os.open(EPG_LOCK_PATH, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fd is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            if fd is not None:
+                os.close(fd)  # 关闭即释放锁
+
 
 class TimeUtils:
     """时间处理工具类"""
@@ -33,21 +65,50 @@ class TimeUtils:
 class XmlUtils:
     """EPG XML 处理工具类"""
 
-    # 空 tv 默认 XML（接口失败/异常时的兜底返回，同时落盘）
-    EMPTY_XML = ('<?xml version="1.0" encoding="UTF-8"?>'
-                 '<tv generator-info-name="hntv-live" '
-                 'generator-info-url="https://github.com/AlanNiew"></tv>')
+    # 空 tv 默认 XML（接口失败/异常时的兜底返回）
+    EMPTY_XML = xmltv.EMPTY
 
     # XML 头（channel/programme 均追加在此之后，结束于 </tv>）
-    XML_HEADER = ('<?xml version="1.0" encoding="UTF-8"?>'
-                  '<tv generator-info-name="hntv-live" '
-                  'generator-info-url="https://github.com/AlanNiew">\n')
+    XML_HEADER = xmltv.HEADER
 
     @staticmethod
-    def _build_channel_block(item):
+    def _fetch_programs(cid, date_timestamp):
+        """
+        拉取单频道节目列表（带超时与重试；网络异常/5xx 重试，4xx/格式错误不重试）
+        :param cid: 频道ID
+        :param date_timestamp: 日期时间戳（当天零点）
+        :return: programs 列表；失败返回 None
         """
-        构建单个频道的 XML 块（channel 定义 + 当日 programme 列表）
+        for attempt in range(EPG_FETCH_RETRIES + 1):
+            if attempt:
+                time.sleep(EPG_FETCH_RETRY_BACKOFF * attempt)
+            try:
+                response = ApiUtils.get_hntv_epg_data(cid, date_timestamp, timeout=EPG_FETCH_TIMEOUT)
+            except Exception as e:
+                _logger.warning(f"EPG 拉取失败 cid={cid}（第 {attempt + 1} 次）: {e}")
+                continue
+            if response.status_code >= 500:
+                _logger.warning(f"EPG 接口返回 {response.status_code} cid={cid}（第 {attempt + 1} 次）")
+                continue
+            if response.status_code != 200:
+                return None
+            try:
+                epg_data = response.json()
+            except ValueError:
+                return None
+            if not isinstance(epg_data, dict) or not isinstance(epg_data.get('programs'), list):
+                return None
+            return epg_data['programs']
+        return None
+
+    @staticmethod
+    def _build_channel_block(item, dates=None, fetch=True):
+        """
+        构建单个频道的 XML 块（channel 定义 + 窗口内逐日 programme 列表）
+        只拉存储中缺失/过期的日期（见 epg_store.stale_dates），单日拉取失败沿用存储中的旧数据
         :param item: 官方接口返回的单个频道 dict
+        :param dates: 窗口内日期（同一轮生成共用，避免跨零点时各频道窗口不一致），默认当前窗口
+        :param fetch: False 时不请求接口，只按存储渲染（列表接口故障时）
         :return: XML 块字符串（无 cid 时返回空串）
         """
         name = item.get('name', 'Unknown')
@@ -55,62 +116,162 @@ class XmlUtils:
         if cid is None:
             return ""
 
-        block = f'<channel id="{cid}">\n' \
-                f'<display-name lang="zh">{name}</display-name>\n' \
-                f'</channel>\n'
-
-        # 拉取当日 EPG 节目数据（当天零点时间戳）
-        today = datetime.datetime.now(tz=GMT8).date()
-        zero_time = datetime.datetime.combine(today, datetime.time.min, tzinfo=GMT8)
-        epg_response = ApiUtils.get_hntv_epg_data(cid, int(zero_time.timestamp()))
-        if epg_response.status_code != 200:
-            return block
-        epg_data = epg_response.json()
-        if not isinstance(epg_data, dict) or not isinstance(epg_data.get('programs'), list):
-            return block
-
-        for program in epg_data['programs']:
-            title = program.get('title', 'Unknown')
-            begin_time = TimeUtils.format_timestamp_for_epg(program.get('beginTime', ''))
-            end_time = TimeUtils.format_timestamp_for_epg(program.get('endTime', ''))
-            block += f'<programme start="{begin_time}" stop="{end_time}" channel="{cid}">\n' \
-                     f'<title lang="zh">{title}</title>\n' \
-                     f'</programme>\n'
-        return block
+        parts = [xmltv.channel(cid, name)]
+
+        dates = dates or epg_store.window_dates()
+        days = epg_store.load(cid)
+        now = time.time()
+        fetched = 0
+        for day in (epg_store.stale_dates(days, dates, now) if fetch else []):
+            programs = XmlUtils._fetch_programs(cid, epg_store.day_start(day))
+            if programs is None:
+                if day.isoformat() in days:
+                    _logger.info(f"EPG cid={cid} {day} 拉取失败，沿用已存储的节目单")
+                continue
+            days[day.isoformat()] = {
+                'fetched_at': now,
+                'programs': [{key: program.get(key) for key in ('title', 'beginTime', 'endTime')}
+                             for program in programs if isinstance(program, dict)],
+            }
+            fetched += 1
+        if fetched or (fetch and set(days) - {day.isoformat() for day in dates}):
+            epg_store.save(cid, days, dates)
+
+        # 按日期顺序渲染；跨零点的节目可能同时出现在相邻两天的列表里，按开始时间去重
+        seen = set()
+        for day in dates:
+            for program in days.get(day.isoformat(), {}).get('programs', []):
+                begin = program.get('beginTime', '')
+                if begin in seen:
+                    continue
+                seen.add(begin)
+                parts.append(xmltv.programme(cid,
+                                             TimeUtils.format_timestamp_for_epg(begin),
+                                             TimeUtils.format_timestamp_for_epg(program.get('endTime', '')),
+                                             program.get('title') or 'Unknown'))
+        return ''.join(parts)
 
     @staticmethod
-    def _fetch_xml_content():
+    def _write_xml_content(out):
         """
-        拉取频道列表并构建完整 XML 内容
-        :return: XML 文本（接口非 200 时返回空 tv 默认）
+        拉取频道列表并把完整 XML 逐频道写入 out（逐频道节目单有界并发拉取，输出顺序与列表一致）
+        在途频道块不超过并发数的 2 倍，写出即释放，内存占用与频道总数无关；
+        官方频道之后追加外部 XMLTV 源中对齐到播放列表的频道（见 _write_external_programmes）。
+        列表接口失败时按上次保存的频道列表只从存储渲染（不请求节目单接口），存储也为空则抛异常，
+        由调用方保留原文件（不用空文档覆盖整份节目单）
+        :param out: 带 write(text) 的写入器
+        :return: 写入的频道数
         """
-        response = ApiUtils.get_hntv_live_list()
-        if response.status_code != 200:
-            return XmlUtils.EMPTY_XML
+        fetch = True
+        try:
+            response = ApiUtils.get_hntv_live_list(timeout=EPG_FETCH_TIMEOUT)
+            if response.status_code != 200:
+                raise ValueError(f"HTTP {response.status_code}")
+            data = response.json()
+            if not isinstance(data, list):
+                data = []
+            if data:
+                epg_store.save_channels(data)
+        except Exception as e:
+            data = epg_store.load_channels()
+            if not data:
+                raise RuntimeError(f"频道列表接口失败且无已存储的节目单: {str(e)}")
+            fetch = False
+            _logger.warning(f"频道列表接口失败（{str(e)}），按存储中的 {len(data)} 个频道渲染节目单")
+        out.write(XmlUtils.XML_HEADER)
+        if data:
+            dates = epg_store.window_dates()
 
-        data = response.json()
-        xml_content = XmlUtils.XML_HEADER
-        if isinstance(data, list):
-            for item in data:
-                xml_content += XmlUtils._build_channel_block(item)
-        xml_content += '</tv>'
-        return xml_content
+            def build(item):
+                # 单频道异常不影响其它频道（只丢该频道块）
+                try:
+                    return XmlUtils._build_channel_block(item, dates, fetch)
+                except Exception as e:
+                    _logger.warning(f"构建频道 EPG 块失败 cid={item.get('cid')}: {e}")
+                    return ""
+
+            started = time.time()
+            workers = max(1, min(EPG_FETCH_CONCURRENCY, len(data)))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                # 按提交顺序写出（保持频道顺序）；写出一块再补提交一个，限制在途块数
+                pending = deque()
+                for item in data:
+                    pending.append(executor.submit(build, item))
+                    if len(pending) >= workers * 2:
+                        out.write(pending.popleft().result())
+                while pending:
+                    out.write(pending.popleft().result())
+            _logger.info(f"EPG 节目单拉取完成：{len(data)} 个频道，{dates[0]} ~ {dates[-1]}，并发 {workers}，"
+                         f"耗时 {time.time() - started:.1f}s")
+        merged = XmlUtils._write_external_programmes(
+            out, {str(item.get('cid')) for item in data if isinstance(item, dict)})
+        out.write(xmltv.FOOTER)
+        return len(data) + merged
 
     @staticmethod
-    def get_and_save_xml_data():
+    def _write_external_programmes(out, skip_ids):
         """
-        获取XML数据并保存到文件（原子写入），同时生成压缩文件
-        :return: XML 文本内容
+        合并外部 XMLTV 源：为播放列表里没有官方节目单的频道（公开源央视/卫视、B 站）
+        写入 channel 定义与窗口内的节目（频道 id 即列表 tvg-id）；多源按顺序，同一频道取第一个有节目的源
+        :param out: 带 write(text) 的写入器
+        :param skip_ids: 已写入官方节目单的 tvg-id（hntv cid）
+        :return: 合并的频道数
+        """
+        urls = epg_feeds.feed_urls()
+        if not urls:
+            return 0
+        wanted = epg_feeds.playlist_channels(skip_ids)
+        if not wanted:
+            return 0
+        dates = epg_store.window_dates()
+        start, stop = epg_store.day_start(dates[0]), epg_store.day_start(dates[-1]) + 86400
+        covered = set()
+        programmes = 0
+        started = time.time()
+        for url in urls:
+            path = epg_feeds.fetch_feed(url)
+            if not path:
+                continue
+            channels = set()
+            try:
+                for tvg_id, begin, end, title in epg_feeds.iter_programmes(path, wanted, start, stop, covered):
+                    if tvg_id not in channels:
+                        out.write(xmltv.channel(tvg_id, tvg_id))
+                        channels.add(tvg_id)
+                    out.write(xmltv.programme(tvg_id, TimeUtils.format_timestamp_for_epg(begin),
+                                              TimeUtils.format_timestamp_for_epg(end), title))
+                    programmes += 1
+            except Exception as e:
+                # 源文件损坏/截断：已写出的节目保留（每段片段完整），其余频道留给后面的源
+                _logger.warning(f"解析外部 XMLTV 出错: {url} -> {str(e)}")
+            covered |= channels
+        _logger.info(f"外部 XMLTV 合并完成：{len(covered)}/{len(wanted)} 个频道 {programmes} 条节目，"
+                     f"耗时 {time.time() - started:.1f}s")
+        return len(covered)
+
+    @staticmethod
+    def get_and_save_xml_data(unless_exists=()):
+        """
+        生成 XML 并保存：明文与压缩文件在同一遍流式写入中生成（core.atomic_io 原子替换），
+        生成中途出错保留原文件。同一时刻只有一个生成在跑（_generation_lock，跨线程与 worker），
+        后到者等前一个结束
+        :param unless_exists: 拿到锁后其中任一文件已存在则不再生成（请求路径冷启动补生成用：
+                              并发的首批请求只有第一个真正生成，其余等它写完直接复用）
+        :return: 是否保存成功（因文件已存在而跳过也算成功）
         """
         try:
-            xml_content = XmlUtils._fetch_xml_content()
-            atomic_write_text(XML_FILE_PATH, xml_content)
-            atomic_write_gzip(GZ_FILE_PATH, xml_content)
+            with _generation_lock():
+                if any(os.path.exists(path) for path in unless_exists):
+                    return True
+                # 持锁期间没有别的写入者：清掉上次生成被杀时残留的临时文件
+                remove_stream_tmp(XML_FILE_PATH, GZ_FILE_PATH)
+                with atomic_stream_writer(XML_FILE_PATH, GZ_FILE_PATH) as out:
+                    XmlUtils._write_xml_content(out)
             _logger.info(f"XML数据已保存到 {XML_FILE_PATH} 和 {GZ_FILE_PATH}")
-            return xml_content
+            return True
         except Exception as e:
             _logger.warning(f"获取并保存XML数据时出错: {str(e)}")
-            return XmlUtils.EMPTY_XML
+            return False
 
     @staticmethod
     def load_xml_from_file():
@@ -119,15 +280,15 @@ class XmlUtils:
         :return: XML 文本内容
         """
         try:
+            if not os.path.exists(GZ_FILE_PATH) and not os.path.exists(XML_FILE_PATH):
+                # 如果文件不存在，获取并保存数据（拿到生成锁后再确认一次，并发请求只生成一轮）
+                if not XmlUtils.get_and_save_xml_data(unless_exists=(GZ_FILE_PATH, XML_FILE_PATH)):
+                    return XmlUtils.EMPTY_XML
             if os.path.exists(GZ_FILE_PATH):
                 with gzip.open(GZ_FILE_PATH, 'rt', encoding='utf-8') as f:
                     return f.read()
-            elif os.path.exists(XML_FILE_PATH):
-                with open(XML_FILE_PATH, 'r', encoding='utf-8') as f:
-                    return f.read()
-            else:
-                # 如果文件不存在，获取并保存数据
-                return XmlUtils.get_and_save_xml_data()
+            with open(XML_FILE_PATH, 'r', encoding='utf-8') as f:
+                return f.read()
         except Exception as e:
             _logger.warning(f"从文件加载XML数据时出错: {str(e)}")
             return XmlUtils.EMPTY_XML
@@ -0,0 +1,180 @@
+"""外部 XMLTV 节目单：拉取落盘、流式解析、频道对齐与窗口过滤（合并进 live.xml 的数据来源）
+
+官方接口只有 hntv 频道（cid）的节目单；公开源央视/卫视与 B 站频道在播放列表里有 tvg-id，
+却没有任何 EPG。本模块为 XmlUtils 提供外部 XMLTV 源（EPG_XMLTV_URLS / 管理设置 epg_xmltv_urls）：
+- fetch_feed：条件 GET（ETag/Last-Modified）边下载边写入磁盘缓存，304 直接复用，失败沿用旧文件
+- playlist_channels：当前播放列表的 tvg-id，按 SourceUtils.normalize_name 归一化作对齐键
+- iter_programmes：iterparse 逐元素解析（.gz 按文件头自动识别），处理完即清理，
+  百兆级全国源也只占常数内存；只产出能对齐到列表频道、且落在时间窗口内的节目
+外部源的 channel 定义需出现在其 programme 之前（XMLTV 惯例），之后才出现的定义对应的节目被忽略。
+"""
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import time
+from xml.etree import ElementTree
+
+from config import EPG_XMLTV_CACHE_DIR, EPG_XMLTV_FETCH_TIMEOUT, EPG_XMLTV_URLS, GMT8
+from core import http_client
+from core.atomic_io import atomic_write_chunks, atomic_write_text
+from core.logger import get_logger
+from core.sources import SourceUtils
+
+_logger = get_logger('epg_feeds')
+
+_DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+def feed_urls():
+    """外部 XMLTV 源地址：管理设置 epg_xmltv_urls（逗号分隔，设为空串即关闭）优先，config 兜底"""
+    from admin import db
+    raw = db.get_effective_str('epg_xmltv_urls', None)
+    if raw is None:
+        return list(EPG_XMLTV_URLS)
+    return [url.strip() for url in raw.split(',') if url.strip()]
+
+
+def _cache_paths(url):
+    """单源缓存文件（url 哈希命名）：(正文原样落盘, 校验值元数据)"""
+    digest = hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]
+    return (os.path.join(EPG_XMLTV_CACHE_DIR, f"{digest}.xml"),
+            os.path.join(EPG_XMLTV_CACHE_DIR, f"{digest}.json"))
+
+
+def _load_meta(url, meta_path):
+    """读取单源元数据 {url, etag, last_modified, fetched_at}；不存在/损坏/url 不符返回 None"""
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if isinstance(meta, dict) and meta.get('url') == url:
+            return meta
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def fetch_feed(url):
+    """
+    拉取单个外部 XMLTV 源到磁盘缓存（条件 GET）：
+    - 200：流式写入缓存文件并记录新的 ETag/Last-Modified
+    - 304：上游未变更，复用缓存文件
+    - 失败：有缓存沿用旧文件，否则返回 None（不抛异常，单源挂掉不影响其他）
+    :param url: XMLTV 地址（.xml 或 .xml.gz）
+    :return: 本地缓存文件路径或 None
+    """
+    started = time.time()
+    data_path, meta_path = _cache_paths(url)
+    cached = _load_meta(url, meta_path) if os.path.exists(data_path) else None
+    try:
+        response = http_client.conditional_get(url, cached, timeout=EPG_XMLTV_FETCH_TIMEOUT, stream=True)
+        with response:
+            if response.status_code == 304 and cached:
+                _logger.info(f"外部 XMLTV 未变更(304)，复用缓存: {url}")
+                return data_path
+            if response.status_code == 200:
+                atomic_write_chunks(data_path, response.iter_content(_DOWNLOAD_CHUNK_SIZE))
+                validators = http_client.response_validators(response)
+                atomic_write_text(meta_path, json.dumps({
+                    "url": url,
+                    "etag": validators.get('etag'),
+                    "last_modified": validators.get('last_modified'),
+                    "fetched_at": int(time.time()),
+                }, ensure_ascii=False))
+                _logger.info(f"拉取外部 XMLTV 成功：{os.path.getsize(data_path)} 字节"
+                             f"（{time.time() - started:.2f}s）: {url}")
+                return data_path
+            _logger.warning(f"拉取外部 XMLTV 失败({response.status_code}，"
+                            f"{time.time() - started:.2f}s): {url}")
+    except Exception as e:
+        _logger.warning(f"拉取外部 XMLTV 出错({time.time() - started:.2f}s): {url} -> {str(e)}")
+    if cached:
+        _logger.info(f"外部 XMLTV 沿用上次缓存: {url}")
+        return data_path
+    return None
+
+
+def playlist_channels(skip_ids=()):
+    """
+    当前播放列表中待补节目单的频道
+    :param skip_ids: 已有节目单的 tvg-id（官方 hntv 频道的 cid）
+    :return: {归一化频道名: tvg-id}
+    """
+    from core.aggregator import AggregatorUtils
+    snapshot = AggregatorUtils.get_playlist_snapshot()
+    wanted = {}
+    for extinf, _url in SourceUtils.iter_m3u_entries(snapshot.text if snapshot else ''):
+        tvg_id = SourceUtils.parse_extinf_attrs(extinf).get('tvg-id')
+        if tvg_id and tvg_id not in skip_ids:
+            wanted.setdefault(SourceUtils.normalize_name(tvg_id), tvg_id)
+    return wanted
+
+
+def parse_time(value):
+    """
+    XMLTV 时间串 -> epoch 秒（"YYYYMMDDHHMMSS +0800"；缺时区按 GMT+8，缺秒/分补零）
+    :return: epoch 秒；无法解析返回 None
+    """
+    digits, _, offset = (value or '').strip().partition(' ')
+    if len(digits) < 8 or not digits[:14].isdigit():
+        return None
+    try:
+        moment = datetime.datetime.strptime(digits[:14].ljust(14, '0'), '%Y%m%d%H%M%S')
+        tz = datetime.datetime.strptime(offset.strip(), '%z').tzinfo if offset.strip() else GMT8
+        return int(moment.replace(tzinfo=tz).timestamp())
+    except ValueError:
+        return None
+
+
+def _open_feed(path):
+    """按文件头识别 gzip（服务端未声明 Content-Encoding 的 .xml.gz 原样落盘）"""
+    with open(path, 'rb') as f:
+        magic = f.read(2)
+    return gzip.open(path, 'rb') if magic == b'\x1f\x8b' else open(path, 'rb')
+
+
+def _match_channel(elem, wanted):
+    """外部 channel 元素对齐到列表 tvg-id：display-name 优先，其次 id，均按频道名归一化比对"""
+    names = [node.text for node in elem.findall('display-name')] + [elem.get('id')]
+    for name in names:
+        if name and name.strip():
+            tvg_id = wanted.get(SourceUtils.normalize_name(name))
+            if tvg_id:
+                return tvg_id
+    return None
+
+
+def iter_programmes(path, wanted, start, stop, exclude=()):
+    """
+    流式解析外部 XMLTV，产出可对齐且落在窗口内的节目
+    :param path: 本地缓存文件（fetch_feed 返回值）
+    :param wanted: playlist_channels 的 {归一化频道名: tvg-id}
+    :param start: 窗口起点 epoch 秒（结束时间不晚于此的节目丢弃）
+    :param stop: 窗口终点 epoch 秒（开始时间不早于此的节目丢弃）
+    :param exclude: 已由前面的源覆盖的 tvg-id（不再对齐）
+    :yield: (tvg-id, 开始 epoch 秒, 结束 epoch 秒, 标题)
+    """
+    claimed = set(exclude)
+    mapping = {}  # 外部 channel id -> 列表 tvg-id（同一 tvg-id 只认第一个外部频道）
+    with _open_feed(path) as f:
+        context = ElementTree.iterparse(f, events=('start', 'end'))
+        _event, root = next(context)
+        for event, elem in context:
+            if event != 'end' or elem.tag not in ('channel', 'programme'):
+                continue
+            if elem.tag == 'channel':
+                tvg_id = _match_channel(elem, wanted)
+                if tvg_id and tvg_id not in claimed and elem.get('id') not in mapping:
+                    mapping[elem.get('id')] = tvg_id
+                    claimed.add(tvg_id)
+            else:
+                tvg_id = mapping.get(elem.get('channel'))
+                if tvg_id:
+                    begin = parse_time(elem.get('start'))
+                    end = parse_time(elem.get('stop')) or begin
+                    title = (elem.findtext('title') or '').strip()
+                    if begin is not None and title and begin < stop and end > start:
+                        yield tvg_id, begin, end, title
+            # 顶层元素处理完即从根节点摘除，已解析部分不留在内存里
+            root.clear()
@@ -0,0 +1,120 @@
+"""EPG 节目单存储：按 (频道 cid, GMT+8 日期) 保存节目列表，支撑多日滑动窗口与逐日增量刷新
+
+原先每天 02:30 只拉"当天"节目单并整份重写 XML：过了零点到 02:30 之间播放器没有任何节目数据，
+也没有后续几天的预告。本模块为每个频道保存窗口内（昨天 .. 后天，见 EPG_WINDOW_*）逐日的节目列表：
+- window_dates：当前窗口内的日期
+- stale_dates：需要重新拉取的日期（缺失，或当天及以后且拉取已超过 EPG_DAY_MAX_AGE；
+  已过去的日期拉到过就不再刷新）
+- load / save：每频道一个 JSON 文件 {日期: {fetched_at, programs}}，写入时裁掉窗口外的日期
+- load_channels / save_channels：最近一次成功拿到的频道列表（列表接口故障时按它从存储渲染）
+单日拉取失败时沿用存储中该日的旧数据；XML 每次从存储整体渲染。
+"""
+import datetime
+import json
+import os
+import time
+
+from config import EPG_DAY_MAX_AGE, EPG_STORE_DIR, EPG_WINDOW_FUTURE_DAYS, EPG_WINDOW_PAST_DAYS, GMT8
+from core.atomic_io import atomic_write_text
+from core.logger import get_logger
+
+_logger = get_logger('epg_store')
+
+# 频道列表文件名（下划线开头，不会与 {cid}.json 冲突）
+_CHANNELS_FILE = '_channels.json'
+
+
+def today():
+    """GMT+8 当天日期"""
+    return datetime.datetime.now(tz=GMT8).date()
+
+
+def window_dates(day=None):
+    """窗口内的日期（从早到晚）：day - EPG_WINDOW_PAST_DAYS .. day + EPG_WINDOW_FUTURE_DAYS"""
+    day = day or today()
+    return [day + datetime.timedelta(days=offset)
+            for offset in range(-EPG_WINDOW_PAST_DAYS, EPG_WINDOW_FUTURE_DAYS + 1)]
+
+
+def day_start(day):
+    """日期的 GMT+8 零点时间戳（节目单接口的 date 参数）"""
+    return int(datetime.datetime.combine(day, datetime.time.min, tzinfo=GMT8).timestamp())
+
+
+def stale_dates(days, dates, now=None, current=None):
+    """
+    需要拉取的日期
+    :param days: 频道已存储的 {日期字符串: {fetched_at, programs}}
+    :param dates: 窗口内日期（window_dates）
+    :param now: 当前 epoch 秒（测试可注入）
+    :param current: 当天日期（测试可注入）
+    """
+    now = now if now is not None else time.time()
+    current = current or today()
+    stale = []
+    for day in dates:
+        entry = days.get(day.isoformat())
+        if entry is None:
+            stale.append(day)
+        elif day >= current and now - entry.get('fetched_at', 0) >= EPG_DAY_MAX_AGE:
+            stale.append(day)
+    return stale
+
+
+def _path(cid):
+    return os.path.join(EPG_STORE_DIR, f"{cid}.json")
+
+
+def load(cid):
+    """读取频道已存储的逐日节目 {日期字符串: {fetched_at, programs}}；无文件或损坏返回空 dict"""
+    try:
+        with open(_path(cid), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        _logger.warning(f"读取 EPG 存储出错 cid={cid}: {str(e)}")
+        return {}
+
+
+def save(cid, days, dates):
+    """保存频道逐日节目（只保留窗口内日期，原子写入）"""
+    keep = {day.isoformat() for day in dates}
+    data = {key: value for key, value in sorted(days.items()) if key in keep}
+    try:
+        atomic_write_text(_path(cid), json.dumps(data, ensure_ascii=False))
+    except Exception as e:
+        _logger.warning(f"保存 EPG 存储出错 cid={cid}: {str(e)}")
+
+
+def save_channels(items):
+    """保存频道列表 [{cid, name}]（原子写入）"""
+    channels = [{'cid': item.get('cid'), 'name': item.get('name')}
+                for item in items if isinstance(item, dict) and item.get('cid') is not None]
+    try:
+        atomic_write_text(os.path.join(EPG_STORE_DIR, _CHANNELS_FILE), json.dumps(channels, ensure_ascii=False))
+    except Exception as e:
+        _logger.warning(f"保存 EPG 频道列表出错: {str(e)}")
+
+
+def load_channels():
+    """
+    最近一次保存的频道列表；没有则按存储目录里已有的频道文件兜底（频道名用 cid）
+    :return: [{cid, name}]，存储为空返回空列表
+    """
+    try:
+        with open(os.path.join(EPG_STORE_DIR, _CHANNELS_FILE), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if isinstance(data, list) and data:
+            return data
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        _logger.warning(f"读取 EPG 频道列表出错: {str(e)}")
+    try:
+        names = sorted(os.listdir(EPG_STORE_DIR))
+    except OSError:
+        return []
+    return [{'cid': name[:-5], 'name': name[:-5]} for name in names
+            if name.endswith('.json') and not name.startswith('_')]
@@ -0,0 +1,147 @@
+"""公开频道故障切换（redirect 模式）：/api/ch/<频道> 按内存健康表 302 到当前最健康的候选
+
+聚合列表每台只给一个地址时，地址在两轮聚合（6 小时）之间失效，频道就要坏好几个小时。
+redirect 模式下列表里的公开频道地址是本服务的 /api/ch/<key>，本模块维护：
+- 候选表 {key: [主地址, 备用地址, ...]}：每轮聚合整体替换（顺序即测速排名）
+- 健康表 {url: {ok, checked_at, retry_at}}：后台线程每 FAILOVER_CHECK_INTERVAL 秒
+  探测各频道当前选用的地址（宽松口径，同聚合过滤），失败地址 FAILOVER_RETRY_AFTER 秒内不再选用
+resolve 按候选顺序取第一个未标记失败的地址——主地址一挂，下一次请求即切到备用，无需重新生成、
+重新下载整份列表；全部失败时仍返回主地址（交给播放器重试）。
+
+多 worker 部署时聚合与健康检查只在调度 leader 里跑（见 core/leader.py）：leader 每次更新
+候选表 / 健康表后写入 FAILOVER_STATE_PATH，follower 的 resolve 读该文件。
+"""
+import threading
+import time
+
+from config import (FAILOVER_CHECK_INTERVAL, FAILOVER_RETRY_AFTER, FAILOVER_STATE_PATH,
+                    STREAM_PROBE_UA_LOOSE)
+from core import leader
+from core.logger import get_logger
+from core.probing import probe_many
+
+_logger = get_logger('failover')
+
+# 候选表 {key: [url, ...]} 与健康表 {url: {ok, checked_at, retry_at}}
+_candidates = {}
+_health = {}
+_lock = threading.Lock()
+_checker_thread = None
+# leader 发布给 follower 的 {candidates, health} 文件
+_shared = leader.SharedState(FAILOVER_STATE_PATH)
+
+
+def _export():
+    """leader 把候选表与健康表写入共享文件（follower 的 resolve 用；未参与选主时不写）"""
+    if not leader.started():
+        return
+    with _lock:
+        data = {'candidates': {key: list(c) for key, c in _candidates.items()},
+                'health': {url: dict(state) for url, state in _health.items()}}
+    _shared.write(data)
+
+
+def publish(table):
+    """
+    整体替换候选表（每轮聚合调用；不在新表中的地址健康记录一并清理）
+    :param table: {key: [主地址, 备用地址, ...]}
+    """
+    urls = {u for candidates in table.values() for u in candidates}
+    with _lock:
+        _candidates.clear()
+        _candidates.update({key: list(candidates) for key, candidates in table.items()})
+        for url in [u for u in _health if u not in urls]:
+            del _health[url]
+    _export()
+
+
+def _pick(candidates, now, health=None):
+    """按候选顺序取第一个可用地址（未探测 / 上次可达 / 失败已过冷却期）；全部失败取主地址"""
+    health = _health if health is None else health
+    for url in candidates:
+        state = health.get(url)
+        if state is None or state['ok'] or state['retry_at'] <= now:
+            return url
+    return candidates[0]
+
+
+def resolve(key, now=None):
+    """
+    频道当前应跳转的地址
+    :param key: 频道标准名（聚合去重 key）
+    :return: 地址；频道不在候选表返回 None
+    """
+    now = now if now is not None else time.time()
+    if not leader.is_leader():
+        data, _mtime = _shared.read()
+        if data:
+            candidates = data.get('candidates', {}).get(key)
+            return _pick(candidates, now, data.get('health', {})) if candidates else None
+    with _lock:
+        candidates = _candidates.get(key)
+        return _pick(candidates, now) if candidates else None
+
+
+def mark(url, ok, now=None):
+    """记录一次地址探测结果（失败地址 FAILOVER_RETRY_AFTER 秒内不再选用）"""
+    now = now if now is not None else time.time()
+    with _lock:
+        _health[url] = {'ok': ok, 'checked_at': now,
+                        'retry_at': now if ok else now + FAILOVER_RETRY_AFTER}
+
+
+def check_once(now=None):
+    """探测各频道当前选用的地址，更新健康表；返回探测的地址数"""
+    now = now if now is not None else time.time()
+    with _lock:
+        urls = list(dict.fromkeys(_pick(c, now) for c in _candidates.values() if c))
+    if not urls:
+        return 0
+    results = probe_many(urls, accept_403=True, user_agent=STREAM_PROBE_UA_LOOSE)
+    failed = 0
+    for url, ok in zip(urls, results):
+        mark(url, ok, now)
+        failed += not ok
+    _export()
+    if failed:
+        _logger.info(f"故障切换：{failed}/{len(urls)} 个当前地址不可达，后续请求改用备用地址")
+    return len(urls)
+
+
+def _restore():
+    """接管调度的新 leader 沿用上一个 leader 落盘的候选表与健康表（否则到下轮聚合前都是空表）"""
+    data, _mtime = _shared.read()
+    if not data:
+        return
+    with _lock:
+        if _candidates:
+            return
+        _candidates.update({key: list(c) for key, c in data.get('candidates', {}).items()})
+        _health.update({url: dict(state) for url, state in data.get('health', {}).items()})
+
+
+def start():
+    """启动后台健康检查线程（进程内只启动一次；候选表为空时空转）"""
+    global _checker_thread
+    _restore()
+
+    def loop():
+        while True:
+            time.sleep(FAILOVER_CHECK_INTERVAL)
+            try:
+                check_once()
+            except Exception:
+                _logger.exception("故障切换健康检查出错")
+
+    with _lock:
+        if _checker_thread is not None:
+            return
+        _checker_thread = threading.Thread(target=loop, daemon=True, name='故障切换检查')
+    _checker_thread.start()
+
+
+def reset():
+    """清空候选表与健康表（测试用）"""
+    with _lock:
+        _candidates.clear()
+        _health.clear()
@@ -2,9 +2,8 @@
 import hashlib
 import time
 
-import requests
-
 from config import API_TOKEN, SECRET_KEY
+from core import http_client
 
 
 class TokenUtils:
@@ -48,21 +47,23 @@ class ApiUtils:
     """HNTV 官方接口请求工具类"""
 
     @staticmethod
-    def get_hntv_live_list():
+    def get_hntv_live_list(timeout=None):
         """
         获取 hntv 官方直播频道列表
+        :param timeout: 请求超时（秒），None 取连接池预设默认值
         :return: requests.Response
         """
         url = "https://pubmod.hntv.tv/program/getAuth/live/class/program/11/"
-        return requests.get(url, headers=CryptoUtils._auth_headers())
+        return http_client.get(url, preset='hntv', headers=CryptoUtils._auth_headers(), timeout=timeout)
 
     @staticmethod
-    def get_hntv_epg_data(cid, date_timestamp):
+    def get_hntv_epg_data(cid, date_timestamp, timeout=None):
         """
         获取单频道当日 EPG 节目数据
         :param cid: 频道ID
         :param date_timestamp: 日期时间戳（当天零点）
+        :param timeout: 请求超时（秒），None 取连接池预设默认值
         :return: requests.Response
         """
         url = f"https://pubmod.hntv.tv/program/getAuth/vod/originStream/program/{cid}/{date_timestamp}"
-        return requests.get(url, headers=CryptoUtils._auth_headers())
+        return http_client.get(url, preset='hntv', headers=CryptoUtils._auth_headers(), timeout=timeout)
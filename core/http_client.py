@@ -0,0 +1,162 @@
+"""上游 HTTP 客户端：按 (预设, 协议, 主机) 复用 keep-alive 连接池
+
+项目所有上游请求（HNTV 接口、公开源、B 站接口/分片、流探测）统一走这里，
+同一主机的连续请求复用已建立的 TCP+TLS 连接。每个预设（preset）定义：
+- headers：会话级固定请求头（如 B 站防盗链 Referer/UA）
+- timeout：调用方未传超时时的默认值
+- retries：连接失败 / 502 / 503 / 504 自动重试次数（探测预设为 0，
+  探测结果本身就是可达性判定，不能被重试掩盖；B 站 CDN 线路预设也为 0，
+  线路故障应立即切下一条，而不是在同一主机上重试）
+
+会话不保存上游下发的 cookie（与旧版每次 requests.get 的无状态语义一致；
+B 站登录 cookie 由调用方按请求显式传入）。
+"""
+import threading
+from collections import OrderedDict
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config import (BILIBILI_REFERER, BILIBILI_UA, HTTP_DEFAULT_TIMEOUT,
+                    HTTP_MAX_SESSIONS, HTTP_POOL_SIZE, HTTP_RETRIES,
+                    HTTP_RETRY_BACKOFF)
+
+# 上游预设：会话级请求头 / 默认超时 / 重试次数
+PRESETS = {
+    'default': {'headers': {}, 'timeout': HTTP_DEFAULT_TIMEOUT, 'retries': HTTP_RETRIES},
+    'hntv': {'headers': {}, 'timeout': HTTP_DEFAULT_TIMEOUT, 'retries': HTTP_RETRIES},
+    'bilibili': {
+        'headers': {'Referer': BILIBILI_REFERER, 'User-Agent': BILIBILI_UA},
+        'timeout': HTTP_DEFAULT_TIMEOUT,
+        'retries': HTTP_RETRIES,
+    },
+    # B 站 CDN 线路（清单/分片）：请求头同 bilibili，不重试，由多线路故障切换兜底
+    'bilibili_route': {
+        'headers': {'Referer': BILIBILI_REFERER, 'User-Agent': BILIBILI_UA},
+        'timeout': HTTP_DEFAULT_TIMEOUT,
+        'retries': 0,
+    },
+    'probe': {'headers': {}, 'timeout': HTTP_DEFAULT_TIMEOUT, 'retries': 0},
+}
+
+# 会话池 {(preset, scheme, host): Session}，按最近使用排序（LRU 淘汰）
+_sessions = OrderedDict()
+_sessions_lock = threading.Lock()
+
+
+def _build_session(preset):
+    """按预设新建会话：挂载带重试的连接池适配器、固定请求头、禁用 cookie 持久化"""
+    spec = PRESETS[preset]
+    retries = spec['retries']
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset(['GET']),
+        backoff_factor=HTTP_RETRY_BACKOFF,
+        raise_on_status=False,
+    ) if retries else 0
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update(spec['headers'])
+    # 拒收一切上游 Set-Cookie：避免会话间/请求间串状态
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    return session
+
+
+def get_session(url, preset='default'):
+    """
+    取 url 所属主机的复用会话（不存在则创建）
+    :param url: 请求地址
+    :param preset: 上游预设名（见 PRESETS）
+    :return: requests.Session
+    """
+    if preset not in PRESETS:
+        raise ValueError(f"未知 HTTP 预设: {preset}")
+    parts = urlsplit(url)
+    key = (preset, parts.scheme.lower(), parts.netloc.lower())
+    evicted = []
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is not None:
+            _sessions.move_to_end(key)
+            return session
+        session = _build_session(preset)
+        _sessions[key] = session
+        while len(_sessions) > HTTP_MAX_SESSIONS:
+            evicted.append(_sessions.popitem(last=False)[1])
+    for old in evicted:
+        try:
+            old.close()
+        except Exception:
+            pass
+    return session
+
+
+def get(url, preset='default', params=None, headers=None, timeout=None, stream=False, **kwargs):
+    """
+    连接复用版 GET（参数语义同 requests.get）
+    :param url: 请求地址
+    :param preset: 上游预设名
+    :param params: 查询参数
+    :param headers: 本次请求附加头（覆盖预设同名头）
+    :param timeout: 超时（秒或 (连接, 读取) 元组），默认取预设值
+    :param stream: 流式读取（调用方须读完或 close，连接才回池）
+    :return: requests.Response
+    """
+    if timeout is None:
+        timeout = PRESETS[preset]['timeout']
+    session = get_session(url, preset)
+    return session.get(url, params=params, headers=headers, timeout=timeout,
+                       stream=stream, **kwargs)
+
+
+def conditional_get(url, validators=None, preset='default', headers=None, **kwargs):
+    """
+    条件 GET：带上次响应的 ETag / Last-Modified，上游未变更时返回 304（无正文）
+    :param url: 请求地址
+    :param validators: 上次的校验值 {'etag': ..., 'last_modified': ...}（见 response_validators）
+    :param preset: 上游预设名
+    :param headers: 附加请求头
+    :return: requests.Response（调用方按 status_code == 304 判定未变更）
+    """
+    headers = dict(headers or {})
+    validators = validators or {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+    return get(url, preset=preset, headers=headers, **kwargs)
+
+
+def response_validators(response):
+    """提取响应的缓存校验值（供下次 conditional_get 使用）"""
+    return {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+    }
+
+
+def close_all():
+    """关闭并清空全部会话（测试与进程退出用）"""
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        try:
+            session.close()
+        except Exception:
+            pass
+
+
+def session_count():
+    """当前会话数（诊断用）"""
+    with _sessions_lock:
+        return len(_sessions)
@@ -0,0 +1,176 @@
+"""多 worker 调度选主：文件锁选出唯一 leader 跑后台任务，其余 worker 只读共享文件应答请求
+
+后台调度线程（聚合 / EPG / 监控 / 开播追踪 / 故障切换检查）原先在 main.py 导入时无条件启动，
+GUNICORN_WORKERS 只能为 1，否则任务随 worker 数重复执行、告警邮件重复轰炸。本模块：
+- start：各 worker 竞争 LEADER_LOCK_PATH 上的 fcntl.flock 排他锁，抢到的即 leader，
+  立即执行 on_elected（启动后台任务）；没抢到的起守候线程每 LEADER_RETRY_INTERVAL 秒重试，
+  leader 退出（崩溃 / max_requests 回收 / SIGKILL）时锁随进程释放，由某个守候 worker 接管
+- SharedState：leader 写、follower 按 mtime 读的 JSON 状态文件（开播状态表、故障切换表）
+- request_refresh / take_refresh_request：follower 收到的手动刷新请求落成标志文件，由 leader 消费
+平台不支持 fcntl（Windows 开发环境）时当前进程直接当选，行为与单 worker 一致；
+未调用 start（测试 / 脚本）时 is_leader 恒为 True，各模块按单进程方式工作。
+"""
+import json
+import os
+import threading
+import time
+
+from config import (LEADER_LOCK_PATH, LEADER_RETRY_INTERVAL, REFRESH_REQUEST_PATH,
+                    SHARED_STATE_CHECK_INTERVAL)
+from core.atomic_io import atomic_write_text
+from core.logger import get_logger
+
+try:
+    import fcntl
+except ImportError:  # 非 POSIX 平台：不选主，当前进程即 leader
+    fcntl = None
+
+_logger = get_logger('leader')
+
+_started = False
+_elected = threading.Event()
+_start_lock = threading.Lock()
+# 持锁的文件描述符（进程存活期间保持打开，关闭即释放锁）
+_lock_fd = None
+
+
+def _try_acquire():
+    """尝试非阻塞获取选主锁；成功时把 pid / 当选时间写入锁文件（便于排查谁是 leader）"""
+    global _lock_fd
+    os.makedirs(os.path.dirname(LEADER_LOCK_PATH), exist_ok=True)
+    fd = os.open(LEADER_LOCK_PATH, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return False
+    try:
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{os.getpid()} {int(time.time())}\n".encode())
+    except OSError:
+        pass
+    _lock_fd = fd
+    return True
+
+
+def _become_leader(on_elected):
+    """当选：置标志后启动后台任务（on_elected 异常只记日志，锁继续持有）"""
+    _elected.set()
+    _logger.info(f"进程 {os.getpid()} 当选调度 leader，启动后台任务")
+    try:
+        on_elected()
+    except Exception:
+        _logger.exception("启动后台任务出错")
+
+
+def start(on_elected):
+    """
+    参与选主（进程内只生效一次）
+    :param on_elected: 当选后执行的无参函数（启动后台调度线程）；当选后只调用一次
+    :return: 本次调用时是否已当选
+    """
+    global _started
+    with _start_lock:
+        if _started:
+            return _elected.is_set()
+        _started = True
+
+    if fcntl is None or _try_acquire():
+        _become_leader(on_elected)
+        return True
+
+    def standby():
+        while not _try_acquire():
+            time.sleep(LEADER_RETRY_INTERVAL)
+        _become_leader(on_elected)
+
+    _logger.info(f"进程 {os.getpid()} 作为 follower 运行（每 {LEADER_RETRY_INTERVAL} 秒尝试接管调度）")
+    threading.Thread(target=standby, daemon=True, name='调度选主').start()
+    return False
+
+
+def is_leader():
+    """当前进程是否负责后台任务（未参与选主时视为单进程，恒为 True）"""
+    return not _started or _elected.is_set()
+
+
+def started():
+    """当前进程是否参与了选主（未参与时无需写共享状态文件）"""
+    return _started
+
+
+def request_refresh():
+    """follower 收到手动刷新请求：写标志文件交给 leader（多次请求自然合并为一个文件）"""
+    try:
+        atomic_write_text(REFRESH_REQUEST_PATH, f"{os.getpid()} {int(time.time())}\n")
+    except Exception as e:
+        _logger.warning(f"写入刷新请求标志出错: {str(e)}")
+
+
+def take_refresh_request():
+    """leader 消费刷新请求标志：存在则删除并返回 True"""
+    try:
+        os.remove(REFRESH_REQUEST_PATH)
+        return True
+    except FileNotFoundError:
+        return False
+    except OSError as e:
+        _logger.warning(f"读取刷新请求标志出错: {str(e)}")
+        return False
+
+
+class SharedState:
+    """leader 写、follower 读的 JSON 状态文件（读取按 mtime 缓存，stat 至多每 SHARED_STATE_CHECK_INTERVAL 秒一次）"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data = None
+        self._mtime = None
+        self._checked_at = 0
+
+    def write(self, data):
+        """原子写入状态（leader 调用；失败只记日志）"""
+        try:
+            atomic_write_text(self.path, json.dumps(data, ensure_ascii=False))
+        except Exception as e:
+            _logger.warning(f"写入共享状态出错({os.path.basename(self.path)}): {str(e)}")
+
+    def read(self):
+        """
+        最近一次 leader 写入的状态（follower 调用）
+        :return: (数据, 文件 mtime)；文件不存在或损坏返回 (None, None)
+        """
+        now = time.time()
+        with self._lock:
+            if now - self._checked_at < SHARED_STATE_CHECK_INTERVAL:
+                return self._data, self._mtime
+            self._checked_at = now
+            try:
+                mtime = os.path.getmtime(self.path)
+            except OSError:
+                self._data, self._mtime = None, None
+                return None, None
+            if mtime != self._mtime:
+                try:
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        self._data = json.load(f)
+                    self._mtime = mtime
+                except Exception as e:
+                    _logger.warning(f"读取共享状态出错({os.path.basename(self.path)}): {str(e)}")
+                    self._data, self._mtime = None, None
+            return self._data, self._mtime
+
+
+def reset():
+    """释放选主锁并回到未参与选主状态（测试用）"""
+    global _started, _lock_fd
+    with _start_lock:
+        _started = False
+        _elected.clear()
+        if _lock_fd is not None:
+            try:
+                os.close(_lock_fd)
+            except OSError:
+                pass
+            _lock_fd = None
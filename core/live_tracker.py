@@ -0,0 +1,223 @@
+"""B 站开播状态追踪：后台线程按自适应周期轮询全部房间，请求路径查内存表
+
+开播判定（BilibiliUtils.is_live）要解析流地址 + 实测拉主清单，单房间就要数百毫秒到数秒。
+聚合、/api/bilibili/rooms、/api/bilibili/<room_id>/status 原先都在请求路径上同步判定，
+房间一多接口就要等好几秒。本模块由后台线程轮询，维护 {room_id: 状态} 内存表，
+三处调用直接查表（O(1)）。
+
+自适应周期（见 _next_interval）：
+- 在播房间：BILIBILI_LIVE_CHECK_INTERVAL（及时发现下播）
+- 临近该房间历史开播时刻（±BILIBILI_START_WINDOW）：BILIBILI_PEAK_CHECK_INTERVAL（及时发现开播）
+- 未开播：BILIBILI_OFFLINE_CHECK_INTERVAL；连续未开播超 BILIBILI_IDLE_AFTER 秒的
+  "久未开播"房间降到 BILIBILI_IDLE_CHECK_INTERVAL
+
+追踪线程未启动（测试 / 脚本）或房间尚未被追踪时，回退同步判定并把结果记入表。
+
+多 worker 部署时追踪线程只在调度 leader 里跑（见 core/leader.py）：leader 每轮把状态表
+写入 LIVE_STATE_PATH，follower 查询时读该文件（LIVE_STATE_MAX_AGE 内有效），不重复轮询 B 站。
+"""
+import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import (BILIBILI_IDLE_AFTER, BILIBILI_IDLE_CHECK_INTERVAL,
+                    BILIBILI_LIVE_CHECK_INTERVAL, BILIBILI_OFFLINE_CHECK_INTERVAL,
+                    BILIBILI_PEAK_CHECK_INTERVAL, BILIBILI_START_WINDOW,
+                    BILIBILI_TRACKER_ROOMS_REFRESH, BILIBILI_TRACKER_TICK,
+                    BILIBILI_TRACKER_WORKERS, GMT8, LIVE_STATE_MAX_AGE, LIVE_STATE_PATH)
+from core import leader
+from core.bilibili import BilibiliUtils
+from core.logger import get_logger
+
+_logger = get_logger('live_tracker')
+
+# 每个房间最多记住的历史开播时刻数（一天内分钟数）
+_START_HISTORY = 8
+_MINUTES_PER_DAY = 24 * 60
+
+# 开播状态表 {room_id: {live, checked_at, changed_at, next_check_at, start_minutes}}
+_states = {}
+_states_lock = threading.Lock()
+# 追踪线程是否在运行（未运行时查询回退同步判定）
+_running = threading.Event()
+_tracker_thread = None
+# leader 发布给 follower 的状态表文件；至少每 _EXPORT_EVERY 秒重写一次（证明 leader 仍在追踪）
+_shared = leader.SharedState(LIVE_STATE_PATH)
+_EXPORT_EVERY = 60
+
+
+def _minute_of_day(ts):
+    """epoch 秒 -> GMT+8 当天第几分钟"""
+    dt = datetime.datetime.fromtimestamp(ts, tz=GMT8)
+    return dt.hour * 60 + dt.minute
+
+
+def _near_known_start(start_minutes, now):
+    """当前时刻是否临近历史开播时刻（按一天循环计算距离）"""
+    current = _minute_of_day(now)
+    window = BILIBILI_START_WINDOW / 60
+    for minute in start_minutes:
+        diff = abs(current - minute)
+        if min(diff, _MINUTES_PER_DAY - diff) <= window:
+            return True
+    return False
+
+
+def _next_interval(state, now):
+    """
+    按房间状态计算下次检测间隔（秒）
+    :param state: 房间状态 dict（live / changed_at / start_minutes）
+    :param now: 当前 epoch 秒
+    """
+    if state['live']:
+        return BILIBILI_LIVE_CHECK_INTERVAL
+    if _near_known_start(state['start_minutes'], now):
+        return BILIBILI_PEAK_CHECK_INTERVAL
+    if now - state['changed_at'] >= BILIBILI_IDLE_AFTER:
+        return BILIBILI_IDLE_CHECK_INTERVAL
+    return BILIBILI_OFFLINE_CHECK_INTERVAL
+
+
+def record(room_id, live, now=None):
+    """
+    记录一次开播判定结果（状态变化时更新 changed_at；未开播→开播时记下开播时刻）
+    :param room_id: 直播间房间号
+    :param live: 判定结果
+    :param now: 判定时间（epoch 秒，测试可注入）
+    :return: True=状态发生变化（首次记录不算）
+    """
+    now = now if now is not None else time.time()
+    with _states_lock:
+        state = _states.get(room_id)
+        changed = state is not None and state['live'] != live
+        if state is None:
+            state = {'live': live, 'checked_at': now, 'changed_at': now, 'start_minutes': []}
+            _states[room_id] = state
+        if changed:
+            state['changed_at'] = now
+            if live:
+                state['start_minutes'] = (state['start_minutes'] + [_minute_of_day(now)])[-_START_HISTORY:]
+        state['live'] = live
+        state['checked_at'] = now
+        state['next_check_at'] = now + _next_interval(state, now)
+    if changed:
+        _logger.info(f"B站房间 {room_id} {'开播' if live else '下播'}")
+    return changed
+
+
+def _shared_state(room_id):
+    """follower 从 leader 发布的状态表查房间（文件缺失 / 过期 / 未追踪该房间返回 None）"""
+    data, mtime = _shared.read()
+    if not data or time.time() - mtime > LIVE_STATE_MAX_AGE:
+        return None
+    state = data.get(str(room_id))
+    return dict(state) if state else None
+
+
+def export_states():
+    """leader 把当前状态表写入共享文件（follower 查询用）"""
+    with _states_lock:
+        data = {str(room_id): dict(state) for room_id, state in _states.items()}
+    _shared.write(data)
+
+
+def get_state(room_id):
+    """房间状态副本（未追踪返回 None；follower 优先取 leader 发布的状态）"""
+    if not leader.is_leader():
+        state = _shared_state(room_id)
+        if state is not None:
+            return state
+    with _states_lock:
+        state = _states.get(room_id)
+        return dict(state) if state else None
+
+
+def is_live(room_id):
+    """
+    房间是否在播：追踪线程运行中且已追踪该房间 → 查表；follower 查 leader 发布的表；
+    否则同步判定并记入表
+    :param room_id: 直播间房间号
+    :return: True 在播 / False 未开播或不可用
+    """
+    if not leader.is_leader():
+        state = _shared_state(room_id)
+        if state is not None:
+            return state['live']
+    if _running.is_set():
+        with _states_lock:
+            state = _states.get(room_id)
+            if state is not None:
+                return state['live']
+    live = BilibiliUtils.is_live(room_id)
+    record(room_id, live)
+    return live
+
+
+def _check(room_id):
+    """后台检测单个房间（异常按未开播处理，不中断追踪）"""
+    try:
+        live = BilibiliUtils.is_live(room_id)
+    except Exception as e:
+        _logger.warning(f"B站开播检测出错(room={room_id}): {str(e)}")
+        live = False
+    record(room_id, live)
+
+
+def _sync_rooms(room_ids):
+    """同步追踪房间集合：移除已删除的房间（新房间在下一轮立即检测）"""
+    with _states_lock:
+        for room_id in [r for r in _states if r not in room_ids]:
+            del _states[room_id]
+
+
+def due_rooms(room_ids, now=None):
+    """到期需检测的房间（未追踪的新房间立即到期）"""
+    now = now if now is not None else time.time()
+    with _states_lock:
+        return [r for r in room_ids
+                if r not in _states or _states[r].get('next_check_at', 0) <= now]
+
+
+def start(rooms_provider):
+    """
+    启动后台追踪线程（进程内只启动一次）
+    :param rooms_provider: 无参函数，返回当前全部房间 [{room_id, ...}]（如 AggregatorUtils.list_bilibili_rooms）
+    """
+    global _tracker_thread
+
+    def loop():
+        room_ids = []
+        rooms_loaded_at = 0
+        exported_at = 0
+        with ThreadPoolExecutor(max_workers=BILIBILI_TRACKER_WORKERS) as executor:
+            while True:
+                try:
+                    now = time.time()
+                    if now - rooms_loaded_at >= BILIBILI_TRACKER_ROOMS_REFRESH:
+                        room_ids = [item['room_id'] for item in rooms_provider()]
+                        rooms_loaded_at = now
+                        _sync_rooms(set(room_ids))
+                    # 首轮全部房间检测完才切到查表模式，避免启动初期误判未开播
+                    due = due_rooms(room_ids, now)
+                    list(executor.map(_check, due))
+                    _running.set()
+                    if due or now - exported_at >= _EXPORT_EVERY:
+                        export_states()
+                        exported_at = now
+                except Exception:
+                    _logger.exception("B站开播追踪出错")
+                time.sleep(BILIBILI_TRACKER_TICK)
+
+    with _states_lock:
+        if _tracker_thread is not None:
+            return
+        _tracker_thread = threading.Thread(target=loop, daemon=True, name='B站开播追踪')
+    _tracker_thread.start()
+
+
+def reset():
+    """清空状态表并回到同步判定模式（测试用）"""
+    _running.clear()
+    with _states_lock:
+        _states.clear()
@@ -0,0 +1,39 @@
+"""M3U 输出：聚合/降级各路径共用的频道条目渲染（list-join 线性拼接）
+
+条目格式（与历史输出逐字节一致，tests/test_equivalence.py 锁定）：
+    #EXTINF:-1 tvg-id="<id>" tvg-name="<tvg名>" group-title="<分组>",<显示名>
+    <播放地址>
+    <空行>
+"""
+
+# 文件头（头部后空一行）
+M3U_HEADER = "#EXTM3U\n\n"
+
+
+def render_entry(tvg_id, tvg_name, group_title, name, url):
+    """
+    渲染单个频道条目（值按 f-string 语义转字符串：None 输出 "None"，与旧版一致）
+    :return: 条目文本（含结尾空行）
+    """
+    return (f'#EXTINF:-1 tvg-id="{tvg_id}" tvg-name="{tvg_name}" '
+            f'group-title="{group_title}",{name}\n'
+            f'{url}\n\n')
+
+
+def iter_m3u(entries):
+    """
+    流式产出 m3u 文本片段（文件头 + 逐条目）
+    :param entries: 可迭代的 (tvg_id, tvg_name, group_title, name, url) 元组
+    """
+    yield M3U_HEADER
+    for entry in entries:
+        yield render_entry(*entry)
+
+
+def render_m3u(entries):
+    """
+    渲染完整 m3u 文本（一次 join，频道数线性）
+    :param entries: 可迭代的 (tvg_id, tvg_name, group_title, name, url) 元组
+    :return: m3u 文本
+    """
+    return ''.join(iter_m3u(entries))
@@ -0,0 +1,156 @@
+"""探测结果共享存储：聚合过滤（宽松口径）与流监控（严格口径）共用一张 URL → 最近结果表
+
+聚合过滤（AggregatorUtils.filter_unreachable）原先每轮都把全部公开频道重新探测一遍，
+而流监控（run_stream_check_once）几分钟前可能刚探测过同一批 URL，两边结果各存各的。
+本模块把每条 URL 的最近结果（严格/宽松结论、时间、状态码、耗时）与聚合过滤的
+连续失败计数统一存在 admin 库 probe_results 表：
+- record：探测后按口径写入结果
+- fresh_ok：新鲜期内已确认可达的 URL（宽松可达或严格可达均算——严格口径更苛刻）
+- load_fail_counts / save_fail_counts：取代原 stream_failures.json 的读写
+  （旧文件里的计数由 migrate_legacy_fail_counts 在启动时一次性迁入）
+管理库未初始化（测试 / 脚本）时退回进程内字典，行为一致，只是不跨进程持久化。
+"""
+import json
+import os
+import threading
+import time
+
+from config import STREAM_FAILURES_PATH
+from core.logger import get_logger
+
+_logger = get_logger('probe_store')
+
+# 管理库不可用时的进程内兜底 {url: 行 dict}，字段同 probe_results 表
+_memory = {}
+_memory_lock = threading.Lock()
+
+
+def _db():
+    """可用的管理库模块；未初始化返回 None"""
+    try:
+        from admin import db
+        return db if db.db_ready() else None
+    except Exception:
+        return None
+
+
+def record(urls, results, mode, now=None):
+    """
+    写入一轮探测结果
+    :param urls: 探测的 URL 列表
+    :param results: 与 urls 对应的 ProbeResult 列表（ok / status / latency）
+    :param mode: 'strict'（监控口径）/ 'loose'（聚合过滤口径）
+    :param now: 探测时间（epoch 秒，测试可注入）
+    """
+    now = now if now is not None else time.time()
+    rows = [(url, now, r.ok, r.status, r.latency) for url, r in zip(urls, results)]
+    if not rows:
+        return
+    db = _db()
+    if db is not None:
+        try:
+            db.save_probe_results(mode, rows)
+        except Exception as e:
+            _logger.warning(f"保存探测结果出错: {str(e)}")
+        return
+    with _memory_lock:
+        for url, ts, ok, status, latency in rows:
+            row = _memory.setdefault(url, {'url': url, 'fail_count': 0})
+            row.update({f'{mode}_ok': 1 if ok else 0, f'{mode}_at': ts,
+                        'status': status, 'latency': latency, 'checked_at': ts})
+
+
+def get_results(urls):
+    """按 URL 查最近探测结果 {url: 行 dict}（无记录的 URL 不出现）"""
+    db = _db()
+    if db is not None:
+        try:
+            return db.get_probe_results(urls)
+        except Exception:
+            return {}
+    with _memory_lock:
+        return {u: dict(_memory[u]) for u in urls if u in _memory}
+
+
+def fresh_ok(urls, max_age, now=None):
+    """
+    新鲜期内已确认可达的 URL 集合（宽松或严格口径任一在 max_age 秒内可达即算）
+    :param urls: 候选 URL 列表
+    :param max_age: 新鲜期（秒），<= 0 时返回空集（全部重新探测）
+    :param now: 当前时间（epoch 秒，测试可注入）
+    """
+    if max_age <= 0:
+        return set()
+    now = now if now is not None else time.time()
+    cutoff = now - max_age
+    fresh = set()
+    for url, row in get_results(urls).items():
+        for mode in ('loose', 'strict'):
+            if row.get(f'{mode}_ok') and (row.get(f'{mode}_at') or 0) >= cutoff:
+                fresh.add(url)
+                break
+    return fresh
+
+
+def load_fail_counts():
+    """聚合过滤的连续失败计数 {url: 次数}"""
+    db = _db()
+    if db is not None:
+        try:
+            return db.get_probe_fail_counts()
+        except Exception:
+            return {}
+    with _memory_lock:
+        return {u: row['fail_count'] for u, row in _memory.items() if row.get('fail_count')}
+
+
+def save_fail_counts(counts):
+    """整体替换连续失败计数（counts 之外的 URL 清零）"""
+    db = _db()
+    if db is not None:
+        try:
+            db.save_probe_fail_counts(counts)
+        except Exception as e:
+            _logger.warning(f"保存探测失败计数出错: {str(e)}")
+        return
+    with _memory_lock:
+        for row in _memory.values():
+            row['fail_count'] = 0
+        for url, count in counts.items():
+            _memory.setdefault(url, {'url': url})['fail_count'] = count
+
+
+def migrate_legacy_fail_counts(path=STREAM_FAILURES_PATH):
+    """
+    旧版 stream_failures.json 的连续失败计数一次性并入管理库（升级前差一轮就要被丢弃的频道
+    不因换存储被清零）；同一 URL 库里已有计数时以库为准。迁移后删除旧文件，可重复调用。
+    管理库不可用时不迁移、保留文件（进程内兜底本就不跨进程持久化）
+    :return: 迁入的 URL 数
+    """
+    if not os.path.exists(path):
+        return 0
+    db = _db()
+    if db is None:
+        return 0
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            legacy = json.load(f)
+    except (OSError, ValueError) as e:
+        _logger.warning(f"读取旧失败计数文件出错，跳过迁移: {str(e)}")
+        return 0
+    counts = {url: count for url, count in legacy.items()
+              if isinstance(count, int) and count > 0} if isinstance(legacy, dict) else {}
+    if counts:
+        db.save_probe_fail_counts({**counts, **db.get_probe_fail_counts()})
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass  # 其它 worker 已迁移
+    _logger.info(f"旧失败计数已迁入探测结果存储：{len(counts)} 个 URL")
+    return len(counts)
+
+
+def reset():
+    """清空进程内兜底表（测试用）"""
+    with _memory_lock:
+        _memory.clear()
@@ -1,7 +1,22 @@
 """流地址可达性探测（monitor 严格版与聚合宽松版共用单实现）"""
-import requests
+import asyncio
+import time
+import urllib.request
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlsplit
 
-from config import STREAM_PROBE_TIMEOUT, STREAM_USER_AGENT
+from requests.utils import requote_uri
+
+from config import FILTER_PROBE_CONCURRENCY, STREAM_PROBE_TIMEOUT, STREAM_USER_AGENT
+from core import http_client
+
+# 探测响应体不超过此长度时读完再释放（连接可回池复用）；更长则直接断开
+_DRAIN_LIMIT = 64 * 1024
+
+# 批量探测单条结果：ok 是否可达；status 最终响应状态码（连接失败为 None）；
+# latency 发起请求到收到最终响应头的耗时（秒，连接失败为 None）
+ProbeResult = namedtuple('ProbeResult', ['ok', 'status', 'latency'])
 
 
 def _probe_timeout():
@@ -13,6 +28,23 @@ def _probe_timeout():
         return STREAM_PROBE_TIMEOUT
 
 
+def _drain_small_body(r):
+    """
+    响应体较小（如服务端遵守 Range 的 206、错误页）时读完剩余部分，
+    使 keep-alive 连接回池供同主机下一条探测复用；无长度/较大的直播流不读，直接断开
+    """
+    try:
+        length = int(r.headers.get('Content-Length', ''))
+    except ValueError:
+        return
+    if length <= _DRAIN_LIMIT:
+        try:
+            for _ in r.iter_content(16 * 1024):
+                pass
+        except Exception:
+            pass  # 读不完就随 close 断开，不影响探测结论
+
+
 def probe_stream(url, accept_403=False, user_agent=None, timeout=None):
     """
     探测单个流地址可达性：GET + Range 请求读少量字节即断开
@@ -27,21 +59,439 @@ def probe_stream(url, accept_403=False, user_agent=None, timeout=None):
     :return: True 可达 / False 不可达
     """
     timeout = timeout if timeout is not None else _probe_timeout()
+    return _probe_sync(url, accept_403, user_agent, timeout).ok
+
+
+def _probe_sync(url, accept_403, user_agent, timeout):
+    """requests 单条探测 → ProbeResult（probe_stream 与走代理的批量探测共用）"""
+    started = time.monotonic()
     r = None
     try:
-        r = requests.get(
-            url, timeout=timeout, stream=True,
+        r = http_client.get(
+            url, preset='probe', timeout=timeout, stream=True,
             headers={'Range': 'bytes=0-1024',
                      'User-Agent': user_agent or STREAM_USER_AGENT},
         )
+        latency = round(time.monotonic() - started, 3)
         if r.status_code in (200, 206) or (accept_403 and r.status_code == 403):
             try:
-                return bool(next(r.iter_content(1024)))
+                ok = bool(next(r.iter_content(1024)))
             except StopIteration:
-                return False
-        return False
+                return ProbeResult(False, r.status_code, latency)
+            _drain_small_body(r)
+            return ProbeResult(ok, r.status_code, latency)
+        _drain_small_body(r)
+        return ProbeResult(False, r.status_code, latency)
     except Exception:
+        return ProbeResult(False, r.status_code if r is not None else None, None)
+    finally:
+        if r is not None:
+            try:
+                r.close()
+            except Exception:
+                pass
+
+
+def _uses_proxy(url, proxies):
+    """
+    该地址是否需经环境代理（HTTP(S)_PROXY / ALL_PROXY，NO_PROXY 排除）访问：
+    asyncio 直连探测不支持代理，这类地址改走 requests（与其它上游请求同样读取环境代理）
+    """
+    if not proxies:
         return False
+    parts = urlsplit(url)
+    if not (proxies.get(parts.scheme.lower()) or proxies.get('all')):
+        return False
+    try:
+        return not urllib.request.proxy_bypass(parts.hostname or '')
+    except Exception:
+        return True
+
+
+def _split_proxied(urls):
+    """按是否走代理拆分下标：(直连下标列表, 代理下标列表)"""
+    proxies = urllib.request.getproxies()
+    direct, proxied = [], []
+    for index, url in enumerate(urls):
+        (proxied if _uses_proxy(url, proxies) else direct).append(index)
+    return direct, proxied
+
+
+def _run_threaded(func, items, concurrency):
+    """代理路径的同步请求放线程池并发（代理场景一般地址不多）"""
+    if not items:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(items)))) as executor:
+        return list(executor.map(func, items))
+
+
+# ---------------------------------------------------------------- 批量异步探测
+# 聚合过滤/监控轮次一次探测数百上千条 URL：改用单线程 asyncio 协程并发，
+# 并发数只受信号量约束，不再按并发数开线程。判定口径与 probe_stream 完全一致：
+# GET + Range bytes=0-1024，200/206（宽松口径另加 403）且读到首个非空数据块才算可达；
+# 跟随重定向；同一轮内同主机的小响应连接回池复用。
+# 协程直连不支持代理：配置了 HTTP(S)_PROXY / ALL_PROXY 且未被 NO_PROXY 排除的地址
+# 改走 requests（_probe_sync / _measure_sync，线程池并发），判定口径不变。
+
+_MAX_REDIRECTS = 10
+_REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+_MAX_HEADER_BYTES = 64 * 1024
+
+
+class _ConnPool:
+    """单轮探测内的 keep-alive 连接池 {(scheme, host, port): [(reader, writer), ...]}"""
+
+    def __init__(self):
+        self._idle = {}
+
+    def take(self, key):
+        conns = self._idle.get(key)
+        while conns:
+            reader, writer = conns.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer
+        return None
+
+    def put(self, key, conn):
+        self._idle.setdefault(key, []).append(conn)
+
+    def close_all(self):
+        for conns in self._idle.values():
+            for _reader, writer in conns:
+                writer.close()
+        self._idle.clear()
+
+
+def _ssl_context():
+    """与 requests 同源的 CA 证书（certifi）"""
+    import ssl
+    import requests.certs
+    return ssl.create_default_context(cafile=requests.certs.where())
+
+
+async def _open(key, timeout, ssl_ctx):
+    scheme, host, port = key
+    return await asyncio.wait_for(
+        asyncio.open_connection(host, port, ssl=ssl_ctx if scheme == 'https' else None,
+                                server_hostname=host if scheme == 'https' else None,
+                                limit=_MAX_HEADER_BYTES),
+        timeout)
+
+
+async def _read_head(reader, timeout):
+    """读取状态行与响应头 → (版本, 状态码, {小写头名: 值})"""
+    raw = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout)
+    lines = raw.decode('latin-1').split('\r\n')
+    version, status = lines[0].split(' ', 2)[:2]
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+    return version, int(status), headers
+
+
+async def _first_chunk(reader, headers, timeout):
+    """
+    读取响应体首个非空数据块（对应 requests 的 next(iter_content(1024))）
+    :return: (是否读到数据, 连接能否回池复用)
+    """
+    if 'chunked' in headers.get('transfer-encoding', '').lower():
+        size_line = await asyncio.wait_for(reader.readline(), timeout)
+        size = int(size_line.split(b';', 1)[0].strip() or b'0', 16)
+        if size == 0:
+            return False, False
+        data = await asyncio.wait_for(reader.read(min(size, 1024)), timeout)
+        return bool(data), False
+    length = headers.get('content-length')
+    if length is not None:
+        length = int(length)
+        if length == 0:
+            return False, True
+        if length <= _DRAIN_LIMIT:
+            # 小响应体读完：连接可回池
+            await asyncio.wait_for(reader.readexactly(length), timeout)
+            return True, True
+        data = await asyncio.wait_for(reader.read(1024), timeout)
+        return bool(data), False
+    # 无长度：读到连接关闭为止的流，取首块即可
+    data = await asyncio.wait_for(reader.read(1024), timeout)
+    return bool(data), False
+
+
+async def _request(url, user_agent, timeout, pool, ssl_ctx, range_header):
+    """
+    发 GET（含重定向跟随，重定向响应的连接按需回池）
+    :return: (连接 key, reader, writer, 状态码, 响应头, keep_alive)；地址非法返回 None
+    """
+    for _ in range(_MAX_REDIRECTS + 1):
+        parts = urlsplit(requote_uri(url))
+        scheme = parts.scheme.lower()
+        if scheme not in ('http', 'https') or not parts.hostname:
+            return None
+        port = parts.port or (443 if scheme == 'https' else 80)
+        key = (scheme, parts.hostname, port)
+        host_header = parts.netloc.rsplit('@', 1)[-1]
+        target = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+        request = (f'GET {target} HTTP/1.1\r\n'
+                   f'Host: {host_header}\r\n'
+                   f'User-Agent: {user_agent or STREAM_USER_AGENT}\r\n'
+                   f'Range: {range_header}\r\n'
+                   f'Accept: */*\r\n'
+                   f'Accept-Encoding: identity\r\n'
+                   f'Connection: keep-alive\r\n\r\n').encode('latin-1', 'replace')
+
+        conn = pool.take(key)
+        reused = conn is not None
+        if conn is None:
+            conn = await _open(key, timeout, ssl_ctx)
+        reader, writer = conn
+        try:
+            writer.write(request)
+            await asyncio.wait_for(writer.drain(), timeout)
+            version, status, headers = await _read_head(reader, timeout)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            writer.close()
+            if not reused:
+                raise
+            # 复用的空闲连接已被对端关闭：新建连接重发一次
+            reader, writer = await _open(key, timeout, ssl_ctx)
+            writer.write(request)
+            await asyncio.wait_for(writer.drain(), timeout)
+            version, status, headers = await _read_head(reader, timeout)
+
+        keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+        if status in _REDIRECT_STATUSES and headers.get('location'):
+            # 重定向响应体按长度丢弃后回池；否则断开
+            reusable = False
+            if keep_alive and 'content-length' in headers:
+                length = int(headers['content-length'])
+                if length <= _DRAIN_LIMIT:
+                    await asyncio.wait_for(reader.readexactly(length), timeout)
+                    reusable = True
+            if reusable:
+                pool.put(key, (reader, writer))
+            else:
+                writer.close()
+            url = urljoin(url, headers['location'])
+            continue
+        return key, reader, writer, status, headers, keep_alive
+    raise ConnectionError('重定向次数过多')
+
+
+async def _probe_async(url, accept_403, user_agent, timeout, pool, ssl_ctx):
+    """单条异步探测（含重定向跟随）→ ProbeResult；任何异常视为不可达"""
+    started = time.monotonic()
+    status = latency = None
+    try:
+        response = await _request(url, user_agent, timeout, pool, ssl_ctx, 'bytes=0-1024')
+        if response is None:
+            return ProbeResult(False, None, None)
+        key, reader, writer, status, headers, keep_alive = response
+        latency = round(time.monotonic() - started, 3)
+        if status in (200, 206) or (accept_403 and status == 403):
+            ok, reusable = await _first_chunk(reader, headers, timeout)
+        else:
+            ok, reusable = False, False
+        if reusable and keep_alive:
+            pool.put(key, (reader, writer))
+        else:
+            writer.close()
+        return ProbeResult(ok, status, latency)
+    except Exception:
+        return ProbeResult(False, status, latency)
+
+
+async def _probe_batch(urls, accept_403, user_agent, timeout, concurrency):
+    pool = _ConnPool()
+    ssl_ctx = _ssl_context()
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(url):
+        async with semaphore:
+            # 整体兜底超时：防止慢速滴灌式响应在逐段超时下无限拖延
+            try:
+                return await asyncio.wait_for(
+                    _probe_async(url, accept_403, user_agent, timeout, pool, ssl_ctx),
+                    timeout * 3)
+            except asyncio.TimeoutError:
+                return ProbeResult(False, None, None)
+
+    try:
+        return await asyncio.gather(*(run(u) for u in urls))
+    finally:
+        pool.close_all()
+
+
+def probe_many(urls, accept_403=False, user_agent=None, timeout=None, concurrency=None,
+               details=False):
+    """
+    批量探测流地址可达性（asyncio 协程并发，单线程）
+    :param urls: 流地址列表
+    :param accept_403: 同 probe_stream（宽松口径 403 算可达）
+    :param user_agent: 同 probe_stream
+    :param timeout: 连接/单次读取超时（秒），默认动态读 settings
+    :param concurrency: 同时在途探测数，默认 FILTER_PROBE_CONCURRENCY
+    :param details: True 时返回 ProbeResult 列表（含状态码与耗时，供探测结果存储）
+    :return: 与 urls 顺序一致的 bool 列表（details=True 时为 ProbeResult 列表）
+    """
+    urls = list(urls)
+    if not urls:
+        return []
+    timeout = timeout if timeout is not None else _probe_timeout()
+    concurrency = concurrency or FILTER_PROBE_CONCURRENCY
+    direct, proxied = _split_proxied(urls)
+    results = [None] * len(urls)
+    if direct:
+        direct_results = asyncio.run(_probe_batch([urls[i] for i in direct], accept_403, user_agent,
+                                                  timeout, concurrency))
+        for index, result in zip(direct, direct_results):
+            results[index] = result
+    proxied_results = _run_threaded(lambda u: _probe_sync(u, accept_403, user_agent, timeout),
+                                    [urls[i] for i in proxied], concurrency)
+    for index, result in zip(proxied, proxied_results):
+        results[index] = result
+    if details:
+        return list(results)
+    return [r.ok for r in results]
+
+
+# ---------------------------------------------------------------- 测速采样
+# 候选择优（core/ranking.py）用：除可达性外再测首字节耗时（TTFB）与一小段下载速率。
+# 请求头同探测（Range 只要前 sample_bytes 字节），读满 sample_bytes / 读到末尾 /
+# 超过 sample_seconds 即停；连接不回池（已读位置不确定）。
+
+# 测速结果：ok 是否读到数据（200/206；accept_403 时 403 也算可达，但无速率样本）；status 最终状态码；
+# ttfb 发起请求到收到响应头（秒）；rate 采样下载速率（字节/秒，数据太少无法计时为 None）
+Measurement = namedtuple('Measurement', ['ok', 'status', 'ttfb', 'rate'])
+
+
+async def _read_sample(reader, headers, timeout, sample_bytes, deadline):
+    """读取响应体样本，返回读到的字节数（分块编码按原始字节计，仅用于估算速率）"""
+    length = headers.get('content-length')
+    limit = min(sample_bytes, int(length)) if length is not None else sample_bytes
+    total = 0
+    loop = asyncio.get_running_loop()
+    while total < limit:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        try:
+            data = await asyncio.wait_for(reader.read(min(16 * 1024, limit - total)),
+                                          min(timeout, remaining))
+        except asyncio.TimeoutError:
+            break
+        if not data:
+            break
+        total += len(data)
+    return total
+
+
+async def _measure_async(url, accept_403, user_agent, timeout, sample_bytes, sample_seconds, pool, ssl_ctx):
+    """单条测速 → Measurement；任何异常视为不可达"""
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    status = ttfb = None
+    try:
+        response = await _request(url, user_agent, timeout, pool, ssl_ctx,
+                                  f'bytes=0-{sample_bytes - 1}')
+        if response is None:
+            return Measurement(False, None, None, None)
+        _key, reader, writer, status, headers, _keep_alive = response
+        head_at = loop.time()
+        ttfb = round(head_at - started, 3)
+        try:
+            if status not in (200, 206):
+                return Measurement(accept_403 and status == 403, status, ttfb, None)
+            total = await _read_sample(reader, headers, timeout, sample_bytes,
+                                       head_at + sample_seconds)
+        finally:
+            writer.close()
+        elapsed = loop.time() - head_at
+        rate = round(total / elapsed) if total and elapsed >= 0.01 else None
+        return Measurement(total > 0, status, ttfb, rate)
+    except Exception:
+        return Measurement(False, status, ttfb, None)
+
+
+async def _measure_batch(urls, accept_403, user_agent, timeout, sample_bytes, sample_seconds, concurrency):
+    pool = _ConnPool()
+    ssl_ctx = _ssl_context()
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(url):
+        async with semaphore:
+            try:
+                return await asyncio.wait_for(
+                    _measure_async(url, accept_403, user_agent, timeout, sample_bytes,
+                                   sample_seconds, pool, ssl_ctx),
+                    timeout * 2 + sample_seconds)
+            except asyncio.TimeoutError:
+                return Measurement(False, None, None, None)
+
+    try:
+        return await asyncio.gather(*(run(u) for u in urls))
+    finally:
+        pool.close_all()
+
+
+def measure_many(urls, sample_bytes, sample_seconds, accept_403=False, user_agent=None, timeout=None,
+                 concurrency=None):
+    """
+    批量测速（asyncio 协程并发，单线程）
+    :param urls: 流地址列表
+    :param sample_bytes: 每条最多读取的样本字节数
+    :param sample_seconds: 每条读样本的最长时间（秒，不含 TTFB）
+    :param accept_403: 同 probe_stream（宽松口径 403 算可达，不采样速率）
+    :param user_agent: 同 probe_stream
+    :param timeout: 连接/单次读取超时（秒），默认动态读 settings
+    :param concurrency: 同时在途数，默认 FILTER_PROBE_CONCURRENCY
+    :return: 与 urls 顺序一致的 Measurement 列表
+    """
+    urls = list(urls)
+    if not urls:
+        return []
+    timeout = timeout if timeout is not None else _probe_timeout()
+    concurrency = concurrency or FILTER_PROBE_CONCURRENCY
+    direct, proxied = _split_proxied(urls)
+    results = [None] * len(urls)
+    if direct:
+        direct_results = asyncio.run(_measure_batch([urls[i] for i in direct], accept_403, user_agent,
+                                                    timeout, sample_bytes, sample_seconds, concurrency))
+        for index, result in zip(direct, direct_results):
+            results[index] = result
+    proxied_results = _run_threaded(
+        lambda u: _measure_sync(u, accept_403, user_agent, timeout, sample_bytes, sample_seconds),
+        [urls[i] for i in proxied], concurrency)
+    for index, result in zip(proxied, proxied_results):
+        results[index] = result
+    return results
+
+
+def _measure_sync(url, accept_403, user_agent, timeout, sample_bytes, sample_seconds):
+    """requests 单条测速 → Measurement（走环境代理的地址用，口径同 _measure_async）"""
+    started = time.monotonic()
+    r = None
+    try:
+        r = http_client.get(
+            url, preset='probe', timeout=timeout, stream=True,
+            headers={'Range': f'bytes=0-{sample_bytes - 1}',
+                     'User-Agent': user_agent or STREAM_USER_AGENT},
+        )
+        head_at = time.monotonic()
+        ttfb = round(head_at - started, 3)
+        if r.status_code not in (200, 206):
+            return Measurement(accept_403 and r.status_code == 403, r.status_code, ttfb, None)
+        total = 0
+        for chunk in r.raw.stream(16 * 1024, decode_content=False):
+            total += len(chunk)
+            if total >= sample_bytes or time.monotonic() - head_at >= sample_seconds:
+                break
+        elapsed = time.monotonic() - head_at
+        rate = round(total / elapsed) if total and elapsed >= 0.01 else None
+        return Measurement(total > 0, r.status_code, ttfb, rate)
+    except Exception:
+        return Measurement(False, r.status_code if r is not None else None, None, None)
     finally:
         if r is not None:
             try:
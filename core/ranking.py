@@ -0,0 +1,145 @@
+"""公开源候选测速择优：同台保留前 N 个候选，实测首字节耗时与下载速率后择优选可达地址
+
+原先 pick_best_public 只按地址启发式（域名 > IP > 运营商前缀）与名称里的分辨率
+每台选一个地址，filter_unreachable 只探测这一个——它若失效，即使别的源里同台地址能用，
+这个频道也会连续两轮后消失。本模块：
+- group_candidates：同台按 (地址质量分, 分辨率) 降序取前 RANK_TOP_N 个不同地址
+- rank_public：全部候选一次并发测速（probing.measure_many，可达口径同聚合过滤的宽松口径，
+  403 算可达），每台在可达候选中按 _rank_key 择优：分辨率优先（RANK_PREFER_RESOLUTION），
+  同分辨率内实测拉到数据的优先于 403，再比代价；代价 = TTFB + 按采样速率下载 RANK_SAMPLE_BYTES 的预计耗时
+- 全部候选都测不通时：沿用上轮胜出地址（仍在候选中时），否则退回启发式第一名，
+  交给 filter_unreachable 按连续失败轮数决定去留
+- 测速可达的地址写入探测结果存储（宽松口径），随后的 filter_unreachable 直接沿用不再复探
+- 每轮排名（各候选实测值与胜出地址）原子写入 CHANNEL_RANKINGS_PATH，跨轮沿用
+- 其余实测可达的候选按同一顺序记入胜出频道的 backup_urls（故障切换输出用）
+"""
+import json
+import os
+import time
+
+from config import (CHANNEL_RANKINGS_PATH, FILTER_UNREACHABLE, RANK_PREFER_RESOLUTION,
+                    RANK_SAMPLE_BYTES, RANK_SAMPLE_SECONDS, RANK_TOP_N, STREAM_PROBE_UA_LOOSE)
+from core import probe_store
+from core.atomic_io import atomic_write_text
+from core.logger import get_logger
+from core.probing import ProbeResult, measure_many
+from core.sources import SourceUtils
+
+_logger = get_logger('ranking')
+
+
+def group_candidates(public_channels, top_n):
+    """
+    按台分组并按启发式排序取前 top_n 个候选（同地址只保留一个）
+    :param public_channels: 已过滤+中文化的公开源频道
+    :param top_n: 每台候选数上限
+    :return: {key: [(频道, 地址质量分, 分辨率), ...]}（按启发式降序；同分保持出现顺序）
+    """
+    groups = {}
+    for ch in public_channels:
+        key = SourceUtils.normalize_name(ch["name"])
+        groups.setdefault(key, []).append(
+            (ch, SourceUtils.score_url(ch["url"]), ch.get("_resolution", 0)))
+    result = {}
+    for key, items in groups.items():
+        items.sort(key=lambda item: (item[1], item[2]), reverse=True)
+        seen = set()
+        picked = []
+        for item in items:
+            if item[0]["url"] in seen:
+                continue
+            seen.add(item[0]["url"])
+            picked.append(item)
+            if len(picked) >= top_n:
+                break
+        result[key] = picked
+    return result
+
+
+def _cost(measurement):
+    """测速代价（秒，越小越快）：TTFB + 按采样速率下载 RANK_SAMPLE_BYTES 的预计耗时"""
+    if measurement.rate:
+        return measurement.ttfb + RANK_SAMPLE_BYTES / measurement.rate
+    return measurement.ttfb
+
+
+def _rank_key(item, measurement):
+    """
+    可达候选排序键（越小越优）：
+    分辨率降序（RANK_PREFER_RESOLUTION 时）→ 实测拉到数据的优先于 403（宽松口径可达但未采样）→ 测速代价
+    """
+    resolution = -item[2] if RANK_PREFER_RESOLUTION else 0
+    return resolution, measurement.status == 403, _cost(measurement)
+
+
+def load_rankings():
+    """读取上轮排名 {key: {winner, measured_at, candidates}}；文件不存在或损坏返回空 dict"""
+    try:
+        if os.path.exists(CHANNEL_RANKINGS_PATH):
+            with open(CHANNEL_RANKINGS_PATH, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+                return data if isinstance(data, dict) else {}
+    except Exception as e:
+        _logger.warning(f"读取候选排名出错: {str(e)}")
+    return {}
+
+
+def _save_rankings(rankings):
+    """保存本轮排名（原子写入）"""
+    try:
+        atomic_write_text(CHANNEL_RANKINGS_PATH, json.dumps(rankings, ensure_ascii=False, indent=2))
+    except Exception as e:
+        _logger.warning(f"保存候选排名出错: {str(e)}")
+
+
+def rank_public(public_channels):
+    """
+    公开源同台择优（候选测速版）
+    :param public_channels: 已过滤+中文化的公开源频道
+    :return: key -> (频道, 地址质量分, 分辨率) 的 dict（与 pick_best_public 同形）
+    """
+    top_n = RANK_TOP_N if FILTER_UNREACHABLE else 1
+    groups = group_candidates(public_channels, max(1, top_n))
+    if top_n <= 1:
+        return {key: items[0] for key, items in groups.items()}
+
+    urls = list(dict.fromkeys(item[0]["url"] for items in groups.values() for item in items))
+    measured = dict(zip(urls, measure_many(urls, RANK_SAMPLE_BYTES, RANK_SAMPLE_SECONDS,
+                                           accept_403=True, user_agent=STREAM_PROBE_UA_LOOSE)))
+    reachable = [u for u in urls if measured[u].ok]
+    probe_store.record(reachable, [ProbeResult(True, measured[u].status, measured[u].ttfb)
+                                   for u in reachable], 'loose')
+
+    previous = load_rankings()
+    now = time.time()
+    best = {}
+    rankings = {}
+    switched = 0
+    for key, items in groups.items():
+        ok_items = sorted((item for item in items if measured[item[0]["url"]].ok),
+                          key=lambda item: _rank_key(item, measured[item[0]["url"]]))
+        if ok_items:
+            winner = ok_items[0]
+        else:
+            last = (previous.get(key) or {}).get('winner')
+            winner = next((item for item in items if item[0]["url"] == last), items[0])
+        if winner is not items[0]:
+            switched += 1
+        # 其余实测可达的候选按同一顺序作为备用地址（故障切换输出用，见 FAILOVER_MODE）
+        backups = [item[0]["url"] for item in ok_items if item is not winner]
+        if backups:
+            winner = (dict(winner[0], backup_urls=backups),) + winner[1:]
+        best[key] = winner
+        rankings[key] = {
+            'winner': winner[0]["url"],
+            'measured_at': round(now),
+            'candidates': [
+                {'url': item[0]["url"], 'score': item[1], 'resolution': item[2],
+                 **measured[item[0]["url"]]._asdict()}
+                for item in items
+            ],
+        }
+    _save_rankings(rankings)
+    _logger.info(f"候选测速：{len(groups)} 个频道共 {len(urls)} 个候选，"
+                 f"{len(reachable)} 个可达，{switched} 个频道改选实测更优的候选")
+    return best
@@ -0,0 +1,218 @@
+"""B 站分片缓存：同一 (房间, 分片) 的并发请求合并为一次上游拉取
+
+代理模式（BILIBILI_DIRECT_SEGMENTS=False）下，同房间的每个观众都会请求同一批 .ts 分片。
+本模块按 (room_id, seg_path) 单飞（single-flight）：
+- 首个请求启动后台线程向上游拉取，边收边把数据块追加到缓存条目；
+- 后到的请求复用同一条目，从头读已缓存的块，并等待后续块到达（流式转发，不必等整片下完）；
+- 每个房间只保留最近 BILIBILI_SEGMENT_CACHE_PER_ROOM 个分片（HLS 滑动窗口前移即淘汰），
+  房间数超 BILIBILI_SEGMENT_CACHE_ROOMS 时整体淘汰最久未访问的房间。
+上游拉取失败的条目立即移出缓存（下个请求重新拉），不缓存错误。
+后台线程与客户端连接解耦：首个观众中途断开，其余观众的转发不受影响。
+缓存与单飞都在进程内存里：多 gunicorn worker 时同一分片最多被每个 worker 各拉一次
+（N 个 worker 最多 N 次上游请求）；需要跨 worker 合并时在前置 nginx 开 proxy_cache_lock
+（示例见 docker/nginx.conf.example），或用 BILIBILI_DIRECT_SEGMENTS 让播放器直连 CDN。
+
+转发名额（acquire_stream / StreamSlot）：gthread/gevent worker 下每条分片流在整个下载期间
+占用一个线程（协程），本进程同时转发数超过 SEGMENT_STREAM_LIMIT 时新分片请求直接 503，
+给播放列表 / EPG 等短请求留出余量，不会被长连接饿死。
+"""
+import threading
+from collections import OrderedDict
+
+from config import (BILIBILI_SEGMENT_CACHE_PER_ROOM, BILIBILI_SEGMENT_CACHE_ROOMS,
+                    BILIBILI_SEGMENT_WAIT_TIMEOUT, SEGMENT_STREAM_LIMIT)
+from core.logger import get_logger
+
+_logger = get_logger('segment_cache')
+
+# 分片缓存 {room_id: OrderedDict{seg_path: _SegmentEntry}}，房间与分片均按最近访问排序
+_rooms = OrderedDict()
+_rooms_lock = threading.Lock()
+# 本进程正在转发的分片流数（上限 SEGMENT_STREAM_LIMIT，0=不限）
+_active_streams = 0
+_streams_lock = threading.Lock()
+
+
+class _SegmentEntry:
+    """单个分片的拉取状态与已收数据块（由后台线程写入，多个读者共享）"""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.status = None      # 上游状态码（None=响应头未到）
+        self.headers = None     # 透传响应头（None=失败）
+        self.chunks = []        # 已收数据块
+        self.done = False       # 上游数据已收完（或中途出错）
+
+    def wait_headers(self, timeout):
+        """等待上游响应头（状态码）就绪；超时返回 False"""
+        with self.cond:
+            return self.cond.wait_for(lambda: self.status is not None, timeout=timeout)
+
+    def iter_chunks(self, timeout):
+        """从头读取数据块，读到末尾时等待新块，直到上游收完或等待超时"""
+        index = 0
+        while True:
+            with self.cond:
+                ready = self.cond.wait_for(
+                    lambda: index < len(self.chunks) or self.done, timeout=timeout)
+                if not ready:
+                    _logger.warning("等待上游分片数据超时，提前结束转发")
+                    return
+                pending = self.chunks[index:]
+                finished = self.done
+            for chunk in pending:
+                yield chunk
+            index += len(pending)
+            if finished and not pending:
+                return
+
+
+def _room_segments(room_id):
+    """取房间的分片表（不存在则创建；调用方须持有 _rooms_lock）"""
+    segments = _rooms.get(room_id)
+    if segments is None:
+        segments = OrderedDict()
+        _rooms[room_id] = segments
+        while len(_rooms) > BILIBILI_SEGMENT_CACHE_ROOMS:
+            _rooms.popitem(last=False)
+    else:
+        _rooms.move_to_end(room_id)
+    return segments
+
+
+def _discard(room_id, seg_path, entry):
+    """把失败条目移出缓存（仅当缓存里仍是该条目时）"""
+    with _rooms_lock:
+        segments = _rooms.get(room_id)
+        if segments is not None and segments.get(seg_path) is entry:
+            del segments[seg_path]
+
+
+def _fill(room_id, seg_path, entry, fetcher):
+    """后台线程：调用 fetcher 拉上游，把响应头与数据块写入条目"""
+    try:
+        status, headers, chunks = fetcher()
+    except Exception as e:
+        _logger.warning(f"拉取分片出错(room={room_id}, seg={seg_path}): {str(e)}")
+        status, headers, chunks = 500, None, None
+    with entry.cond:
+        entry.status = status
+        entry.headers = headers
+        if headers is None:
+            entry.done = True
+        entry.cond.notify_all()
+    if headers is None:
+        _discard(room_id, seg_path, entry)
+        return
+    failed = False
+    try:
+        for chunk in chunks:
+            if not chunk:
+                continue
+            with entry.cond:
+                entry.chunks.append(chunk)
+                entry.cond.notify_all()
+    except Exception as e:
+        failed = True
+        _logger.warning(f"分片传输中断(room={room_id}, seg={seg_path}): {str(e)}")
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close:
+            try:
+                close()
+            except Exception:
+                pass
+        with entry.cond:
+            entry.done = True
+            entry.cond.notify_all()
+    if failed:
+        # 不完整的分片不留给后来者
+        _discard(room_id, seg_path, entry)
+
+
+def fetch(room_id, seg_path, fetcher):
+    """
+    取分片（并发请求合并为一次上游拉取）
+    :param room_id: 直播间房间号
+    :param seg_path: 分片相对路径
+    :param fetcher: 无参函数，向上游拉取分片，返回 (status_code, headers, 数据块迭代器)；
+                    失败返回 (status_code, None, None)
+    :return: (status_code, headers dict, 流式迭代器) 或 (status_code, None, None)
+    """
+    with _rooms_lock:
+        segments = _room_segments(room_id)
+        entry = segments.get(seg_path)
+        leader = entry is None
+        if leader:
+            entry = _SegmentEntry()
+            segments[seg_path] = entry
+            while len(segments) > BILIBILI_SEGMENT_CACHE_PER_ROOM:
+                segments.popitem(last=False)
+        else:
+            segments.move_to_end(seg_path)
+    if leader:
+        threading.Thread(target=_fill, args=(room_id, seg_path, entry, fetcher),
+                         name=f"segment-{room_id}", daemon=True).start()
+
+    if not entry.wait_headers(BILIBILI_SEGMENT_WAIT_TIMEOUT):
+        return 504, None, None
+    if entry.headers is None:
+        return entry.status, None, None
+    return entry.status, dict(entry.headers), entry.iter_chunks(BILIBILI_SEGMENT_WAIT_TIMEOUT)
+
+
+def acquire_stream():
+    """占用一个转发名额；已达 SEGMENT_STREAM_LIMIT 返回 False（调用方应答 503）"""
+    global _active_streams
+    with _streams_lock:
+        if SEGMENT_STREAM_LIMIT and _active_streams >= SEGMENT_STREAM_LIMIT:
+            return False
+        _active_streams += 1
+        return True
+
+
+def release_stream():
+    """归还一个转发名额"""
+    global _active_streams
+    with _streams_lock:
+        _active_streams = max(0, _active_streams - 1)
+
+
+def active_streams():
+    """本进程正在转发的分片流数（诊断用）"""
+    with _streams_lock:
+        return _active_streams
+
+
+class StreamSlot:
+    """占用转发名额的分片流：WSGI 服务器关闭响应（转发完 / 客户端断开）时归还名额（只归还一次）"""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._lock = threading.Lock()
+        self._released = False
+
+    def __iter__(self):
+        return iter(self._chunks)
+
+    def close(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        release_stream()
+        close = getattr(self._chunks, 'close', None)
+        if close:
+            close()
+
+
+def clear():
+    """清空全部分片缓存（测试用）"""
+    with _rooms_lock:
+        _rooms.clear()
+
+
+def cached_segments(room_id):
+    """房间当前缓存的分片路径（按访问先后，诊断用）"""
+    with _rooms_lock:
+        return list(_rooms.get(room_id) or ())
@@ -0,0 +1,71 @@
+"""播放列表快照：聚合落盘时一次性预编码（UTF-8 / gzip / deflate）+ 强 ETag + Last-Modified
+
+/api/live.m3u8 被数百台盒子每隔几分钟轮询，绝大多数轮询时内容并未变化。
+快照在聚合落盘时发布一次（不可变对象，发布即整体替换引用），请求路径只做
+条件判断（304）与编码协商，不读盘、不重复编码/压缩。
+"""
+import gzip
+import hashlib
+import time
+import zlib
+from collections import namedtuple
+
+# 支持的内容编码（不含 brotli：标准库无实现，盒子端普遍只认 gzip/deflate）
+SNAPSHOT_ENCODINGS = ('gzip', 'deflate')
+
+
+class PlaylistSnapshot(namedtuple('PlaylistSnapshot', [
+        'text', 'body', 'gzip_body', 'deflate_body', 'etag', 'last_modified'])):
+    """
+    不可变播放列表快照：
+    - text：原始 m3u 文本（监控/管理端解析用）
+    - body / gzip_body / deflate_body：三种预编码字节
+    - etag：内容哈希（不带引号；各编码变体另加后缀，见 variant_etag）
+    - last_modified：发布时间（epoch 秒，HTTP 日期精度为秒）
+    """
+    __slots__ = ()
+
+    @classmethod
+    def build(cls, text, last_modified=None):
+        """
+        由 m3u 文本构建快照（一次性完成全部编码）
+        :param text: m3u 文本
+        :param last_modified: 内容修改时间（epoch 秒），默认当前时间
+        :return: PlaylistSnapshot
+        """
+        body = text.encode('utf-8')
+        return cls(
+            text=text,
+            body=body,
+            # mtime=0：同内容压缩结果逐字节稳定（变体 ETag 才能长期有效）
+            gzip_body=gzip.compress(body, compresslevel=9, mtime=0),
+            # HTTP 的 deflate 即 zlib 格式（RFC 1950），不是裸 deflate 流
+            deflate_body=zlib.compress(body, 9),
+            etag=hashlib.sha1(body).hexdigest(),
+            last_modified=int(last_modified if last_modified is not None else time.time()),
+        )
+
+    def variant(self, coding):
+        """按内容编码取对应字节（None/identity 返回原文字节）"""
+        if coding == 'gzip':
+            return self.gzip_body
+        if coding == 'deflate':
+            return self.deflate_body
+        return self.body
+
+    def variant_etag(self, coding):
+        """各编码变体的强 ETag（字节不同则 ETag 必须不同）"""
+        if coding == 'gzip':
+            return f"{self.etag}-gz"
+        if coding == 'deflate':
+            return f"{self.etag}-df"
+        return self.etag
+
+    def all_etags(self):
+        """全部变体 ETag（If-None-Match 命中任一即内容未变）"""
+        return [self.variant_etag(c) for c in (None,) + SNAPSHOT_ENCODINGS]
+
+    @property
+    def channel_count(self):
+        """频道数（EXTINF 条目数）"""
+        return self.text.count('#EXTINF')
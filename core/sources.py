@@ -1,35 +1,172 @@
 """公开源处理：m3u 拉取/解析、地址质量评分、频道过滤与中文化"""
+import functools
+import hashlib
+import io
+import json
+import os
 import re
-
-import requests
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from config import (CARRIER_IP_PREFIXES, CCTV_NAME_MAP, DEFAULT_GROUP_NAME,
-                    PUBLIC_M3U_SOURCES, SIGN_PARAM_PAT)
+                    NAME_INDEX_CACHE_SIZE, PUBLIC_M3U_SOURCES, PUBLIC_SOURCE_CACHE_DIR,
+                    PUBLIC_SOURCE_FETCH_CONCURRENCY, PUBLIC_SOURCE_FETCH_TIMEOUT,
+                    SIGN_PARAM_PAT)
+from core import http_client
+from core.atomic_io import atomic_write_text
 from core.logger import get_logger
 
 _logger = get_logger('sources')
 
+# EXTINF 属性（key="value"），一次 findall 取全部属性
+_EXTINF_ATTR_RE = re.compile(r'([A-Za-z0-9_-]+)="([^"]*)"')
+# 尾部分辨率后缀，如 "河南卫视 (2160p)"
+_RESOLUTION_SUFFIX_RE = re.compile(r'\s*\(\d+[piK]+.*\)\s*$')
+_RESOLUTION_RE = re.compile(r'\((\d+)[piK]')
+# 尾部清晰度标记，如 "CCTV-1 HD" / "北京卫视高清"（"超高清"须排在"高清"前）
+_QUALITY_SUFFIX_RE = re.compile(r'[\s_-]*(?:超高清|高清|超清|标清|蓝光|FHD|UHD|HD)$', re.IGNORECASE)
+# 别名比对时忽略的分隔符
+_SEPARATOR_RE = re.compile(r'[\s_·-]+')
+_WEISHI_RE = re.compile(r'([\u4e00-\u9fa5]+卫视)')
+# 仅带英文台标前缀的卫视全名（"BRTV 北京卫视"；"河南卫视B站" 这类不算）
+_PREFIXED_WEISHI_RE = re.compile(r'^[A-Za-z0-9\s_-]*([\u4e00-\u9fa5]+卫视)$')
+_URL_HOST_RE = re.compile(r'https?://([^\[/:]+)')
+_IPV4_RE = re.compile(r'\d+\.\d+\.\d+\.\d+$')
+
+
+def _alias_key(name):
+    """别名比对键：去分隔符 + 大写（"CCTV 1" / "cctv-1" -> "CCTV1"）"""
+    return _SEPARATOR_RE.sub('', name).upper()
+
+
+def _build_alias_index():
+    """由 CCTV_NAME_MAP 生成别名表：短名与中文标准名的各种写法都映射到中文标准名"""
+    index = {}
+    for short, canonical in CCTV_NAME_MAP.items():
+        index[_alias_key(short)] = canonical
+        index[_alias_key(canonical)] = canonical
+    return index
+
+
+# 别名比对键 -> 标准名（如 "CCTV1" / "CCTV1综合" -> "CCTV-1 综合"）
+_NAME_ALIASES = _build_alias_index()
+# 央视开路频道标准名集合
+_CCTV_CANONICAL_NAMES = frozenset(CCTV_NAME_MAP.values())
+
+
+@functools.lru_cache(maxsize=NAME_INDEX_CACHE_SIZE)
+def _canonical_name(name):
+    """频道名 -> 标准名（带 LRU 缓存，见 SourceUtils.normalize_name）"""
+    normalized = _RESOLUTION_SUFFIX_RE.sub('', name.strip()).strip()
+    bare = _QUALITY_SUFFIX_RE.sub('', normalized).strip()
+    canonical = _NAME_ALIASES.get(_alias_key(bare))
+    if canonical:
+        return canonical
+    # 卫视：去掉英文台标前缀/清晰度后缀，只留中文台名（"BRTV 北京卫视HD" -> "北京卫视"）
+    weishi = _PREFIXED_WEISHI_RE.match(bare)
+    if weishi:
+        return weishi.group(1)
+    return bare or normalized
+
 
 class SourceUtils:
     """公开 m3u 源工具类"""
 
     @staticmethod
-    def fetch_public_m3u(url):
+    def _source_cache_path(url):
+        """单源缓存文件路径（url 哈希命名）"""
+        digest = hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(PUBLIC_SOURCE_CACHE_DIR, f"{digest}.json")
+
+    @staticmethod
+    def _load_source_cache(url):
+        """
+        读取单源缓存 {url, etag, last_modified, fetched_at, channels}
+        :return: 缓存 dict；不存在/损坏/url 不符返回 None
+        """
+        try:
+            with open(SourceUtils._source_cache_path(url), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if isinstance(data, dict) and data.get('url') == url \
+                    and isinstance(data.get('channels'), list):
+                return data
+        except (OSError, ValueError):
+            pass
+        return None
+
+    @staticmethod
+    def _save_source_cache(url, validators, channels):
+        """保存单源缓存（原子写入，失败只记日志）"""
+        try:
+            atomic_write_text(SourceUtils._source_cache_path(url), json.dumps({
+                "url": url,
+                "etag": validators.get('etag'),
+                "last_modified": validators.get('last_modified'),
+                "fetched_at": int(time.time()),
+                "channels": channels,
+            }, ensure_ascii=False))
+        except Exception as e:
+            _logger.warning(f"保存公开源缓存出错: {url} -> {str(e)}")
+
+    @staticmethod
+    def _iter_response_lines(response):
         """
-        拉取单个公开 m3u 源
+        流式响应逐行解码：Content-Type 声明了 charset 则按声明解码，
+        否则按 UTF-8（m3u 事实标准；requests 对 text/* 默认的 ISO-8859-1 会把中文解成乱码）。
+        首行 BOM 去除
+        """
+        content_type = response.headers.get('Content-Type', '')
+        encoding = response.encoding if 'charset=' in content_type.lower() else 'utf-8'
+        first = True
+        for raw in response.iter_lines():
+            line = raw.decode(encoding or 'utf-8', 'replace')
+            if first:
+                line = line.lstrip('\ufeff')
+                first = False
+            yield line
+
+    @staticmethod
+    def fetch_public_source(url):
+        """
+        拉取并解析单个公开源（条件 GET + 磁盘缓存）：
+        - 200：解析并刷新缓存（连同新 ETag/Last-Modified）；解析出 0 个频道按失败处理
+        - 304：上游未变更，直接复用缓存的频道列表（不重新下载/解析）
+        - 失败：有缓存则用上次结果兜底，否则空列表（不抛异常，单源挂掉不影响其他）
         :param url: m3u 源地址
-        :return: 成功返回 m3u 文本，失败返回空字符串（不抛异常，单源挂掉不影响其他）
+        :return: 频道 dict 列表
         """
+        started = time.time()
+        cached = SourceUtils._load_source_cache(url)
         try:
-            response = requests.get(url, timeout=20)
-            if response.status_code != 200:
-                _logger.warning(f"拉取公开源失败({response.status_code}): {url}")
-                return ""
-            _logger.info(f"拉取公开源成功: {url}")
-            return response.text
+            response = http_client.conditional_get(url, cached, timeout=PUBLIC_SOURCE_FETCH_TIMEOUT,
+                                                   stream=True)
+            with response:
+                if response.status_code == 304 and cached:
+                    _logger.info(f"公开源未变更(304)，复用缓存 {len(cached['channels'])} 个频道"
+                                 f"（{time.time() - started:.2f}s）: {url}")
+                    return cached['channels']
+                if response.status_code == 200:
+                    # 边下载边解析，不在内存里保留整份列表文本
+                    channels = SourceUtils.parse_m3u_channels(
+                        SourceUtils._iter_response_lines(response))
+                    if channels:
+                        SourceUtils._save_source_cache(
+                            url, http_client.response_validators(response), channels)
+                        _logger.info(f"拉取公开源成功：{len(channels)} 个频道"
+                                     f"（{time.time() - started:.2f}s）: {url}")
+                        return channels
+                    # 200 但解析不出频道（错误页/空正文）：按失败处理，不覆盖已有缓存
+                    _logger.warning(f"拉取公开源返回 200 但无频道"
+                                    f"（{time.time() - started:.2f}s）: {url}")
+                else:
+                    _logger.warning(f"拉取公开源失败({response.status_code}，"
+                                    f"{time.time() - started:.2f}s): {url}")
         except Exception as e:
-            _logger.warning(f"拉取公开源出错: {url} -> {str(e)}")
-            return ""
+            _logger.warning(f"拉取公开源出错({time.time() - started:.2f}s): {url} -> {str(e)}")
+        if cached:
+            _logger.info(f"公开源沿用上次缓存 {len(cached['channels'])} 个频道: {url}")
+            return cached['channels']
+        return []
 
     @staticmethod
     def get_public_source_urls():
@@ -51,11 +188,20 @@ class SourceUtils:
 
     @staticmethod
     def fetch_all_public_channels():
-        """拉取全部公开源并解析为频道列表"""
-        channels = []
-        for url in SourceUtils.get_public_source_urls():
-            m3u_text = SourceUtils.fetch_public_m3u(url)
-            channels.extend(SourceUtils.parse_m3u_channels(m3u_text))
+        """
+        并发拉取全部公开源并解析为频道列表（总耗时取决于最慢单源；
+        结果按源列表顺序拼接，保持择优时的源优先级不变）
+        """
+        urls = SourceUtils.get_public_source_urls()
+        if not urls:
+            return []
+        started = time.time()
+        workers = max(1, min(PUBLIC_SOURCE_FETCH_CONCURRENCY, len(urls)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(SourceUtils.fetch_public_source, urls))
+        channels = [ch for source_channels in results for ch in source_channels]
+        _logger.info(f"公开源拉取完成：{len(urls)} 个源 {len(channels)} 个频道，"
+                     f"耗时 {time.time() - started:.2f}s")
         return channels
 
     @staticmethod
@@ -66,65 +212,86 @@ class SourceUtils:
         :return: group 名；未指定时返回 None，由调用方决定兜底语义
                 （parse 用 DEFAULT_GROUP_NAME，监控用沿用上一组）
         """
-        m = re.search(r'group-title="([^"]*)"', extinf_line)
-        return m.group(1) if m else None
+        return SourceUtils.parse_extinf_attrs(extinf_line).get('group-title')
+
+    @staticmethod
+    def parse_extinf_attrs(extinf_line):
+        """
+        一次扫描提取 EXTINF 行全部 key="value" 属性（属性名小写；重复属性取首次出现）
+        :param extinf_line: #EXTINF 行文本
+        :return: {属性名: 值}
+        """
+        attrs = {}
+        for key, value in _EXTINF_ATTR_RE.findall(extinf_line):
+            attrs.setdefault(key.lower(), value)
+        return attrs
+
+    @staticmethod
+    def _iter_lines(source):
+        """
+        统一行来源：整段文本逐行惰性切分（不先 splitlines 成列表）；
+        行迭代器（如 response.iter_lines()）原样消费，bytes 行按 UTF-8 解码
+        """
+        if isinstance(source, str):
+            return io.StringIO(source)
+        return (line.decode('utf-8', 'replace') if isinstance(line, bytes) else line
+                for line in source)
 
     @staticmethod
-    def iter_m3u_entries(m3u_text):
+    def iter_m3u_entries(source):
         """
-        迭代 m3u 文本，产出 (EXTINF 行, 播放地址行) 条目
-        条目配对模型：供 parse_m3u_channels 使用。
+        单遍流式迭代 m3u，产出 (EXTINF 行, 播放地址行) 条目
+        EXTINF 与地址之间的空行及 #EXTVLCOPT / #KODIPROP / #EXTGRP 等指令行跳过；
+        EXTINF 后未出现地址就遇到下一个 EXTINF 时，前者丢弃。
         注意：监控探测（monitoring/checks.py:fetch_m3u_groups）因需要
         行级状态机语义（缺 group-title 沿用上一组、裸 URL 行收集），
         自建行扫描，不使用本生成器
-        :param m3u_text: m3u 原始文本
+        :param source: m3u 原始文本，或行迭代器（str/bytes 行均可）
         :yield: (EXTINF 行字符串, 播放地址行)
         """
-        if not m3u_text:
+        if not source:
             return
-        lines = m3u_text.strip().splitlines()
-        i = 0
-        while i < len(lines):
-            line = lines[i].strip()
-            # EXTINF 行后面紧跟一个播放地址行
-            if line.startswith("#EXTINF") and i + 1 < len(lines):
-                yield line, lines[i + 1].strip()
-                i += 2
-            else:
-                i += 1
-
-    @staticmethod
-    def parse_m3u_channels(m3u_text):
-        """
-        按行解析 m3u 文本，提取频道列表
-        :param m3u_text: m3u 原始文本
-        :return: 频道 dict 列表，每个 dict 含 name/tvg_name/group_title/url
+        pending = None
+        for line in SourceUtils._iter_lines(source):
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('#EXTINF'):
+                pending = line
+            elif line.startswith('#'):
+                continue
+            elif pending is not None:
+                yield pending, line
+                pending = None
+
+    @staticmethod
+    def iter_m3u_channels(source):
+        """
+        流式解析 m3u，逐条产出频道 dict（name/tvg_name/group_title/url）
+        :param source: m3u 原始文本，或行迭代器
         """
-        channels = []
-        for line, url in SourceUtils.iter_m3u_entries(m3u_text):
+        for line, url in SourceUtils.iter_m3u_entries(source):
             # 清洗多线路后缀：`$` 后是线路标记（tvbox 语法）、`;` 分隔备选地址，
             # 都只保留第一路，避免把整串当 URL 请求 404
-            url = url.split('$')[0].split(';')[0].strip()
-
-            # 解析 tvg-name / group-title 属性
-            tvg_name = ""
-            group_title = SourceUtils.extract_group_title(line) or DEFAULT_GROUP_NAME
-
-            tvg_match = re.search(r'tvg-name="([^"]*)"', line)
-            if tvg_match:
-                tvg_name = tvg_match.group(1)
-
+            url = url.split('$', 1)[0].split(';', 1)[0].strip()
+            attrs = SourceUtils.parse_extinf_attrs(line)
             # 频道名取 EXTINF 行末尾逗号后的部分
-            name = line.split(",")[-1].strip()
-
-            channels.append({
+            name = line.rsplit(',', 1)[-1].strip()
+            yield {
                 "name": name,
-                "tvg_name": tvg_name or name,
-                "group_title": group_title,
+                "tvg_name": attrs.get('tvg-name') or name,
+                "group_title": attrs.get('group-title') or DEFAULT_GROUP_NAME,
                 "url": url,
-            })
+            }
 
-        return channels
+    @staticmethod
+    def parse_m3u_channels(source):
+        """
+        解析 m3u，提取频道列表
+        :param source: m3u 原始文本，或行迭代器（如流式响应的 iter_lines()）
+        :return: 频道 dict 列表，每个 dict 含 name/tvg_name/group_title/url
+        """
+        return list(SourceUtils.iter_m3u_channels(source))
 
     @staticmethod
     def extract_resolution(name):
@@ -133,7 +300,7 @@ class SourceUtils:
         :param name: 频道名（如 "CCTV-1 (1080p)"）
         :return: 分辨率高度数值（1080）；无法识别返回 0
         """
-        match = re.search(r'\((\d+)[piK]', name)
+        match = _RESOLUTION_RE.search(name)
         return int(match.group(1)) if match else 0
 
     @staticmethod
@@ -143,12 +310,12 @@ class SourceUtils:
         :param url: 流地址
         :return: 质量分（无签名域名=3 > 公网IP/签名域名=2 > 疑似内网IP=1 > 其他=0）
         """
-        match = re.match(r'https?://([^\[/:]+)', url)
+        match = _URL_HOST_RE.match(url)
         if not match:
             return 0
         host = match.group(1)
         # 域名（含子域）通常指向 CDN/电视台官网，公网可达性最好
-        if not re.match(r'\d+\.\d+\.\d+\.\d+$', host):
+        if not _IPV4_RE.match(host):
             score = 3
             # 带时效签名的域名源（cztv auth_key / jxtvcn token 等）会过期，降 1 分，
             # 让同台无签名源（如 wwb521 的 CDN 源）胜出
@@ -172,13 +339,14 @@ class SourceUtils:
         for ch in channels:
             raw = ch["name"]
 
-            # 1. CCTV 开路频道：匹配 CCTV_NAME_MAP 的 key（去掉分辨率后缀后比对）
-            bare = re.sub(r'\s*\(\d+[piK]+.*\)\s*$', '', raw).strip()
-            if bare in CCTV_NAME_MAP:
+            canonical = SourceUtils.normalize_name(raw)
+
+            # 1. CCTV 开路频道：归一化后命中别名表（"CCTV1" / "CCTV-1 HD" / "CCTV-1 (1080p)" 等）
+            if canonical in _CCTV_CANONICAL_NAMES:
                 # 记录原始分辨率，供去重时选最高清；再用中文标准名替换显示名
                 ch["_resolution"] = SourceUtils.extract_resolution(raw)
-                ch["name"] = CCTV_NAME_MAP[bare]
-                ch["tvg_name"] = CCTV_NAME_MAP[bare]
+                ch["name"] = canonical
+                ch["tvg_name"] = canonical
                 ch["group_title"] = "央视"
                 result.append(ch)
                 continue
@@ -188,7 +356,7 @@ class SourceUtils:
                 # 记录原始分辨率（如 "河南卫视 (2160p)" -> 2160）
                 ch["_resolution"] = SourceUtils.extract_resolution(raw)
                 # BRTV 北京卫视 这种带英文前缀的，去掉前缀只留中文部分
-                cn_part = re.search(r'([\u4e00-\u9fa5]+卫视)', raw)
+                cn_part = _WEISHI_RE.search(raw)
                 if cn_part:
                     ch["name"] = cn_part.group(1)
                     ch["tvg_name"] = cn_part.group(1)
@@ -204,11 +372,16 @@ class SourceUtils:
     @staticmethod
     def normalize_name(name):
         """
-        频道名归一化，用于去重对齐
+        频道名归一化，用于去重对齐与手动覆盖匹配
+        去掉分辨率后缀（"河南卫视 (2160p)"）与清晰度标记（"HD"/"高清"），
+        再查别名表（"CCTV1" / "CCTV 1 HD" / "CCTV-1综合" -> "CCTV-1 综合"）；
+        结果走有界 LRU 缓存
         :param name: 原始频道名
         :return: 归一化后的频道名
         """
-        normalized = name.strip()
-        # 去掉尾部分辨率后缀，如 "河南卫视 (2160p)" -> "河南卫视"
-        normalized = re.sub(r'\s*\(\d+[piK]+.*\)\s*$', '', normalized)
-        return normalized.strip()
+        return _canonical_name(name)
+
+    @staticmethod
+    def reset_name_index():
+        """清空归一化缓存（每轮聚合开始时调用，缓存只服务本轮的反复查询）"""
+        _canonical_name.cache_clear()
@@ -0,0 +1,46 @@
+"""XMLTV 片段渲染：文档头尾、channel、programme（文本与属性按 XML 规则转义）
+
+EPG 生成逐频道渲染片段并流式写入文件（见 XmlUtils.get_and_save_xml_data），
+不在内存里拼整份文档。节目名/频道名里的 & < > 引号会被转义，XML 1.0 不允许的控制字符直接去掉，
+单个标题不会再破坏整份文件。输出排版与历史版本一致（每个元素一行）。
+"""
+import re
+
+# XML 1.0 不允许出现的字符（除 \t \n \r 外的 C0 控制字符、代理区、U+FFFE/U+FFFF）
+_ILLEGAL_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff￾￿]')
+
+GENERATOR_ATTRS = 'generator-info-name="hntv-live" generator-info-url="https://github.com/AlanNiew"'
+HEADER = f'<?xml version="1.0" encoding="UTF-8"?><tv {GENERATOR_ATTRS}>\n'
+FOOTER = '</tv>'
+# 空 tv 文档（接口失败/异常时的兜底）
+EMPTY = f'<?xml version="1.0" encoding="UTF-8"?><tv {GENERATOR_ATTRS}></tv>'
+
+
+def escape_text(value):
+    """元素文本转义"""
+    text = _ILLEGAL_XML_CHARS.sub('', str(value))
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def escape_attr(value):
+    """双引号属性值转义"""
+    return escape_text(value).replace('"', '&quot;')
+
+
+def channel(channel_id, name, lang='zh'):
+    """channel 定义片段"""
+    return (f'<channel id="{escape_attr(channel_id)}">\n'
+            f'<display-name lang="{lang}">{escape_text(name)}</display-name>\n'
+            f'</channel>\n')
+
+
+def programme(channel_id, start, stop, title, lang='zh'):
+    """
+    programme 片段
+    :param start: XMLTV 时间串（YYYYMMDDHHMMSS +0800）
+    :param stop: 同上
+    """
+    return (f'<programme start="{escape_attr(start)}" stop="{escape_attr(stop)}" '
+            f'channel="{escape_attr(channel_id)}">\n'
+            f'<title lang="{lang}">{escape_text(title)}</title>\n'
+            f'</programme>\n')
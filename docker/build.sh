@@ -55,7 +55,7 @@ run_container() {
     -p 15002:5002 \
     -v "${SCRIPT_DIR}/../xml_data:/app/xml_data" \
     --env-file "${SCRIPT_DIR}/../.env" \
-    -e GUNICORN_WORKERS=1 \
+    -e GUNICORN_WORKERS=4 \
     -e TZ=Asia/Shanghai \
     --log-opt max-size=10m \
     --log-opt max-file=3 \
@@ -1,14 +1,24 @@
 # Gunicorn configuration file
 import os
+import sys
+
+# worker 模型与并发参数集中在 config.py（与分片转发名额 SEGMENT_STREAM_LIMIT 同源计算）
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from config import GUNICORN_THREADS, GUNICORN_WORKER_CLASS, GUNICORN_WORKER_CONNECTIONS  # noqa: E402
 
 # Server socket
 bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5002')
 backlog = 2048
 
 # Worker processes
-workers = int(os.getenv('GUNICORN_WORKERS', 1))
-worker_class = 'sync'
-worker_connections = 1000
+# 后台调度经文件锁选主只在一个 worker 里运行（core/leader.py），worker 数可按并发需要调整
+workers = int(os.getenv('GUNICORN_WORKERS', 4))
+# gthread（默认）：分片流各占一个线程，播放列表/EPG 由其余线程应答；
+# gevent（需安装 gevent）：协程并发，单进程数百路分片流；sync：历史单线程模型
+worker_class = GUNICORN_WORKER_CLASS
+# sync 配 threads>1 会被 gunicorn 自动改成 gthread，非 gthread 固定 1
+threads = GUNICORN_THREADS if worker_class == 'gthread' else 1
+worker_connections = GUNICORN_WORKER_CONNECTIONS
 timeout = 120
 keepalive = 5
 
@@ -28,7 +38,7 @@ proc_name = 'hntv_api'
 # Server mechanics
 # 不使用 preload_app：main.py 在 import 时启动 daemon 线程（聚合/XML/监控），
 # preload 会在 master fork worker 时复制线程，导致锁死/重复执行（worker 卡死 120s 超时被 SIGKILL）。
-# 默认懒加载下线程只在 worker 内启动，GUNICORN_WORKERS=1 保证线程唯一。
+# 默认懒加载下线程只在 worker 内启动，再由选主锁保证只有一个 worker 跑后台任务。
 daemon = False
 pidfile = '/tmp/hntv_api.pid'
 user = None
@@ -1,8 +1,8 @@
 """项目入口：创建 Flask 应用并启动后台调度
 
-注意：start_all() 在模块顶层调用，gunicorn 导入 main:app 时即启动三个 daemon 线程
-（XML 每日更新 / 聚合刷新 / 健康监控）。因此 GUNICORN_WORKERS 必须为 1，
-否则每个 worker 都会起一份线程，任务重复执行、告警邮件重复轰炸。
+注意：start_all() 在模块顶层调用，gunicorn 每个 worker 导入 main:app 时都会执行；
+后台任务（XML 每日更新 / 聚合刷新 / 健康监控等）经文件锁选主只在一个 worker 里运行
+（见 core/leader.py），其余 worker 只应答请求，因此可以开多个 worker。
 """
 import atexit
 
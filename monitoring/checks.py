@@ -1,14 +1,27 @@
-"""健康检测项：服务存活/直播列表/EPG/流探测，含常规与流探测两套状态机"""
+"""健康检测项：服务存活/直播列表/EPG/流探测，含常规与流探测两套状态机
+
+检测方式（MONITOR_CHECK_MODE）：
+- inprocess（默认）：直接读本进程已发布的播放列表快照与磁盘 EPG 文件。
+  原先经 HTTP 请求自身（HEALTH_URL/M3U_URL/EPG_URL），单 sync worker 下会占住唯一的
+  worker（同步请求自身有死锁风险），且每 10 分钟整包下载 EPG 只为量大小
+- external：保留 HTTP 黑盒检测（监控部署在别处 / 需验证反代链路时用）
+"""
 import datetime
+import os
+import threading
+import time
 from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlsplit
 
 import requests
-from config import (ALERT_GROUPS, DEFAULT_GROUP_NAME, DEFAULT_GROUP_RATIO,
-                    EPG_URL, GMT8, GROUP_HEALTH_RATIOS, HEALTH_URL, M3U_URL,
-                    MIN_CHANNEL_COUNT, STREAM_CHECK_CONCURRENCY)
+from config import (AGGREGATE_REFRESH_INTERVAL, AGGREGATE_THREAD_NAME, ALERT_GROUPS,
+                    DEFAULT_GROUP_NAME, DEFAULT_GROUP_RATIO, EPG_URL, GMT8,
+                    GROUP_HEALTH_RATIOS, GZ_FILE_PATH, HEALTH_URL, M3U_URL,
+                    MIN_CHANNEL_COUNT, MONITOR_CHECK_MODE, MONITOR_EPG_MAX_AGE,
+                    OFFICIAL_REFRESH_INTERVAL, STREAM_CHECK_CONCURRENCY)
+from core import failover, probe_store
 from core.logger import get_logger
-from core.probing import probe_stream
+from core.probing import probe_many
 from core.sources import SourceUtils
 from monitoring.alerts import AlertUtils
 
@@ -20,7 +33,7 @@ class CheckUtils:
     """健康检测工具类"""
 
     # 记录上次检测结果，用于状态翻转判断（OK / FAIL）。模块级变量，
-    # 单进程内有效（GUNICORN_WORKERS=1 保证线程唯一）
+    # 单进程内有效（监控线程只在调度 leader 里运行，见 core/leader.py）
     _last_status = "OK"
     # 连续失败计数，仅用于日志，不影响发邮件逻辑
     _fail_count = 0
@@ -57,12 +70,36 @@ class CheckUtils:
         from admin import db
         return db.get_effective_int('stream_check_concurrency', STREAM_CHECK_CONCURRENCY)
 
+    @staticmethod
+    def _in_process():
+        """是否进程内检测（MONITOR_CHECK_MODE != external）"""
+        return MONITOR_CHECK_MODE != 'external'
+
+    @staticmethod
+    def _playlist_max_age():
+        """播放列表新鲜度阈值（秒）：两个刷新周期（官方源；B 站测试模式无官方源线程取公开源周期）"""
+        from admin import db
+        from core.aggregator import AggregatorUtils
+        if AggregatorUtils.is_bilibili_only_mode():
+            interval = db.get_effective_int('aggregate_refresh_interval', AGGREGATE_REFRESH_INTERVAL)
+        else:
+            interval = db.get_effective_int('official_refresh_interval', OFFICIAL_REFRESH_INTERVAL)
+        return 2 * interval
+
     @staticmethod
     def check_health():
         """
-        检测服务存活：/health 返回 200 且 status=healthy
+        检测服务存活：
+        - inprocess：公开源聚合调度线程在运行（线程挂了列表将不再刷新）
+        - external：/health 返回 200 且 status=healthy
         :return: True 健康 / False 异常
         """
+        if CheckUtils._in_process():
+            alive = any(t.name == AGGREGATE_THREAD_NAME and t.is_alive()
+                        for t in threading.enumerate())
+            if not alive:
+                _logger.warning("健康检测：聚合调度线程未运行")
+            return alive
         try:
             r = requests.get(HEALTH_URL, timeout=5)
             if r.status_code != 200:
@@ -76,9 +113,23 @@ class CheckUtils:
     @staticmethod
     def check_m3u():
         """
-        检测核心功能：/api/live.m3u8 返回 200 且频道数 ≥ 阈值（DB 设置优先，config 兜底）
+        检测核心功能：频道数 ≥ 阈值（DB 设置优先，config 兜底）
+        - inprocess：读已发布快照，另要求最近一次发布在新鲜度阈值内
+        - external：/api/live.m3u8 返回 200
         :return: (正常bool, 频道数int)
         """
+        if CheckUtils._in_process():
+            from core.aggregator import AggregatorUtils
+            snapshot = AggregatorUtils.get_playlist_snapshot()
+            if snapshot is None:
+                _logger.warning("m3u 检测：播放列表快照尚未发布")
+                return False, 0
+            count = snapshot.channel_count
+            age = time.time() - snapshot.last_modified
+            fresh = age <= CheckUtils._playlist_max_age()
+            if not fresh:
+                _logger.warning(f"m3u 检测：播放列表已 {int(age // 60)} 分钟未刷新")
+            return fresh and count >= CheckUtils._min_channel_count(), count
         try:
             r = requests.get(M3U_URL, timeout=10)
             if r.status_code != 200:
@@ -92,10 +143,23 @@ class CheckUtils:
     @staticmethod
     def check_epg():
         """
-        检测 EPG 节目单：/api/live.xml.gz 返回 200 且内容非空
-        只验证可下载，不解压解析（gzip 内容有即视为正常）
+        检测 EPG 节目单：内容非空（gzip 内容有即视为正常，不解压解析）
+        - inprocess：只 stat 磁盘 gz 文件（大小 + 修改时间在新鲜度阈值内），不读内容
+        - external：/api/live.xml.gz 返回 200
         :return: (正常bool, 大小KBint)
         """
+        if CheckUtils._in_process():
+            try:
+                st = os.stat(GZ_FILE_PATH)
+            except OSError:
+                _logger.warning("epg 检测：节目单文件不存在")
+                return False, 0
+            size_kb = st.st_size // 1024
+            age = time.time() - st.st_mtime
+            if age > MONITOR_EPG_MAX_AGE:
+                _logger.warning(f"epg 检测：节目单已 {int(age // 3600)} 小时未更新")
+                return False, size_kb
+            return size_kb > 0, size_kb
         try:
             r = requests.get(EPG_URL, timeout=15)
             if r.status_code != 200:
@@ -107,35 +171,79 @@ class CheckUtils:
             return False, 0
 
     @staticmethod
-    def fetch_m3u_groups():
+    def _m3u_text():
+        """当前聚合 m3u 文本（inprocess 读快照，external 走 HTTP）；不可用返回 None"""
+        if CheckUtils._in_process():
+            from core.aggregator import AggregatorUtils
+            snapshot = AggregatorUtils.get_playlist_snapshot()
+            return snapshot.text if snapshot is not None else None
+        try:
+            r = requests.get(M3U_URL, timeout=10)
+            return r.text if r.status_code == 200 else None
+        except Exception as e:
+            _logger.warning(f"流地址解析请求失败: {str(e)}")
+            return None
+
+    @staticmethod
+    def parse_m3u_groups(text):
         """
-        拉取聚合 m3u 文本并解析出 (url, group, name) 列表
+        解析 m3u 文本为 (url, group, name) 列表
         只统计 http(s) 流：rtmp 等非 HTTP 协议 requests 无法探测，跳过不计入分母
         行级状态机语义（与旧版逐行等价）：EXTINF 行更新当前 group/name（缺 group-title
         则沿用上一组）；任何裸 http(s) 行都收集并归属当前 group/name
+        """
+        items = []
+        cur_group = DEFAULT_GROUP_NAME
+        cur_name = "未知频道"
+        for line in text.splitlines():
+            line = line.strip()
+            if line.startswith('#EXTINF'):
+                group = SourceUtils.extract_group_title(line)
+                if group is not None:
+                    cur_group = group
+                # 频道名取 EXTINF 行末尾逗号后的部分
+                cur_name = line.split(',')[-1].strip() if ',' in line else "未知频道"
+            elif line.startswith(('http://', 'https://')):
+                items.append((line, cur_group, cur_name))
+        return items
+
+    @staticmethod
+    def _upstream_url(url):
+        """
+        列表地址还原为实际上游地址：
+        - tvbox 模式 主#备 拼接：取主地址
+        - redirect 模式 /api/ch/<key>：取故障切换表当前选用的候选（探测本服务跳转接口
+          既测不到上游，又会占用 worker 请求线程）；候选表里没有该频道时保留原地址
+        """
+        url = url.split('#', 1)[0]
+        path = urlsplit(url).path
+        if '/api/ch/' in path:
+            target = failover.resolve(unquote(path.split('/api/ch/', 1)[1]))
+            if target:
+                return target
+        return url
+
+    @staticmethod
+    def fetch_m3u_groups():
+        """
+        取聚合 m3u 并解析出 (url, group, name) 列表（见 parse_m3u_groups），每个频道一条：
+        - 地址还原为实际上游地址（见 _upstream_url）
+        - multi 模式同一频道展开为多行主备地址，只保留首行（主地址），否则备用地址多的
+          频道在分组可达率里占多份权重
         :return: (url, group, name) 列表；拉取失败返回空列表
         """
-        try:
-            r = requests.get(M3U_URL, timeout=10)
-            if r.status_code != 200:
-                return []
-            items = []
-            cur_group = DEFAULT_GROUP_NAME
-            cur_name = "未知频道"
-            for line in r.text.splitlines():
-                line = line.strip()
-                if line.startswith('#EXTINF'):
-                    group = SourceUtils.extract_group_title(line)
-                    if group is not None:
-                        cur_group = group
-                    # 频道名取 EXTINF 行末尾逗号后的部分
-                    cur_name = line.split(',')[-1].strip() if ',' in line else "未知频道"
-                elif line.startswith(('http://', 'https://')):
-                    items.append((line, cur_group, cur_name))
-            return items
-        except Exception as e:
-            _logger.warning(f"流地址解析请求失败: {str(e)}")
+        text = CheckUtils._m3u_text()
+        if not text:
             return []
+        items = []
+        seen = set()
+        for url, group, name in CheckUtils.parse_m3u_groups(text):
+            if (group, name) in seen:
+                continue
+            if name != "未知频道":
+                seen.add((group, name))
+            items.append((CheckUtils._upstream_url(url), group, name))
+        return items
 
     # ------------------------------------------------------------ 常规状态机
 
@@ -241,9 +349,12 @@ class CheckUtils:
                 "detail": "聚合列表拉取失败或无流地址",
             }]
         else:
-            # 并发探测所有流（严格判定：仅 200/206 可达，与聚合过滤的宽松口径区分）
-            with ThreadPoolExecutor(max_workers=concurrency) as executor:
-                results = list(executor.map(probe_stream, [u for u, _, _ in items]))
+            # 并发探测所有流（严格判定：仅 200/206 可达，与聚合过滤的宽松口径区分）；
+            # 监控是告警口径，每轮全量实测不复用旧结果，结果写入共享存储供聚合过滤跳过复探
+            urls = [u for u, _, _ in items]
+            probed = probe_many(urls, concurrency=concurrency, details=True)
+            probe_store.record(urls, probed, 'strict')
+            results = [r.ok for r in probed]
             # 落库：本轮流探测明细（每频道一条，整轮批量写入，失败静默不影响检测）
             try:
                 from admin import db
@@ -64,7 +64,7 @@ class MonitorScheduler:
     def schedule_monitor():
         """
         启动 daemon 线程，定时执行健康检测（常规 10 分钟一轮 + 流探测 30 分钟一轮）
-        依赖 GUNICORN_WORKERS=1 保证线程只起一次（已在 gunicorn.conf.py 配置）
+        只在调度 leader 里调用（scheduling.start_leader_tasks），多 worker 部署线程也只起一份
         """
 
         def monitor_loop():
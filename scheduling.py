@@ -1,16 +1,21 @@
-"""定时调度统一入口：XML 每日更新 + 聚合刷新 + 健康监控
+"""定时调度统一入口：XML 每日更新 + 聚合刷新 + 健康监控 + B 站开播追踪
 
-三个 daemon 线程均在 import 时启动（main.py 导入即触发，含 WSGI 部署场景）。
-因此 GUNICORN_WORKERS 必须为 1（gunicorn.conf.py 默认已配置），
-否则线程会随每个 worker 重复启动，导致任务重复执行、告警邮件重复轰炸。
+start_all 在 import 时调用（main.py 导入即触发，含 WSGI 部署场景），每个 gunicorn worker 各调一次。
+后台任务经 core/leader.py 选主，只在持有 LEADER_LOCK_PATH 文件锁的 leader worker 里启动，
+其余 worker 只读 leader 落盘的聚合结果 / 共享状态文件应答请求；leader 退出后由某个 follower 接管。
+B 站线路签名预刷新是每个进程自己的地址缓存，各 worker 都启动。
 """
 import datetime
+import os
 import threading
 import time
 
-from config import (AGGREGATE_REFRESH_INTERVAL, BILIBILI_ONLY_MODE, GMT8,
-                    OFFICIAL_REFRESH_INTERVAL)
+from config import (AGGREGATE_REFRESH_INTERVAL, AGGREGATE_THREAD_NAME, AGGREGATED_M3U_PATH,
+                    BILIBILI_ONLY_MODE, GMT8, OFFICIAL_REFRESH_INTERVAL,
+                    PUBLIC_CHANNELS_CACHE_PATH, REFRESH_REQUEST_POLL)
+from core import failover, leader, live_tracker, probe_store
 from core.aggregator import AggregatorUtils
+from core.bilibili import BilibiliUtils
 from core.epg import XmlUtils
 from monitoring.scheduler import MonitorScheduler
 
@@ -19,7 +24,7 @@ _logger = get_logger('scheduling')
 
 
 def schedule_daily_xml_update():
-    """每天 GMT+8 02:30 刷新 EPG XML 数据"""
+    """每天 GMT+8 02:30 刷新 EPG XML 数据（增量：只拉多日窗口中缺失/过期的日期，见 core.epg_store）"""
 
     def update_xml_daily():
         while True:
@@ -48,6 +53,18 @@ def schedule_daily_xml_update():
     scheduler_thread.start()
 
 
+def _remaining_wait(path, interval, now=None):
+    """
+    距离下次刷新还需等待的秒数（按结果文件 mtime 计算；文件缺失或已过期返回 0）
+    leader 切换（崩溃 / worker 回收）后新 leader 据此接续周期，不必一接管就重跑全量聚合
+    """
+    try:
+        age = (now if now is not None else time.time()) - os.path.getmtime(path)
+    except OSError:
+        return 0
+    return max(0, int(interval - age))
+
+
 def schedule_aggregate_refresh():
     """
     聚合刷新（双频率）：
@@ -57,9 +74,16 @@ def schedule_aggregate_refresh():
       官方源线程与公开源线程做的是同一件事，跳过官方源线程避免重复采集
     """
     def public_loop():
+        # 上一个 leader 刚聚合过（公开源缓存仍在周期内）则等到期再刷新，否则立即刷新
+        from admin import db
+        wait = _remaining_wait(PUBLIC_CHANNELS_CACHE_PATH, db.get_effective_int(
+            'aggregate_refresh_interval', AGGREGATE_REFRESH_INTERVAL))
+        if wait:
+            _logger.info(f"公开源聚合结果仍在周期内，{wait} 秒后刷新")
+            time.sleep(wait)
         while True:
             try:
-                # 首次启动立即刷新一次，之后按间隔刷新；锁被占/失败返回 None，区分日志
+                # 按间隔刷新；锁被占/失败返回 None，区分日志
                 if AggregatorUtils.get_aggregated_m3u():
                     _logger.info("聚合 m3u 已刷新（公开源）")
                 else:
@@ -73,7 +97,7 @@ def schedule_aggregate_refresh():
                 _logger.exception("定时刷新聚合 m3u 出错")
                 time.sleep(60)  # 出错后等 1 分钟再试，避免狂跑
 
-    public_thread = threading.Thread(target=public_loop, daemon=True, name='聚合-公开源')
+    public_thread = threading.Thread(target=public_loop, daemon=True, name=AGGREGATE_THREAD_NAME)
     public_thread.start()
 
     if BILIBILI_ONLY_MODE:
@@ -81,8 +105,11 @@ def schedule_aggregate_refresh():
         return
 
     def official_loop():
-        # 稍等公开源线程完成首次聚合（公开缓存未就绪时 refresh_official_only 会自动回退全量）
-        time.sleep(10)
+        # 稍等公开源线程完成首次聚合（公开缓存未就绪时 refresh_official_only 会自动回退全量）；
+        # 聚合文件仍在官方源周期内（上一个 leader 刚刷新过）则等到期
+        from admin import db
+        time.sleep(max(10, _remaining_wait(AGGREGATED_M3U_PATH, db.get_effective_int(
+            'official_refresh_interval', OFFICIAL_REFRESH_INTERVAL))))
         while True:
             try:
                 # 锁被占/失败返回 None，区分日志避免误导
@@ -103,20 +130,60 @@ def schedule_aggregate_refresh():
     official_thread.start()
 
 
-def start_all():
-    """统一启动全部后台调度（main.py 导入时调用一次）"""
-    # 初始化管理数据库（建表；失败不阻断服务，落库静默降级）
-    try:
-        from admin import db
-        db.init_db()
-    except Exception:
-        pass
+def schedule_refresh_requests():
+    """leader 轮询 follower 写下的刷新请求标志，转为本进程的异步聚合刷新"""
+
+    def watch_loop():
+        while True:
+            time.sleep(REFRESH_REQUEST_POLL)
+            try:
+                if leader.take_refresh_request():
+                    _logger.info("收到其他 worker 的刷新请求，执行异步聚合刷新")
+                    AggregatorUtils.request_async_refresh()
+            except Exception:
+                _logger.exception("处理刷新请求出错")
 
+    threading.Thread(target=watch_loop, daemon=True, name='刷新请求').start()
+
+
+def start_leader_tasks():
+    """启动只应在一个进程里运行的后台任务（当选调度 leader 后调用）"""
     schedule_daily_xml_update()
     _logger.info("定时XML更新任务已启动")
 
     schedule_aggregate_refresh()
     _logger.info("定时聚合刷新任务已启动")
 
+    schedule_refresh_requests()
+    _logger.info("跨 worker 刷新请求处理已启动")
+
+    live_tracker.start(AggregatorUtils.list_bilibili_rooms)
+    _logger.info("B站开播追踪已启动")
+
+    failover.start()
+    _logger.info("公开频道故障切换健康检查已启动")
+
     MonitorScheduler.schedule_monitor()
     _logger.info("健康监控任务已启动")
+
+
+def start_all():
+    """统一启动后台调度（main.py 导入时每个 worker 调用一次）"""
+    # 初始化管理数据库（建表；失败不阻断服务，落库静默降级）
+    try:
+        from admin import db
+        db.init_db()
+    except Exception:
+        pass
+    # 旧版 stream_failures.json 的连续失败计数迁入管理库（只在首次升级后有文件时生效）
+    try:
+        probe_store.migrate_legacy_fail_counts()
+    except Exception:
+        _logger.exception("迁移旧失败计数出错")
+
+    # 线路签名预刷新维护的是本进程的地址缓存，每个 worker 都要跑
+    BilibiliUtils.start_route_refresher()
+    _logger.info("B站线路签名预刷新已启动")
+
+    # 其余后台任务只在调度 leader 里启动（follower 守候，leader 退出后接管）
+    leader.start(start_leader_tasks)
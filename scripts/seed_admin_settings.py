@@ -24,9 +24,9 @@ sys.path.insert(0, BASE_DIR)
 
 from admin import db  # noqa: E402  导入顺序：先修正 sys.path
 from config import (AGGREGATE_REFRESH_INTERVAL, CHECK_INTERVAL,
-                    CHECK_WINDOW_END_HOUR, CHECK_WINDOW_START_HOUR,
+                    CHECK_WINDOW_END_HOUR, FAILOVER_MODE, CHECK_WINDOW_START_HOUR,
                     GROUP_HEALTH_RATIOS, LOG_KEEP_DAYS, MONITOR_HISTORY_KEEP,
-                    OFFICIAL_REFRESH_INTERVAL, STARTUP_DELAY,
+                    OFFICIAL_REFRESH_INTERVAL, PROBE_RESULT_MAX_AGE, STARTUP_DELAY,
                     STREAM_CHECK_CONCURRENCY, STREAM_CHECK_INTERVAL,
                     STREAM_FAIL_LIMIT, STREAM_HISTORY_KEEP, STREAM_PROBE_TIMEOUT)  # noqa: E402
 
@@ -53,6 +53,9 @@ DEFAULTS = [
     ('startup_delay', '监控首次启动延迟（秒）', STARTUP_DELAY, 'int'),
     ('stream_check_concurrency', '流探测并发数', STREAM_CHECK_CONCURRENCY, 'int'),
     ('stream_probe_timeout', '单流探测超时（秒）', STREAM_PROBE_TIMEOUT, 'int'),
+    ('probe_result_max_age', '探测结果新鲜期（秒，期内已确认可达的 URL 聚合时不再探测；0=不复用）',
+     PROBE_RESULT_MAX_AGE, 'int'),
+    ('failover_mode', '公开频道备用地址输出方式（off / tvbox / multi / redirect）', FAILOVER_MODE, 'str'),
 ]
 
 
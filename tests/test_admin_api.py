@@ -414,6 +414,17 @@ class AdminApiTest(unittest.TestCase):
         self.assertEqual(self.client.put('/api/admin/settings',
                                          json={'group_health_ratios': [0.5]}).status_code, 400)
 
+    def test_settings_epg_xmltv_urls(self):
+        """epg_xmltv_urls：逗号分隔的 http(s) 地址，规范化存储；非法地址 400"""
+        self._login()
+        resp = self.client.put('/api/admin/settings', json={
+            'epg_xmltv_urls': ' https://a.example/e.xml.gz ,http://b.example/e.xml, '})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.get_json()['effective']['epg_xmltv_urls'],
+                         'https://a.example/e.xml.gz, http://b.example/e.xml')
+        self.assertEqual(self.client.put('/api/admin/settings',
+                                         json={'epg_xmltv_urls': 'ftp://x/e.xml'}).status_code, 400)
+
     def test_settings_public_base_url_and_alert_enabled(self):
         """public_base_url / alert_enabled：读写与校验"""
         self._login()
@@ -7,6 +7,7 @@ import unittest
 from unittest import mock
 
 from admin import db
+from core.probing import ProbeResult
 
 
 class AdminDbTest(unittest.TestCase):
@@ -65,6 +66,32 @@ class AdminDbTest(unittest.TestCase):
         self.assertEqual(ov['group_title'], '测试组')
         self.assertEqual(ov['enabled'], 0)  # 未传 enabled 保持原值
 
+    def test_override_keys_migrated(self):
+        """旧归一化规则下保存的 key（"CCTV1"）重新建库时迁移为新 key；同一新 key 保留先保存的一行"""
+        db.upsert_channel_override('CCTV1', display_name='央视一套')
+        db.upsert_channel_override('CCTV-1 HD', display_name='后保存')
+        db.upsert_channel_override('BRTV 北京卫视HD', group_title='卫视')
+        db.upsert_channel_override('河南卫视', enabled=0)
+        db.init_db()
+        overrides = db.get_channel_overrides()
+        self.assertEqual(sorted(overrides), ['CCTV-1 综合', '北京卫视', '河南卫视'])
+        self.assertEqual(overrides['CCTV-1 综合']['display_name'], '央视一套')
+        self.assertEqual(overrides['北京卫视']['group_title'], '卫视')
+        db.init_db()  # 可重复执行
+        self.assertEqual(sorted(db.get_channel_overrides()), ['CCTV-1 综合', '北京卫视', '河南卫视'])
+
+    def test_override_key_collision_logged(self):
+        """多个旧 key 归到同一新 key：保留先保存的一行，丢弃的行逐条记 WARNING（含旧/新 key 与内容）"""
+        db.upsert_channel_override('CCTV1', display_name='央视一套')
+        db.upsert_channel_override('CCTV-1 HD', group_title='央视高清', enabled=0)
+        with self.assertLogs(db._get_db_logger(), 'WARNING') as logs:
+            db.init_db()
+        self.assertEqual(len(logs.records), 1)
+        message = logs.records[0].getMessage()
+        for part in ("'CCTV-1 HD'", "'CCTV1'", "'CCTV-1 综合'", "'央视高清'", 'enabled=0'):
+            self.assertIn(part, message)
+        self.assertEqual(db.get_channel_overrides()['CCTV-1 综合']['display_name'], '央视一套')
+
     def test_delete_channel_override(self):
         """删除覆盖恢复默认"""
         db.upsert_channel_override('cctv1', enabled=0)
@@ -224,8 +251,9 @@ class MonitorPersistTest(unittest.TestCase):
             ("http://bad/2.m3u8", "卫视", "北京卫视"),
         ]
         with mock.patch.object(CheckUtils, 'fetch_m3u_groups', return_value=items), \
-             mock.patch('monitoring.checks.probe_stream',
-                        side_effect=lambda u, accept_403=False: u.startswith('http://ok')), \
+             mock.patch('monitoring.checks.probe_many',
+                        side_effect=lambda urls, concurrency=None, details=False: [
+                            ProbeResult(u.startswith('http://ok'), 200, 0.05) for u in urls]), \
              mock.patch('monitoring.checks.AlertUtils.send_alert'):
             CheckUtils.run_stream_check_once()
         rows = db.get_stream_history()
@@ -233,6 +261,11 @@ class MonitorPersistTest(unittest.TestCase):
         bad = db.get_stream_history(unreachable_only=True)
         self.assertEqual(len(bad), 1)
         self.assertEqual(bad[0]['channel_name'], '北京卫视')
+        # 同时写入共享探测结果（严格口径）
+        results = db.get_probe_results([u for u, _, _ in items])
+        self.assertEqual(results['http://ok/1.m3u8']['strict_ok'], 1)
+        self.assertEqual(results['http://bad/2.m3u8']['strict_ok'], 0)
+        self.assertIsNone(results['http://ok/1.m3u8']['loose_ok'])
 
 
 class SettingsEffectiveTest(unittest.TestCase):
@@ -360,22 +393,21 @@ class SettingsEffectiveTest(unittest.TestCase):
         m3u = ('#EXTM3U\n#EXTINF:-1 tvg-id="1",A\nhttp://a\n'
                '#EXTINF:-1 tvg-id="2",B\nhttp://b\n'
                '#EXTINF:-1 tvg-id="3",C\nhttp://c\n')
-        with mock.patch('monitoring.checks.requests.get') as m:
-            resp = mock.Mock()
-            resp.status_code = 200
-            resp.text = m3u
-            m.return_value = resp
+        from core.snapshot import PlaylistSnapshot
+        with mock.patch('core.aggregator.AggregatorUtils.get_playlist_snapshot',
+                        return_value=PlaylistSnapshot.build(m3u)):
             ok, count = CheckUtils.check_m3u()
         self.assertTrue(ok)
         self.assertEqual(count, 3)
 
     def test_check_m3u_falls_back_to_config_threshold(self):
-        """未设置：回退 config 阈值（正式模式 30），3 个频道不达标"""
+        """未设置：回退 config 阈值（正式模式 30），3 个频道不达标（external 模式经 HTTP 取列表）"""
         from monitoring.checks import CheckUtils
         m3u = ('#EXTM3U\n#EXTINF:-1 tvg-id="1",A\nhttp://a\n'
                '#EXTINF:-1 tvg-id="2",B\nhttp://b\n'
                '#EXTINF:-1 tvg-id="3",C\nhttp://c\n')
         with mock.patch('monitoring.checks.requests.get') as m, \
+             mock.patch('monitoring.checks.MONITOR_CHECK_MODE', 'external'), \
              mock.patch('core.aggregator.AggregatorUtils.is_bilibili_only_mode',
                         return_value=False), \
              mock.patch('monitoring.checks.MIN_CHANNEL_COUNT', 30):
@@ -6,12 +6,14 @@ import unittest
 from unittest import mock
 
 from config import XML_DATA_DIR
+from core import failover, probe_store
 from core.aggregator import AggregatorUtils
+from core.probing import ProbeResult
 from core.sources import SourceUtils
 
 
 class AggregatorFilterTest(unittest.TestCase):
-    """探测过滤逻辑测试（mock probe_stream 控制结果，失败记录用临时文件）"""
+    """探测过滤逻辑测试（mock probe_many 控制结果，失败记录用临时文件）"""
 
     def setUp(self):
         # 隔离失败记录文件
@@ -28,14 +30,21 @@ class AggregatorFilterTest(unittest.TestCase):
         patcher_save.start()
         self.addCleanup(patcher_load.stop)
         self.addCleanup(patcher_save.stop)
+        # 探测结果存储走进程内兜底（管理库指向不存在的路径）
+        patcher_db = mock.patch('admin.db.ADMIN_DB_PATH',
+                                os.path.join(self.tmp_dir, 'missing', 'admin.db'))
+        patcher_db.start()
+        self.addCleanup(patcher_db.stop)
+        probe_store.reset()
+        self.addCleanup(probe_store.reset)
 
         # 探测结果控制：url -> 可达
         self.results = {}
 
-        def fake_probe(url, accept_403=False, user_agent=None):
-            return self.results.get(url, True)
+        def fake_probe(urls, accept_403=False, user_agent=None, details=False):
+            return [ProbeResult(self.results.get(url, True), 200, 0.01) for url in urls]
 
-        patcher_probe = mock.patch('core.aggregator.probe_stream', side_effect=fake_probe)
+        patcher_probe = mock.patch('core.aggregator.probe_many', side_effect=fake_probe)
         self.probe_mock = patcher_probe.start()
         self.addCleanup(patcher_probe.stop)
 
@@ -55,7 +64,7 @@ class AggregatorFilterTest(unittest.TestCase):
         self.assertEqual(len(kept), 2, "第一轮失败应保留")
         rec = json.load(open(self.fail_path, encoding='utf-8'))
         self.assertEqual(rec.get('http://bad/bjws.m3u8'), 1)
-        probed_urls = [c.args[0] for c in self.probe_mock.call_args_list]
+        probed_urls = [u for c in self.probe_mock.call_args_list for u in c.args[0]]
         self.assertIn('http://bad/bjws.m3u8', probed_urls)
 
     def test_second_fail_dropped(self):
@@ -87,6 +96,25 @@ class AggregatorFilterTest(unittest.TestCase):
         rec = json.load(open(self.fail_path, encoding='utf-8'))
         self.assertNotIn('http://old/gone.m3u8', rec)
 
+    def test_fresh_result_skips_probe(self):
+        """新鲜期内已确认可达（如流监控刚探测过）的 URL 不再探测，直接保留"""
+        probe_store.record(['http://good/cctv1.m3u8'], [ProbeResult(True, 206, 0.1)], 'strict')
+        kept = AggregatorUtils.filter_unreachable(self._build())
+        self.assertEqual(len(kept), 2)
+        probed_urls = [u for c in self.probe_mock.call_args_list for u in c.args[0]]
+        self.assertEqual(probed_urls, ['http://bad/bjws.m3u8'])
+
+    def test_stale_or_failed_result_reprobed(self):
+        """过了新鲜期或上次不可达的 URL 照常探测；本轮结果写回存储"""
+        probe_store.record(['http://good/cctv1.m3u8'], [ProbeResult(True, 200, 0.1)], 'loose',
+                           now=0)
+        probe_store.record(['http://bad/bjws.m3u8'], [ProbeResult(False, 404, 0.1)], 'strict')
+        AggregatorUtils.filter_unreachable(self._build())
+        probed_urls = [u for c in self.probe_mock.call_args_list for u in c.args[0]]
+        self.assertEqual(sorted(probed_urls), ['http://bad/bjws.m3u8', 'http://good/cctv1.m3u8'])
+        self.assertEqual(probe_store.fresh_ok(probed_urls, 60),
+                         {'http://good/cctv1.m3u8', 'http://bad/bjws.m3u8'})
+
     def test_db_stream_fail_limit_override(self):
         """stream_fail_limit 动态读取：DB=1 时第一轮失败即丢弃"""
         with mock.patch('admin.db.ADMIN_DB_PATH',
@@ -193,6 +221,51 @@ class RefreshCallbackTest(unittest.TestCase):
         self.assertIn('#EXTM3U', content)
 
 
+class FailoverOutputTest(unittest.TestCase):
+    """公开频道主备地址输出（FAILOVER_MODE 四种方式）"""
+
+    def setUp(self):
+        failover.reset()
+        self.addCleanup(failover.reset)
+        self.public = [
+            {'name': 'CCTV-1 综合', 'tvg_name': 'CCTV1', 'group_title': '央视',
+             'url': 'http://a/1', 'backup_urls': ['http://b/1', 'http://c/1']},
+            {'name': '北京卫视', 'tvg_name': 'BRTV', 'group_title': '卫视', 'url': 'http://d/1'},
+        ]
+        self.hntv = [{'name': '河南卫视', 'cid': 1, 'group_title': '河南卫视', 'url': 'http://h/1',
+                      'backup_urls': ['http://ignored']}]
+        for patcher in (
+            mock.patch('core.aggregator._get_channel_overrides', return_value={}),
+            mock.patch.object(AggregatorUtils, '_public_base_url', return_value='http://svc:5002/'),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _urls(self, mode):
+        with mock.patch.object(AggregatorUtils, '_failover_mode', return_value=mode):
+            m3u = AggregatorUtils.aggregate_m3u(self.hntv, self.public)
+        return [line for line in m3u.splitlines() if line.startswith('http')]
+
+    def test_off_single_url(self):
+        self.assertEqual(self._urls('off'), ['http://h/1', 'http://a/1', 'http://d/1'])
+
+    def test_tvbox_joined(self):
+        self.assertEqual(self._urls('tvbox'),
+                         ['http://h/1', 'http://a/1#http://b/1#http://c/1', 'http://d/1'])
+
+    def test_multi_entries(self):
+        self.assertEqual(self._urls('multi'),
+                         ['http://h/1', 'http://a/1', 'http://b/1', 'http://c/1', 'http://d/1'])
+
+    def test_redirect_endpoint(self):
+        """redirect：有备用地址的公开频道指向 /api/ch/<key>，候选表同步发布"""
+        self.assertEqual(self._urls('redirect'),
+                         ['http://h/1', 'http://svc:5002/api/ch/CCTV-1%20%E7%BB%BC%E5%90%88',
+                          'http://d/1'])
+        self.assertEqual(failover.resolve('CCTV-1 综合'), 'http://a/1')
+        self.assertIsNone(failover.resolve('北京卫视'))
+
+
 class SourceUtilsTest(unittest.TestCase):
     """公开源解析/评分/过滤逻辑测试"""
     def test_parse_m3u_with_line_suffix(self):
@@ -208,6 +281,41 @@ class SourceUtilsTest(unittest.TestCase):
         self.assertEqual(channels[0]['url'], "http://a.com/1.m3u8")
         self.assertEqual(channels[1]['url'], "http://b.com/2.m3u8")
 
+    def test_parse_m3u_skips_directives_and_blank_lines(self):
+        """EXTINF 与地址之间的 #EXTVLCOPT/#KODIPROP/空行跳过；无地址的 EXTINF 丢弃"""
+        m3u = (
+            "#EXTM3U\n"
+            '#EXTINF:-1 tvg-name="北京卫视" group-title="卫视",北京卫视\n'
+            "#EXTVLCOPT:http-user-agent=Mozilla\n"
+            "#KODIPROP:inputstream=adaptive\n"
+            "\n"
+            "http://a.com/1.m3u8\n"
+            '#EXTINF:-1 group-title="央视",无地址频道\n'
+            '#EXTINF:-1 group-title="央视",CCTV-1综合\n'
+            "\n"
+            "http://b.com/2.m3u8\n"
+        )
+        channels = SourceUtils.parse_m3u_channels(m3u)
+        self.assertEqual([(c['name'], c['url']) for c in channels],
+                         [('北京卫视', 'http://a.com/1.m3u8'), ('CCTV-1综合', 'http://b.com/2.m3u8')])
+
+    def test_parse_m3u_attrs_first_wins(self):
+        """属性一次提取：重复属性取首次出现；缺 tvg-name 回退频道名、缺分组回退默认组"""
+        m3u = ('#EXTINF:-1 tvg-id="x" group-title="卫视" group-title="其它",湖南卫视\n'
+               'http://a/1.m3u8\n#EXTINF:-1,裸频道\nhttp://a/2.m3u8\n')
+        first, second = SourceUtils.parse_m3u_channels(m3u)
+        self.assertEqual(first['group_title'], '卫视')
+        self.assertEqual(first['tvg_name'], '湖南卫视')
+        self.assertEqual(second['group_title'], '其他')
+
+    def test_parse_m3u_from_line_iterator(self):
+        """可直接消费行迭代器（bytes 行按 UTF-8 解码），与整段文本结果一致"""
+        m3u = ('#EXTM3U\n#EXTINF:-1 group-title="央视",CCTV-1\nhttp://a/1.m3u8\n'
+               '#EXTINF:-1 group-title="卫视",北京卫视\r\nhttp://a/2.m3u8\r\n')
+        lines = (line.encode('utf-8') for line in m3u.splitlines())
+        self.assertEqual(SourceUtils.parse_m3u_channels(lines),
+                         SourceUtils.parse_m3u_channels(m3u))
+
     def test_score_url_signed_domain_penalty(self):
         """带时效签名的域名源降 1 分"""
         self.assertEqual(SourceUtils.score_url("http://ali-m-l.cztv.com/1.m3u8"), 3)
@@ -226,6 +334,30 @@ class SourceUtilsTest(unittest.TestCase):
         self.assertEqual([c['name'] for c in result], ['CCTV-1 综合', '北京卫视'])
         self.assertEqual(result[1]['group_title'], '卫视')
 
+    def test_normalize_name_aliases(self):
+        """别名写法 / 清晰度标记 / 分辨率后缀归一到同一标准名"""
+        for raw in ('CCTV1', 'CCTV 1 HD', 'cctv-1', 'CCTV-1 综合', 'CCTV-1综合 (1080p)', 'CCTV-1 高清'):
+            self.assertEqual(SourceUtils.normalize_name(raw), 'CCTV-1 综合', raw)
+        self.assertEqual(SourceUtils.normalize_name('CCTV5+'), 'CCTV-5+ 体育赛事')
+        self.assertEqual(SourceUtils.normalize_name('CCTV-5 HD'), 'CCTV-5 体育')
+        self.assertEqual(SourceUtils.normalize_name('CCTV-4K'), 'CCTV-4K 超高清')
+        self.assertEqual(SourceUtils.normalize_name('BRTV 北京卫视HD'), '北京卫视')
+        self.assertEqual(SourceUtils.normalize_name('河南卫视 (2160p)'), '河南卫视')
+        # 卫视名后带其它内容的不是同一频道（B 站直播间名等）
+        self.assertEqual(SourceUtils.normalize_name('河南卫视B站'), '河南卫视B站')
+        self.assertEqual(SourceUtils.normalize_name(' 大象新闻 '), '大象新闻')
+
+    def test_filter_and_translate_dedupes_alias_variants(self):
+        """别名写法的央视频道都识别并中文化，择优时按同一 key 去重"""
+        channels = [
+            {'name': 'CCTV1', 'tvg_name': 'CCTV1', 'group_title': '', 'url': 'http://a.com/1'},
+            {'name': 'CCTV 1 HD', 'tvg_name': '', 'group_title': '', 'url': 'http://b.com/1'},
+            {'name': 'CCTV-4 欧洲', 'tvg_name': '', 'group_title': '', 'url': 'http://c.com/1'},
+        ]
+        result = SourceUtils.filter_and_translate(channels)
+        self.assertEqual([c['name'] for c in result], ['CCTV-1 综合', 'CCTV-1 综合'])
+        self.assertEqual(len(AggregatorUtils.pick_best_public(result)), 1)
+
 
 if __name__ == '__main__':
     unittest.main()
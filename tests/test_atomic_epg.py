@@ -1,14 +1,40 @@
-"""原子写入与 EPG 生成测试"""
+"""原子写入、EPG 生成与多日窗口存储测试"""
+import datetime
 import gzip
+import json
 import os
+import shutil
 import tempfile
 import unittest
 from unittest import mock
 
-from core.atomic_io import atomic_write_gzip, atomic_write_text
+from core import epg_store
+from core.atomic_io import atomic_stream_writer, atomic_write_chunks, atomic_write_gzip, atomic_write_text
 from core.epg import XmlUtils
 
 
+def _render():
+    """_write_xml_content 写入内存并返回全文（测试用）"""
+    parts = []
+    XmlUtils._write_xml_content(mock.Mock(write=parts.append))
+    return ''.join(parts)
+
+
+def _use_temp_store(test, past_days=None, future_days=None):
+    """EPG 存储指向临时目录；可收窄窗口（0/0 = 只有当天，与旧版单日行为一致）"""
+    store_dir = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, store_dir, True)
+    patchers = [mock.patch.object(epg_store, 'EPG_STORE_DIR', store_dir)]
+    if past_days is not None:
+        patchers.append(mock.patch.object(epg_store, 'EPG_WINDOW_PAST_DAYS', past_days))
+    if future_days is not None:
+        patchers.append(mock.patch.object(epg_store, 'EPG_WINDOW_FUTURE_DAYS', future_days))
+    for p in patchers:
+        p.start()
+        test.addCleanup(p.stop)
+    return store_dir
+
+
 class AtomicIoTest(unittest.TestCase):
 
     def setUp(self):
@@ -18,12 +44,12 @@ class AtomicIoTest(unittest.TestCase):
         return os.path.join(self.tmp_dir, name)
 
     def test_atomic_write_text(self):
-        """文本原子写入：内容正确、无 .tmp 残留"""
+        """文本原子写入：内容正确、无临时文件残留"""
         path = self._path('a.txt')
         atomic_write_text(path, '你好 hello')
         with open(path, encoding='utf-8') as f:
             self.assertEqual(f.read(), '你好 hello')
-        self.assertFalse(os.path.exists(path + '.tmp'))
+        self.assertEqual(os.listdir(self.tmp_dir), ['a.txt'])
         # 覆盖已有文件
         atomic_write_text(path, '第二次')
         with open(path, encoding='utf-8') as f:
@@ -35,7 +61,88 @@ class AtomicIoTest(unittest.TestCase):
         atomic_write_gzip(path, '压缩内容测试')
         with gzip.open(path, 'rt', encoding='utf-8') as f:
             self.assertEqual(f.read(), '压缩内容测试')
-        self.assertFalse(os.path.exists(path + '.tmp'))
+        self.assertEqual(os.listdir(self.tmp_dir), ['a.gz'])
+
+    def test_atomic_write_concurrent_same_target(self):
+        """多线程同时写同一目标（多 worker 写房间缓存/刷新标志）：不报错，结果为某一次完整写入，无残留"""
+        import threading
+        path = self._path('shared.json')
+        errors = []
+
+        def write(i):
+            try:
+                for _ in range(50):
+                    atomic_write_text(path, str(i) * 10000)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=write, args=(i,)) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        with open(path, encoding='utf-8') as f:
+            content = f.read()
+        self.assertEqual(content, content[0] * 10000)
+        self.assertEqual(os.listdir(self.tmp_dir), ['shared.json'])
+
+    def test_atomic_write_chunks_error_cleans_tmp(self):
+        """字节块写入中途异常：原文件保留，临时文件删除，异常继续抛出"""
+        path = self._path('feed.xml')
+        atomic_write_text(path, '旧内容')
+
+        def chunks():
+            yield b'<tv>'
+            raise ConnectionError('reset')
+
+        with self.assertRaises(ConnectionError):
+            atomic_write_chunks(path, chunks())
+        with open(path, encoding='utf-8') as f:
+            self.assertEqual(f.read(), '旧内容')
+        self.assertEqual(os.listdir(self.tmp_dir), ['feed.xml'])
+
+    def test_stream_writer_plain_and_gzip(self):
+        """流式写入：明文与 gzip 同一遍写出，内容一致、无 .tmp 残留"""
+        path, gz_path = self._path('sub/a.xml'), self._path('sub/a.xml.gz')
+        with atomic_stream_writer(path, gz_path) as out:
+            for part in ('<tv>', '节目 & 频道', '</tv>'):
+                out.write(part)
+        with open(path, encoding='utf-8') as f:
+            self.assertEqual(f.read(), '<tv>节目 & 频道</tv>')
+        with gzip.open(gz_path, 'rt', encoding='utf-8') as f:
+            self.assertEqual(f.read(), '<tv>节目 & 频道</tv>')
+        self.assertEqual(sorted(os.listdir(self._path('sub'))), ['a.xml', 'a.xml.gz'])
+
+    def test_stream_writer_concurrent_same_target(self):
+        """两个写入者交错写同一目标：临时文件各自独立，都能替换成功，后替换者生效"""
+        path, gz_path = self._path('c.xml'), self._path('c.xml.gz')
+        with atomic_stream_writer(path, gz_path) as first:
+            first.write('<tv>一')
+            with atomic_stream_writer(path, gz_path) as second:
+                second.write('<tv>二</tv>')
+            with open(path, encoding='utf-8') as f:
+                self.assertEqual(f.read(), '<tv>二</tv>')
+            first.write('</tv>')
+        with open(path, encoding='utf-8') as f:
+            self.assertEqual(f.read(), '<tv>一</tv>')
+        with gzip.open(gz_path, 'rt', encoding='utf-8') as f:
+            self.assertEqual(f.read(), '<tv>一</tv>')
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), ['c.xml', 'c.xml.gz'])
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o644)
+
+    def test_stream_writer_error_keeps_old(self):
+        """写入中途异常：原文件保留，临时文件清理，异常继续抛出"""
+        path, gz_path = self._path('a.xml'), self._path('a.xml.gz')
+        atomic_write_text(path, '旧内容')
+        with self.assertRaises(RuntimeError):
+            with atomic_stream_writer(path, gz_path) as out:
+                out.write('<tv>')
+                raise RuntimeError('boom')
+        with open(path, encoding='utf-8') as f:
+            self.assertEqual(f.read(), '旧内容')
+        self.assertFalse(os.path.exists(gz_path))
+        self.assertEqual(os.listdir(self.tmp_dir), ['a.xml'])
 
     def test_atomic_write_creates_dir(self):
         """父目录不存在时自动创建"""
@@ -47,6 +154,14 @@ class AtomicIoTest(unittest.TestCase):
 class EpgXmlTest(unittest.TestCase):
     """EPG 生成逻辑（mock 官方接口，验证输出格式与降级）"""
 
+    def setUp(self):
+        store_dir = _use_temp_store(self)
+        # 节目单拉取失败的重试退避不真等（多日窗口 × 重试次数）；生成锁文件放临时目录
+        for patcher in (mock.patch('core.epg.time.sleep'),
+                        mock.patch('core.epg.EPG_LOCK_PATH', os.path.join(store_dir, 'epg.lock'))):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
     def test_channel_block_format(self):
         """单频道块：channel + programme 结构正确，时间 GMT+8 格式"""
         item = {'name': '河南卫视', 'cid': 145}
@@ -80,31 +195,369 @@ class EpgXmlTest(unittest.TestCase):
         self.assertIn('<channel id="145">', block)
         self.assertNotIn('<programme', block)
 
-    def test_fetch_xml_non_200_returns_empty(self):
-        """列表接口非 200：返回空 tv 默认"""
-        with mock.patch('core.epg.ApiUtils.get_hntv_live_list') as m:
-            resp = mock.Mock()
-            resp.status_code = 500
-            m.return_value = resp
-            self.assertEqual(XmlUtils._fetch_xml_content(), XmlUtils.EMPTY_XML)
+    def test_list_non_200_without_store_keeps_files(self):
+        """列表接口非 200 且存储为空：生成失败，上次的 live.xml 原样保留（不写空文档）"""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir, True)
+        xml_path = os.path.join(tmp_dir, 'live.xml')
+        atomic_write_text(xml_path, '上次内容')
+        with mock.patch('core.epg.XML_FILE_PATH', xml_path), \
+             mock.patch('core.epg.GZ_FILE_PATH', os.path.join(tmp_dir, 'live.xml.gz')), \
+             mock.patch('core.epg.ApiUtils.get_hntv_live_list', return_value=mock.Mock(status_code=500)):
+            self.assertFalse(XmlUtils.get_and_save_xml_data())
+        with open(xml_path, encoding='utf-8') as f:
+            self.assertEqual(f.read(), '上次内容')
+
+    def test_list_non_200_renders_from_store(self):
+        """列表接口 500：按上次的频道列表从存储渲染，live.xml 内容不变，也不请求节目单接口"""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir, True)
+        xml_path = os.path.join(tmp_dir, 'live.xml')
+        live_list = mock.Mock(status_code=200, json=mock.Mock(return_value=[{'name': '河南卫视', 'cid': 145}]))
+        epg = mock.Mock(status_code=200, json=mock.Mock(return_value={'programs': [
+            {'title': '梨园春', 'beginTime': '1786511621', 'endTime': '1786515221'}]}))
+        with mock.patch('core.epg.XML_FILE_PATH', xml_path), \
+             mock.patch('core.epg.GZ_FILE_PATH', os.path.join(tmp_dir, 'live.xml.gz')):
+            with mock.patch('core.epg.ApiUtils.get_hntv_live_list', return_value=live_list), \
+                 mock.patch('core.epg.ApiUtils.get_hntv_epg_data', return_value=epg):
+                self.assertTrue(XmlUtils.get_and_save_xml_data())
+            with open(xml_path, encoding='utf-8') as f:
+                before = f.read()
+            with mock.patch('core.epg.ApiUtils.get_hntv_live_list', return_value=mock.Mock(status_code=500)), \
+                 mock.patch.object(epg_store, 'EPG_DAY_MAX_AGE', 0), \
+                 mock.patch('core.epg.ApiUtils.get_hntv_epg_data') as epg_api:
+                self.assertTrue(XmlUtils.get_and_save_xml_data())
+            epg_api.assert_not_called()
+        with open(xml_path, encoding='utf-8') as f:
+            self.assertEqual(f.read(), before)
+        self.assertIn('<display-name lang="zh">河南卫视</display-name>', before)
+        self.assertIn('<title lang="zh">梨园春</title>', before)
 
     def test_get_and_save_writes_files(self):
         """生成并原子落盘 xml 与 gz，内容一致"""
         tmp_dir = tempfile.mkdtemp()
         xml_path = os.path.join(tmp_dir, 'live.xml')
         gz_path = os.path.join(tmp_dir, 'live.xml.gz')
+        content = '<?xml version="1.0" encoding="UTF-8"?><tv></tv>'
+
+        def write(out):
+            out.write(content[:-5])
+            out.write(content[-5:])
+
         with mock.patch('core.epg.XML_FILE_PATH', xml_path), \
              mock.patch('core.epg.GZ_FILE_PATH', gz_path), \
-             mock.patch.object(XmlUtils, '_fetch_xml_content',
-                               return_value='<?xml version="1.0" encoding="UTF-8"?><tv></tv>'):
-            content = XmlUtils.get_and_save_xml_data()
+             mock.patch.object(XmlUtils, '_write_xml_content', side_effect=write):
+            self.assertTrue(XmlUtils.get_and_save_xml_data())
 
-        self.assertEqual(content, '<?xml version="1.0" encoding="UTF-8"?><tv></tv>')
         with open(xml_path, encoding='utf-8') as f:
             self.assertEqual(f.read(), content)
         with gzip.open(gz_path, 'rt', encoding='utf-8') as f:
             self.assertEqual(f.read(), content)
 
+    def test_get_and_save_failure_keeps_files(self):
+        """生成中途出错：返回 False，上次的文件原样保留"""
+        tmp_dir = tempfile.mkdtemp()
+        xml_path = os.path.join(tmp_dir, 'live.xml')
+        atomic_write_text(xml_path, '上次内容')
+
+        def write(out):
+            out.write(XmlUtils.XML_HEADER)
+            raise ValueError('bad json')
+
+        with mock.patch('core.epg.XML_FILE_PATH', xml_path), \
+             mock.patch('core.epg.GZ_FILE_PATH', os.path.join(tmp_dir, 'live.xml.gz')), \
+             mock.patch.object(XmlUtils, '_write_xml_content', side_effect=write):
+            self.assertFalse(XmlUtils.get_and_save_xml_data())
+        with open(xml_path, encoding='utf-8') as f:
+            self.assertEqual(f.read(), '上次内容')
+
+    def test_concurrent_cold_start_generates_once(self):
+        """冷启动并发请求：生成互斥，拿到锁后文件已存在的请求不再生成；残留临时文件被清理"""
+        import threading
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir, True)
+        xml_path = os.path.join(tmp_dir, 'live.xml')
+        active = {'now': 0, 'peak': 0, 'calls': 0}
+        lock = threading.Lock()
+
+        def write(out):
+            with lock:
+                active['now'] += 1
+                active['calls'] += 1
+                active['peak'] = max(active['peak'], active['now'])
+            threading.Event().wait(0.1)
+            out.write(XmlUtils.EMPTY_XML)
+            with lock:
+                active['now'] -= 1
+
+        with open(xml_path + '.killed.tmp', 'w') as f:
+            f.write('上次被杀的残留')
+        results = []
+        with mock.patch('core.epg.XML_FILE_PATH', xml_path), \
+             mock.patch('core.epg.GZ_FILE_PATH', os.path.join(tmp_dir, 'live.xml.gz')), \
+             mock.patch.object(XmlUtils, '_write_xml_content', side_effect=write):
+            threads = [threading.Thread(target=lambda: results.append(
+                XmlUtils.get_and_save_xml_data(unless_exists=(xml_path,)))) for _ in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            # 定时任务不带 unless_exists：总是重新生成
+            self.assertTrue(XmlUtils.get_and_save_xml_data())
+        self.assertEqual(results, [True] * 4)
+        self.assertEqual((active['calls'], active['peak']), (2, 1))
+        self.assertEqual(sorted(os.listdir(tmp_dir)), ['live.xml', 'live.xml.gz'])
+
+    def test_names_and_titles_escaped(self):
+        """频道名/节目名中的 & < > 引号与控制字符被转义/去除，输出可被 XML 解析"""
+        from xml.etree import ElementTree
+        item = {'name': 'A&B "台"', 'cid': 145}
+        with mock.patch('core.epg.ApiUtils.get_hntv_epg_data') as m:
+            m.return_value = mock.Mock(status_code=200, json=mock.Mock(return_value={'programs': [
+                {'title': '<新闻> & 天气\x01', 'beginTime': '1786511621', 'endTime': '1786515221'},
+            ]}))
+            block = XmlUtils._build_channel_block(item)
+        root = ElementTree.fromstring(f'<tv>{block}</tv>')
+        self.assertEqual(root.find('channel/display-name').text, 'A&B "台"')
+        self.assertEqual(root.find('programme/title').text, '<新闻> & 天气')
+
+
+class EpgConcurrentFetchTest(unittest.TestCase):
+    """逐频道并发拉取：顺序保持、超时重试、失败沿用已存储的节目单（窗口收窄为当天）"""
+
+    def setUp(self):
+        self.store_dir = _use_temp_store(self, past_days=0, future_days=0)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.xml_path = os.path.join(self.tmp_dir, 'live.xml')
+        patchers = [
+            mock.patch('core.epg.XML_FILE_PATH', self.xml_path),
+            mock.patch('core.epg.time.sleep'),
+        ]
+        for p in patchers:
+            p.start()
+            self.addCleanup(p.stop)
+
+    @staticmethod
+    def _resp(status, programs=None):
+        resp = mock.Mock()
+        resp.status_code = status
+        resp.json.return_value = {'programs': programs or []}
+        return resp
+
+    def _live_list(self, cids):
+        return mock.patch('core.epg.ApiUtils.get_hntv_live_list',
+                          return_value=mock.Mock(status_code=200, json=mock.Mock(
+                              return_value=[{'name': f'台{c}', 'cid': c} for c in cids])))
+
+    def test_order_preserved_under_concurrency(self):
+        """先提交的频道响应更慢：输出顺序仍与列表一致，且确实并发执行"""
+        import threading
+        active = {'now': 0, 'peak': 0}
+        lock = threading.Lock()
+
+        def epg(cid, ts, timeout=None):
+            with lock:
+                active['now'] += 1
+                active['peak'] = max(active['peak'], active['now'])
+            threading.Event().wait(0.05 * (5 - cid))  # time.sleep 已被 mock
+            with lock:
+                active['now'] -= 1
+            return self._resp(200, [{'title': f'节目{cid}', 'beginTime': '1786511621',
+                                     'endTime': '1786515221'}])
+
+        with self._live_list([1, 2, 3, 4]), \
+             mock.patch('core.epg.ApiUtils.get_hntv_epg_data', side_effect=epg):
+            content = _render()
+
+        positions = [content.index(f'<channel id="{c}">') for c in (1, 2, 3, 4)]
+        self.assertEqual(positions, sorted(positions))
+        self.assertGreater(active['peak'], 1)
+        self.assertTrue(content.endswith('</tv>'))
+
+    def test_retry_then_success(self):
+        """首次超时、重试成功：节目单正常输出，超时参数透传"""
+        calls = []
+
+        def epg(cid, ts, timeout=None):
+            calls.append(timeout)
+            if len(calls) == 1:
+                raise TimeoutError('read timeout')
+            return self._resp(200, [{'title': '梨园春', 'beginTime': '1', 'endTime': '2'}])
+
+        with mock.patch('core.epg.ApiUtils.get_hntv_epg_data', side_effect=epg):
+            block = XmlUtils._build_channel_block({'name': '河南卫视', 'cid': 145})
+        self.assertEqual(len(calls), 2)
+        self.assertTrue(all(t for t in calls))
+        self.assertIn('<title lang="zh">梨园春</title>', block)
+
+    def test_failure_falls_back_to_previous(self):
+        """单频道重试耗尽：沿用存储中该频道当天的旧节目，其它频道不受影响"""
+        with open(os.path.join(self.store_dir, '7.json'), 'w', encoding='utf-8') as f:
+            json.dump({epg_store.today().isoformat(): {
+                'fetched_at': 0, 'programs': [{'title': '上次节目', 'beginTime': '1', 'endTime': '2'}]}}, f)
+
+        def epg(cid, ts, timeout=None):
+            if cid == 7:
+                raise ConnectionError('down')
+            return self._resp(200, [{'title': '今日节目', 'beginTime': '1', 'endTime': '2'}])
+
+        with self._live_list([7, 8]), \
+             mock.patch('core.epg.ApiUtils.get_hntv_epg_data', side_effect=epg) as m:
+            content = _render()
+
+        self.assertIn('<title lang="zh">上次节目</title>', content)
+        self.assertIn('channel="8">\n<title lang="zh">今日节目</title>', content)
+        # cid=7 共尝试 1 + 重试次数
+        from config import EPG_FETCH_RETRIES
+        self.assertEqual(sum(1 for c in m.call_args_list if c.args[0] == 7), EPG_FETCH_RETRIES + 1)
+
+
+class EpgWindowTest(unittest.TestCase):
+    """多日窗口：按 (cid, 日期) 存储，只拉缺失/过期的日期，XML 从存储渲染"""
+
+    def setUp(self):
+        self.store_dir = _use_temp_store(self, past_days=1, future_days=2)
+        self.today = epg_store.today()
+        self.dates = epg_store.window_dates(self.today)
+        self.calls = []
+
+    def _epg(self, cid, ts, timeout=None):
+        day = datetime.datetime.fromtimestamp(ts, tz=epg_store.GMT8).date()
+        self.calls.append(day)
+        resp = mock.Mock(status_code=200)
+        resp.json.return_value = {'programs': [
+            {'title': f'{day.isoformat()} 节目', 'beginTime': str(ts + 3600), 'endTime': str(ts + 7200)},
+            {'title': '跨零点', 'beginTime': str(ts + 86000), 'endTime': str(ts + 90000)},
+        ]}
+        return resp
+
+    def _build(self):
+        with mock.patch('core.epg.ApiUtils.get_hntv_epg_data', side_effect=self._epg):
+            return XmlUtils._build_channel_block({'name': '河南卫视', 'cid': 145}, self.dates)
+
+    def test_window_rendered_in_order(self):
+        """首轮拉齐昨天 .. 后天共 4 天，按日期顺序输出，跨零点节目只出现一次"""
+        block = self._build()
+        self.assertEqual(self.calls, self.dates)
+        positions = [block.index(f'{day.isoformat()} 节目') for day in self.dates]
+        self.assertEqual(positions, sorted(positions))
+        self.assertEqual(block.count('跨零点'), 4)  # 每天一个，各自开始时间不同
+        self.assertEqual(len(epg_store.load(145)), 4)
+
+    def test_incremental_refresh(self):
+        """次轮只拉过期的当天及以后的日期；已过去的日期不再刷新"""
+        self._build()
+        self.calls.clear()
+        self.assertEqual(self._build().count('<programme'), 8)
+        self.assertEqual(self.calls, [])  # 都未过期
+
+        with mock.patch.object(epg_store, 'EPG_DAY_MAX_AGE', 0):  # 全部视为过期
+            self._build()
+        self.assertEqual(self.calls, self.dates[1:])
+
+    def test_day_rollover_fetches_new_day(self):
+        """窗口后移一天：只拉新进入窗口的日期，滑出窗口的日期从存储中裁掉"""
+        self._build()
+        self.calls.clear()
+        self.dates = epg_store.window_dates(self.today + datetime.timedelta(days=1))
+        with mock.patch.object(epg_store, 'today', return_value=self.today + datetime.timedelta(days=1)):
+            block = self._build()
+        self.assertEqual(self.calls, [self.dates[-1]])
+        self.assertNotIn(f'{(self.today - datetime.timedelta(days=1)).isoformat()} 节目', block)
+        self.assertEqual(sorted(epg_store.load(145)), [day.isoformat() for day in self.dates])
+
+    def test_stale_dates(self):
+        """缺失即拉；当天及以后按拉取时间过期；过去的日期存在即不拉"""
+        now = 1_000_000
+        old = now - epg_store.EPG_DAY_MAX_AGE
+        days = {self.dates[0].isoformat(): {'fetched_at': old},
+                self.dates[1].isoformat(): {'fetched_at': old},
+                self.dates[2].isoformat(): {'fetched_at': now - 60}}
+        self.assertEqual(epg_store.stale_dates(days, self.dates, now, self.today),
+                         [self.dates[1], self.dates[3]])
+
+    def test_load_channels_fallback(self):
+        """频道列表：有保存的列表用列表；没有则按存储里已有的频道文件兜底（名称用 cid）"""
+        self._build()
+        self.assertEqual(epg_store.load_channels(), [{'cid': '145', 'name': '145'}])
+        epg_store.save_channels([{'name': '河南卫视', 'cid': 145, 'url': 'x'}, {'name': '无 cid'}])
+        self.assertEqual(epg_store.load_channels(), [{'cid': 145, 'name': '河南卫视'}])
+
+
+class EpgRouteTest(unittest.TestCase):
+    """/api/live.xml：按 Accept-Encoding 直接发明文 / gz 文件，条件请求与 Range"""
+
+    XML = '<?xml version="1.0" encoding="UTF-8"?><tv><channel id="1"></channel></tv>'
+
+    def setUp(self):
+        from app import create_app
+        self.tmp_dir = tempfile.mkdtemp()
+        self.xml_path = os.path.join(self.tmp_dir, 'live.xml')
+        self.gz_path = os.path.join(self.tmp_dir, 'live.xml.gz')
+        atomic_write_text(self.xml_path, self.XML)
+        atomic_write_gzip(self.gz_path, self.XML)
+        for patcher in (mock.patch('app.XML_FILE_PATH', self.xml_path),
+                        mock.patch('app.GZ_FILE_PATH', self.gz_path),
+                        mock.patch.object(XmlUtils, 'get_and_save_xml_data')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        app = create_app()
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+
+    def test_plain_without_gzip(self):
+        """不接受 gzip：发明文文件，带 ETag / Last-Modified"""
+        resp = self.client.get('/api/live.xml', headers={'Accept-Encoding': 'identity'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data.decode('utf-8'), self.XML)
+        self.assertEqual(resp.mimetype, 'application/xml')
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertIn('ETag', resp.headers)
+        self.assertIn('Last-Modified', resp.headers)
+        self.assertEqual(resp.headers['Vary'], 'Accept-Encoding')
+        resp.close()
+
+    def test_gzip_served_directly(self):
+        """接受 gzip：直接发 .gz 文件字节（Content-Encoding: gzip），不解压"""
+        resp = self.client.get('/api/live.xml', headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        with open(self.gz_path, 'rb') as f:
+            self.assertEqual(resp.data, f.read())
+        self.assertEqual(gzip.decompress(resp.data).decode('utf-8'), self.XML)
+        resp.close()
+
+    def test_conditional_and_range(self):
+        """If-None-Match 命中 304；Range 返回 206 片段"""
+        first = self.client.get('/api/live.xml')
+        etag = first.headers['ETag']
+        first.close()
+        resp = self.client.get('/api/live.xml', headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 304)
+        resp = self.client.get('/api/live.xml', headers={'Range': 'bytes=0-4'})
+        self.assertEqual(resp.status_code, 206)
+        self.assertEqual(resp.data, self.XML.encode('utf-8')[:5])
+        resp.close()
+
+    def test_accel_redirect(self):
+        """配置 nginx 前缀：只回 X-Accel-Redirect 头，gzip 变体走 gz/ 子路径"""
+        with mock.patch('app.SENDFILE_ACCEL_PREFIX', '/_xml_data/'):
+            plain = self.client.get('/api/live.xml')
+            gz = self.client.get('/api/live.xml', headers={'Accept-Encoding': 'gzip'})
+            download = self.client.get('/api/live.xml.gz')
+        self.assertEqual(plain.headers['X-Accel-Redirect'], '/_xml_data/live.xml')
+        self.assertEqual(plain.data, b'')
+        self.assertEqual(gz.headers['X-Accel-Redirect'], '/_xml_data/gz/live.xml.gz')
+        self.assertEqual(gz.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(download.headers['X-Accel-Redirect'], '/_xml_data/live.xml.gz')
+        self.assertIn('attachment', download.headers['Content-Disposition'])
+
+    def test_generates_when_missing(self):
+        """两份文件都不存在：现场生成一次"""
+        os.remove(self.xml_path)
+        os.remove(self.gz_path)
+        self.client.get('/api/live.xml')
+        XmlUtils.get_and_save_xml_data.assert_called_once_with(unless_exists=(self.xml_path, self.gz_path))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,59 @@
+"""基准套件冒烟测试：小规模跑通流水线、合成源可解析、结果字段齐全"""
+import json
+import os
+import tempfile
+import unittest
+
+from benchmarks import bench_aggregation, bench_serving
+from benchmarks.fixtures import synthetic_m3u
+from core.sources import SourceUtils
+
+
+class BenchmarkSmokeTest(unittest.TestCase):
+
+    def test_synthetic_source_parses(self):
+        """合成源：条目数正确，过滤后只剩央视/卫视"""
+        channels = SourceUtils.parse_m3u_channels(synthetic_m3u(0, 200, 'http://h'))
+        self.assertEqual(len(channels), 200)
+        kept = SourceUtils.filter_and_translate(channels)
+        self.assertTrue(kept)
+        self.assertEqual({c['group_title'] for c in kept}, {'央视', '卫视'})
+
+    def test_run_writes_json_report(self):
+        """小规模端到端：各阶段均有耗时/分配/RSS 记录，失败比例生效"""
+        out = os.path.join(tempfile.mkdtemp(), 'bench.json')
+        self.assertEqual(bench_aggregation.main(
+            ['--sizes', '100', '--sources', '2', '--latency-ms', '0',
+             '--failure-rate', '1', '--probe-candidates', '--output', out]), 0)
+        with open(out, encoding='utf-8') as f:
+            report = json.load(f)
+        run = report['runs'][0]
+        self.assertEqual(run['entries_parsed'], 200)
+        self.assertEqual([s['stage'] for s in run['stages']],
+                         ['fetch_all_public_channels', 'probe_candidates', 'filter_and_translate',
+                          'pick_best_public', 'filter_unreachable', 'aggregate_m3u'])
+        for stage in run['stages']:
+            self.assertIn('wall_s', stage)
+            self.assertIn('alloc_peak_kb', stage)
+            self.assertGreater(stage['rss_peak_kb'], 0)
+        # 全部流地址失败：首轮失败仍保留（连续两轮才丢弃）
+        self.assertEqual(run['kept_channels'], run['unique_channels'])
+
+
+class ServingBenchmarkSmokeTest(unittest.TestCase):
+
+    def test_segment_streams_do_not_starve_playlist(self):
+        """gthread 单 worker：分片流占满转发名额时播放列表仍及时应答，超额分片 503 而非排队"""
+        result = bench_serving.run('gthread', streams=12, threads=12,
+                                   segment_seconds=1, playlist_requests=5)
+        self.assertEqual(result['streams_failed'], 0)
+        self.assertEqual(result['streams_completed'], 4)   # 12 线程 - 8 个保留
+        self.assertEqual(result['streams_rejected'], 8)
+        loaded = result['playlist_under_load']
+        self.assertEqual(loaded['failed'], 0)
+        # 分片要 1 秒才吐完；播放列表若排在分片后面，延迟至少接近 1 秒
+        self.assertLess(loaded['max_s'], 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
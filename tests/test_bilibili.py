@@ -2,14 +2,20 @@
 
 全部 mock 网络请求，不触碰真实直播源；用 unittest.mock 模拟 requests 响应。
 """
+import http.server
 import json
 import os
+import socketserver
 import tempfile
+import threading
+import time
 import unittest
 from unittest import mock
+from urllib.parse import parse_qs, urlsplit
 
+from core import http_client, segment_cache
 from core.aggregator import AggregatorUtils
-from core.bilibili import BilibiliUtils, _play_cache
+from core.bilibili import BilibiliUtils, _play_cache, _playlist_cache, _room_viewers
 
 
 def _fake_response(status_code=200, text='', json_data=None, headers=None):
@@ -22,9 +28,18 @@ def _fake_response(status_code=200, text='', json_data=None, headers=None):
     return resp
 
 
+def _room_ids(room_by_uid, default=None):
+    """构造 get_room_ids 的 mock：按 uid 映射返回房间号"""
+    return lambda uids: {str(uid): room_by_uid.get(uid, default) for uid in uids}
+
+
 class RoomResolveTest(unittest.TestCase):
     """房间号解析与磁盘缓存兜底"""
 
+    def setUp(self):
+        BilibiliUtils.reset_room_index()
+        self.addCleanup(BilibiliUtils.reset_room_index)
+
     def test_resolve_room_ok(self):
         """uid 解析成功：返回房间号/开播状态/标题"""
         resp = _fake_response(json_data={
@@ -55,13 +70,16 @@ class RoomResolveTest(unittest.TestCase):
         cache = {'2057655323': 22861369}
         with mock.patch.object(BilibiliUtils, '_load_room_cache', return_value=cache), \
              mock.patch.object(BilibiliUtils, '_save_room_cache'), \
+             mock.patch.object(BilibiliUtils, '_resolve_rooms_bulk', return_value=None), \
              mock.patch.object(BilibiliUtils, 'resolve_room_by_uid', return_value=None):
             self.assertEqual(BilibiliUtils.get_room_id(2057655323), 22861369)
+            BilibiliUtils.wait_room_refresh()
 
     def test_get_room_id_saves_cache(self):
         """解析成功时更新磁盘缓存"""
         info = {'room_id': 22861369, 'live_status': 1, 'title': 'x', 'online': 0}
-        with mock.patch.object(BilibiliUtils, 'resolve_room_by_uid', return_value=info), \
+        with mock.patch.object(BilibiliUtils, '_resolve_rooms_bulk', return_value=None), \
+             mock.patch.object(BilibiliUtils, 'resolve_room_by_uid', return_value=info), \
              mock.patch.object(BilibiliUtils, '_load_room_cache', return_value={}), \
              mock.patch.object(BilibiliUtils, '_save_room_cache') as save:
             self.assertEqual(BilibiliUtils.get_room_id(2057655323), 22861369)
@@ -69,6 +87,149 @@ class RoomResolveTest(unittest.TestCase):
             self.assertEqual(save.call_args[0][0], {'2057655323': 22861369})
 
 
+class _FakeBilibiliApi(http.server.BaseHTTPRequestHandler):
+    """本地 B 站接口替身：批量 get_status_info_by_uids + 单个 getRoomInfoOld"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        parts = urlsplit(self.path)
+        query = parse_qs(parts.query)
+        with server.lock:
+            server.hits.append(parts.path)
+        if parts.path == '/busy':
+            self._json(503, {})
+            return
+        if parts.path == '/bulk':
+            if server.bulk_down:
+                self._json(502, {})
+                return
+            uids = query.get('uids[]', [])
+            data = {uid: {'room_id': server.rooms[uid], 'live_status': 1, 'title': 't'}
+                    for uid in uids if uid in server.rooms and uid not in server.bulk_missing}
+            self._json(200, {'code': 0, 'data': data})
+        else:
+            uid = query.get('mid', [''])[0]
+            room_id = server.rooms.get(uid)
+            self._json(200, {'code': 0, 'data': {
+                'roomStatus': 1 if room_id else 0, 'roomid': room_id or 0, 'liveStatus': 0}})
+
+    def _json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class BatchRoomResolveTest(unittest.TestCase):
+    """批量房间解析：批量接口一次解析、回退逐个解析、内存索引、磁盘缓存每轮只写一次"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.srv = _Server(('127.0.0.1', 0), _FakeBilibiliApi)
+        cls.srv.lock = threading.Lock()
+        cls.base = f"http://127.0.0.1:{cls.srv.server_address[1]}"
+        threading.Thread(target=cls.srv.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.srv.shutdown()
+        cls.srv.server_close()
+
+    def setUp(self):
+        self.srv.hits = []
+        self.srv.rooms = {'1': 101, '2': 102, '3': 103}
+        self.srv.bulk_missing = set()
+        self.srv.bulk_down = False
+        http_client.close_all()
+        BilibiliUtils.reset_room_index()
+        self.addCleanup(BilibiliUtils.reset_room_index)
+        cache_path = os.path.join(tempfile.mkdtemp(), 'rooms.json')
+        for target, value in (('core.bilibili.BILIBILI_CACHE_PATH', cache_path),
+                              ('core.bilibili.ROOM_STATUS_BULK_API', self.base + '/bulk'),
+                              ('core.bilibili.ROOM_INFO_API', self.base + '/single'),
+                              ('core.bilibili.BILIBILI_COOKIE', ''),
+                              ('core.http_client.HTTP_RETRY_BACKOFF', 0)):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.cache_path = cache_path
+
+    def test_bulk_single_request(self):
+        """全部 uid 一次批量请求解析；内存索引命中后不再请求，也不读盘"""
+        with mock.patch.object(BilibiliUtils, '_save_room_cache',
+                               wraps=BilibiliUtils._save_room_cache) as save:
+            self.assertEqual(BilibiliUtils.get_room_ids([1, 2, 3]), {'1': 101, '2': 102, '3': 103})
+            self.assertEqual(self.srv.hits, ['/bulk'])
+            self.assertEqual(save.call_count, 1)
+            with mock.patch.object(BilibiliUtils, '_load_room_cache') as load:
+                self.assertEqual(BilibiliUtils.get_room_id(2), 102)
+            load.assert_not_called()
+        self.assertEqual(self.srv.hits, ['/bulk'])
+        with open(self.cache_path, encoding='utf-8') as f:
+            self.assertEqual(json.load(f), {'1': 101, '2': 102, '3': 103})
+
+    def test_fallback_to_single_calls(self):
+        """批量接口失败或漏掉的 uid：逐个调 getRoomInfoOld"""
+        self.srv.bulk_missing = {'3'}
+        self.assertEqual(BilibiliUtils.get_room_ids([1, 3]), {'1': 101, '3': 103})
+        self.assertEqual(sorted(self.srv.hits), ['/bulk', '/single'])
+
+        BilibiliUtils.reset_room_index()
+        os.remove(self.cache_path)
+        self.srv.hits = []
+        self.srv.bulk_down = True
+        self.assertEqual(BilibiliUtils.get_room_ids([1, 2]), {'1': 101, '2': 102})
+        self.assertEqual(self.srv.hits.count('/single'), 2)
+
+    def test_unresolved_uses_disk_cache(self):
+        """上游解析不到的 uid 用磁盘缓存兜底；缓存也没有则 None"""
+        with open(self.cache_path, 'w', encoding='utf-8') as f:
+            json.dump({'9': 909}, f)
+        self.assertEqual(BilibiliUtils.get_room_ids([1, 9, 8]), {'1': 101, '9': 909, '8': None})
+
+    def test_index_expiry_triggers_reresolve(self):
+        """内存索引过期后先返回旧房间号，后台重新批量解析"""
+        BilibiliUtils.get_room_ids([1])
+        self.srv.rooms['1'] = 111
+        with mock.patch('core.bilibili.BILIBILI_ROOM_INDEX_TTL', 0):
+            self.assertEqual(BilibiliUtils.get_room_ids([1]), {'1': 101})
+            BilibiliUtils.wait_room_refresh()
+        self.assertEqual(self.srv.hits, ['/bulk', '/bulk'])
+        self.assertEqual(BilibiliUtils.get_room_ids([1]), {'1': 111})
+
+    def test_disk_cache_seeded_with_mtime(self):
+        """磁盘缓存按文件修改时间计解析时间：未过期直接命中，不请求上游"""
+        with open(self.cache_path, 'w', encoding='utf-8') as f:
+            json.dump({'1': 101}, f)
+        self.assertEqual(BilibiliUtils.get_room_ids([1]), {'1': 101})
+        BilibiliUtils.wait_room_refresh()
+        self.assertEqual(self.srv.hits, [])
+
+    def test_failure_negatively_cached(self):
+        """解析失败的 uid 在 BILIBILI_ROOM_FAIL_TTL 内不再请求上游；过期后重试"""
+        self.srv.bulk_down = True
+        self.srv.rooms = {}
+        self.assertEqual(BilibiliUtils.get_room_ids([1]), {'1': None})
+        hits = len(self.srv.hits)
+        self.assertIn('/single', self.srv.hits)
+        self.assertEqual(BilibiliUtils.get_room_ids([1]), {'1': None})
+        self.assertEqual(len(self.srv.hits), hits)
+        with mock.patch('core.bilibili.BILIBILI_ROOM_FAIL_TTL', 0):
+            BilibiliUtils.get_room_ids([1])
+        self.assertEqual(len(self.srv.hits), 2 * hits)
+
+
 class PlayUrlResolveTest(unittest.TestCase):
     """流地址解析（旧接口多线路）与内存缓存"""
 
@@ -203,6 +364,10 @@ class PlayUrlResolveTest(unittest.TestCase):
 class IsLiveTest(unittest.TestCase):
     """开播判定：实测主清单 200 才算在播"""
 
+    def setUp(self):
+        BilibiliUtils.reset_route_health()
+        self.addCleanup(BilibiliUtils.reset_route_health)
+
     def test_is_live_true_when_200(self):
         """主线路 200：判定在播"""
         routes = [('http://x.com/a.m3u8?s=1', 'http://x.com/', 's=1')]
@@ -236,9 +401,182 @@ class IsLiveTest(unittest.TestCase):
             self.assertFalse(BilibiliUtils.is_live(999999))
 
 
+class RouteRefreshTest(unittest.TestCase):
+    """签名过期解析、线路缓存提前过期、有观众房间预刷新、失败主机降级"""
+
+    def setUp(self):
+        _play_cache.clear()
+        _room_viewers.clear()
+        BilibiliUtils.reset_route_health()
+        self.addCleanup(_play_cache.clear)
+        self.addCleanup(_room_viewers.clear)
+        self.addCleanup(BilibiliUtils.reset_route_health)
+
+    def test_route_expiry_params(self):
+        """expires= / deadline= 均可识别；无签名时间返回 None"""
+        self.assertEqual(BilibiliUtils._route_expiry(('u', 'b', 'expires=1700000000&len=0')), 1700000000)
+        self.assertEqual(BilibiliUtils._route_expiry(('u', 'b', 'deadline=1700000100')), 1700000100)
+        self.assertIsNone(BilibiliUtils._route_expiry(('u', 'b', 's=1')))
+
+    def test_cache_expires_before_signature(self):
+        """线路缓存在签名过期前 MARGIN 秒失效；无签名时间用默认 TTL"""
+        now = 1000000
+        signed = [('u', 'b', f'expires={now + 1000}'), ('u', 'b', f'expires={now + 3600}')]
+        self.assertEqual(BilibiliUtils._play_cache_expiry(signed, now), now + 1000 - 300)
+        self.assertEqual(BilibiliUtils._play_cache_expiry([('u', 'b', 's=1')], now), now + 1800)
+        # 签名比 MARGIN 还短：缓存到签名失效
+        self.assertEqual(BilibiliUtils._play_cache_expiry([('u', 'b', f'expires={now + 100}')], now),
+                         now + 100)
+
+    def test_refresh_only_active_expiring_rooms(self):
+        """只预刷新最近有观众且缓存即将过期的房间"""
+        now = 1000000
+        _play_cache[1] = (now + 30, ['old'])     # 有观众、快过期 → 刷新
+        _play_cache[2] = (now + 900, ['old'])    # 有观众、还新鲜 → 不刷新
+        _play_cache[3] = (now + 30, ['old'])     # 无观众 → 不刷新
+        _room_viewers.update({1: now - 10, 2: now - 10, 3: now - 600})
+        with mock.patch.object(BilibiliUtils, 'resolve_play_m3u8', return_value=['new']) as resolve:
+            self.assertEqual(BilibiliUtils.refresh_expiring_routes(now=now), [1])
+        resolve.assert_called_once_with(1, force=True)
+        self.assertNotIn(3, _room_viewers)
+
+    def test_playlist_request_marks_viewer(self):
+        """主清单请求记录观众活跃"""
+        with mock.patch.object(BilibiliUtils, '_fetch_proxied_m3u8', return_value='#EXTM3U\n'):
+            BilibiliUtils.build_proxied_m3u8(7, 'http://api')
+        self.assertIn(7, _room_viewers)
+        _playlist_cache.clear()
+
+    def test_failed_host_demoted(self):
+        """主机失败后降级：下次先试备用线路，不再先撞故障主机"""
+        routes = [('http://dead.com/d/a.m3u8?s=1', 'http://dead.com/d/', 's=1'),
+                  ('http://ok.com/d/a.m3u8?s=1', 'http://ok.com/d/', 's=1')]
+        ok = _fake_response(status_code=200)
+        with mock.patch.object(BilibiliUtils, '_request_get',
+                               side_effect=[_fake_response(status_code=403), ok, ok]) as req:
+            BilibiliUtils._try_routes(1, routes, lambda r: r[0])
+            _response, route = BilibiliUtils._try_routes(1, routes, lambda r: r[0])
+        self.assertEqual(route[0], 'http://ok.com/d/a.m3u8?s=1')
+        self.assertEqual([c[0][0] for c in req.call_args_list],
+                         ['http://dead.com/d/a.m3u8?s=1', 'http://ok.com/d/a.m3u8?s=1',
+                          'http://ok.com/d/a.m3u8?s=1'])
+
+
+class RouteHealthTest(unittest.TestCase):
+    """线路健康 EWMA 排序、(连接, 读取) 超时、对冲请求"""
+
+    ROUTES = [('http://slow.com/d/a.m3u8', 'http://slow.com/d/', ''),
+              ('http://fast.com/d/a.m3u8', 'http://fast.com/d/', '')]
+
+    def setUp(self):
+        BilibiliUtils.reset_route_health()
+        self.addCleanup(BilibiliUtils.reset_route_health)
+
+    def test_order_by_latency_and_errors(self):
+        """延迟低的主机排前；失败率高的主机即便快也排后"""
+        slow, fast = self.ROUTES
+        BilibiliUtils._mark_route(slow, True, 1.0)
+        BilibiliUtils._mark_route(fast, True, 0.1)
+        self.assertEqual(BilibiliUtils._order_routes(self.ROUTES), [fast, slow])
+        health = BilibiliUtils.route_health()
+        self.assertAlmostEqual(health['fast.com']['latency'], 0.1)
+        # fast 一次失败：降级期内排末尾
+        BilibiliUtils._mark_route(fast, False)
+        self.assertEqual(BilibiliUtils._order_routes(self.ROUTES), [slow, fast])
+        # 降级期过后按期望耗时（延迟 + 失败率惩罚）排序
+        with mock.patch('core.bilibili.time.time', return_value=time.time() + 3600):
+            self.assertEqual(BilibiliUtils._order_routes(self.ROUTES), [slow, fast])
+
+    def test_connect_read_timeout_tuple(self):
+        """线路请求使用 (连接, 读取) 超时元组"""
+        with mock.patch.object(BilibiliUtils, '_request_get',
+                               return_value=_fake_response(status_code=200)) as req:
+            BilibiliUtils._try_routes(1, self.ROUTES[:1], lambda r: r[0])
+        self.assertEqual(req.call_args[1]['timeout'], (3, 10))
+
+    def test_route_attempt_not_retried(self):
+        """线路请求不走预设重试：503 线路一次尝试只打一次上游，随即判失败"""
+        srv = _Server(('127.0.0.1', 0), _FakeBilibiliApi)
+        srv.lock = threading.Lock()
+        srv.hits = []
+        threading.Thread(target=srv.serve_forever, daemon=True).start()
+        self.addCleanup(srv.server_close)
+        self.addCleanup(srv.shutdown)
+        http_client.close_all()
+        self.addCleanup(http_client.close_all)
+        url = f"http://127.0.0.1:{srv.server_address[1]}/busy"
+        with mock.patch('core.http_client.HTTP_RETRY_BACKOFF', 0):
+            self.assertIsNone(BilibiliUtils._attempt_route((url, '', ''), lambda r: r[0], True))
+        self.assertEqual(srv.hits, ['/busy'])
+        health = BilibiliUtils.route_health()[f"127.0.0.1:{srv.server_address[1]}"]
+        self.assertGreater(health['demoted_until'], 0)
+
+    def test_segment_404_does_not_demote(self):
+        """分片 404（已滑出窗口）：不降级线路、不记失败率，也不强制重解析"""
+        route = self.ROUTES[1]
+        BilibiliUtils._mark_route(route, True, 0.1)
+        with mock.patch.object(BilibiliUtils, '_request_get',
+                               return_value=_fake_response(status_code=404)), \
+             mock.patch.object(BilibiliUtils, 'resolve_play_m3u8') as resolve:
+            self.assertEqual(BilibiliUtils._try_routes(1, [route], lambda r: r[0], stream=True),
+                             (None, None))
+        resolve.assert_not_called()
+        health = BilibiliUtils.route_health()['fast.com']
+        self.assertEqual((health['demoted_until'], health['errors']), (0, 0.0))
+
+    def test_403_refreshes_signature_without_demote(self):
+        """403（签名过期）：不降级线路，强制重解析后用新签名再试"""
+        fresh = ('http://fast.com/d/a.m3u8?sign=new', 'http://fast.com/d/', 'sign=new')
+
+        def fake_get(url, **_kwargs):
+            return _fake_response(status_code=200 if 'sign=new' in url else 403)
+
+        with mock.patch.object(BilibiliUtils, '_request_get', side_effect=fake_get), \
+             mock.patch.object(BilibiliUtils, 'resolve_play_m3u8', return_value=[fresh]) as resolve:
+            response, route = BilibiliUtils._try_routes(1, self.ROUTES, lambda r: r[0])
+        resolve.assert_called_once_with(1, force=True)
+        self.assertEqual((response.status_code, route), (200, fresh))
+        # 403 的线路从未记失败：无健康记录（未降级）
+        self.assertNotIn('slow.com', BilibiliUtils.route_health())
+
+    def test_hedged_request_takes_first_success(self):
+        """开启对冲：首选线路迟迟不响应时并发请求备用线路，取先成功者"""
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def fake_get(url, **_kwargs):
+            if 'slow.com' in url:
+                release.wait(5)
+            return _fake_response(status_code=200)
+
+        with mock.patch('core.bilibili.BILIBILI_HEDGE_REQUESTS', True), \
+                mock.patch('core.bilibili.BILIBILI_HEDGE_DEFAULT_DELAY', 0.05), \
+                mock.patch('core.bilibili.BILIBILI_HEDGE_MIN_DELAY', 0.05), \
+                mock.patch.object(BilibiliUtils, '_request_get', side_effect=fake_get):
+            started = time.monotonic()
+            response, route = BilibiliUtils._try_routes(1, self.ROUTES, lambda r: r[0])
+            elapsed = time.monotonic() - started
+        self.assertIsNotNone(response)
+        self.assertEqual(route, self.ROUTES[1])
+        self.assertLess(elapsed, 1)
+
+    def test_hedge_delay_p95(self):
+        """对冲等待取近期耗时 p95，样本不足用默认值"""
+        self.assertEqual(BilibiliUtils._hedge_delay(), 1.0)
+        for i in range(100):
+            BilibiliUtils._mark_route(self.ROUTES[0], True, 0.01 * (i + 1))
+        self.assertAlmostEqual(BilibiliUtils._hedge_delay(), 0.96)
+
+
 class M3u8RewriteTest(unittest.TestCase):
     """主清单分片 URL 重写（直连/代理两种模式）"""
 
+    def setUp(self):
+        BilibiliUtils.reset_route_health()
+        self.addCleanup(BilibiliUtils.reset_route_health)
+        _playlist_cache.clear()
+        self.addCleanup(_playlist_cache.clear)
+
     RAW_M3U8 = (
         "#EXTM3U\n"
         "#EXT-X-VERSION:3\n"
@@ -317,9 +655,89 @@ class M3u8RewriteTest(unittest.TestCase):
         self.assertEqual(req.call_count, 2)
 
 
+class PlaylistCacheTest(unittest.TestCase):
+    """重写后主清单缓存：TTL 取目标时长、并发单飞、上游失败沿用过期缓存"""
+
+    RAW_M3U8 = "#EXTM3U\n#EXT-X-TARGETDURATION:4\n#EXTINF:4.000,\nlive_abc-100.ts\n"
+    ROUTES = [('http://cdn.com/d/live.m3u8?s=1', 'http://cdn.com/d/', 's=1')]
+
+    def setUp(self):
+        BilibiliUtils.reset_route_health()
+        self.addCleanup(BilibiliUtils.reset_route_health)
+        _playlist_cache.clear()
+        self.addCleanup(_playlist_cache.clear)
+        patcher = mock.patch.object(BilibiliUtils, 'resolve_play_m3u8', return_value=self.ROUTES)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_ttl_from_target_duration(self):
+        """TTL 内重复请求命中缓存；过期后重新拉取；模式/基础地址不同分开缓存"""
+        resp = _fake_response(status_code=200, text=self.RAW_M3U8)
+        with mock.patch.object(BilibiliUtils, '_request_get', return_value=resp) as req, \
+                mock.patch('core.bilibili.time.time', return_value=1000.0) as clock:
+            first = BilibiliUtils.build_proxied_m3u8(1, 'http://api:5002')
+            self.assertEqual(BilibiliUtils.build_proxied_m3u8(1, 'http://api:5002'), first)
+            self.assertEqual(req.call_count, 1)
+            BilibiliUtils.build_proxied_m3u8(1, 'http://other:5002')
+            self.assertEqual(req.call_count, 2)
+            clock.return_value = 1004.5
+            BilibiliUtils.build_proxied_m3u8(1, 'http://api:5002')
+            self.assertEqual(req.call_count, 3)
+
+    def test_ttl_clamped(self):
+        """目标时长限定在 [MIN, MAX]，缺标签用默认值"""
+        self.assertEqual(BilibiliUtils._playlist_ttl('#EXTM3U\n#EXT-X-TARGETDURATION:60\n'), 10)
+        self.assertEqual(BilibiliUtils._playlist_ttl('#EXTM3U\n#EXT-X-TARGETDURATION:0\n'), 1)
+        self.assertEqual(BilibiliUtils._playlist_ttl('#EXTM3U\n'), 2)
+
+    def test_concurrent_requests_single_flight(self):
+        """并发请求同一房间清单：上游只拉一次"""
+        gate = threading.Event()
+        calls = []
+
+        def slow_get(url, **_kwargs):
+            calls.append(url)
+            gate.wait(2)
+            return _fake_response(status_code=200, text=self.RAW_M3U8)
+
+        results = []
+        with mock.patch.object(BilibiliUtils, '_request_get', side_effect=slow_get):
+            threads = [threading.Thread(
+                target=lambda: results.append(BilibiliUtils.build_proxied_m3u8(1, 'http://api')))
+                for _ in range(5)]
+            for t in threads:
+                t.start()
+            threading.Event().wait(0.1)
+            gate.set()
+            for t in threads:
+                t.join(5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 5)
+        self.assertEqual(len(set(results)), 1)
+
+    def test_stale_on_upstream_error(self):
+        """上游失败：沿用期内返回过期缓存，超出沿用期返回 None"""
+        ok = _fake_response(status_code=200, text=self.RAW_M3U8)
+        with mock.patch('core.bilibili.time.time', return_value=1000.0) as clock:
+            with mock.patch.object(BilibiliUtils, '_request_get', return_value=ok):
+                cached = BilibiliUtils.build_proxied_m3u8(1, 'http://api')
+            with mock.patch.object(BilibiliUtils, '_request_get',
+                                   return_value=_fake_response(status_code=403)):
+                clock.return_value = 1010.0
+                self.assertEqual(BilibiliUtils.build_proxied_m3u8(1, 'http://api'), cached)
+                clock.return_value = 1100.0
+                self.assertIsNone(BilibiliUtils.build_proxied_m3u8(1, 'http://api'))
+
+
 class ProxySegmentTest(unittest.TestCase):
     """分片反代：多线路切换与头部透传"""
 
+    def setUp(self):
+        BilibiliUtils.reset_route_health()
+        self.addCleanup(BilibiliUtils.reset_route_health)
+        segment_cache.clear()
+        self.addCleanup(segment_cache.clear)
+
     def test_proxy_segment_builds_signed_url(self):
         """分片 URL = 基础目录 + 相对路径 + 签名查询串；透传 Content-Type"""
         resp = mock.Mock()
@@ -370,15 +788,16 @@ class CookieTest(unittest.TestCase):
     def test_request_get_carries_cookie(self):
         """配置了 BILIBILI_COOKIE 时请求带上 Cookie 头"""
         with mock.patch('core.bilibili.BILIBILI_COOKIE', 'SESSDATA=abc123'), \
-             mock.patch('core.bilibili.requests.get') as get:
+             mock.patch('core.bilibili.http_client.get') as get:
             BilibiliUtils._request_get('http://x.com')
         headers = get.call_args[1]['headers']
         self.assertEqual(headers.get('Cookie'), 'SESSDATA=abc123')
+        self.assertEqual(get.call_args[1]['preset'], 'bilibili')
 
     def test_request_get_no_cookie(self):
         """未配置 cookie 时不带 Cookie 头"""
         with mock.patch('core.bilibili.BILIBILI_COOKIE', ''), \
-             mock.patch('core.bilibili.requests.get') as get:
+             mock.patch('core.bilibili.http_client.get') as get:
             BilibiliUtils._request_get('http://x.com')
         headers = get.call_args[1]['headers']
         self.assertNotIn('Cookie', headers)
@@ -423,7 +842,7 @@ class AggregateIntegrationTest(unittest.TestCase):
 
     def test_fetch_bilibili_skips_not_live(self):
         """未开播的房间被跳过，不进列表"""
-        with mock.patch.object(BilibiliUtils, 'get_room_id', return_value=22861369), \
+        with mock.patch.object(BilibiliUtils, 'get_room_ids', side_effect=_room_ids({}, 22861369)), \
              mock.patch.object(BilibiliUtils, 'is_live', return_value=False):
             channels = AggregatorUtils.fetch_bilibili_channels()
         self.assertEqual(channels, [])
@@ -434,8 +853,7 @@ class AggregateIntegrationTest(unittest.TestCase):
                  {'name': '河南卫视', 'uid': 2057655323}]
         room_by_uid = {222103174: 8178490, 2057655323: 22861369}
         with mock.patch('core.aggregator.BILIBILI_ROOMS', rooms), \
-             mock.patch.object(BilibiliUtils, 'get_room_id',
-                               side_effect=lambda uid: room_by_uid.get(uid)), \
+             mock.patch.object(BilibiliUtils, 'get_room_ids', side_effect=_room_ids(room_by_uid)), \
              mock.patch.object(BilibiliUtils, 'is_live', return_value=True):
             channels = AggregatorUtils.fetch_bilibili_channels()
         self.assertEqual(len(channels), 2)
@@ -452,15 +870,14 @@ class AggregateIntegrationTest(unittest.TestCase):
         def fake_is_live(room_id):
             return room_id == 8178490
 
-        with mock.patch.object(BilibiliUtils, 'get_room_id',
-                               side_effect=lambda uid: room_by_uid.get(uid)), \
+        with mock.patch.object(BilibiliUtils, 'get_room_ids', side_effect=_room_ids(room_by_uid)), \
              mock.patch.object(BilibiliUtils, 'is_live', side_effect=fake_is_live):
             channels = AggregatorUtils.fetch_bilibili_channels()
         self.assertEqual([c['name'] for c in channels], ['央视新闻'])
 
     def test_fetch_bilibili_room_fail_skip(self):
         """房间号解析失败：跳过"""
-        with mock.patch.object(BilibiliUtils, 'get_room_id', return_value=None):
+        with mock.patch.object(BilibiliUtils, 'get_room_ids', side_effect=_room_ids({})):
             channels = AggregatorUtils.fetch_bilibili_channels()
         self.assertEqual(channels, [])
 
@@ -615,8 +1032,7 @@ class ListRoomsTest(unittest.TestCase):
                  {'name': '中国应急管理', 'uid': 3707002299615617}]
         uid_map = {222103174: 8178490, 2057655323: 22861369, 3707002299615617: 1706660507}
         with mock.patch('core.aggregator.BILIBILI_ROOMS', rooms), \
-             mock.patch.object(BilibiliUtils, 'get_room_id',
-                               side_effect=lambda uid: uid_map.get(uid)), \
+             mock.patch.object(BilibiliUtils, 'get_room_ids', side_effect=_room_ids(uid_map)), \
              mock.patch.object(BilibiliUtils, 'load_custom_rooms', return_value=[
                  {'name': '动态重复', 'room_id': 8178490},   # 与静态重复，应被剔除
                  {'name': '动态新频道', 'room_id': 99999},    # 新房间，保留
@@ -630,10 +1046,10 @@ class ListRoomsTest(unittest.TestCase):
         self.assertEqual(rooms[-1]['source'], 'custom')
 
     def test_room_id_direct_in_static(self):
-        """静态配置支持 room_id 直填（不调 get_room_id）"""
+        """静态配置支持 room_id 直填（不调 get_room_ids）"""
         with mock.patch('core.aggregator.BILIBILI_ROOMS',
                         [{'name': '某频道', 'room_id': 12345}]), \
-             mock.patch.object(BilibiliUtils, 'get_room_id') as get_room, \
+             mock.patch.object(BilibiliUtils, 'get_room_ids') as get_room, \
              mock.patch.object(BilibiliUtils, 'load_custom_rooms', return_value=[]):
             rooms = AggregatorUtils.list_bilibili_rooms()
         self.assertEqual([r['room_id'] for r in rooms], [12345])
@@ -641,7 +1057,7 @@ class ListRoomsTest(unittest.TestCase):
 
     def test_fetch_includes_custom_live_room(self):
         """动态添加的开播房间被采集进列表"""
-        with mock.patch.object(BilibiliUtils, 'get_room_id', return_value=None), \
+        with mock.patch.object(BilibiliUtils, 'get_room_ids', side_effect=_room_ids({})), \
              mock.patch.object(BilibiliUtils, 'load_custom_rooms',
                                return_value=[{'name': '动态频道', 'room_id': 99999}]), \
              mock.patch.object(BilibiliUtils, 'is_live', return_value=True):
@@ -0,0 +1,188 @@
+"""外部 XMLTV 合并测试：条件 GET 落盘、gzip 识别、流式解析的频道对齐与窗口过滤、合并进 live.xml"""
+import datetime
+import gzip
+import http.server
+import shutil
+import socketserver
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from xml.etree import ElementTree
+
+from core import epg_feeds, epg_store, http_client
+from core.epg import XmlUtils
+from core.snapshot import PlaylistSnapshot
+
+PLAYLIST = ('#EXTM3U\n'
+            '#EXTINF:-1 tvg-id="145" tvg-name="145" group-title="河南卫视",河南卫视\nhttp://h/145\n'
+            '#EXTINF:-1 tvg-id="CCTV-1 综合" tvg-name="CCTV-1 综合" group-title="央视",CCTV-1 综合\nhttp://p/1\n'
+            '#EXTINF:-1 tvg-id="北京卫视" tvg-name="北京卫视" group-title="卫视",北京卫视\nhttp://p/2\n')
+
+
+def _xmltv_time(ts):
+    return datetime.datetime.fromtimestamp(ts, tz=epg_store.GMT8).strftime('%Y%m%d%H%M%S +0800')
+
+
+def _feed():
+    """外部源：CCTV1 / BTV北京卫视 / 河南卫视（官方已覆盖）/ 列表外频道；节目含窗口内外"""
+    today = epg_store.day_start(epg_store.today())
+    programmes = [
+        ('cctv1', today + 3600, '新闻联播 & 天气'),
+        ('cctv1', today - 5 * 86400, '窗口外旧节目'),
+        ('cctv1', today + 10 * 86400, '窗口外新节目'),
+        ('btv', today + 7200, '北京新闻'),
+        ('hntv', today + 3600, '梨园春'),
+        ('cctv2', today + 3600, '经济半小时'),
+    ]
+    body = ''.join(
+        f'<programme start="{_xmltv_time(ts)}" stop="{_xmltv_time(ts + 1800)}" channel="{cid}">'
+        f'<title lang="zh">{title.replace("&", "&amp;")}</title><desc>详情</desc></programme>'
+        for cid, ts, title in programmes)
+    return ('<?xml version="1.0" encoding="UTF-8"?><tv>'
+            '<channel id="cctv1"><display-name>CCTV1</display-name></channel>'
+            '<channel id="cctv1hd"><display-name>CCTV-1 HD</display-name></channel>'
+            '<channel id="btv"><display-name lang="zh">BTV北京卫视</display-name></channel>'
+            '<channel id="hntv"><display-name>河南卫视</display-name></channel>'
+            '<channel id="cctv2"><display-name>CCTV2</display-name></channel>'
+            f'{body}</tv>').encode('utf-8')
+
+
+class _FeedHandler(http.server.BaseHTTPRequestHandler):
+    """模拟外部源：/feed.xml 带 ETag（命中回 304），/feed.xml.gz 原样 gzip 文件，/down 500"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.hits.append((self.path, self.headers.get('If-None-Match')))
+        if self.path == '/down' or server.all_down:
+            self._send(500, b'')
+            return
+        if self.path.endswith('.gz'):
+            self._send(200, gzip.compress(_feed()), {'Content-Type': 'application/gzip'})
+            return
+        if self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self._send(200, _feed(), {'ETag': '"v1"', 'Content-Type': 'application/xml'})
+
+    def _send(self, status, body, headers=None):
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class EpgFeedTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.srv = _Server(('127.0.0.1', 0), _FeedHandler)
+        cls.srv.lock = threading.Lock()
+        cls.base = f"http://127.0.0.1:{cls.srv.server_address[1]}"
+        threading.Thread(target=cls.srv.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.srv.shutdown()
+        cls.srv.server_close()
+
+    def setUp(self):
+        self.srv.hits = []
+        self.srv.all_down = False
+        http_client.close_all()
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp, True)
+        for patcher in (mock.patch.object(epg_feeds, 'EPG_XMLTV_CACHE_DIR', tmp),
+                        mock.patch.object(epg_store, 'EPG_STORE_DIR', tmp),
+                        mock.patch.object(http_client, 'HTTP_RETRY_BACKOFF', 0),
+                        mock.patch('core.epg.time.sleep'),
+                        mock.patch('core.aggregator.AggregatorUtils.get_playlist_snapshot',
+                                   return_value=PlaylistSnapshot.build(PLAYLIST))):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        today = epg_store.day_start(epg_store.today())
+        self.window = (today - 86400, today + 3 * 86400)
+
+    def _programmes(self, path, exclude=()):
+        wanted = epg_feeds.playlist_channels({'145'})
+        return list(epg_feeds.iter_programmes(path, wanted, *self.window, exclude=exclude))
+
+    def test_conditional_get(self):
+        """首轮下载落盘，次轮带 If-None-Match 命中 304 复用；上游故障沿用缓存，无缓存返回 None"""
+        first = epg_feeds.fetch_feed(self.base + '/feed.xml')
+        self.assertEqual(epg_feeds.fetch_feed(self.base + '/feed.xml'), first)
+        self.assertEqual(self.srv.hits, [('/feed.xml', None), ('/feed.xml', '"v1"')])
+        self.srv.all_down = True
+        self.assertEqual(epg_feeds.fetch_feed(self.base + '/feed.xml'), first)
+        self.assertIsNone(epg_feeds.fetch_feed(self.base + '/down'))
+
+    def test_playlist_channels(self):
+        """待补频道：列表 tvg-id 按归一化频道名索引，跳过官方已覆盖的 cid"""
+        self.assertEqual(epg_feeds.playlist_channels({'145'}),
+                         {'CCTV-1 综合': 'CCTV-1 综合', '北京卫视': '北京卫视'})
+
+    def test_alignment_and_window(self):
+        """按显示名归一化对齐；列表外频道、窗口外节目丢弃；同台第二个外部频道不重复对齐"""
+        items = self._programmes(epg_feeds.fetch_feed(self.base + '/feed.xml'))
+        self.assertEqual([(tvg_id, title) for tvg_id, _b, _e, title in items],
+                         [('CCTV-1 综合', '新闻联播 & 天气'), ('北京卫视', '北京新闻')])
+        self.assertEqual(items[0][2] - items[0][1], 1800)
+
+    def test_gzip_feed_and_exclude(self):
+        """gzip 原样落盘的源按文件头识别；前面源已覆盖的频道不再对齐"""
+        path = epg_feeds.fetch_feed(self.base + '/feed.xml.gz')
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(2), b'\x1f\x8b')
+        items = self._programmes(path, exclude={'CCTV-1 综合'})
+        self.assertEqual([tvg_id for tvg_id, *_rest in items], ['北京卫视'])
+
+    def test_parse_time(self):
+        """带时区 / 缺时区（按 GMT+8）/ 缺秒 / 非法"""
+        self.assertEqual(epg_feeds.parse_time('20260101000000 +0000'), 1767225600)
+        self.assertEqual(epg_feeds.parse_time('20260101080000'), 1767225600)
+        self.assertEqual(epg_feeds.parse_time('202601010800 +0800'), 1767225600)
+        self.assertIsNone(epg_feeds.parse_time('tomorrow'))
+        self.assertIsNone(epg_feeds.parse_time(None))
+
+    def test_feed_urls_db_override(self):
+        """管理设置优先（逗号分隔，空串关闭），未设置回退 config"""
+        with mock.patch.object(epg_feeds, 'EPG_XMLTV_URLS', ['http://config/e.xml']), \
+             mock.patch('admin.db.get_effective_str', return_value=None):
+            self.assertEqual(epg_feeds.feed_urls(), ['http://config/e.xml'])
+        with mock.patch('admin.db.get_effective_str', return_value='http://a/e.xml, http://b/e.xml.gz'):
+            self.assertEqual(epg_feeds.feed_urls(), ['http://a/e.xml', 'http://b/e.xml.gz'])
+        with mock.patch('admin.db.get_effective_str', return_value=''):
+            self.assertEqual(epg_feeds.feed_urls(), [])
+
+    def test_merged_into_live_xml(self):
+        """官方频道之后追加对齐到列表 tvg-id 的外部频道与节目，整份文档可解析、标题已转义"""
+        live_list = mock.Mock(status_code=200, json=mock.Mock(return_value=[{'name': '河南卫视', 'cid': 145}]))
+        parts = []
+        with mock.patch.object(epg_feeds, 'feed_urls',
+                               return_value=[self.base + '/down', self.base + '/feed.xml.gz']), \
+             mock.patch('core.epg.ApiUtils.get_hntv_live_list', return_value=live_list), \
+             mock.patch('core.epg.ApiUtils.get_hntv_epg_data', return_value=mock.Mock(status_code=500)):
+            self.assertEqual(XmlUtils._write_xml_content(mock.Mock(write=parts.append)), 3)
+
+        root = ElementTree.fromstring(''.join(parts).encode('utf-8'))
+        self.assertEqual([c.get('id') for c in root.findall('channel')], ['145', 'CCTV-1 综合', '北京卫视'])
+        titles = {p.get('channel'): p.findtext('title') for p in root.findall('programme')}
+        self.assertEqual(titles, {'CCTV-1 综合': '新闻联播 & 天气', '北京卫视': '北京新闻'})
+
+
+if __name__ == '__main__':
+    unittest.main()
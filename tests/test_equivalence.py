@@ -8,6 +8,7 @@ import re
 import unittest
 from unittest import mock
 
+from config import GROUP_ORDER
 from core.aggregator import AggregatorUtils
 from monitoring.checks import CheckUtils
 
@@ -30,6 +31,54 @@ def _legacy_get_hntv_only_m3u(data):
     return m3u_content
 
 
+def _legacy_aggregate_render(hntv, public, bilibili, overrides):
+    """旧版 aggregate_m3u 的覆盖应用 + 字符串累加渲染（输入已去重择优）"""
+    merged = {}
+    order = []
+    for ch in hntv + public + bilibili:
+        if ch["name"] not in merged:
+            merged[ch["name"]] = ch
+            order.append(ch["name"])
+    for key in list(order):
+        ov = overrides.get(key)
+        if not ov:
+            continue
+        if ov.get("enabled") == 0:
+            merged.pop(key, None)
+            order.remove(key)
+            continue
+        if ov.get("display_name"):
+            merged[key] = dict(merged[key], name=ov["display_name"])
+        if ov.get("group_title"):
+            merged[key] = dict(merged[key], group_title=ov["group_title"])
+    order.sort(key=lambda k: GROUP_ORDER.get(merged[k]["group_title"], 3))
+    m3u_content = "#EXTM3U\n\n"
+    for key in order:
+        ch = merged[key]
+        if "cid" in ch:
+            tvg_id = str(ch["cid"]) if ch["cid"] is not None else ch["name"]
+        else:
+            tvg_id = ch["tvg_name"]
+        m3u_content += (
+            f'#EXTINF:-1 tvg-id="{tvg_id}" tvg-name="{tvg_id}" '
+            f'group-title="{ch["group_title"]}",{ch["name"]}\n'
+            f'{ch["url"]}\n\n'
+        )
+    return m3u_content
+
+
+def _legacy_get_bilibili_only_m3u(channels):
+    """旧版 get_bilibili_only_m3u 的字符串累加渲染"""
+    m3u_content = "#EXTM3U\n\n"
+    for ch in channels:
+        m3u_content += (
+            f'#EXTINF:-1 tvg-id="{ch["name"]}" tvg-name="{ch["name"]}" '
+            f'group-title="{ch["group_title"]}",{ch["name"]}\n'
+            f'{ch["url"]}\n\n'
+        )
+    return m3u_content
+
+
 def _legacy_fetch_m3u_groups(text):
     """旧版 MonitorUtils.fetch_m3u_urls 的行级状态机（cur_group 跨行继承）"""
     items = []
@@ -88,18 +137,57 @@ class LegacyGetHntvOnlyM3uEquivalenceTest(unittest.TestCase):
                          "#EXTM3U\n# Error: Failed to fetch data")
 
 
+class LegacyM3uWriterEquivalenceTest(unittest.TestCase):
+    """aggregate_m3u / get_bilibili_only_m3u：共享 writer 输出与旧版字符串累加逐字节一致"""
+
+    def setUp(self):
+        self.hntv = [
+            {'name': '河南卫视', 'cid': 145, 'group_title': '河南卫视', 'url': 'http://h/1.m3u8'},
+            {'name': '新闻频道', 'cid': None, 'group_title': '河南卫视', 'url': 'http://h/2.m3u8'},
+        ]
+        self.public = [
+            {'name': f'公开台{i}', 'tvg_name': f'tvg{i}', 'url': f'http://p/{i}.m3u8',
+             'group_title': ('央视', '卫视', '其他')[i % 3]}
+            for i in range(300)
+        ]
+        self.bilibili = [{'name': '央视新闻', 'tvg_name': '央视新闻', 'group_title': 'B站直播',
+                          'url': 'http://b/1.m3u8'}]
+
+    def _run_new(self, overrides):
+        with mock.patch('core.aggregator._get_channel_overrides', return_value=overrides):
+            return AggregatorUtils.aggregate_m3u(self.hntv, self.public, self.bilibili)
+
+    def test_no_overrides(self):
+        """无覆盖：一致"""
+        self.assertEqual(self._run_new({}),
+                         _legacy_aggregate_render(self.hntv, self.public, self.bilibili, {}))
+
+    def test_many_overrides(self):
+        """大量禁用/改名/改分组混合（单遍 dropped 集合 vs 旧版逐个 remove）：一致"""
+        overrides = {}
+        for i in range(0, 300, 2):
+            overrides[f'公开台{i}'] = {'enabled': 0}
+        for i in range(1, 300, 7):
+            overrides[f'公开台{i}'] = {'display_name': f'改名{i}', 'group_title': '测试组'}
+        overrides['新闻频道'] = {'group_title': '卫视'}
+        self.assertEqual(self._run_new(overrides),
+                         _legacy_aggregate_render(self.hntv, self.public, self.bilibili, overrides))
+
+    def test_bilibili_only(self):
+        """B 站降级列表：一致"""
+        with mock.patch.object(AggregatorUtils, 'fetch_bilibili_channels',
+                               return_value=self.bilibili * 2):
+            self.assertEqual(AggregatorUtils.get_bilibili_only_m3u(),
+                             _legacy_get_bilibili_only_m3u(self.bilibili * 2))
+
+
 class LegacyFetchM3uGroupsEquivalenceTest(unittest.TestCase):
     """fetch_m3u_groups：新版输出与旧版逐元素一致"""
 
     def _run_new(self, text):
-        with mock.patch('monitoring.checks.requests.get') as m:
-            resp = mock.Mock()
-            resp.status_code = 200
-            resp.text = text
-            m.return_value = resp
-            # 新版为 (url, group, name) 三元组，name 为新增排查信息；
-            # 等价性比较沿用旧版二元组口径
-            return [(u, g) for u, g, _ in CheckUtils.fetch_m3u_groups()]
+        # 新版为 (url, group, name) 三元组，name 为新增排查信息；
+        # 等价性比较沿用旧版二元组口径（取文本与解析已拆开，直接比解析器）
+        return [(u, g) for u, g, _ in CheckUtils.parse_m3u_groups(text)]
 
     def test_normal(self):
         """规范 m3u：EXTINF+group+URL 成对"""
@@ -112,15 +200,10 @@ class LegacyFetchM3uGroupsEquivalenceTest(unittest.TestCase):
 
     def test_name_extracted(self):
         """新增的频道名字段：从 EXTINF 行逗号后正确提取"""
-        with mock.patch('monitoring.checks.requests.get') as m:
-            resp = mock.Mock()
-            resp.status_code = 200
-            resp.text = (
-                '#EXTINF:-1 group-title="卫视",北京卫视\nhttp://a/1.m3u8\n'
-                "#EXTINF:-1,某频道\nhttp://b/2.m3u8\n"
-            )
-            m.return_value = resp
-            items = CheckUtils.fetch_m3u_groups()
+        items = CheckUtils.parse_m3u_groups(
+            '#EXTINF:-1 group-title="卫视",北京卫视\nhttp://a/1.m3u8\n'
+            "#EXTINF:-1,某频道\nhttp://b/2.m3u8\n"
+        )
         self.assertEqual(items, [
             ('http://a/1.m3u8', '卫视', '北京卫视'),
             ('http://b/2.m3u8', '卫视', '某频道'),
@@ -0,0 +1,72 @@
+"""故障切换测试：候选顺序选址、失败冷却与恢复、健康检查只探当前地址、/api/ch 跳转"""
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from core import failover
+
+
+class FailoverTableTest(unittest.TestCase):
+
+    def setUp(self):
+        failover.reset()
+        self.addCleanup(failover.reset)
+        failover.publish({'CCTV-1 综合': ['http://a/1', 'http://b/1', 'http://c/1']})
+
+    def test_resolve_prefers_first_healthy(self):
+        """未探测/可达取主地址；主地址失败切到下一个；全部失败仍回主地址"""
+        self.assertEqual(failover.resolve('CCTV-1 综合', now=100), 'http://a/1')
+        failover.mark('http://a/1', False, now=100)
+        self.assertEqual(failover.resolve('CCTV-1 综合', now=101), 'http://b/1')
+        failover.mark('http://b/1', False, now=101)
+        failover.mark('http://c/1', False, now=101)
+        self.assertEqual(failover.resolve('CCTV-1 综合', now=102), 'http://a/1')
+        self.assertIsNone(failover.resolve('不存在'))
+
+    def test_failed_url_retried_after_cooldown(self):
+        """失败地址冷却期过后重新参选"""
+        with mock.patch.object(failover, 'FAILOVER_RETRY_AFTER', 60):
+            failover.mark('http://a/1', False, now=100)
+        self.assertEqual(failover.resolve('CCTV-1 综合', now=159), 'http://b/1')
+        self.assertEqual(failover.resolve('CCTV-1 综合', now=160), 'http://a/1')
+
+    def test_check_once_probes_current_url(self):
+        """健康检查只探测各频道当前选用的地址；失败后下次请求即切换"""
+        with mock.patch.object(failover, 'probe_many', return_value=[False]) as probe:
+            self.assertEqual(failover.check_once(now=100), 1)
+        self.assertEqual(probe.call_args.args[0], ['http://a/1'])
+        self.assertEqual(failover.resolve('CCTV-1 综合', now=101), 'http://b/1')
+
+    def test_publish_replaces_table(self):
+        """新一轮聚合替换候选表，并清理不再出现的地址的健康记录"""
+        failover.mark('http://a/1', False, now=100)
+        failover.publish({'CCTV-1 综合': ['http://a/1', 'http://d/1'], '北京卫视': ['http://e/1']})
+        self.assertEqual(failover.resolve('CCTV-1 综合', now=101), 'http://d/1')
+        failover.publish({'北京卫视': ['http://e/1']})
+        self.assertIsNone(failover.resolve('CCTV-1 综合'))
+
+
+class ChannelRedirectRouteTest(unittest.TestCase):
+
+    def setUp(self):
+        failover.reset()
+        self.addCleanup(failover.reset)
+        patcher = mock.patch('admin.db.ADMIN_DB_PATH',
+                             os.path.join(tempfile.mkdtemp(), 'missing', 'a.db'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        from app import create_app
+        self.client = create_app().test_client()
+
+    def test_redirect_to_current_candidate(self):
+        failover.publish({'CCTV-1 综合': ['http://a/1', 'http://b/1']})
+        failover.mark('http://a/1', False)
+        resp = self.client.get('/api/ch/CCTV-1%20%E7%BB%BC%E5%90%88')
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(resp.headers['Location'], 'http://b/1')
+        self.assertEqual(self.client.get('/api/ch/unknown').status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
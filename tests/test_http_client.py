@@ -0,0 +1,132 @@
+"""上游连接池测试：keep-alive 复用、重试、预设请求头、cookie 不持久化、会话淘汰"""
+import http.server
+import socketserver
+import threading
+import unittest
+from unittest import mock
+
+from core import http_client
+from core.probing import probe_stream
+
+
+class _KeepAliveHandler(http.server.BaseHTTPRequestHandler):
+    """HTTP/1.1 保活服务：记录每个请求的客户端端口与请求头"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.client_address[1], self.path, dict(self.headers)))
+            fail = server.fail_left > 0 and self.path.startswith('/flaky')
+            if fail:
+                server.fail_left -= 1
+        if fail:
+            status, body = 503, b'busy'
+        elif self.path.startswith('/cookie'):
+            status, body = 200, b'ok'
+        else:
+            status, body = 200, b'x' * 100
+        self.send_response(status)
+        if self.path.startswith('/cookie'):
+            self.send_header('Set-Cookie', 'sid=abc; Path=/')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class HttpClientTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.srv = _Server(('127.0.0.1', 0), _KeepAliveHandler)
+        cls.srv.lock = threading.Lock()
+        cls.base = f"http://127.0.0.1:{cls.srv.server_address[1]}"
+        threading.Thread(target=cls.srv.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.srv.shutdown()
+        cls.srv.server_close()
+
+    def setUp(self):
+        http_client.close_all()
+        self.srv.requests = []
+        self.srv.fail_left = 0
+
+    def tearDown(self):
+        http_client.close_all()
+
+    def _client_ports(self):
+        return {port for port, _path, _headers in self.srv.requests}
+
+    def test_connection_reused(self):
+        """同主机连续请求复用同一 TCP 连接"""
+        for _ in range(5):
+            self.assertEqual(http_client.get(self.base + '/a').status_code, 200)
+        self.assertEqual(len(self.srv.requests), 5)
+        self.assertEqual(len(self._client_ports()), 1)
+
+    def test_session_per_preset_and_host(self):
+        """同主机同预设共用会话；预设不同则分开"""
+        a = http_client.get_session(self.base + '/x', 'default')
+        self.assertIs(a, http_client.get_session(self.base + '/y', 'default'))
+        self.assertIsNot(a, http_client.get_session(self.base + '/x', 'bilibili'))
+        with self.assertRaises(ValueError):
+            http_client.get_session(self.base, 'nope')
+
+    def test_retry_on_503(self):
+        """503 自动重试后成功（默认预设）"""
+        self.srv.fail_left = 1
+        with mock.patch.object(http_client, 'HTTP_RETRY_BACKOFF', 0):
+            http_client.close_all()
+            resp = http_client.get(self.base + '/flaky')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(self.srv.requests), 2)
+
+    def test_probe_preset_no_retry(self):
+        """探测预设不重试：503 直接返回给调用方判定"""
+        self.srv.fail_left = 1
+        resp = http_client.get(self.base + '/flaky', preset='probe')
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(len(self.srv.requests), 1)
+
+    def test_bilibili_preset_headers(self):
+        """bilibili 预设自带 Referer/UA；单次请求头可追加"""
+        http_client.get(self.base + '/b', preset='bilibili', headers={'Cookie': 'SESSDATA=x'})
+        headers = self.srv.requests[0][2]
+        self.assertEqual(headers['Referer'], 'https://live.bilibili.com/')
+        self.assertIn('Mozilla', headers['User-Agent'])
+        self.assertEqual(headers['Cookie'], 'SESSDATA=x')
+
+    def test_cookies_not_persisted(self):
+        """上游 Set-Cookie 不被会话保存，后续请求不带 Cookie"""
+        http_client.get(self.base + '/cookie')
+        http_client.get(self.base + '/a')
+        self.assertNotIn('Cookie', self.srv.requests[1][2])
+
+    def test_session_eviction(self):
+        """会话数超上限时淘汰最久未用的"""
+        with mock.patch.object(http_client, 'HTTP_MAX_SESSIONS', 2):
+            first = http_client.get_session('http://h1/')
+            http_client.get_session('http://h2/')
+            http_client.get_session('http://h3/')
+            self.assertEqual(http_client.session_count(), 2)
+            self.assertIsNot(first, http_client.get_session('http://h1/'))
+
+    def test_probe_reuses_connection(self):
+        """小响应体探测读完后连接回池：同主机多条探测共用连接"""
+        for i in range(4):
+            self.assertTrue(probe_stream(f"{self.base}/s{i}.m3u8"))
+        self.assertEqual(len(self._client_ports()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
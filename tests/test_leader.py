@@ -0,0 +1,197 @@
+"""调度选主测试：文件锁选主与接管、共享状态文件、follower 读 leader 落盘的快照/状态、刷新请求转交"""
+import fcntl
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import core.aggregator
+import scheduling
+from core import failover, leader, live_tracker
+from core.aggregator import AggregatorUtils
+
+
+class _TempDirTest(unittest.TestCase):
+    """每个用例独立临时目录；结束时释放选主锁"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+        leader.reset()
+        self.addCleanup(leader.reset)
+
+    def path(self, name):
+        return os.path.join(self.tmp, name)
+
+    def as_follower(self):
+        """当前进程扮演未当选的 follower"""
+        patcher = mock.patch.object(leader, '_started', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class ElectionTest(_TempDirTest):
+
+    def setUp(self):
+        super().setUp()
+        for name, value in (('LEADER_LOCK_PATH', self.path('scheduler.lock')),
+                            ('LEADER_RETRY_INTERVAL', 0.05)):
+            patcher = mock.patch.object(leader, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _hold_lock(self):
+        """模拟另一个 worker 持有选主锁（flock 按打开的文件描述计，同进程另开一份即可）"""
+        fd = os.open(leader.LEADER_LOCK_PATH, os.O_RDWR | os.O_CREAT)
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return fd
+
+    def test_first_worker_elected(self):
+        """锁空闲：当选并立即启动后台任务；再次 start 不重复启动；其他 worker 拿不到锁"""
+        calls = []
+        self.assertTrue(leader.start(lambda: calls.append(1)))
+        self.assertTrue(leader.start(lambda: calls.append(2)))
+        self.assertEqual(calls, [1])
+        self.assertTrue(leader.is_leader())
+        with open(leader.LEADER_LOCK_PATH) as f:
+            self.assertEqual(f.read().split()[0], str(os.getpid()))
+        fd = os.open(leader.LEADER_LOCK_PATH, os.O_RDWR)
+        self.addCleanup(os.close, fd)
+        with self.assertRaises(OSError):
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def test_follower_takes_over_when_leader_exits(self):
+        """锁被占：作为 follower 不启动任务；leader 释放锁后接管并启动任务"""
+        fd = self._hold_lock()
+        elected = threading.Event()
+        self.assertFalse(leader.start(elected.set))
+        self.assertFalse(leader.is_leader())
+        self.assertFalse(elected.wait(0.2))
+        os.close(fd)  # leader 进程退出，锁随之释放
+        self.assertTrue(elected.wait(2))
+        self.assertTrue(leader.is_leader())
+
+    def test_not_started_is_leader(self):
+        """未参与选主（测试 / 脚本）按单进程处理"""
+        self.assertTrue(leader.is_leader())
+        self.assertFalse(leader.started())
+
+
+class SharedStateTest(_TempDirTest):
+
+    def test_read_follows_mtime(self):
+        """读取按 mtime 缓存：文件更新后重新加载；文件缺失返回 None"""
+        state = leader.SharedState(self.path('state.json'))
+        with mock.patch.object(leader, 'SHARED_STATE_CHECK_INTERVAL', 0):
+            self.assertEqual(state.read(), (None, None))
+            state.write({'a': 1})
+            self.assertEqual(state.read()[0], {'a': 1})
+            state.write({'a': 2})
+            os.utime(state.path, (time.time() + 10, time.time() + 10))
+            self.assertEqual(state.read()[0], {'a': 2})
+
+    def test_read_throttled(self):
+        """检查间隔内不重新 stat，沿用上次结果"""
+        state = leader.SharedState(self.path('state.json'))
+        state.write({'a': 1})
+        self.assertEqual(state.read()[0], {'a': 1})
+        state.write({'a': 2})
+        os.utime(state.path, (time.time() + 10, time.time() + 10))
+        self.assertEqual(state.read()[0], {'a': 1})
+
+
+class FollowerTest(_TempDirTest):
+
+    def setUp(self):
+        super().setUp()
+        self.as_follower()
+
+    def test_snapshot_reloads_when_file_changes(self):
+        """follower 不跑聚合：聚合文件被 leader 更新后重新加载快照"""
+        m3u = self.path('aggregated.m3u')
+        with open(m3u, 'w', encoding='utf-8') as f:
+            f.write("#EXTM3U\n#EXTINF:-1,A\nhttp://a\n")
+        with mock.patch.object(core.aggregator, 'AGGREGATED_M3U_PATH', m3u), \
+             mock.patch.object(core.aggregator, 'SHARED_STATE_CHECK_INTERVAL', 0), \
+             mock.patch.object(core.aggregator, '_playlist_snapshot', None):
+            self.assertIn('http://a', AggregatorUtils.get_playlist_snapshot().text)
+            with open(m3u, 'w', encoding='utf-8') as f:
+                f.write("#EXTM3U\n#EXTINF:-1,B\nhttp://b\n")
+            os.utime(m3u, (time.time() + 10, time.time() + 10))
+            self.assertIn('http://b', AggregatorUtils.get_playlist_snapshot().text)
+
+    def test_refresh_request_handed_to_leader(self):
+        """follower 的刷新请求写标志文件（不在本进程聚合），leader 消费一次"""
+        flag = self.path('refresh.request')
+        with mock.patch.object(leader, 'REFRESH_REQUEST_PATH', flag), \
+             mock.patch.object(AggregatorUtils, '_async_refresh_worker') as worker:
+            AggregatorUtils.request_async_refresh()
+            AggregatorUtils.request_async_refresh()
+            worker.assert_not_called()
+            self.assertTrue(leader.take_refresh_request())
+            self.assertFalse(leader.take_refresh_request())
+
+    def test_live_state_from_leader(self):
+        """follower 查开播状态读 leader 发布的状态表，不做同步判定"""
+        shared = leader.SharedState(self.path('live_state.json'))
+        shared.write({'123': {'live': True, 'checked_at': time.time()}})
+        with mock.patch.object(live_tracker, '_shared', shared), \
+             mock.patch('core.bilibili.BilibiliUtils.is_live', side_effect=AssertionError):
+            self.assertTrue(live_tracker.is_live(123))
+            self.assertTrue(live_tracker.get_state(123)['live'])
+
+    def test_stale_live_state_falls_back(self):
+        """leader 发布的状态表过期：回退同步判定"""
+        shared = leader.SharedState(self.path('live_state.json'))
+        shared.write({'123': {'live': True}})
+        old = time.time() - 3600
+        os.utime(shared.path, (old, old))
+        self.addCleanup(live_tracker.reset)
+        with mock.patch.object(live_tracker, '_shared', shared), \
+             mock.patch('core.bilibili.BilibiliUtils.is_live', return_value=False) as is_live:
+            self.assertFalse(live_tracker.is_live(123))
+            is_live.assert_called_once_with(123)
+
+    def test_failover_resolve_from_leader(self):
+        """follower 的 /api/ch 跳转读 leader 发布的候选表与健康表"""
+        shared = leader.SharedState(self.path('failover_state.json'))
+        now = time.time()
+        shared.write({'candidates': {'CCTV1': ['http://a', 'http://b']},
+                      'health': {'http://a': {'ok': False, 'checked_at': now,
+                                              'retry_at': now + 600}}})
+        with mock.patch.object(failover, '_shared', shared):
+            self.assertEqual(failover.resolve('CCTV1', now), 'http://b')
+            self.assertIsNone(failover.resolve('CCTV2', now))
+
+
+class FailoverRestoreTest(_TempDirTest):
+
+    def test_new_leader_restores_table(self):
+        """接管的 leader 沿用落盘的候选表（不必等下轮聚合）"""
+        shared = leader.SharedState(self.path('failover_state.json'))
+        shared.write({'candidates': {'CCTV1': ['http://a', 'http://b']}, 'health': {}})
+        failover.reset()
+        self.addCleanup(failover.reset)
+        with mock.patch.object(failover, '_shared', shared):
+            failover._restore()
+            self.assertEqual(failover.resolve('CCTV1'), 'http://a')
+
+
+class RemainingWaitTest(_TempDirTest):
+
+    def test_remaining_wait(self):
+        """新 leader 按结果文件更新时间接续刷新周期"""
+        path = self.path('aggregated.m3u')
+        self.assertEqual(scheduling._remaining_wait(path, 600), 0)
+        with open(path, 'w') as f:
+            f.write('#EXTM3U\n')
+        mtime = os.path.getmtime(path)
+        self.assertEqual(scheduling._remaining_wait(path, 600, now=mtime + 100), 500)
+        self.assertEqual(scheduling._remaining_wait(path, 600, now=mtime + 700), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+"""B 站开播追踪测试：自适应检测周期、状态变化记录、查表与同步回退"""
+import datetime
+import unittest
+from unittest import mock
+
+from config import (BILIBILI_IDLE_CHECK_INTERVAL, BILIBILI_LIVE_CHECK_INTERVAL,
+                    BILIBILI_OFFLINE_CHECK_INTERVAL, BILIBILI_PEAK_CHECK_INTERVAL, GMT8)
+from core import live_tracker
+from core.bilibili import BilibiliUtils
+
+
+def _ts(hour, minute=0, day=11):
+    return datetime.datetime(2026, 8, day, hour, minute, tzinfo=GMT8).timestamp()
+
+
+class LiveTrackerTest(unittest.TestCase):
+
+    def setUp(self):
+        live_tracker.reset()
+        self.addCleanup(live_tracker.reset)
+
+    def _interval(self, room_id):
+        state = live_tracker.get_state(room_id)
+        return state['next_check_at'] - state['checked_at']
+
+    def test_record_change_timestamps(self):
+        """状态变化才更新 changed_at；首次记录不算变化"""
+        self.assertFalse(live_tracker.record(1, False, now=_ts(10)))
+        self.assertFalse(live_tracker.record(1, False, now=_ts(11)))
+        self.assertEqual(live_tracker.get_state(1)['changed_at'], _ts(10))
+        self.assertTrue(live_tracker.record(1, True, now=_ts(20)))
+        state = live_tracker.get_state(1)
+        self.assertEqual(state['changed_at'], _ts(20))
+        self.assertEqual(state['checked_at'], _ts(20))
+        self.assertEqual(state['start_minutes'], [20 * 60])
+
+    def test_adaptive_intervals(self):
+        """在播 / 未开播 / 临近历史开播时刻 / 久未开播 各自的检测间隔"""
+        live_tracker.record(1, True, now=_ts(12))
+        self.assertEqual(self._interval(1), BILIBILI_LIVE_CHECK_INTERVAL)
+
+        live_tracker.record(2, False, now=_ts(12))
+        self.assertEqual(self._interval(2), BILIBILI_OFFLINE_CHECK_INTERVAL)
+
+        # 20:00 开播过一次，次日 19:50 临近开播时刻 → 加密检测
+        live_tracker.record(3, False, now=_ts(10))
+        live_tracker.record(3, True, now=_ts(20))
+        live_tracker.record(3, False, now=_ts(23))
+        self.assertEqual(self._interval(3), BILIBILI_OFFLINE_CHECK_INTERVAL)
+        live_tracker.record(3, False, now=_ts(19, 50, day=12))
+        self.assertEqual(self._interval(3), BILIBILI_PEAK_CHECK_INTERVAL)
+
+        # 连续多天未开播 → 降频
+        live_tracker.record(4, False, now=_ts(12, day=1))
+        live_tracker.record(4, False, now=_ts(12, day=5))
+        self.assertEqual(self._interval(4), BILIBILI_IDLE_CHECK_INTERVAL)
+
+    def test_due_rooms(self):
+        """未追踪的房间立即到期；已检测的到 next_check_at 才到期"""
+        live_tracker.record(1, False, now=_ts(12))
+        self.assertEqual(live_tracker.due_rooms([1, 2], now=_ts(12)), [2])
+        self.assertEqual(live_tracker.due_rooms([1, 2], now=_ts(13)), [1, 2])
+
+    def test_is_live_fallback_and_lookup(self):
+        """追踪未运行：同步判定；运行中：已追踪房间直接查表，不再访问上游"""
+        with mock.patch.object(BilibiliUtils, 'is_live', return_value=True) as sync:
+            self.assertTrue(live_tracker.is_live(1))
+            self.assertEqual(sync.call_count, 1)
+            live_tracker._running.set()
+            self.assertTrue(live_tracker.is_live(1))
+            self.assertEqual(sync.call_count, 1)
+            # 未追踪的新房间仍同步判定
+            self.assertTrue(live_tracker.is_live(2))
+            self.assertEqual(sync.call_count, 2)
+
+    def test_sync_rooms_drops_removed(self):
+        """房间从配置删除后移出状态表"""
+        live_tracker.record(1, True)
+        live_tracker.record(2, True)
+        live_tracker._sync_rooms({2})
+        self.assertIsNone(live_tracker.get_state(1))
+        self.assertIsNotNone(live_tracker.get_state(2))
+
+
+if __name__ == '__main__':
+    unittest.main()
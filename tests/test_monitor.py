@@ -1,11 +1,17 @@
-"""监控状态机测试：分组阈值判定、卫视仅日志不告警、恢复通知、列表失败告警"""
+"""监控测试：流探测状态机（分组阈值、卫视仅日志、恢复通知、列表失败告警）与进程内检测项"""
+import gzip
 import os
 import tempfile
+import threading
+import time
 import unittest
 from unittest import mock
 
 from admin import db
-from config import XML_DATA_DIR
+from config import AGGREGATE_THREAD_NAME, XML_DATA_DIR
+from core import failover
+from core.snapshot import PlaylistSnapshot
+from core.probing import ProbeResult
 from monitoring.checks import CheckUtils
 
 
@@ -27,8 +33,10 @@ class StreamCheckStateMachineTest(unittest.TestCase):
         patcher_fetch = mock.patch.object(
             CheckUtils, 'fetch_m3u_groups',
             side_effect=lambda: list(self.items))
-        patcher_probe = mock.patch('monitoring.checks.probe_stream',
-                                   side_effect=lambda u, accept_403=False: self.probe_results.get(u, True))
+        patcher_probe = mock.patch('monitoring.checks.probe_many',
+                                   side_effect=lambda urls, concurrency=None, details=False: [
+                                       ProbeResult(self.probe_results.get(u, True), 200, 0.01)
+                                       for u in urls])
         patcher_alert = mock.patch('monitoring.checks.AlertUtils.send_alert',
                                    side_effect=lambda **kw: self.mails.append(kw))
         patcher_fetch.start()
@@ -89,5 +97,93 @@ class StreamCheckStateMachineTest(unittest.TestCase):
         self.assertEqual(self.mails[0]['level'], 'error')
 
 
+M3U = ('#EXTM3U\n\n#EXTINF:-1 tvg-id="1" group-title="央视",CCTV-1 综合\nhttp://a/1.m3u8\n\n'
+       '#EXTINF:-1 tvg-id="2" group-title="卫视",北京卫视\nhttp://b/2.m3u8\n\n')
+
+
+class InProcessCheckTest(unittest.TestCase):
+    """进程内检测：读快照/EPG 文件，不发 HTTP 请求"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.gz_path = os.path.join(self.tmp_dir, 'live.xml.gz')
+        for patcher in (
+            mock.patch('admin.db.ADMIN_DB_PATH', os.path.join(self.tmp_dir, 'missing', 'a.db')),
+            mock.patch('monitoring.checks.MONITOR_CHECK_MODE', 'inprocess'),
+            mock.patch('monitoring.checks.GZ_FILE_PATH', self.gz_path),
+            mock.patch('monitoring.checks.MIN_CHANNEL_COUNT', 2),
+            mock.patch('core.aggregator.AggregatorUtils.is_bilibili_only_mode', return_value=False),
+            # 进程内模式任何 HTTP 请求都是回归
+            mock.patch('monitoring.checks.requests.get', side_effect=AssertionError('HTTP 请求')),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _snapshot(self, snapshot):
+        return mock.patch('core.aggregator.AggregatorUtils.get_playlist_snapshot',
+                          return_value=snapshot)
+
+    def test_m3u_counts_and_freshness(self):
+        """快照频道数达标且新鲜 → 正常；发布过久 / 未发布 → 异常"""
+        with self._snapshot(PlaylistSnapshot.build(M3U)):
+            self.assertEqual(CheckUtils.check_m3u(), (True, 2))
+        with self._snapshot(PlaylistSnapshot.build(M3U, time.time() - 3 * 86400)):
+            self.assertEqual(CheckUtils.check_m3u(), (False, 2))
+        with self._snapshot(None):
+            self.assertEqual(CheckUtils.check_m3u(), (False, 0))
+
+    def test_epg_size_and_freshness(self):
+        """EPG 只 stat 文件：存在且新鲜 → 正常；过旧 / 缺失 → 异常"""
+        self.assertEqual(CheckUtils.check_epg(), (False, 0))
+        with open(self.gz_path, 'wb') as f:
+            f.write(gzip.compress(os.urandom(4096)))
+        ok, size_kb = CheckUtils.check_epg()
+        self.assertTrue(ok)
+        self.assertGreaterEqual(size_kb, 4)
+        old = time.time() - 3 * 86400
+        os.utime(self.gz_path, (old, old))
+        self.assertFalse(CheckUtils.check_epg()[0])
+
+    def test_health_follows_aggregate_thread(self):
+        """服务存活：聚合调度线程在运行"""
+        self.assertFalse(CheckUtils.check_health())
+        stop = threading.Event()
+        t = threading.Thread(target=stop.wait, name=AGGREGATE_THREAD_NAME, daemon=True)
+        t.start()
+        try:
+            self.assertTrue(CheckUtils.check_health())
+        finally:
+            stop.set()
+            t.join(1)
+
+    def test_fetch_groups_from_snapshot(self):
+        with self._snapshot(PlaylistSnapshot.build(M3U)):
+            self.assertEqual(CheckUtils.fetch_m3u_groups(), [
+                ('http://a/1.m3u8', '央视', 'CCTV-1 综合'),
+                ('http://b/2.m3u8', '卫视', '北京卫视'),
+            ])
+        with self._snapshot(None):
+            self.assertEqual(CheckUtils.fetch_m3u_groups(), [])
+
+    def test_fetch_groups_probes_upstream_once_per_channel(self):
+        """redirect 地址还原为当前候选；multi 多行与 tvbox 拼接只取主地址，每频道一条"""
+        failover.reset()
+        self.addCleanup(failover.reset)
+        failover.publish({'北京卫视': ['http://b/2.m3u8', 'http://c/2.m3u8']})
+        failover.mark('http://b/2.m3u8', False)
+        text = ('#EXTM3U\n'
+                '#EXTINF:-1 tvg-id="1" group-title="央视",CCTV-1 综合\nhttp://a/1.m3u8\n'
+                '#EXTINF:-1 tvg-id="1" group-title="央视",CCTV-1 综合\nhttp://a2/1.m3u8\n'
+                '#EXTINF:-1 tvg-id="2" group-title="卫视",北京卫视\n'
+                'http://127.0.0.1:8080/api/ch/%E5%8C%97%E4%BA%AC%E5%8D%AB%E8%A7%86\n'
+                '#EXTINF:-1 tvg-id="3" group-title="卫视",东方卫视\nhttp://d/3.m3u8#http://e/3.m3u8\n')
+        with self._snapshot(PlaylistSnapshot.build(text)):
+            self.assertEqual(CheckUtils.fetch_m3u_groups(), [
+                ('http://a/1.m3u8', '央视', 'CCTV-1 综合'),
+                ('http://c/2.m3u8', '卫视', '北京卫视'),
+                ('http://d/3.m3u8', '卫视', '东方卫视'),
+            ])
+
+
 if __name__ == '__main__':
     unittest.main()
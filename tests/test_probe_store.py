@@ -0,0 +1,101 @@
+"""探测结果共享存储测试：新鲜期判定、严格/宽松口径分列、失败计数整体替换、库未初始化兜底"""
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from admin import db
+from core import probe_store
+from core.probing import ProbeResult
+
+OK = ProbeResult(True, 206, 0.12)
+FAIL = ProbeResult(False, 404, 0.05)
+
+
+class ProbeStoreDbTest(unittest.TestCase):
+    """管理库已初始化：结果落 probe_results 表"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        patcher = mock.patch('admin.db.ADMIN_DB_PATH', os.path.join(self.tmp_dir, 't.db'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        db.init_db()
+
+    def test_fresh_window(self):
+        """新鲜期内可达才算；不可达、过期、max_age=0 均需重新探测"""
+        probe_store.record(['http://a', 'http://b'], [OK, FAIL], 'loose', now=1000)
+        self.assertEqual(probe_store.fresh_ok(['http://a', 'http://b', 'http://c'], 60, now=1050),
+                         {'http://a'})
+        self.assertEqual(probe_store.fresh_ok(['http://a'], 60, now=1100), set())
+        self.assertEqual(probe_store.fresh_ok(['http://a'], 0, now=1000), set())
+
+    def test_modes_stored_separately(self):
+        """严格口径失败不覆盖宽松口径的可达结论；任一口径新鲜可达即算"""
+        probe_store.record(['http://a'], [OK], 'loose', now=1000)
+        probe_store.record(['http://a'], [FAIL], 'strict', now=1010)
+        row = probe_store.get_results(['http://a'])['http://a']
+        self.assertEqual((row['loose_ok'], row['strict_ok']), (1, 0))
+        self.assertEqual((row['status'], row['latency'], row['checked_at']), (404, 0.05, 1010))
+        self.assertEqual(probe_store.fresh_ok(['http://a'], 60, now=1020), {'http://a'})
+
+    def test_fail_counts_replace(self):
+        """失败计数整体替换：未出现在新计数里的 URL 清零，且不影响已存探测结果"""
+        probe_store.record(['http://a'], [OK], 'loose', now=1000)
+        probe_store.save_fail_counts({'http://a': 1, 'http://b': 2})
+        self.assertEqual(probe_store.load_fail_counts(), {'http://a': 1, 'http://b': 2})
+        probe_store.save_fail_counts({'http://b': 3})
+        self.assertEqual(probe_store.load_fail_counts(), {'http://b': 3})
+        self.assertEqual(probe_store.get_results(['http://a'])['http://a']['loose_ok'], 1)
+
+    def test_legacy_fail_counts_migrated_once(self):
+        """旧 stream_failures.json 的计数迁入库（库里已有的以库为准），迁移后删除旧文件"""
+        path = os.path.join(self.tmp_dir, 'stream_failures.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'http://a': 1, 'http://b': 1, 'http://c': 0}, f)
+        probe_store.save_fail_counts({'http://b': 2})
+        self.assertEqual(probe_store.migrate_legacy_fail_counts(path), 2)
+        self.assertEqual(probe_store.load_fail_counts(), {'http://a': 1, 'http://b': 2})
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(probe_store.migrate_legacy_fail_counts(path), 0)
+
+    def test_old_results_pruned(self):
+        """超过保留天数且无失败计数的记录在下次写入时清理"""
+        probe_store.record(['http://old', 'http://failing'], [OK, FAIL], 'loose', now=0)
+        probe_store.save_fail_counts({'http://failing': 1})
+        probe_store.record(['http://new'], [OK], 'loose', now=30 * 86400)
+        self.assertEqual(sorted(probe_store.get_results(['http://old', 'http://failing', 'http://new'])),
+                         ['http://failing', 'http://new'])
+
+
+class ProbeStoreMemoryTest(unittest.TestCase):
+    """管理库未初始化：退回进程内兜底，不创建库文件"""
+
+    def setUp(self):
+        self.db_path = os.path.join(tempfile.mkdtemp(), 'missing', 't.db')
+        patcher = mock.patch('admin.db.ADMIN_DB_PATH', self.db_path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        probe_store.reset()
+        self.addCleanup(probe_store.reset)
+
+    def test_memory_fallback(self):
+        probe_store.record(['http://a'], [OK], 'strict', now=1000)
+        probe_store.save_fail_counts({'http://b': 1})
+        self.assertEqual(probe_store.fresh_ok(['http://a', 'http://b'], 60, now=1030), {'http://a'})
+        self.assertEqual(probe_store.load_fail_counts(), {'http://b': 1})
+        self.assertFalse(os.path.exists(self.db_path))
+
+    def test_legacy_file_kept_without_db(self):
+        """库未初始化：不迁移，保留旧文件等库可用后再迁"""
+        path = os.path.join(os.path.dirname(os.path.dirname(self.db_path)), 'stream_failures.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'http://a': 1}, f)
+        self.assertEqual(probe_store.migrate_legacy_fail_counts(path), 0)
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(probe_store.load_fail_counts(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
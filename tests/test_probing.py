@@ -1,10 +1,14 @@
 """流探测测试：可达/拒绝/超时判定、宽松 vs 严格口径"""
 import http.server
+import os
 import socketserver
 import threading
+import time
 import unittest
+from unittest import mock
 
-from core.probing import probe_stream
+from core import http_client, probing
+from core.probing import measure_many, probe_many, probe_stream
 
 
 class _Handler(http.server.BaseHTTPRequestHandler):
@@ -66,5 +70,194 @@ class ProbeStreamTest(unittest.TestCase):
         srv.server_close()
 
 
+class _BatchHandler(http.server.BaseHTTPRequestHandler):
+    """批量探测用 HTTP/1.1 服务：按路径模拟各类上游行为，记录客户端端口"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.ports.append(self.client_address[1])
+        path = self.path.split('?', 1)[0]
+        if 'slow' in path:
+            time.sleep(0.3)
+        if path.startswith('/redirect'):
+            self._send(302, b'', {'Location': '/ok.m3u8'})
+        elif path.startswith('/forbidden'):
+            self._send(403, b'forbidden')
+        elif path.startswith('/missing'):
+            self._send(404, b'nope')
+        elif path.startswith('/empty'):
+            self._send(200, b'')
+        elif path.startswith('/chunked'):
+            self.send_response(200)
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            self.wfile.write(b'5\r\nhello\r\n0\r\n\r\n')
+        elif path.startswith('/range'):
+            # 遵守 Range：206 + 1025 字节（小响应，连接可复用）
+            self._send(206, b'r' * 1025, {'Content-Range': 'bytes 0-1024/99999'})
+        else:
+            self._send(200, b'x' * 1000)
+
+    def _send(self, status, body, headers=None):
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _ThreadingServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class ProbeManyTest(unittest.TestCase):
+    """asyncio 批量探测：口径与 probe_stream 一致、顺序保持、并发、连接复用"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.srv = _ThreadingServer(('127.0.0.1', 0), _BatchHandler)
+        cls.srv.lock = threading.Lock()
+        cls.srv.ports = []
+        cls.base = f"http://127.0.0.1:{cls.srv.server_address[1]}"
+        threading.Thread(target=cls.srv.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.srv.shutdown()
+        cls.srv.server_close()
+
+    def setUp(self):
+        self.srv.ports = []
+
+    def test_semantics_match_probe_stream(self):
+        """各类响应在严格/宽松口径下与 probe_stream 判定一致"""
+        urls = [f"{self.base}/{p}" for p in
+                ('ok.m3u8', 'redirect', 'forbidden', 'missing', 'empty', 'chunked', 'range')]
+        urls += ["http://127.0.0.1:9/refused.m3u8", "not-a-url"]
+        for accept_403 in (False, True):
+            expected = [probe_stream(u, accept_403=accept_403, timeout=3) for u in urls]
+            self.assertEqual(probe_many(urls, accept_403=accept_403, timeout=3), expected)
+        self.assertEqual(probe_many(urls, timeout=3),
+                         [True, True, False, False, False, True, True, False, False])
+
+    def test_details(self):
+        """details=True：返回最终响应状态码与耗时；连接失败两者为 None"""
+        urls = [f"{self.base}/redirect", f"{self.base}/missing", "http://127.0.0.1:9/refused.m3u8"]
+        ok, missing, refused = probe_many(urls, timeout=3, details=True)
+        self.assertEqual((ok.ok, missing.ok, missing.status), (True, False, 404))
+        self.assertIn(ok.status, (200, 206))
+        self.assertGreaterEqual(ok.latency, 0)
+        self.assertEqual(refused, (False, None, None))
+
+    def test_measure_many(self):
+        """测速：可达地址给出 TTFB 与样本速率；慢首包 TTFB 更大；非 200/206 与连接失败不可达"""
+        urls = [f"{self.base}/ok.m3u8", f"{self.base}/slow-ok", f"{self.base}/missing",
+                "http://127.0.0.1:9/refused.m3u8"]
+        fast, slow, missing, refused = measure_many(urls, 4096, 1, timeout=3)
+        self.assertTrue(fast.ok and slow.ok)
+        self.assertGreaterEqual(slow.ttfb, 0.3)
+        self.assertLess(fast.ttfb, slow.ttfb)
+        self.assertEqual((missing.ok, missing.status), (False, 404))
+        self.assertEqual(refused, (False, None, None, None))
+        self.assertEqual(measure_many([], 4096, 1), [])
+
+    def test_measure_many_accept_403(self):
+        """宽松口径：403 算可达（无速率样本），与 probe_many(accept_403=True) 一致"""
+        url = f"{self.base}/forbidden"
+        self.assertFalse(measure_many([url], 4096, 1, timeout=3)[0].ok)
+        loose = measure_many([url], 4096, 1, accept_403=True, timeout=3)[0]
+        self.assertEqual((loose.ok, loose.status, loose.rate), (True, 403, None))
+        self.assertEqual(probe_many([url], accept_403=True, timeout=3), [True])
+
+    def test_empty_input(self):
+        """空列表直接返回空结果"""
+        self.assertEqual(probe_many([]), [])
+
+    def test_concurrent_and_ordered(self):
+        """10 条慢响应并发完成（远少于串行耗时），结果顺序与输入一致"""
+        urls = [f"{self.base}/slow{i}" for i in range(10)]
+        urls[3] = f"{self.base}/missing-slow"
+        started = time.time()
+        results = probe_many(urls, timeout=3, concurrency=10)
+        self.assertLess(time.time() - started, 2.0)
+        self.assertEqual(results, [i != 3 for i in range(10)])
+
+    def test_concurrency_limit(self):
+        """并发上限 1：退化为串行"""
+        urls = [f"{self.base}/slow{i}" for i in range(3)]
+        started = time.time()
+        self.assertEqual(probe_many(urls, timeout=3, concurrency=1), [True] * 3)
+        self.assertGreaterEqual(time.time() - started, 0.9)
+
+    def test_keep_alive_reuse(self):
+        """串行探测同主机的小响应：共用一条连接"""
+        urls = [f"{self.base}/range{i}" for i in range(5)]
+        self.assertEqual(probe_many(urls, timeout=3, concurrency=1), [True] * 5)
+        self.assertEqual(len(set(self.srv.ports)), 1)
+
+    def test_timeout(self):
+        """读超时：判不可达"""
+        self.assertEqual(probe_many([f"{self.base}/slow"], timeout=0.1), [False])
+
+
+class _ProxyHandler(http.server.BaseHTTPRequestHandler):
+    """正向代理替身：记录收到的绝对 URI 请求目标，回 200 + 数据"""
+
+    def do_GET(self):
+        self.server.targets.append(self.path)
+        self.send_response(200)
+        self.send_header('Content-Length', '1000')
+        self.end_headers()
+        self.wfile.write(b'x' * 1000)
+
+    def log_message(self, *args):
+        pass
+
+
+class ProbeProxyTest(unittest.TestCase):
+    """配置了环境代理：批量探测/测速改走 requests 经代理访问；NO_PROXY 排除的仍直连"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.proxy = _ThreadingServer(('127.0.0.1', 0), _ProxyHandler)
+        threading.Thread(target=cls.proxy.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.proxy.shutdown()
+        cls.proxy.server_close()
+
+    def setUp(self):
+        self.proxy.targets = []
+        http_client.close_all()
+        self.addCleanup(http_client.close_all)
+        patcher = mock.patch.dict(os.environ, {
+            'HTTP_PROXY': f"http://127.0.0.1:{self.proxy.server_address[1]}",
+            'NO_PROXY': 'direct.example'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_probe_and_measure_via_proxy(self):
+        """代理后的地址（本机无法直接解析）经代理探测可达、测速有数据"""
+        url = 'http://stream.invalid/live.m3u8'
+        self.assertEqual(probe_many([url], timeout=3, details=True)[0][:2], (True, 200))
+        self.assertTrue(measure_many([url], 4096, 1, timeout=3)[0].ok)
+        self.assertEqual(self.proxy.targets, [url, url])
+
+    def test_no_proxy_bypass(self):
+        """NO_PROXY 命中或协议无代理的地址仍走协程直连"""
+        proxies = {'http': 'http://proxy:3128'}
+        self.assertTrue(probing._uses_proxy('http://stream.invalid/a', proxies))
+        self.assertFalse(probing._uses_proxy('http://direct.example/a', proxies))
+        self.assertFalse(probing._uses_proxy('https://stream.invalid/a', proxies))
+        self.assertFalse(probing._uses_proxy('http://stream.invalid/a', {}))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,136 @@
+"""候选测速择优测试：启发式分组取前 N、可达者分辨率优先同分辨率比速度、403 宽松可达、全挂沿用上轮胜者、N=1 不测速"""
+import http.server
+import json
+import os
+import socketserver
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from core import probe_store, ranking
+from core.sources import SourceUtils
+
+KEY = SourceUtils.normalize_name('CCTV-1')
+BODY = b'#EXTM3U\n' + b'#EXTINF:-1,\nseg.ts\n' * 50
+
+
+class _CandidateHandler(http.server.BaseHTTPRequestHandler):
+    """候选上游：/fast 立即返回，/slow 首包延迟，/dead 404，/forbidden 403"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path.startswith('/slow'):
+            time.sleep(0.3)
+        if self.path.startswith('/dead'):
+            self._send(404, b'gone')
+        elif self.path.startswith('/forbidden'):
+            self._send(403, b'no')
+        else:
+            self._send(200, BODY)
+
+    def _send(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class RankPublicTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.srv = _Server(('127.0.0.1', 0), _CandidateHandler)
+        cls.base = f"http://127.0.0.1:{cls.srv.server_address[1]}"
+        threading.Thread(target=cls.srv.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.srv.shutdown()
+        cls.srv.server_close()
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.rankings_path = os.path.join(self.tmp_dir, 'rankings.json')
+        for patcher in (
+            mock.patch.object(ranking, 'CHANNEL_RANKINGS_PATH', self.rankings_path),
+            mock.patch.object(ranking, 'RANK_TOP_N', 3),
+            mock.patch('admin.db.ADMIN_DB_PATH', os.path.join(self.tmp_dir, 'missing', 'a.db')),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        probe_store.reset()
+        self.addCleanup(probe_store.reset)
+
+    def _channel(self, path, resolution=0):
+        return {'name': 'CCTV-1', 'url': f"{self.base}{path}", 'group_title': '央视',
+                '_resolution': resolution}
+
+    def test_group_candidates(self):
+        """同台按分辨率降序取前 N，重复地址只保留一个"""
+        chans = [self._channel('/a', 720), self._channel('/b', 1080),
+                 self._channel('/b', 1080), self._channel('/c', 480)]
+        groups = ranking.group_candidates(chans, 2)
+        self.assertEqual([item[0]['url'][-2:] for item in groups[KEY]], ['/b', '/a'])
+
+    def test_resolution_first_speed_breaks_tie(self):
+        """启发式第一名已失效：可达候选中分辨率最高者胜出，同分辨率内实测更快的优先；记入排名与探测结果"""
+        chans = [self._channel('/dead', 1080), self._channel('/slow', 720),
+                 self._channel('/fast', 720), self._channel('/fast-low', 480)]
+        with mock.patch.object(ranking, 'RANK_TOP_N', 4):
+            best = ranking.rank_public(chans)
+        self.assertEqual(best[KEY][0]['url'], f"{self.base}/fast")
+        self.assertEqual(best[KEY][0]['backup_urls'], [f"{self.base}/slow", f"{self.base}/fast-low"])
+        saved = json.load(open(self.rankings_path, encoding='utf-8'))[KEY]
+        self.assertEqual(saved['winner'], f"{self.base}/fast")
+        self.assertEqual([c['ok'] for c in saved['candidates']], [False, True, True, True])
+        self.assertEqual(probe_store.fresh_ok([c['url'] for c in saved['candidates']], 60),
+                         {f"{self.base}/slow", f"{self.base}/fast", f"{self.base}/fast-low"})
+
+    def test_speed_only(self):
+        """关闭分辨率优先：只比实测代价"""
+        chans = [self._channel('/dead', 1080), self._channel('/slow', 720),
+                 self._channel('/fast', 480)]
+        with mock.patch.object(ranking, 'RANK_PREFER_RESOLUTION', False):
+            best = ranking.rank_public(chans)
+        self.assertEqual(best[KEY][0]['url'], f"{self.base}/fast")
+        self.assertEqual(best[KEY][0]['backup_urls'], [f"{self.base}/slow"])
+
+    def test_forbidden_reachable_like_loose_filter(self):
+        """403 与聚合过滤宽松口径一致算可达（未采样，同分辨率内排在实测拉到数据的候选之后）"""
+        chans = [self._channel('/forbidden', 1080), self._channel('/forbidden-b', 720),
+                 self._channel('/slow', 720)]
+        best = ranking.rank_public(chans)
+        self.assertEqual(best[KEY][0]['url'], f"{self.base}/forbidden")
+        self.assertEqual(best[KEY][0]['backup_urls'], [f"{self.base}/slow", f"{self.base}/forbidden-b"])
+
+    def test_all_dead_keeps_previous_winner(self):
+        """候选全部测不通：沿用上轮胜者（仍在候选中时），否则启发式第一名"""
+        chans = [self._channel('/dead-a', 1080), self._channel('/dead-b', 720)]
+        json.dump({KEY: {'winner': f"{self.base}/dead-b"}},
+                  open(self.rankings_path, 'w', encoding='utf-8'))
+        self.assertEqual(ranking.rank_public(chans)[KEY][0]['url'], f"{self.base}/dead-b")
+        os.remove(self.rankings_path)
+        self.assertEqual(ranking.rank_public(chans)[KEY][0]['url'], f"{self.base}/dead-a")
+
+    def test_top_one_skips_measurement(self):
+        """N=1：退回纯启发式择优，不测速"""
+        chans = [self._channel('/dead', 1080), self._channel('/fast', 480)]
+        with mock.patch.object(ranking, 'RANK_TOP_N', 1), \
+             mock.patch.object(ranking, 'measure_many') as measure:
+            best = ranking.rank_public(chans)
+        measure.assert_not_called()
+        self.assertEqual(best[KEY][0]['url'], f"{self.base}/dead")
+
+
+if __name__ == '__main__':
+    unittest.main()
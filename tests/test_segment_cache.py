@@ -0,0 +1,129 @@
+"""分片缓存测试：并发请求合并为一次上游拉取、流式共享、窗口淘汰、失败不缓存"""
+import threading
+import unittest
+from unittest import mock
+
+from core import segment_cache
+
+
+class _GatedFetcher:
+    """可控上游：headers 立即返回，数据块按 gate 放行；记录拉取次数"""
+
+    def __init__(self, chunks=(b'aa', b'bb', b'cc'), status=200):
+        self.calls = 0
+        self.chunks = chunks
+        self.status = status
+        self.gate = threading.Event()
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            self.calls += 1
+        if self.status != 200:
+            return self.status, None, None
+        return 200, {'Content-Type': 'video/mp2t'}, self._iter()
+
+    def _iter(self):
+        yield self.chunks[0]
+        self.gate.wait(5)
+        yield from self.chunks[1:]
+
+
+class SegmentCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        segment_cache.clear()
+        self.addCleanup(segment_cache.clear)
+
+    def test_concurrent_viewers_single_upstream_fetch(self):
+        """多个观众同时请求同一分片：上游只拉一次，每个观众拿到完整数据"""
+        fetcher = _GatedFetcher()
+        results = []
+        lock = threading.Lock()
+
+        def viewer():
+            status, headers, stream = segment_cache.fetch(1, 'a-1.ts', fetcher)
+            data = b''.join(stream)
+            with lock:
+                results.append((status, headers['Content-Type'], data))
+
+        threads = [threading.Thread(target=viewer) for _ in range(5)]
+        for t in threads:
+            t.start()
+        fetcher.gate.set()
+        for t in threads:
+            t.join(5)
+        self.assertEqual(fetcher.calls, 1)
+        self.assertEqual(results, [(200, 'video/mp2t', b'aabbcc')] * 5)
+
+    def test_late_viewer_served_from_cache(self):
+        """分片拉完后的新观众直接读缓存，不再访问上游"""
+        fetcher = _GatedFetcher()
+        fetcher.gate.set()
+        self.assertEqual(b''.join(segment_cache.fetch(1, 'a-1.ts', fetcher)[2]), b'aabbcc')
+        self.assertEqual(b''.join(segment_cache.fetch(1, 'a-1.ts', fetcher)[2]), b'aabbcc')
+        self.assertEqual(fetcher.calls, 1)
+
+    def test_failure_not_cached(self):
+        """上游失败：返回错误码，条目移出缓存，下个请求重新拉取"""
+        fetcher = _GatedFetcher(status=404)
+        self.assertEqual(segment_cache.fetch(1, 'gone.ts', fetcher), (404, None, None))
+        self.assertEqual(segment_cache.fetch(1, 'gone.ts', fetcher), (404, None, None))
+        self.assertEqual(fetcher.calls, 2)
+
+    def test_window_eviction(self):
+        """每房间只保留最近 N 个分片；房间数超上限淘汰最久未访问的房间"""
+        fetcher = _GatedFetcher()
+        fetcher.gate.set()
+        with mock.patch.object(segment_cache, 'BILIBILI_SEGMENT_CACHE_PER_ROOM', 2), \
+             mock.patch.object(segment_cache, 'BILIBILI_SEGMENT_CACHE_ROOMS', 1):
+            for seg in ('s1.ts', 's2.ts', 's3.ts'):
+                b''.join(segment_cache.fetch(1, seg, fetcher)[2])
+            self.assertEqual(segment_cache.cached_segments(1), ['s2.ts', 's3.ts'])
+            b''.join(segment_cache.fetch(2, 's1.ts', fetcher)[2])
+            self.assertEqual(segment_cache.cached_segments(1), [])
+
+    def test_fetcher_exception(self):
+        """fetcher 抛异常按 500 处理"""
+        def boom():
+            raise RuntimeError('down')
+        self.assertEqual(segment_cache.fetch(1, 'x.ts', boom), (500, None, None))
+
+
+class StreamSlotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(setattr, segment_cache, '_active_streams', 0)
+        segment_cache._active_streams = 0
+
+    def test_limit(self):
+        """名额用尽返回 False；归还后可再占用"""
+        with mock.patch.object(segment_cache, 'SEGMENT_STREAM_LIMIT', 2):
+            self.assertTrue(segment_cache.acquire_stream())
+            self.assertTrue(segment_cache.acquire_stream())
+            self.assertFalse(segment_cache.acquire_stream())
+            segment_cache.release_stream()
+            self.assertTrue(segment_cache.acquire_stream())
+
+    def test_unlimited(self):
+        """上限 0 表示不限"""
+        with mock.patch.object(segment_cache, 'SEGMENT_STREAM_LIMIT', 0):
+            for _ in range(100):
+                self.assertTrue(segment_cache.acquire_stream())
+
+    def test_slot_released_once_on_close(self):
+        """响应关闭（转发完 / 客户端断开）归还名额，重复 close 不重复归还；透传数据并关闭内层迭代器"""
+        inner = mock.MagicMock()
+        inner.__iter__.return_value = iter([b'a', b'b'])
+        segment_cache.acquire_stream()
+        segment_cache.acquire_stream()
+        slot = segment_cache.StreamSlot(inner)
+        self.assertEqual(b''.join(slot), b'ab')
+        slot.close()
+        slot.close()
+        self.assertEqual(segment_cache.active_streams(), 1)
+        inner.close.assert_called_once_with()
+
+
+if __name__ == '__main__':
+    unittest.main()
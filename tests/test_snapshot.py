@@ -0,0 +1,159 @@
+"""播放列表快照测试：预编码变体、聚合落盘后发布、条件请求 304 与编码协商"""
+import gzip
+import os
+import tempfile
+import unittest
+import zlib
+from unittest import mock
+
+import core.aggregator
+from core.aggregator import AggregatorUtils
+from core.snapshot import PlaylistSnapshot
+
+M3U = '#EXTM3U\n\n#EXTINF:-1 tvg-id="145" tvg-name="145" group-title="河南卫视",河南卫视\nhttp://h/1.m3u8\n\n'
+
+
+class PlaylistSnapshotTest(unittest.TestCase):
+
+    def test_variants_roundtrip(self):
+        """三种编码解码后与原文一致；频道数按 EXTINF 计"""
+        snap = PlaylistSnapshot.build(M3U, last_modified=1700000000.7)
+        self.assertEqual(snap.body.decode('utf-8'), M3U)
+        self.assertEqual(gzip.decompress(snap.gzip_body).decode('utf-8'), M3U)
+        self.assertEqual(zlib.decompress(snap.deflate_body).decode('utf-8'), M3U)
+        self.assertEqual(snap.last_modified, 1700000000)
+        self.assertEqual(snap.channel_count, 1)
+
+    def test_etag_stable_and_per_variant(self):
+        """同内容 ETag 稳定（gzip 字节也稳定）；各变体 ETag 互不相同"""
+        a = PlaylistSnapshot.build(M3U)
+        b = PlaylistSnapshot.build(M3U)
+        self.assertEqual(a.etag, b.etag)
+        self.assertEqual(a.gzip_body, b.gzip_body)
+        self.assertEqual(len(set(a.all_etags())), 3)
+        self.assertNotEqual(a.etag, PlaylistSnapshot.build(M3U + '#\n').etag)
+
+
+class SnapshotPublishTest(unittest.TestCase):
+    """聚合落盘后发布快照；冷启动从磁盘加载"""
+
+    def setUp(self):
+        core.aggregator._playlist_snapshot = None
+        self.db_patcher = mock.patch('admin.db.ADMIN_DB_PATH',
+                                     os.path.join(tempfile.mkdtemp(), 'uninit.db'))
+        self.db_patcher.start()
+        self.addCleanup(self.db_patcher.stop)
+
+    def tearDown(self):
+        core.aggregator._playlist_snapshot = None
+
+    def test_published_after_aggregation(self):
+        """_get_aggregated_m3u_locked 落盘后快照即为本轮内容"""
+        with mock.patch('core.aggregator.BILIBILI_ONLY_MODE', False), \
+             mock.patch.object(AggregatorUtils, 'fetch_hntv_channels', return_value=[]), \
+             mock.patch.object(AggregatorUtils, 'prepare_public_channels', return_value=[]), \
+             mock.patch.object(AggregatorUtils, '_save_public_channels'), \
+             mock.patch.object(AggregatorUtils, 'fetch_bilibili_channels', return_value=[]), \
+             mock.patch('core.aggregator.atomic_write_text'):
+            content = AggregatorUtils._get_aggregated_m3u_locked()
+        self.assertEqual(AggregatorUtils.get_playlist_snapshot().text, content)
+
+    def test_cold_start_loads_from_disk(self):
+        """未发布时从磁盘聚合文件加载，Last-Modified 取文件 mtime"""
+        path = os.path.join(tempfile.mkdtemp(), 'aggregated.m3u')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(M3U)
+        os.utime(path, (1700000000, 1700000000))
+        with mock.patch('core.aggregator.AGGREGATED_M3U_PATH', path):
+            snap = AggregatorUtils.get_playlist_snapshot()
+        self.assertEqual(snap.text, M3U)
+        self.assertEqual(snap.last_modified, 1700000000)
+
+    def test_no_file_returns_none(self):
+        """磁盘无聚合文件：返回 None（路由走降级）"""
+        with mock.patch('core.aggregator.AGGREGATED_M3U_PATH',
+                        os.path.join(tempfile.mkdtemp(), 'missing.m3u')):
+            self.assertIsNone(AggregatorUtils.get_playlist_snapshot())
+
+
+class PlaylistRouteTest(unittest.TestCase):
+    """/api/live.m3u8：304 条件请求与 Accept-Encoding 协商"""
+
+    def setUp(self):
+        from app import create_app
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.client = self.app.test_client()
+        core.aggregator._playlist_snapshot = None
+        self.snap = AggregatorUtils.publish_playlist_snapshot(M3U, last_modified=1700000000)
+
+    def tearDown(self):
+        core.aggregator._playlist_snapshot = None
+
+    def test_full_body_with_validators(self):
+        """首次请求：200 + 原文 + ETag/Last-Modified"""
+        resp = self.client.get('/api/live.m3u8')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data.decode('utf-8'), M3U)
+        self.assertEqual(resp.headers['Content-Type'], 'application/x-mpegURL')
+        self.assertEqual(resp.headers['ETag'], f'"{self.snap.etag}"')
+        self.assertIn('Last-Modified', resp.headers)
+
+    def test_if_none_match_304(self):
+        """If-None-Match 命中：304 无正文"""
+        resp = self.client.get('/api/live.m3u8',
+                               headers={'If-None-Match': f'"{self.snap.etag}"'})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.data, b'')
+
+    def test_if_none_match_stale_200(self):
+        """If-None-Match 为旧 ETag：200 返回新内容"""
+        resp = self.client.get('/api/live.m3u8', headers={'If-None-Match': '"old"'})
+        self.assertEqual(resp.status_code, 200)
+
+    def test_if_modified_since_304(self):
+        """If-Modified-Since 不早于发布时间：304"""
+        resp = self.client.get('/api/live.m3u8',
+                               headers={'If-Modified-Since': 'Tue, 14 Nov 2023 22:13:20 GMT'})
+        self.assertEqual(resp.status_code, 304)
+
+    def test_gzip_negotiation(self):
+        """Accept-Encoding: gzip → 返回 gzip 预编码字节与变体 ETag"""
+        resp = self.client.get('/api/live.m3u8', headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(resp.data).decode('utf-8'), M3U)
+        self.assertEqual(resp.headers['ETag'], f'"{self.snap.etag}-gz"')
+        self.assertIn('Accept-Encoding', resp.headers['Vary'])
+
+    def test_deflate_only(self):
+        """只接受 deflate：返回 zlib 格式字节"""
+        resp = self.client.get('/api/live.m3u8', headers={'Accept-Encoding': 'deflate'})
+        self.assertEqual(resp.headers['Content-Encoding'], 'deflate')
+        self.assertEqual(zlib.decompress(resp.data).decode('utf-8'), M3U)
+
+    def test_degraded_when_no_snapshot(self):
+        """快照未就绪：走降级列表（不发布为快照）"""
+        core.aggregator._playlist_snapshot = None
+        with mock.patch.object(AggregatorUtils, 'get_playlist_snapshot', return_value=None), \
+             mock.patch.object(AggregatorUtils, 'trans_list_to_m3u',
+                               return_value='#EXTM3U\n# 降级\n'):
+            resp = self.client.get('/api/live.m3u8')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data.decode('utf-8'), '#EXTM3U\n# 降级\n')
+
+    def test_degraded_snapshot_encoded_once(self):
+        """快照未就绪：同一份降级文本只编码一次，多次请求复用（条件请求照样 304）"""
+        with mock.patch.object(AggregatorUtils, 'get_playlist_snapshot', return_value=None), \
+             mock.patch.object(AggregatorUtils, 'trans_list_to_m3u',
+                               return_value='#EXTM3U\n# 降级\n'), \
+             mock.patch('app.PlaylistSnapshot.build', wraps=PlaylistSnapshot.build) as build:
+            first = self.client.get('/api/live.m3u8', headers={'Accept-Encoding': 'gzip'})
+            again = self.client.get('/api/live.m3u8',
+                                    headers={'If-None-Match': first.headers['ETag']})
+        self.assertEqual(build.call_count, 1)
+        self.assertEqual(gzip.decompress(first.data).decode('utf-8'), '#EXTM3U\n# 降级\n')
+        self.assertEqual(again.status_code, 304)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -62,7 +62,7 @@ class SourceDbFallbackTest(unittest.TestCase):
     def test_fetch_all_uses_db_urls(self):
         """fetch_all_public_channels 用 DB url 逐个拉取"""
         db.add_source('public', 'A', 'http://db/a.m3u')
-        with mock.patch.object(SourceUtils, 'fetch_public_m3u', return_value='') as m:
+        with mock.patch.object(SourceUtils, 'fetch_public_source', return_value=[]) as m:
             SourceUtils.fetch_all_public_channels()
         self.assertEqual([c.args[0] for c in m.call_args_list], ['http://db/a.m3u'])
 
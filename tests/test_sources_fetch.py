@@ -0,0 +1,146 @@
+"""公开源拉取测试：并发拉取、条件 GET（304 复用缓存）、失败沿用磁盘缓存"""
+import http.server
+import socketserver
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from core import http_client
+from core.sources import SourceUtils
+
+M3U_A = '#EXTM3U\n#EXTINF:-1 group-title="央视",CCTV-1\nhttp://a/1.m3u8\n'
+M3U_B = '#EXTM3U\n#EXTINF:-1 group-title="卫视",北京卫视\nhttp://b/1.m3u8\n'
+
+
+class _SourceHandler(http.server.BaseHTTPRequestHandler):
+    """模拟公开源：/a /b 带 ETag（If-None-Match 命中回 304），/slow 延迟，/down 500"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.hits.append((self.path, self.headers.get('If-None-Match')))
+        if self.path.startswith('/gbk'):
+            self._send(200, M3U_B.encode('gbk'), {'Content-Type': 'text/plain; charset=gbk'})
+            return
+        if self.path.startswith('/bom'):
+            # 无 charset 声明 + UTF-8 BOM：应按 UTF-8 解码
+            self._send(200, b'\xef\xbb\xbf' + M3U_B.encode('utf-8'), {'Content-Type': 'text/plain'})
+            return
+        if self.path.startswith('/slow'):
+            time.sleep(0.4)
+        if self.path == '/down' or server.all_down:
+            self._send(500, b'')
+            return
+        if server.error_page:
+            self._send(200, b'<html>maintenance</html>', {'Content-Type': 'text/html'})
+            return
+        body = (M3U_B if self.path.endswith('b') else M3U_A).encode('utf-8')
+        etag = f'"v-{self.path.strip("/")}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self._send(200, body, {'ETag': etag, 'Content-Type': 'audio/x-mpegurl; charset=utf-8'})
+
+    def _send(self, status, body, headers=None):
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class PublicSourceFetchTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.srv = _Server(('127.0.0.1', 0), _SourceHandler)
+        cls.srv.lock = threading.Lock()
+        cls.base = f"http://127.0.0.1:{cls.srv.server_address[1]}"
+        threading.Thread(target=cls.srv.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.srv.shutdown()
+        cls.srv.server_close()
+
+    def setUp(self):
+        self.srv.hits = []
+        self.srv.all_down = False
+        self.srv.error_page = False
+        http_client.close_all()
+        patcher = mock.patch('core.sources.PUBLIC_SOURCE_CACHE_DIR', tempfile.mkdtemp())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # 关掉 5xx 自动重试退避，避免测试等待
+        retry_patcher = mock.patch.object(http_client, 'HTTP_RETRY_BACKOFF', 0)
+        retry_patcher.start()
+        self.addCleanup(retry_patcher.stop)
+
+    def _fetch_all(self, paths):
+        urls = [self.base + p for p in paths]
+        with mock.patch.object(SourceUtils, 'get_public_source_urls', return_value=urls):
+            return SourceUtils.fetch_all_public_channels()
+
+    def test_concurrent_order_preserved(self):
+        """两个慢源并发拉取：耗时约等于最慢单源，结果按源顺序拼接"""
+        started = time.time()
+        channels = self._fetch_all(['/slow-a', '/slow-b'])
+        self.assertLess(time.time() - started, 0.75)
+        self.assertEqual([c['name'] for c in channels], ['CCTV-1', '北京卫视'])
+
+    def test_304_reuses_cache(self):
+        """第二轮带 If-None-Match，上游 304：复用缓存频道列表"""
+        first = SourceUtils.fetch_public_source(self.base + '/a')
+        second = SourceUtils.fetch_public_source(self.base + '/a')
+        self.assertEqual(first, second)
+        self.assertEqual(self.srv.hits, [('/a', None), ('/a', '"v-a"')])
+
+    def test_failure_falls_back_to_cache(self):
+        """上游故障：沿用上次成功缓存；无缓存则空列表"""
+        cached = SourceUtils.fetch_public_source(self.base + '/a')
+        self.srv.all_down = True
+        self.assertEqual(SourceUtils.fetch_public_source(self.base + '/a'), cached)
+        self.assertEqual(SourceUtils.fetch_public_source(self.base + '/b'), [])
+
+    def test_empty_200_keeps_cache(self):
+        """上游 200 但解析不出频道（错误页）：不覆盖缓存，沿用上次结果"""
+        cached = SourceUtils.fetch_public_source(self.base + '/a')
+        self.srv.error_page = True
+        self.assertEqual(SourceUtils.fetch_public_source(self.base + '/a'), cached)
+        self.assertEqual(SourceUtils.fetch_public_source(self.base + '/b'), [])
+        self.srv.error_page = False
+        # 缓存仍是原列表（ETag 未被错误页覆盖，下一轮照常 304）
+        self.assertEqual(SourceUtils.fetch_public_source(self.base + '/a'), cached)
+        self.assertEqual(self.srv.hits[-1], ('/a', '"v-a"'))
+
+    def test_declared_charset_and_utf8_default(self):
+        """声明 charset 按声明解码；未声明按 UTF-8（含 BOM）解码"""
+        for path in ('/gbk', '/bom'):
+            channels = SourceUtils.fetch_public_source(self.base + path)
+            self.assertEqual([c['name'] for c in channels], ['北京卫视'], path)
+
+    def test_unreachable_source(self):
+        """连接失败的源返回空列表，不影响其它源"""
+        urls = [self.base + '/a', 'http://127.0.0.1:9/x.m3u']
+        with mock.patch.object(SourceUtils, 'get_public_source_urls', return_value=urls):
+            channels = SourceUtils.fetch_all_public_channels()
+        self.assertEqual([c['name'] for c in channels], ['CCTV-1'])
+
+
+if __name__ == '__main__':
+    unittest.main()